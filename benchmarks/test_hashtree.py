@@ -0,0 +1,51 @@
+"""
+Benchmarks for building Merkle hash trees.
+
+These don't need a grid: they build the same tree with ``HashTree`` (a list
+of hashes, built a node at a time) and ``CompactHashTree`` (a bytearray,
+built a level at a time), and report how long each took and the peak
+memory it allocated, as measured by ``tracemalloc``.
+"""
+
+import tracemalloc
+from time import process_time
+
+import pytest
+
+from allmydata.hashtree import HashTree, CompactHashTree
+from allmydata.util.hashutil import tagged_hash
+
+
+def measure(f):
+    """
+    Call ``f`` and return the CPU time it took, and the peak memory it
+    allocated while it ran.
+    """
+    started = process_time()
+    f()
+    elapsed = process_time() - started
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        f()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return elapsed, peak - before
+
+
+@pytest.mark.parametrize("implementation", [HashTree, CompactHashTree])
+@pytest.mark.parametrize("num_leaves", [1024, 65536, 262144])
+def test_build(implementation, num_leaves, capsys):
+    """
+    Measure building a tree with ``num_leaves`` leaves, as for the block
+    hash tree of a share of a file with that many segments.
+    """
+    leaves = [tagged_hash(b"tag", b"%d" % i) for i in range(num_leaves)]
+    elapsed, peak = measure(lambda: implementation(leaves))
+    with capsys.disabled():
+        print(
+            f"\nBENCHMARK RESULT: hashtree-build {implementation.__name__} "
+            f"num_leaves={num_leaves} time={elapsed:.3f} (seconds) "
+            f"peak_memory={peak} (bytes)\n"
+        )
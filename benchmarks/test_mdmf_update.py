@@ -0,0 +1,67 @@
+"""
+Benchmarks for how many bytes an in-place update of an MDMF mutable file
+moves to and from the storage servers.
+
+These don't need a grid: they use the in-memory storage servers from the
+mutable file tests, which count the share data read and written, and
+report the bytes moved per update for different file sizes.  An update
+should move roughly the segments it changes, however big the file is.
+"""
+
+import pytest
+import pytest_twisted
+
+from allmydata.interfaces import MDMF_VERSION
+from allmydata.mutable.publish import MutableData
+from allmydata.test.mutable.util import FakeStorage, make_nodemaker
+
+SEGMENT_SIZE = 128 * 1024
+UPDATES = 5
+
+
+async def measure_updates(capsys, name, file_size, offset, data):
+    """
+    Create an MDMF file of ``file_size`` bytes, then write ``data`` into it
+    at ``offset(size)`` ``UPDATES`` times, and report the bytes moved per
+    update.
+    """
+    storage = FakeStorage()
+    nodemaker = make_nodemaker(storage)
+    node = await nodemaker.create_mutable_file(
+        MutableData(b"\x01" * file_size), version=MDMF_VERSION,
+    )
+    storage.bytes_read = storage.bytes_written = 0
+    for _ in range(UPDATES):
+        version = await node.get_best_mutable_version()
+        await version.update(MutableData(data), offset(version.get_size()))
+    with capsys.disabled():
+        print(
+            f"\nBENCHMARK RESULT: {name} file_size={file_size} "
+            f"update_size={len(data)} "
+            f"read={storage.bytes_read // UPDATES} "
+            f"written={storage.bytes_written // UPDATES} (bytes per update)\n"
+        )
+
+
+@pytest.mark.parametrize("file_size", [SEGMENT_SIZE, 16 * SEGMENT_SIZE, 64 * SEGMENT_SIZE])
+@pytest.mark.parametrize("append_size", [100, SEGMENT_SIZE])
+@pytest_twisted.ensureDeferred
+async def test_append(file_size, append_size, capsys):
+    """
+    Measure the bytes moved to append to a file.
+    """
+    await measure_updates(
+        capsys, "mdmf-append", file_size, lambda size: size, b"\x02" * append_size,
+    )
+
+
+@pytest.mark.parametrize("file_size", [16 * SEGMENT_SIZE, 64 * SEGMENT_SIZE])
+@pytest_twisted.ensureDeferred
+async def test_overwrite(file_size, capsys):
+    """
+    Measure the bytes moved to overwrite a little data in the middle of a
+    file.
+    """
+    await measure_updates(
+        capsys, "mdmf-overwrite", file_size, lambda size: size // 2, b"\x02" * 100,
+    )
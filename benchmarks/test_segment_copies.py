@@ -0,0 +1,84 @@
+"""
+Benchmarks for how much segment data the immutable encoder and downloader
+copy.
+
+Unlike the other benchmarks these don't need a grid: they run the buffer
+handling from ``allmydata.codec`` and ``allmydata.util.spans`` the way the
+encoder and downloader use it, and report the bytes allocated (and so
+copied) per segment, as measured by ``tracemalloc``.
+"""
+
+import tracemalloc
+
+import pytest
+
+from allmydata.codec import split_into_shares, join_decoded
+from allmydata.util.mathutil import div_ceil
+from allmydata.util.spans import DataSpans
+
+K = 3
+READ_CHUNK_SIZE = 50 * 1024  # what EncryptAnUploadable hands the encoder
+READ_AHEAD_SEGMENTS = 4
+
+
+def bytes_allocated(f):
+    """
+    Call ``f`` and return the peak memory it allocated, less whatever was
+    allocated before it was called.
+    """
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        f()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - before
+
+
+def report(capsys, name, segment_size, copied):
+    with capsys.disabled():
+        print(
+            f"\nBENCHMARK RESULT: {name} segment_size={segment_size} "
+            f"copied={copied} (bytes) per-segment-byte={copied / segment_size:.2f}\n"
+        )
+
+
+@pytest.mark.parametrize("segment_size", [128 * 1024, 1024 * 1024])
+def test_encoder_input_copies(segment_size, capsys):
+    """
+    Measure the copying done to turn the chunks read from an uploadable into
+    ``K`` input shares for zfec.
+    """
+    share_size = div_ceil(segment_size, K)
+    chunks = [
+        b"\x01" * min(READ_CHUNK_SIZE, segment_size - offset)
+        for offset in range(0, segment_size, READ_CHUNK_SIZE)
+    ]
+    copied = bytes_allocated(lambda: split_into_shares(chunks, K, share_size))
+    report(capsys, "encoder-input-copies", segment_size, copied)
+
+
+@pytest.mark.parametrize("segment_size", [128 * 1024, 1024 * 1024])
+def test_downloader_copies(segment_size, capsys):
+    """
+    Measure the copying done to take one segment's blocks out of the data
+    received from ``K`` servers (which includes the following segments'
+    blocks, as read ahead) and turn the decoded buffers into the segment.
+    """
+    block_size = div_ceil(segment_size, K)
+    received = []
+    for _ in range(K):
+        spans = DataSpans()
+        spans.add(0, b"\x01" * (block_size * READ_AHEAD_SEGMENTS))
+        received.append(spans)
+
+    def download_segment():
+        blocks = [spans.pop(0, block_size, view=True) for spans in received]
+        # zfec hands primary blocks straight back, so decoding them costs
+        # nothing more here
+        return join_decoded(blocks, segment_size)
+
+    copied = bytes_allocated(download_segment)
+    report(capsys, "downloader-copies", segment_size, copied)
@@ -0,0 +1,97 @@
+"""
+Benchmarks for the HTTP storage protocol client talking to a local server.
+
+These run a storage server in-process, listening with HTTPS on localhost,
+and measure how many concurrent share reads per second a
+``StorageClient`` manages for different connection pool sizes.  A pool too
+small for the number of concurrent requests means new connections, and so
+TLS handshakes, for every burst of requests.
+"""
+
+from time import time
+from os import urandom
+
+import pytest
+import pytest_twisted
+
+from twisted.internet import reactor
+from twisted.internet.defer import gatherResults
+from twisted.internet.endpoints import serverFromString
+from twisted.python.filepath import FilePath
+
+from allmydata.storage.server import StorageServer
+from allmydata.storage.http_server import HTTPServer, listen_tls
+from allmydata.storage.http_client import (
+    StorageClientFactory,
+    StorageClientImmutables,
+)
+from allmydata.test.certs import (
+    generate_certificate,
+    generate_private_key,
+    private_key_to_file,
+    cert_to_file,
+)
+
+SHARE_SIZE = 1024 * 1024
+READ_SIZE = 64 * 1024
+CONCURRENT_READS = 50
+ROUNDS = 10
+
+
+@pytest.mark.parametrize("connections_per_server", [1, 10, 50])
+@pytest_twisted.ensureDeferred
+async def test_concurrent_reads(connections_per_server, tmp_path, capsys):
+    """
+    Read ``CONCURRENT_READS`` chunks of a share at once, ``ROUNDS`` times,
+    and report the reads per second.
+    """
+    private_key = generate_private_key()
+    certificate = generate_certificate(private_key)
+    swissnum = b"abcd"
+    storage_server = StorageServer(str(tmp_path / "storage"), b"\x00" * 20)
+    nurl, listening_port = await listen_tls(
+        HTTPServer(reactor, storage_server, swissnum),
+        "127.0.0.1",
+        serverFromString(reactor, "tcp:0:interface=127.0.0.1"),
+        private_key_to_file(FilePath(str(tmp_path / "key.pem")), private_key),
+        cert_to_file(FilePath(str(tmp_path / "cert.pem")), certificate),
+    )
+    client = await StorageClientFactory(
+        {"tcp": "tcp"}, None, connections_per_server=connections_per_server,
+    ).create_storage_client(nurl, reactor)
+    try:
+        immutables = StorageClientImmutables(client)
+        storage_index = urandom(16)
+        upload_secret = urandom(32)
+        await immutables.create(
+            storage_index, {0}, SHARE_SIZE, upload_secret, urandom(32), urandom(32),
+        )
+        await immutables.write_share_chunk(
+            storage_index, 0, upload_secret, 0, urandom(SHARE_SIZE),
+        )
+
+        def read_round():
+            return gatherResults([
+                immutables.read_share_chunk(
+                    storage_index, 0, (i * READ_SIZE) % SHARE_SIZE, READ_SIZE,
+                )
+                for i in range(CONCURRENT_READS)
+            ])
+
+        # Warm up, so the pool starts out as full as it's going to get.
+        await read_round()
+        start = time()
+        for _ in range(ROUNDS):
+            await read_round()
+        elapsed = time() - start
+    finally:
+        await client.shutdown()
+        await listening_port.stopListening()
+
+    with capsys.disabled():
+        print(
+            f"\nBENCHMARK RESULT: storage-http-concurrent-reads "
+            f"connections_per_server={connections_per_server} "
+            f"concurrency={CONCURRENT_READS} "
+            f"reads_per_second={CONCURRENT_READS * ROUNDS / elapsed:.1f}\n"
+        )
@@ -0,0 +1 @@
+``tahoe backup`` now looks up files in the backupdb in batches, ahead of uploading them, so that backups of mostly-unchanged trees make far fewer database queries; with ``--jobs`` the uploads overlap with creating the directories that are already complete.
@@ -0,0 +1 @@
+HTTP storage clients now renew the leases on many storage indexes with a single request to servers that support the new bulk lease API, which makes deep-checks with lease renewal much faster.
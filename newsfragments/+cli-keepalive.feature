@@ -0,0 +1 @@
+The CLI now reuses one keep-alive connection to the web API for all of the requests made by a command, and ``tahoe cp`` and ``tahoe backup`` accept ``--jobs N`` to copy or upload several files at once.
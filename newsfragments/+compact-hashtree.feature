@@ -0,0 +1 @@
+Block, crypttext and share hash trees are now built a level at a time into a single buffer, which is faster and uses less memory for large files.
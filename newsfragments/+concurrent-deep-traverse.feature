@@ -0,0 +1 @@
+Deep-check, manifest and deep-stats operations now read up to ten directories at a time instead of one, while keeping memory use bounded on very large trees.
@@ -0,0 +1 @@
+The immutable downloader now reads ahead, fetching several segments at once when a file is read sequentially.
@@ -0,0 +1 @@
+The HTTP storage protocol gained an endpoint for reading several ranges of several immutable shares with one request, and the immutable downloader now uses it (and a matching Foolscap method) to fetch the offset table, hashes and blocks of a share in a single round trip.
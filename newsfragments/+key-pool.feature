@@ -0,0 +1 @@
+Clients can keep a pool of RSA keypairs generated in advance (``[client]mutable.key_pool_size``), so that creating mutable files and directories doesn't have to wait for a new keypair.
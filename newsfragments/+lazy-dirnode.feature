@@ -0,0 +1 @@
+Reading a large directory is now much faster: children are unpacked only when they are asked for, unchanged directories are not unpacked again, and the unpacking of very large directories happens in a background thread.
@@ -0,0 +1 @@
+With ``[storage]share_index`` enabled, storage servers now also record lease expiration times in the share index, so the lease checker only examines shares that may have expired leases and the storage status page shows lease ages immediately.
@@ -0,0 +1 @@
+In-place updates of MDMF mutable files now read only the segments they change from k shares, and write only the changed blocks and block hashes.
@@ -0,0 +1 @@
+The web API now serves ``multipart/byteranges`` responses for requests with several byte ranges, fetching the ranges concurrently, and gives immutable files strong ETags so that ``If-None-Match`` and ``If-Range`` requests are answered without reading from the grid.
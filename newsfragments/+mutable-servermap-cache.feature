@@ -0,0 +1 @@
+Reads of mutable files and directories can reuse a recent servermap (``[client]mutable.servermap_cache_ttl``) and can start downloading the last known version while the servermap is updated (``[client]mutable.optimistic_reads``).
@@ -0,0 +1 @@
+The client now keeps recently used mutable file and directory nodes in a bounded cache (configured with ``[client]node_cache.max_entries`` and ``node_cache.max_bytes``), so that later requests for the same cap don't start from scratch; its hit rate is shown on ``/statistics``.
@@ -0,0 +1 @@
+The immutable verifier now reads runs of adjacent blocks together, keeps several reads outstanding at each server, and hashes blocks on the CPU thread pool, so ``tahoe check --verify`` of large files is much faster.
@@ -0,0 +1 @@
+Storage servers can now keep recently read immutable share data in memory (``[storage]read_cache.size``), with hit, miss and eviction counts in their statistics.
@@ -0,0 +1 @@
+Clients can now cache recently downloaded immutable file segments in memory (``[client]download.segment_cache_max_bytes``), so repeated range reads of the same file are served without going back to the grid. Hits and misses are shown on ``/statistics``.
@@ -0,0 +1 @@
+The immutable uploader and downloader now copy each segment's data once rather than two or three times while splitting it into, or assembling it from, erasure-coded blocks.
@@ -0,0 +1 @@
+Opening a file read-only over SFTP no longer downloads the whole file first; reads fetch only the parts of the file they need, with read-ahead for sequential access.
@@ -0,0 +1 @@
+Large mutable directories can now be sharded, with ``tahoe shard`` or ``POST /uri/$DIRCAP?t=shard``, so that changing one child only rewrites the part of the directory holding it.
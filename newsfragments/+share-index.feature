@@ -0,0 +1 @@
+Storage servers can now keep an on-disk index of their shares (``[storage]share_index = true``), avoiding directory scans when looking shares up. ``tahoe admin rebuild-share-index`` rebuilds or verifies it.
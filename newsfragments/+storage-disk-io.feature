@@ -0,0 +1 @@
+Storage servers now read and write share files on a dedicated, bounded disk I/O thread pool instead of the reactor thread, configurable with ``[storage]disk_io.threads`` and ``disk_io.max_queue_depth``.
@@ -0,0 +1 @@
+The number of idle HTTPS connections kept open to each storage server can now be set with ``[client]storage.http_connections_per_server``, and new connections to a storage server resume an earlier TLS session instead of doing a full handshake. Storage servers offer HTTP/2 to clients when Twisted's HTTP/2 support is installed.
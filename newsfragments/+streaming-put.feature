@@ -0,0 +1 @@
+Immutable file uploads with ``PUT`` can now pass ``stream=true`` to have the body encoded and uploaded as it arrives, instead of being stored in a temporary file first.
@@ -0,0 +1 @@
+Immutable uploads now encode later segments while earlier segments are still being sent, configurable with ``[client]upload.pipeline_depth`` and ``upload.pipeline_max_bytes``.
@@ -25,6 +25,8 @@ class Blacklist(object):
         self.blacklist_fn = blacklist_fn
         self.last_mtime = None
         self.entries = {}
+        # changes whenever the entries do
+        self.generation = 0
         self.read_blacklist() # sets .last_mtime and .entries
 
     def read_blacklist(self):
@@ -32,11 +34,14 @@ class Blacklist(object):
             current_mtime = os.stat(self.blacklist_fn).st_mtime
         except EnvironmentError:
             # unreadable blacklist file means no blacklist
-            self.entries.clear()
+            if self.entries:
+                self.entries.clear()
+                self.generation += 1
             return
         try:
             if self.last_mtime is None or current_mtime > self.last_mtime:
                 self.entries.clear()
+                self.generation += 1
                 with open(self.blacklist_fn, "rb") as f:
                     for line in f:
                         line = line.strip()
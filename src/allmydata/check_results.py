@@ -216,10 +216,12 @@ class DeepResultsBase(object):
 class DeepCheckResults(DeepResultsBase):
 
     def add_check(self, r, path):
+        # path is None for the shards of a sharded directory, which are
+        # counted but have no path of their own.
         if not r:
             return # non-distributed object, i.e. LIT file
         r = ICheckResults(r)
-        assert isinstance(path, (list, tuple))
+        assert path is None or isinstance(path, (list, tuple))
         self.objects_checked += 1
         if r.is_healthy():
             self.objects_healthy += 1
@@ -227,7 +229,8 @@ class DeepCheckResults(DeepResultsBase):
             self.objects_unhealthy += 1
         if not r.is_recoverable():
             self.objects_unrecoverable += 1
-        self.all_results[tuple(path)] = r
+        if path is not None:
+            self.all_results[tuple(path)] = r
         self.all_results_by_storage_index[r.get_storage_index()] = r
         self.corrupt_shares.extend(r.get_corrupt_shares())
 
@@ -254,10 +257,12 @@ class DeepCheckAndRepairResults(DeepResultsBase):
         self.corrupt_shares_post_repair = []
 
     def add_check_and_repair(self, r, path):
+        # path is None for the shards of a sharded directory, as for
+        # add_check().
         if not r:
             return # non-distributed object, i.e. LIT file
         r = ICheckAndRepairResults(r)
-        assert isinstance(path, (list, tuple))
+        assert path is None or isinstance(path, (list, tuple))
         pre_repair = r.get_pre_repair_results()
         post_repair = r.get_post_repair_results()
         self.objects_checked += 1
@@ -280,7 +285,8 @@ class DeepCheckAndRepairResults(DeepResultsBase):
             self.objects_unhealthy_post_repair += 1
         if not post_repair.is_recoverable():
             self.objects_unrecoverable_post_repair += 1
-        self.all_results[tuple(path)] = r
+        if path is not None:
+            self.all_results[tuple(path)] = r
         self.all_results_by_storage_index[r.get_storage_index()] = r
         self.corrupt_shares_post_repair.extend(post_repair.get_corrupt_shares())
 
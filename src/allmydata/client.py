@@ -36,8 +36,25 @@ from allmydata.dirnode import DirectoryNode
 from allmydata.storage.server import StorageServer, FoolscapStorageServer
 from allmydata import storage_client
 from allmydata.immutable.upload import Uploader
+from allmydata.immutable.encode import (
+    DEFAULT_PIPELINE_DEPTH,
+    DEFAULT_PIPELINE_MAX_BYTES,
+)
+from allmydata.immutable.downloader.cache import (
+    DEFAULT_SEGMENT_CACHE_MAX_BYTES,
+    SegmentCache,
+)
 from allmydata.immutable.offloaded import Helper
-from allmydata.mutable.filenode import MutableFileNode
+from allmydata.key_pool import KeyPool
+from allmydata.node_cache import (
+    DEFAULT_NODE_CACHE_MAX_BYTES,
+    DEFAULT_NODE_CACHE_MAX_ENTRIES,
+    NodeCache,
+)
+from allmydata.mutable.filenode import (
+    MutableFileNode,
+    DEFAULT_SERVERMAP_CACHE_TTL,
+)
 from allmydata.introducer.client import IntroducerClient
 from allmydata.util import (
     hashutil, base32, pollmixin, log, idlib,
@@ -91,13 +108,22 @@ _client_config = configutil.ValidConfiguration(
             "introducer.furl",
             "key_generator.furl",
             "mutable.format",
+            "mutable.key_pool_size",
+            "mutable.optimistic_reads",
+            "mutable.servermap_cache_ttl",
+            "node_cache.max_bytes",
+            "node_cache.max_entries",
             "peers.preferred",
             "shares.happy",
             "shares.needed",
             "shares.total",
             "shares._max_immutable_segment_size_for_testing",
             "storage.plugins",
+            "storage.http_connections_per_server",
             "force_foolscap",
+            "upload.pipeline_depth",
+            "upload.pipeline_max_bytes",
+            "download.segment_cache_max_bytes",
         ),
         "storage": (
             "debug_discard",
@@ -116,6 +142,10 @@ _client_config = configutil.ValidConfiguration(
             "plugins",
             "grid_management",
             "force_foolscap",
+            "disk_io.threads",
+            "disk_io.max_queue_depth",
+            "share_index",
+            "read_cache.size",
         ),
         "sftpd": (
             "accounts.file",
@@ -170,6 +200,10 @@ class SecretHolder(object):
     def get_convergence_secret(self):
         return self._convergence_secret
 
+    def get_key_pool_secret(self):
+        return hashutil.tagged_hash(b"allmydata_key_pool_secret_v1",
+                                    self._lease_secret)
+
 class KeyGenerator(object):
     """I create RSA keys for mutable files. Each call to generate() returns a
     single keypair."""
@@ -648,7 +682,7 @@ class _Client(node.Node, pollmixin.PollMixin):
         self.init_stats_provider()
         self.init_secrets()
         self.init_node_key()
-        self._key_generator = KeyGenerator()
+        self.init_key_generator()
         key_gen_furl = config.get_config("client", "key_generator.furl", None)
         if key_gen_furl:
             log.msg("[client]key_generator.furl= is now ignored, see #2783")
@@ -706,6 +740,20 @@ class _Client(node.Node, pollmixin.PollMixin):
         self.convergence = base32.a2b(convergence_s)
         self._secret_holder = SecretHolder(lease_secret, self.convergence)
 
+    def init_key_generator(self):
+        key_pool_size = int(self.config.get_config(
+            "client", "mutable.key_pool_size", 0))
+        if key_pool_size > 0:
+            self._key_generator = KeyPool(
+                key_pool_size,
+                self.config.get_private_path("key_pool"),
+                self._secret_holder.get_key_pool_secret(),
+            )
+            self._key_generator.setServiceParent(self)
+            self.stats_provider.register_producer(self._key_generator)
+        else:
+            self._key_generator = KeyGenerator()
+
     def init_node_key(self):
         # we only create the key once. On all subsequent runs, we re-use the
         # existing key
@@ -817,6 +865,23 @@ class _Client(node.Node, pollmixin.PollMixin):
             sharetypes.append("mutable")
         expiration_sharetypes = tuple(sharetypes)
 
+        disk_io_threads = int(self.config.get_config("storage", "disk_io.threads", 4))
+        disk_io_max_queue_depth = int(
+            self.config.get_config("storage", "disk_io.max_queue_depth", 1000)
+        )
+        share_index = self.config.get_config(
+            "storage", "share_index", False, boolean=True,
+        )
+        data = self.config.get_config("storage", "read_cache.size", None)
+        try:
+            read_cache_size = parse_abbreviated_size(data)
+        except ValueError:
+            log.msg("[storage]read_cache.size= contains unparseable value %s"
+                    % data)
+            raise
+        if read_cache_size is None:
+            read_cache_size = 0
+
         ss = StorageServer(
             storedir, self.nodeid,
             reserved_space=reserved,
@@ -828,6 +893,10 @@ class _Client(node.Node, pollmixin.PollMixin):
             expiration_override_lease_duration=o_l_d,
             expiration_cutoff_date=cutoff_date,
             expiration_sharetypes=expiration_sharetypes,
+            disk_io_threads=disk_io_threads,
+            disk_io_max_queue_depth=disk_io_max_queue_depth,
+            share_index=share_index,
+            read_cache_size=read_cache_size,
         )
         ss.setServiceParent(self)
         return ss
@@ -946,12 +1015,42 @@ class _Client(node.Node, pollmixin.PollMixin):
         self.history = History(self.stats_provider)
         self.terminator = Terminator()
         self.terminator.setServiceParent(self)
+        pipeline_depth = int(self.config.get_config(
+            "client", "upload.pipeline_depth", DEFAULT_PIPELINE_DEPTH))
+        if pipeline_depth < 1:
+            raise ValueError("config error: upload.pipeline_depth must be "
+                             "at least 1, not %d" % (pipeline_depth,))
+        data = self.config.get_config("client", "upload.pipeline_max_bytes", None)
+        try:
+            pipeline_max_bytes = parse_abbreviated_size(data)
+        except ValueError:
+            log.msg("[client]upload.pipeline_max_bytes= contains unparseable value %s"
+                    % data)
+            raise
+        if pipeline_max_bytes is None:
+            pipeline_max_bytes = DEFAULT_PIPELINE_MAX_BYTES
         uploader = Uploader(
             helper_furl,
             self.stats_provider,
             self.history,
+            pipeline_depth=pipeline_depth,
+            pipeline_max_bytes=pipeline_max_bytes,
         )
         uploader.setServiceParent(self)
+        data = self.config.get_config(
+            "client", "download.segment_cache_max_bytes", None)
+        try:
+            segment_cache_max_bytes = parse_abbreviated_size(data)
+        except ValueError:
+            log.msg("[client]download.segment_cache_max_bytes= contains unparseable value %s"
+                    % data)
+            raise
+        if segment_cache_max_bytes is None:
+            segment_cache_max_bytes = DEFAULT_SEGMENT_CACHE_MAX_BYTES
+        self._segment_cache = None
+        if segment_cache_max_bytes > 0:
+            self._segment_cache = SegmentCache(segment_cache_max_bytes)
+            self.stats_provider.register_producer(self._segment_cache)
         self.init_blacklist()
         self.init_nodemaker()
 
@@ -1008,6 +1107,27 @@ class _Client(node.Node, pollmixin.PollMixin):
             self.mutable_file_default = MDMF_VERSION
         else:
             self.mutable_file_default = SDMF_VERSION
+        servermap_cache_ttl = int(self.config.get_config(
+            "client", "mutable.servermap_cache_ttl",
+            DEFAULT_SERVERMAP_CACHE_TTL))
+        optimistic_reads = self.config.get_config(
+            "client", "mutable.optimistic_reads", False, boolean=True)
+        node_cache_max_entries = int(self.config.get_config(
+            "client", "node_cache.max_entries",
+            DEFAULT_NODE_CACHE_MAX_ENTRIES))
+        data = self.config.get_config("client", "node_cache.max_bytes", None)
+        try:
+            node_cache_max_bytes = parse_abbreviated_size(data)
+        except ValueError:
+            log.msg("[client]node_cache.max_bytes= contains unparseable value %s"
+                    % data)
+            raise
+        if node_cache_max_bytes is None:
+            node_cache_max_bytes = DEFAULT_NODE_CACHE_MAX_BYTES
+        node_cache = None
+        if node_cache_max_entries > 0 and node_cache_max_bytes > 0:
+            node_cache = NodeCache(node_cache_max_entries, node_cache_max_bytes)
+            self.stats_provider.register_producer(node_cache)
         self.nodemaker = NodeMaker(self.storage_broker,
                                    self._secret_holder,
                                    self.get_history(),
@@ -1016,7 +1136,11 @@ class _Client(node.Node, pollmixin.PollMixin):
                                    self.get_encoding_parameters(),
                                    self.mutable_file_default,
                                    self._key_generator,
-                                   self.blacklist)
+                                   self.blacklist,
+                                   self._segment_cache,
+                                   servermap_cache_ttl,
+                                   optimistic_reads,
+                                   node_cache)
 
     def get_history(self):
         return self.history
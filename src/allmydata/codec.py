@@ -82,6 +82,58 @@ class CRSDecoder(object):
             [int(s) for s in their_shareids]
         )
 
+def split_into_shares(chunks, num_shares, share_size):
+    """
+    Rearrange some chunks of data (as returned by ``read_encrypted()``) into
+    ``num_shares`` input shares of ``share_size`` bytes each, zero-padding
+    the last of them if the data falls short.
+
+    Each byte is copied exactly once, straight into the share it belongs
+    to, instead of joining all of the chunks and slicing the result apart
+    again.
+
+    :return: A list of ``bytes``, suitable for ``CRSEncoder.encode()``.
+    """
+    views = [memoryview(chunk) for chunk in chunks if len(chunk)]
+    views.reverse()
+    shares = []
+    for i in range(num_shares):
+        pieces = []
+        wanted = share_size
+        while wanted and views:
+            view = views.pop()
+            if len(view) > wanted:
+                views.append(view[wanted:])
+                view = view[:wanted]
+            pieces.append(view)
+            wanted -= len(view)
+        if wanted:
+            pieces.append(b"\x00" * wanted)
+        shares.append(b"".join(pieces))
+    precondition(not views, "more data than fits in the shares")
+    return shares
+
+
+def join_decoded(buffers, size):
+    """
+    Join the buffers returned by ``CRSDecoder.decode()`` into the first
+    ``size`` bytes of the segment they encode, dropping any padding from the
+    end without a second copy.
+
+    :return: ``bytes`` of length ``size``.
+    """
+    buffers = list(buffers)
+    excess = sum(len(b) for b in buffers) - size
+    precondition(excess >= 0, size, excess)
+    while excess:
+        last = memoryview(buffers.pop())
+        if len(last) > excess:
+            buffers.append(last[:len(last) - excess])
+            break
+        excess -= len(last)
+    return b"".join(buffers)
+
+
 def parse_params(serializedparams):
     pieces = serializedparams.split(b"-")
     return int(pieces[0]), int(pieces[1]), int(pieces[2])
@@ -0,0 +1,257 @@
+"""
+The engine behind ``DirectoryNode.deep_traverse``.
+
+A deep traversal (deep-check, manifest, deep-stats) has to read every
+directory reachable from the one it starts at.  Reading them one at a time
+means a tree with hundreds of thousands of directories takes hours, mostly
+spent waiting on the network; reading them all at once means holding a node
+object for every directory not yet read, which once ran a client out of
+memory.  ``DeepTraversal`` reads a bounded number of directories at a time,
+and keeps the directories waiting to be read as caps in a ``_Frontier``,
+which moves them to a temporary file once there are too many to keep in
+memory.
+"""
+
+from __future__ import annotations
+
+import tempfile
+from typing import IO, Optional
+
+from twisted.internet import defer
+from foolscap.api import fireEventually
+
+from allmydata.interfaces import IDirectoryNode
+from allmydata.unknown import UnknownNode
+from allmydata.util import hashutil, jsonbytes as json
+from allmydata.util.deferredutil import async_to_deferred
+
+# How many directories to read at once.
+DEFAULT_TRAVERSAL_CONCURRENCY = 10
+
+# How many directories waiting to be read to keep in memory before moving
+# them to disk.
+DEFAULT_FRONTIER_IN_MEMORY = 10000
+
+# Only used to tell verify caps apart, so 16 bytes is plenty.
+_VERIFY_CAP_DIGEST_SIZE = 16
+
+
+def _verify_cap_digest(verify_cap) -> bytes:
+    """
+    Return a short digest of a verify cap, to remember having seen it with
+    less memory than the cap itself would take.
+    """
+    return hashutil.tagged_hash(
+        b"allmydata_deep_traverse_verify_cap_v1",
+        verify_cap.to_string(),
+        _VERIFY_CAP_DIGEST_SIZE,
+    )
+
+
+class _Frontier(object):
+    """
+    The directories a traversal has found but not yet read, as
+    ``(writecap, readcap, path, shard)``, where ``shard`` says whether the
+    directory is a shard of the sharded directory at ``path``.
+
+    Up to ``max_in_memory`` entries are kept in memory, and any more are
+    written to a temporary file, to be read back once the ones in memory
+    have been taken.  Entries come out roughly last in, first out, which
+    keeps the frontier small by going deep before going wide.
+    """
+
+    def __init__(self, max_in_memory: int):
+        self._max_in_memory = max_in_memory
+        self._in_memory: list[tuple[Optional[bytes], Optional[bytes], list[str], bool]] = []
+        self._spilled: Optional[IO[bytes]] = None
+        self._spilled_count = 0
+        self._read_position = 0
+
+    def __len__(self) -> int:
+        return len(self._in_memory) + self._spilled_count
+
+    def push(self, writecap: Optional[bytes], readcap: Optional[bytes], path: list[str],
+             shard: bool = False) -> None:
+        self._in_memory.append((writecap, readcap, path, shard))
+        if len(self._in_memory) > self._max_in_memory:
+            self._spill()
+
+    def pop(self) -> tuple[Optional[bytes], Optional[bytes], list[str], bool]:
+        if not self._in_memory:
+            self._unspill()
+        return self._in_memory.pop()
+
+    def close(self) -> None:
+        if self._spilled is not None:
+            self._spilled.close()
+            self._spilled = None
+
+    def _spill(self) -> None:
+        if self._spilled is None:
+            self._spilled = tempfile.TemporaryFile()
+        self._spilled.seek(0, 2)
+        for (writecap, readcap, path, shard) in self._in_memory:
+            self._spilled.write(json.dumps_bytes([
+                None if writecap is None else writecap.decode("ascii"),
+                None if readcap is None else readcap.decode("ascii"),
+                path,
+                shard,
+            ]) + b"\n")
+        self._spilled_count += len(self._in_memory)
+        self._in_memory = []
+
+    def _unspill(self) -> None:
+        assert self._spilled is not None and self._spilled_count > 0
+        self._spilled.seek(self._read_position)
+        for _ in range(min(self._max_in_memory, self._spilled_count)):
+            (writecap, readcap, path, shard) = json.loads(self._spilled.readline())
+            self._in_memory.append((
+                None if writecap is None else writecap.encode("ascii"),
+                None if readcap is None else readcap.encode("ascii"),
+                path,
+                shard,
+            ))
+        self._spilled_count -= len(self._in_memory)
+        if self._spilled_count:
+            self._read_position = self._spilled.tell()
+        else:
+            self._spilled.seek(0)
+            self._spilled.truncate()
+            self._read_position = 0
+
+
+class DeepTraversal(object):
+    """
+    Walk everything reachable from a directory, telling a walker about each
+    node, reading up to ``concurrency`` directories at a time.
+
+    The walker sees each directory as ``add_node()``, then
+    ``enter_directory()`` once it has been read, then ``add_node()`` for
+    each of the files in it, one at a time; the directories in it come
+    later.  Several directories may be at different stages of this at once.
+    The children of the shards of a sharded directory are given to the
+    walker as its children.  The shards themselves are not nodes of the
+    tree, so they are only given to the walker's ``add_shard()``, if it has
+    one, with the sharded directory's path.
+    """
+
+    def __init__(self, nodemaker, walker, monitor, found: set[bytes],
+                 concurrency: int = DEFAULT_TRAVERSAL_CONCURRENCY,
+                 frontier_in_memory: int = DEFAULT_FRONTIER_IN_MEMORY):
+        self._nodemaker = nodemaker
+        self._walker = walker
+        self._monitor = monitor
+        self._found = found
+        self._concurrency = concurrency
+        self._frontier = _Frontier(frontier_in_memory)
+        self._in_progress = 0
+        self._starting = False
+        self._failure = None
+        self._done: defer.Deferred[None] = defer.Deferred()
+
+    def run(self, root) -> defer.Deferred[None]:
+        """
+        Walk everything reachable from the directory node ``root``, firing
+        once it has all been given to the walker, or failing with the first
+        error from reading a directory or from the walker.
+        """
+        self._found.add(_verify_cap_digest(root.get_verify_cap()))
+        self._starting = True
+        try:
+            self._visit(root, [])
+        finally:
+            self._starting = False
+        self._start_more()
+        return self._done
+
+    def _visit(self, node, path: list[str], shard: bool = False) -> None:
+        self._in_progress += 1
+        d = self._read_directory(node, path, shard)
+        d.addErrback(self._failed)
+        d.addCallback(self._finished_one)
+
+    def _start_more(self) -> None:
+        # Directories that are read synchronously finish inside _visit, and
+        # would otherwise recurse back here for every directory in the tree.
+        if self._starting:
+            return
+        self._starting = True
+        try:
+            while (self._failure is None
+                   and self._in_progress < self._concurrency
+                   and len(self._frontier)):
+                (writecap, readcap, path, shard) = self._frontier.pop()
+                self._visit(
+                    self._nodemaker.create_from_cap(writecap, readcap), path, shard
+                )
+        finally:
+            self._starting = False
+        if self._in_progress == 0 and (self._failure or not len(self._frontier)):
+            self._frontier.close()
+            if self._failure is None:
+                self._done.callback(None)
+            else:
+                self._done.errback(self._failure)
+
+    def _finished_one(self, _) -> None:
+        self._in_progress -= 1
+        self._start_more()
+
+    def _failed(self, failure) -> None:
+        if self._failure is None:
+            self._failure = failure
+
+    @async_to_deferred
+    async def _read_directory(self, node, path: list[str], shard: bool) -> None:
+        walker = self._walker
+        self._monitor.raise_if_cancelled()
+        if not shard:
+            await defer.maybeDeferred(walker.add_node, node, path)
+        elif hasattr(walker, "add_shard"):
+            await defer.maybeDeferred(walker.add_shard, node, path)
+        children, shards = await node.list_for_traversal()
+        self._monitor.raise_if_cancelled()
+        if not shard:
+            await defer.maybeDeferred(walker.enter_directory, node, children)
+
+        # The shards of a sharded directory are read later, and their
+        # children appear at the directory's path.
+        for shard_node in shards:
+            digest = _verify_cap_digest(shard_node.get_verify_cap())
+            if digest not in self._found:
+                self._found.add(digest)
+                self._frontier.push(
+                    shard_node.get_write_uri(), shard_node.get_readonly_uri(), path,
+                    shard=True,
+                )
+
+        # Files are given to the walker now, so their nodes can be dropped
+        # as soon as possible; directories go in the frontier, as caps, to
+        # be read later.
+        files = []
+        for name, (child, metadata) in sorted(children.items()):
+            childpath = path + [name]
+            if isinstance(child, UnknownNode):
+                walker.add_node(child, childpath)
+                continue
+            verifier = child.get_verify_cap()
+            # allow LIT files (for which verifier==None) to be processed
+            if verifier is not None:
+                digest = _verify_cap_digest(verifier)
+                if digest in self._found:
+                    continue
+                self._found.add(digest)
+            if IDirectoryNode.providedBy(child):
+                self._frontier.push(
+                    child.get_write_uri(), child.get_readonly_uri(), childpath
+                )
+            else:
+                files.append((child, childpath))
+        del children
+
+        for i, (child, childpath) in enumerate(files):
+            await defer.maybeDeferred(walker.add_node, child, childpath)
+            # Give other work a turn now and then in a directory full of
+            # files the walker deals with synchronously (LIT files, say).
+            if i % 100 == 99:
+                await fireEventually()
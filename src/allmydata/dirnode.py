@@ -7,26 +7,34 @@ import time
 
 from zope.interface import implementer
 from twisted.internet import defer
-from foolscap.api import fireEventually
 
 from allmydata.crypto import aes
 from allmydata.deep_stats import DeepStats
+from allmydata.deep_traverse import (
+    DeepTraversal,
+    DEFAULT_TRAVERSAL_CONCURRENCY,
+    DEFAULT_FRONTIER_IN_MEMORY,
+)
 from allmydata.mutable.common import NotWriteableError
 from allmydata.mutable.filenode import MutableFileNode
-from allmydata.unknown import UnknownNode, strip_prefix_for_ro
+from allmydata.unknown import strip_prefix_for_ro
 from allmydata.interfaces import IFilesystemNode, IDirectoryNode, IFileNode, \
      ExistingChildError, NoSuchChildError, ICheckable, IDeepCheckable, \
-     MustBeDeepImmutableError, CapConstraintError, ChildOfWrongTypeError
+     MustBeDeepImmutableError, CapConstraintError, ChildOfWrongTypeError, \
+     MDMF_VERSION
 from allmydata.check_results import DeepCheckResults, \
      DeepCheckAndRepairResults
 from allmydata.monitor import Monitor
 from allmydata.util import hashutil, base32, log, jsonbytes as json
 from allmydata.util.encodingutil import quote_output, normalize
 from allmydata.util.assertutil import precondition
+from allmydata.util.mathutil import div_ceil
 from allmydata.util.netstring import netstring, split_netstring
 from allmydata.util.consumer import download_to_data
 from allmydata.uri import wrap_dirnode_cap
 from allmydata.util.dictutil import AuxValueDict
+from allmydata.util.cputhreadpool import defer_to_thread
+from allmydata.util.deferredutil import async_to_deferred, gatherResults
 
 from eliot import (
     ActionType,
@@ -124,7 +132,7 @@ class Deleter(object):
         self.must_be_file = must_be_file
 
     def modify(self, old_contents, servermap, first_time):
-        children = self.node._unpack_contents(old_contents)
+        children = self.node._unpack_lazily(old_contents)
         if self.name not in children:
             if first_time and self.must_exist:
                 raise NoSuchChildError(self.name)
@@ -142,6 +150,10 @@ class Deleter(object):
         new_contents = self.node._pack_contents(children)
         return new_contents
 
+    def for_shards(self, shard_for):
+        self.node = shard_for(self.name)
+        return [self]
+
 
 class MetadataSetter(object):
     def __init__(self, node, namex, metadata, create_readonly_node=None):
@@ -151,7 +163,7 @@ class MetadataSetter(object):
         self.create_readonly_node = create_readonly_node
 
     def modify(self, old_contents, servermap, first_time):
-        children = self.node._unpack_contents(old_contents)
+        children = self.node._unpack_lazily(old_contents)
         name = self.name
         if name not in children:
             raise NoSuchChildError(name)
@@ -167,6 +179,10 @@ class MetadataSetter(object):
         new_contents = self.node._pack_contents(children)
         return new_contents
 
+    def for_shards(self, shard_for):
+        self.node = shard_for(self.name)
+        return [self]
+
 
 class Adder(object):
     def __init__(self, node, entries=None, overwrite=True, create_readonly_node=None):
@@ -190,7 +206,7 @@ class Adder(object):
         self.entries[namex] = (node, metadata)
 
     def modify(self, old_contents, servermap, first_time):
-        children = self.node._unpack_contents(old_contents)
+        children = self.node._unpack_lazily(old_contents)
         now = time.time()
         for (namex, (child, new_metadata)) in list(self.entries.items()):
             name = normalize(namex)
@@ -202,11 +218,7 @@ class Adder(object):
 
             metadata = None
             if name in children:
-                if not self.overwrite:
-                    raise ExistingChildError("child %s already exists" % quote_output(name, encoding='utf-8'))
-
-                if self.overwrite == ONLY_FILES and IDirectoryNode.providedBy(children[name][0]):
-                    raise ExistingChildError("child %s already exists as a directory" % quote_output(name, encoding='utf-8'))
+                self._check_overwrite(name, children[name][0])
                 metadata = children[name][1].copy()
 
             metadata = update_metadata(metadata, new_metadata, now)
@@ -217,6 +229,33 @@ class Adder(object):
         new_contents = self.node._pack_contents(children)
         return new_contents
 
+    def _check_overwrite(self, name, old_child):
+        if not self.overwrite:
+            raise ExistingChildError("child %s already exists" % quote_output(name, encoding='utf-8'))
+        if self.overwrite == ONLY_FILES and IDirectoryNode.providedBy(old_child):
+            raise ExistingChildError("child %s already exists as a directory" % quote_output(name, encoding='utf-8'))
+
+    @async_to_deferred
+    async def check_existing(self):
+        """Fail with ExistingChildError, without changing anything, if my
+        overwrite setting won't let me add one of my entries to my node."""
+        if self.overwrite is True:
+            return
+        existing = await self.node._get_entries({normalize(namex) for namex in self.entries})
+        for (name, (old_child, metadata)) in existing.items():
+            self._check_overwrite(name, old_child)
+
+    def for_shards(self, shard_for):
+        """Split me into one Adder for each shard that holds one of my
+        entries."""
+        entries_by_shard = {}
+        for (namex, entry) in self.entries.items():
+            shard = shard_for(normalize(namex))
+            entries_by_shard.setdefault(shard, {})[namex] = entry
+        return [Adder(shard, entries, overwrite=self.overwrite,
+                      create_readonly_node=self.create_readonly_node)
+                for (shard, entries) in entries_by_shard.items()]
+
 def _encrypt_rw_uri(writekey, rw_uri):
     precondition(isinstance(rw_uri, bytes), rw_uri)
     precondition(isinstance(writekey, bytes), writekey)
@@ -243,7 +282,8 @@ def pack_children(childrenx, writekey, deep_immutable=False):
 
 
 ZERO_LEN_NETSTR=netstring(b'')
-def _pack_normalized_children(children, writekey, deep_immutable=False):
+def _pack_normalized_children(children, writekey, deep_immutable=False,
+                              packed_entries=None):
     """Take a dict that maps:
          children[unicode_nfc_name] = (IFileSystemNode, metadata_dict)
     and pack it into a single string, for use as the contents of the backing
@@ -252,6 +292,9 @@ def _pack_normalized_children(children, writekey, deep_immutable=False):
     as the pre-packed entry, which is faster than re-packing everything each
     time.
 
+    If packed_entries is provided, it maps the names of more children to
+    their already-packed entries, which I include as they are.
+
     If writekey is provided then I will superencrypt the child's writecap with
     writekey.
 
@@ -261,9 +304,14 @@ def _pack_normalized_children(children, writekey, deep_immutable=False):
     precondition((writekey is None) or isinstance(writekey, bytes), writekey)
 
     has_aux = isinstance(children, AuxValueDict)
+    if packed_entries is None:
+        packed_entries = {}
     entries = []
-    for name in sorted(children.keys()):
+    for name in sorted(set(children.keys()) | set(packed_entries.keys())):
         assert isinstance(name, str)
+        if name in packed_entries:
+            entries.append(netstring(packed_entries[name]))
+            continue
         entry = None
         (child, metadata) = children[name]
         child.raise_error()
@@ -299,6 +347,296 @@ def _pack_normalized_children(children, writekey, deep_immutable=False):
         entries.append(netstring(entry))
     return b"".join(entries)
 
+# Unpacking at least this many children is done in the CPU thread pool.
+_UNPACK_IN_THREAD_MINIMUM = 1000
+
+# Roughly what it takes to keep a child's packed entry besides the entry
+# itself, in bytes: its name, and its place in a dict.
+_CHILD_OVERHEAD = 128
+
+
+def _decrypt_rwcapdata(writekey, encwrcap):
+    salt = encwrcap[:16]
+    crypttext = encwrcap[16:-32]
+    key = hashutil.mutable_rwcap_key_hash(salt, writekey)
+    encryptor = aes.create_decryptor(key)
+    plaintext = aes.decrypt_data(encryptor, crypttext)
+    return plaintext
+
+
+def _split_entries(data):
+    """Split the packed contents of a directory into a dict mapping each
+    child's normalized name to its packed entry, without unpacking the
+    entries any further."""
+    # the directory is serialized as a list of netstrings, one per child.
+    # Each child is serialized as a list of four netstrings: (name, ro_uri,
+    # rwcapdata, metadata), in which the name, ro_uri, metadata are in
+    # cleartext. The 'name' is UTF-8 encoded, and should be normalized to NFC.
+    # The rwcapdata is formatted as:
+    # pack("16ss32s", iv, AES(H(writekey+iv), plaintext_rw_uri), mac)
+    assert isinstance(data, bytes), (repr(data), type(data))
+    entries = {}
+    position = 0
+    while position < len(data):
+        (entry,), position = split_netstring(data, 1, position)
+        (namex_utf8,), _ = split_netstring(entry, 1)
+        # A name containing characters that are unassigned in one version of Unicode might
+        # not be normalized wrt a later version. See the note in section 'Normalization Stability'
+        # at <http://unicode.org/policies/stability_policy.html>.
+        # Therefore we normalize names going both in and out of directories.
+        entries[normalize(namex_utf8.decode("utf-8"))] = entry
+    return entries
+
+
+def _decode_entries(entries, writekey, mutable):
+    """Take (name, entry) pairs from _split_entries and return (name, entry,
+    rw_uri, ro_uri, metadata_s) for each. If writekey is provided, I use it
+    to decrypt the rw_uri. I don't create nodes, so I can be run in a
+    thread."""
+    decoded = []
+    for (name, entry) in entries:
+        (namex_utf8, ro_uri, rwcapdata, metadata_s), subpos = split_netstring(entry, 4)
+        if not mutable and len(rwcapdata) > 0:
+            raise ValueError("the rwcapdata field of a dirnode in an immutable directory was not empty")
+
+        rw_uri = b""
+        if writekey is not None:
+            rw_uri = _decrypt_rwcapdata(writekey, rwcapdata)
+
+        # Since the encryption uses CTR mode, it currently leaks the length of the
+        # plaintext rw_uri -- and therefore whether it is present, i.e. whether the
+        # dirnode is writeable (ticket #925). By stripping trailing spaces in
+        # Tahoe >= 1.6.0, we may make it easier for future versions to plug this leak.
+        # ro_uri is treated in the same way for consistency.
+        # rw_uri and ro_uri will be either None or a non-empty string.
+
+        rw_uri = rw_uri.rstrip(b' ') or None
+        ro_uri = ro_uri.rstrip(b' ') or None
+        decoded.append((name, entry, rw_uri, ro_uri, metadata_s))
+    return decoded
+
+
+def _load_metadata(metadata):
+    if isinstance(metadata, bytes):
+        metadata = json.loads(metadata)
+        assert isinstance(metadata, dict)
+    return metadata
+
+
+def _build_children(items):
+    """Make the AuxValueDict that DirectoryNode.list() returns from (name,
+    child, metadata, entry) tuples, where metadata may still be JSON."""
+    children = AuxValueDict()
+    for (name, child, metadata, entry) in items:
+        children.set_with_aux(name, (child, _load_metadata(metadata)),
+                              auxilliary=entry)
+    return children
+
+
+class _LazyChildren(object):
+    """The children of a directory, unpacked only as far as their names.
+
+    I look enough like a dict of name -> (child, metadata) for the modifiers
+    above: each child's cap is decrypted and its metadata parsed only when it
+    is asked for, and _pack_contents() copies the entries of children that
+    weren't changed without repacking them.
+
+    I keep the decrypted caps rather than the child nodes, and create a new
+    node each time a child is handed out: a DirectoryNode keeps me between
+    reads, and the nodemaker must not reuse CHK file nodes (ticket #1679).
+    It remembers mutable nodes itself.
+
+    A child which can't be unpacked (because of an unmet cap constraint, say)
+    is dropped once that is discovered, just as _unpack_contents() drops it.
+    """
+
+    def __init__(self, dirnode, data):
+        self._dirnode = dirnode
+        self.writekey = None if dirnode.is_readonly() else dirnode._node.get_writekey()
+        self.mutable = dirnode.is_mutable()
+        self.blacklist_generation = dirnode._blacklist_generation()
+        # name -> entry, for children not unpacked yet
+        self._packed = _split_entries(data)
+        self._size = len(data)
+        self._count = len(self._packed)
+        # name -> (rw_uri, ro_uri, metadata), for unpacked children that
+        # haven't changed, where the metadata is still JSON
+        self._decoded = {}
+        # name -> entry, for the same children
+        self._entries = {}
+        # name -> (child, metadata), for children changed by a modifier
+        self._children = {}
+
+    def __contains__(self, name):
+        return self._lookup(name) is not None
+
+    def __getitem__(self, name):
+        found = self._lookup(name)
+        if found is None:
+            raise KeyError(name)
+        (child, metadata) = found
+        return (child, _load_metadata(metadata))
+
+    def get(self, name, default=None):
+        found = self._lookup(name)
+        if found is None:
+            return default
+        (child, metadata) = found
+        return (child, _load_metadata(metadata))
+
+    def __setitem__(self, name, value):
+        self._packed.pop(name, None)
+        self._decoded.pop(name, None)
+        self._entries.pop(name, None)
+        self._children[name] = value
+
+    def __delitem__(self, name):
+        self._decode(name)
+        if name not in self._children and name not in self._decoded:
+            raise KeyError(name)
+        self._children.pop(name, None)
+        self._decoded.pop(name, None)
+        self._entries.pop(name, None)
+
+    def estimate_size(self):
+        """Return a rough estimate, in bytes, of the memory I use: the packed
+        entries and what it takes to keep each of them, and as much again
+        for the caps and metadata of each unpacked child. Children changed
+        by a modifier aren't counted, since I'm only kept between reads if
+        nothing changed me."""
+        average = self._size // self._count if self._count else 0
+        children = len(self._packed) + len(self._decoded)
+        return (self._size + children * _CHILD_OVERHEAD
+                + len(self._decoded) * average)
+
+    def undecoded(self):
+        """Return (name, entry) for each child not unpacked yet."""
+        return list(self._packed.items())
+
+    def add_decoded(self, decoded):
+        """Keep the caps and metadata of children unpacked by
+        _decode_entries()."""
+        for (name, entry, rw_uri, ro_uri, metadata_s) in decoded:
+            # someone may have asked for this child in the meantime
+            if self._packed.pop(name, None) is None:
+                continue
+            self._decoded[name] = (rw_uri, ro_uri, metadata_s)
+            self._entries[name] = entry
+
+    def items(self):
+        """Return (name, child, metadata, entry) for every child, unpacking
+        any that haven't been. The metadata may still be JSON."""
+        self.add_decoded(_decode_entries(self.undecoded(), self.writekey, self.mutable))
+        items = []
+        for name in sorted(set(self._children) | set(self._decoded)):
+            found = self._lookup(name)
+            if found is not None:
+                (child, metadata) = found
+                items.append((name, child, metadata, self._entries.get(name)))
+        return items
+
+    def pack(self):
+        packed_entries = dict(self._packed)
+        packed_entries.update(self._entries)
+        return _pack_normalized_children(self._children, self.writekey,
+                                         packed_entries=packed_entries)
+
+    def _decode(self, name):
+        entry = self._packed.get(name)
+        if entry is not None:
+            self.add_decoded(_decode_entries([(name, entry)], self.writekey, self.mutable))
+
+    def _lookup(self, name):
+        """Return (child, metadata) for the named child, with a new node for
+        an unchanged one, or None if there is no such child."""
+        self._decode(name)
+        if name in self._children:
+            return self._children[name]
+        decoded = self._decoded.get(name)
+        if decoded is None:
+            return None
+        (rw_uri, ro_uri, metadata_s) = decoded
+        try:
+            child = self._dirnode._create_and_validate_node(rw_uri, ro_uri, name)
+        except CapConstraintError as e:
+            log.msg(format="unmet constraint on cap for child %(name)s unpacked from a directory:\n"
+                           "%(message)s", message=e.args[0], name=quote_output(name, encoding='utf-8'),
+                    facility="tahoe.webish", level=log.UNUSUAL)
+            child = None
+        if child is not None and not (self.mutable or child.is_allowed_in_immutable_directory()):
+            log.msg(format="mutable cap for child %(name)s unpacked from an immutable directory",
+                    name=quote_output(name, encoding='utf-8'),
+                    facility="tahoe.webish", level=log.UNUSUAL)
+            child = None
+        if child is None:
+            del self._decoded[name]
+            del self._entries[name]
+            return None
+        return (child, metadata_s)
+
+
+# A large mutable directory can be sharded: its children are spread across
+# several MDMF directories (its shards), so that changing one child only
+# rewrites the shard holding it. The contents of a sharded directory are
+# SHARDED_MAGIC followed by packed entries for its shards, named "0", "1",
+# and so on. Older clients fail to unpack this, rather than mistaking it for
+# some other set of children.
+SHARDED_MAGIC = b"tahoe-sharded-directory-v1\n"
+
+# DirectoryNode.shard() aims for about this many children in each shard,
+# unless it is told how many shards to use.
+_CHILDREN_PER_SHARD = 1000
+
+
+def _shard_number(storage_index, name, count):
+    """Return which of 'count' shards of the directory with the given
+    storage index holds the child 'name'."""
+    digest = hashutil.tagged_hash(b"allmydata_dirnode_shard_v1",
+                                  storage_index + name.encode("utf-8"))
+    return int.from_bytes(digest[:8], "big") % count
+
+
+class DirectoryChangedError(Exception):
+    """The directory changed while it was being sharded, so it was left as
+    it was."""
+
+
+class _Sharded(Exception):
+    """Raised by DirectoryNode._unpack_lazily() when given the contents of
+    a sharded directory, which the modifiers can't change directly."""
+
+    def __init__(self, data):
+        Exception.__init__(self)
+        self.data = data
+
+
+class _ShardIndex(object):
+    """The contents of a sharded directory: the shard directories, and which
+    of them holds the child of any name."""
+
+    def __init__(self, dirnode, data):
+        assert data.startswith(SHARDED_MAGIC)
+        entries = _LazyChildren(dirnode, data[len(SHARDED_MAGIC):])
+        self.blacklist_generation = entries.blacklist_generation
+        self._storage_index = dirnode.get_storage_index()
+        shards = {name: child for (name, child, metadata, entry) in entries.items()}
+        try:
+            self._shards = [shards[str(i)] for i in range(len(shards))]
+        except KeyError:
+            raise ValueError("the shards of a sharded directory are not numbered 0 to %d"
+                             % (len(shards) - 1,))
+
+    def shards(self):
+        return list(self._shards)
+
+    def estimate_size(self):
+        # the shards count for themselves when they are remembered
+        return len(self._shards) * _CHILD_OVERHEAD
+
+    def shard_for(self, name):
+        return self._shards[_shard_number(self._storage_index, name, len(self._shards))]
+
+
 @implementer(IDirectoryNode, ICheckable, IDeepCheckable)
 class DirectoryNode(object):
     filenode_class = MutableFileNode
@@ -311,6 +649,8 @@ class DirectoryNode(object):
         self._uri = wrap_dirnode_cap(filenode_cap)
         self._nodemaker = nodemaker
         self._uploader = uploader
+        # (version, _LazyChildren) from the last read
+        self._cached_children = None
 
     def __repr__(self):
         return "<%s %s-%s %s>" % (self.__class__.__name__,
@@ -323,27 +663,82 @@ class DirectoryNode(object):
         fetched it. Otherwise return None. This returns synchronously."""
         return self._node.get_size()
 
+    def estimate_memory(self):
+        """Return a rough estimate, in bytes, of the memory used by the
+        children I remember from my last read, or 0 if I haven't been read.
+        This returns synchronously."""
+        cached = self._cached_children
+        if cached is None:
+            return 0
+        return cached[1].estimate_size()
+
     def get_current_size(self):
         """Calculate the size of our backing mutable file, in bytes. Returns
         a Deferred that fires with the result."""
         return self._node.get_current_size()
 
     def _read(self):
+        """Return a Deferred that fires with a _LazyChildren of the current
+        contents. I reuse the one from the last read if the contents haven't
+        changed since, so an unchanged directory isn't unpacked again."""
+        cached = self._cached_children
+        if cached is not None and cached[1].blacklist_generation != self._blacklist_generation():
+            # the children were created before the blacklist changed
+            cached = None
         if self._node.is_mutable():
             # use the IMutableFileNode API.
-            d = self._node.download_best_version()
+            known_version = None if cached is None else cached[0]
+            d = self._node.download_best_version_if_changed(known_version)
+            def _got(version_and_data):
+                (version, data) = version_and_data
+                if data is None:
+                    return cached[1]
+                return self._remember_children(version, data)
+            d.addCallback(_got)
+        elif cached is not None:
+            # the contents of an immutable directory never change
+            d = defer.succeed(cached[1])
         else:
             d = download_to_data(self._node)
-        d.addCallback(self._unpack_contents)
+            d.addCallback(lambda data: self._remember_children(None, data))
         return d
 
+    def _blacklist_generation(self):
+        blacklist = self._nodemaker.blacklist
+        if blacklist is None:
+            return None
+        blacklist.read_blacklist()
+        return blacklist.generation
+
+    def _remember_children(self, version, data):
+        if data.startswith(SHARDED_MAGIC):
+            children = _ShardIndex(self, data)
+        else:
+            children = _LazyChildren(self, data)
+        self._cached_children = (version, children)
+        return children
+
+    @async_to_deferred
+    async def _list_children(self, children):
+        if isinstance(children, _ShardIndex):
+            # the shards' packed entries are encrypted with their own
+            # writekeys, so they can't be used as ours
+            merged = AuxValueDict()
+            for listing in await gatherResults([shard.list() for shard in children.shards()]):
+                for (name, child) in listing.items():
+                    merged[name] = child
+            return merged
+        undecoded = children.undecoded()
+        if len(undecoded) >= _UNPACK_IN_THREAD_MINIMUM:
+            children.add_decoded(await defer_to_thread(
+                _decode_entries, undecoded, children.writekey, children.mutable))
+        items = children.items()
+        if len(items) >= _UNPACK_IN_THREAD_MINIMUM:
+            return await defer_to_thread(_build_children, items)
+        return _build_children(items)
+
     def _decrypt_rwcapdata(self, encwrcap):
-        salt = encwrcap[:16]
-        crypttext = encwrcap[16:-32]
-        key = hashutil.mutable_rwcap_key_hash(salt, self._node.get_writekey())
-        encryptor = aes.create_decryptor(key)
-        plaintext = aes.decrypt_data(encryptor, crypttext)
-        return plaintext
+        return _decrypt_rwcapdata(self._node.get_writekey(), encwrcap)
 
     def _create_and_validate_node(self, rw_uri, ro_uri, name):
         # name is just for error reporting
@@ -360,67 +755,49 @@ class DirectoryNode(object):
         return self._create_and_validate_node(None, node.get_readonly_uri(), name=name)
 
     def _unpack_contents(self, data):
-        # the directory is serialized as a list of netstrings, one per child.
-        # Each child is serialized as a list of four netstrings: (name, ro_uri,
-        # rwcapdata, metadata), in which the name, ro_uri, metadata are in
-        # cleartext. The 'name' is UTF-8 encoded, and should be normalized to NFC.
-        # The rwcapdata is formatted as:
-        # pack("16ss32s", iv, AES(H(writekey+iv), plaintext_rw_uri), mac)
-        assert isinstance(data, bytes), (repr(data), type(data))
-        # an empty directory is serialized as an empty string
-        if data == b"":
-            return AuxValueDict()
-        writeable = not self.is_readonly()
-        mutable = self.is_mutable()
-        children = AuxValueDict()
-        position = 0
-        while position < len(data):
-            entries, position = split_netstring(data, 1, position)
-            entry = entries[0]
-            (namex_utf8, ro_uri, rwcapdata, metadata_s), subpos = split_netstring(entry, 4)
-            if not mutable and len(rwcapdata) > 0:
-                raise ValueError("the rwcapdata field of a dirnode in an immutable directory was not empty")
-
-            # A name containing characters that are unassigned in one version of Unicode might
-            # not be normalized wrt a later version. See the note in section 'Normalization Stability'
-            # at <http://unicode.org/policies/stability_policy.html>.
-            # Therefore we normalize names going both in and out of directories.
-            name = normalize(namex_utf8.decode("utf-8"))
-
-            rw_uri = b""
-            if writeable:
-                rw_uri = self._decrypt_rwcapdata(rwcapdata)
-
-            # Since the encryption uses CTR mode, it currently leaks the length of the
-            # plaintext rw_uri -- and therefore whether it is present, i.e. whether the
-            # dirnode is writeable (ticket #925). By stripping trailing spaces in
-            # Tahoe >= 1.6.0, we may make it easier for future versions to plug this leak.
-            # ro_uri is treated in the same way for consistency.
-            # rw_uri and ro_uri will be either None or a non-empty string.
-
-            rw_uri = rw_uri.rstrip(b' ') or None
-            ro_uri = ro_uri.rstrip(b' ') or None
-
-            try:
-                child = self._create_and_validate_node(rw_uri, ro_uri, name)
-                if mutable or child.is_allowed_in_immutable_directory():
-                    metadata = json.loads(metadata_s)
-                    assert isinstance(metadata, dict)
-                    children[name] = (child, metadata)
-                    children.set_with_aux(name, (child, metadata), auxilliary=entry)
-                else:
-                    log.msg(format="mutable cap for child %(name)s unpacked from an immutable directory",
-                            name=quote_output(name, encoding='utf-8'),
-                            facility="tahoe.webish", level=log.UNUSUAL)
-            except CapConstraintError as e:
-                log.msg(format="unmet constraint on cap for child %(name)s unpacked from a directory:\n"
-                               "%(message)s", message=e.args[0], name=quote_output(name, encoding='utf-8'),
-                               facility="tahoe.webish", level=log.UNUSUAL)
+        """Return an AuxValueDict of every child in the packed contents."""
+        return _build_children(self._unpack_lazily(data).items())
+
+    def _unpack_lazily(self, data):
+        """Return a _LazyChildren of the packed contents, or raise _Sharded
+        if I am sharded."""
+        if data.startswith(SHARDED_MAGIC):
+            raise _Sharded(data)
+        return _LazyChildren(self, data)
+
+    def _modify(self, modifier):
+        """Apply a Deleter, MetadataSetter or Adder to my contents or, if I
+        am sharded, to the shards holding the children it changes."""
+        cached = self._cached_children
+        if cached is not None and isinstance(cached[1], _ShardIndex):
+            # a directory is never unsharded, so there's no need to look
+            return self._modify_shards(cached[1], modifier)
+        d = defer.maybeDeferred(self._node.modify, modifier.modify)
+        def _sharded(f):
+            f.trap(_Sharded)
+            return self._modify_shards(self._remember_children(None, f.value.data),
+                                       modifier)
+        d.addErrback(_sharded)
+        return d
 
-        return children
+    @async_to_deferred
+    async def _modify_shards(self, index, modifier):
+        modifiers = modifier.for_shards(index.shard_for)
+        if len(modifiers) > 1:
+            # An Adder's entries can be spread over several shards, which
+            # are changed separately. Make sure that none of them will
+            # refuse its entries before changing any, so that, as when I'm
+            # not sharded, a refused set_children() changes nothing. (A
+            # child added by someone else in the meantime can still make
+            # one shard refuse after others have been changed.)
+            await gatherResults([m.check_existing() for m in modifiers])
+        return await gatherResults([m.node._modify(m) for m in modifiers])
 
     def _pack_contents(self, children):
-        # expects children in the same format as _unpack_contents returns
+        # expects children in the same format as _unpack_contents or
+        # _unpack_lazily returns
+        if isinstance(children, _LazyChildren):
+            return children.pack()
         return _pack_normalized_children(children, self._node.get_writekey())
 
     def is_readonly(self):
@@ -475,33 +852,81 @@ class DirectoryNode(object):
     def list(self):
         """I return a Deferred that fires with a dictionary mapping child
         name to a tuple of (IFilesystemNode, metadata)."""
-        return self._read()
+        d = self._read()
+        d.addCallback(self._list_children)
+        return d
+
+    def list_for_traversal(self):
+        """I return a Deferred that fires with (children, shards), where
+        children is what list() would give and shards is an empty list,
+        unless I am sharded, in which case children is empty and shards is
+        a list of the directories holding my children."""
+        d = self._read()
+        def _got(children):
+            if isinstance(children, _ShardIndex):
+                return ({}, children.shards())
+            d = self._list_children(children)
+            d.addCallback(lambda listing: (listing, []))
+            return d
+        d.addCallback(_got)
+        return d
+
+    def _get_entry(self, name):
+        """Return a Deferred that fires with the (child, metadata) for the
+        normalized name, or None if I have no child by that name."""
+        d = self._read()
+        def _got(children):
+            if isinstance(children, _ShardIndex):
+                return children.shard_for(name)._get_entry(name)
+            return children.get(name)
+        d.addCallback(_got)
+        return d
+
+    @async_to_deferred
+    async def _get_entries(self, names):
+        """Return a Deferred that fires with a dict mapping each of the
+        normalized names that I have a child by to its (child, metadata),
+        reading each of my shards (if I am sharded) only once."""
+        children = await self._read()
+        if isinstance(children, _ShardIndex):
+            names_by_shard = {}
+            for name in names:
+                names_by_shard.setdefault(children.shard_for(name), []).append(name)
+            entries = {}
+            for found in await gatherResults([shard._get_entries(shard_names)
+                                              for (shard, shard_names) in names_by_shard.items()]):
+                entries.update(found)
+            return entries
+        return {name: children[name] for name in names if name in children}
 
     def has_child(self, namex):
         """I return a Deferred that fires with a boolean, True if there
         exists a child of the given name, False if not."""
         name = normalize(namex)
-        d = self._read()
-        d.addCallback(lambda children: name in children)
+        d = self._get_entry(name)
+        d.addCallback(lambda child: child is not None)
         return d
 
-    def _get(self, children, name):
-        child = children.get(name)
+    def _get(self, child, name):
         if child is None:
             raise NoSuchChildError(name)
         return child[0]
 
-    def _get_with_metadata(self, children, name):
-        child = children.get(name)
+    def _get_with_metadata(self, child, name):
         if child is None:
             raise NoSuchChildError(name)
         return child
 
+    def _get_metadata(self, child, name):
+        if child is None:
+            raise KeyError(name)
+        return child[1]
+
     def get(self, namex):
         """I return a Deferred that fires with the named child node,
         which is an IFilesystemNode."""
         name = normalize(namex)
-        d = self._read()
+        d = self._get_entry(name)
         d.addCallback(self._get, name)
         return d
 
@@ -510,14 +935,14 @@ class DirectoryNode(object):
         the named child. The node is an IFilesystemNode, and the metadata
         is a dictionary."""
         name = normalize(namex)
-        d = self._read()
+        d = self._get_entry(name)
         d.addCallback(self._get_with_metadata, name)
         return d
 
     def get_metadata_for(self, namex):
         name = normalize(namex)
-        d = self._read()
-        d.addCallback(lambda children: children[name][1])
+        d = self._get_entry(name)
+        d.addCallback(self._get_metadata, name)
         return d
 
     def set_metadata_for(self, namex, metadata):
@@ -527,7 +952,7 @@ class DirectoryNode(object):
         assert isinstance(metadata, dict)
         s = MetadataSetter(self, name, metadata,
                            create_readonly_node=self._create_readonly_node)
-        d = self._node.modify(s.modify)
+        d = self._modify(s)
         d.addCallback(lambda res: self)
         return d
 
@@ -598,7 +1023,7 @@ class DirectoryNode(object):
             # for this type of directory.
             child_node = self._create_and_validate_node(writecap, readcap, namex)
             a.set_node(namex, child_node, metadata)
-        d = self._node.modify(a.modify)
+        d = self._modify(a)
         d.addCallback(lambda ign: self)
         return d
 
@@ -619,7 +1044,7 @@ class DirectoryNode(object):
         a = Adder(self, overwrite=overwrite,
                   create_readonly_node=self._create_readonly_node)
         a.set_node(namex, child, metadata)
-        d = self._node.modify(a.modify)
+        d = self._modify(a)
         d.addCallback(lambda res: child)
         return d
 
@@ -629,7 +1054,7 @@ class DirectoryNode(object):
             return defer.fail(NotWriteableError())
         a = Adder(self, entries, overwrite=overwrite,
                   create_readonly_node=self._create_readonly_node)
-        d = self._node.modify(a.modify)
+        d = self._modify(a)
         d.addCallback(lambda res: self)
         return d
 
@@ -661,7 +1086,7 @@ class DirectoryNode(object):
             return defer.fail(NotWriteableError())
         deleter = Deleter(self, namex, must_exist=must_exist,
                           must_be_directory=must_be_directory, must_be_file=must_be_file)
-        d = self._node.modify(deleter.modify)
+        d = self._modify(deleter)
         d.addCallback(lambda res: deleter.old_child)
         return d
 
@@ -687,7 +1112,7 @@ class DirectoryNode(object):
             entries = {name: (child, metadata)}
             a = Adder(self, entries, overwrite=overwrite,
                       create_readonly_node=self._create_readonly_node)
-            d = self._node.modify(a.modify)
+            d = self._modify(a)
             d.addCallback(lambda res: child)
             return d
         d.addCallback(_created)
@@ -729,8 +1154,57 @@ class DirectoryNode(object):
         d.addCallback(lambda child: self.delete(current_child_name))
         return d
 
-
-    def deep_traverse(self, walker):
+    @async_to_deferred
+    async def shard(self, shards=None):
+        """Move my children into 'shards' new MDMF directories, so that
+        changing one of them only rewrites the directory holding it, and
+        replace my contents with an index of those directories. By default
+        I use enough shards for about _CHILDREN_PER_SHARD children each. I
+        return a Deferred that fires with the number of shards.
+
+        If my contents change while this happens, I leave them as they are
+        and fail with DirectoryChangedError. The shard directories I had
+        already created are then left unreferenced: nothing links to them,
+        and their shares are only reclaimed once their leases expire. If I
+        am already sharded, I leave my shards as they are."""
+        if self.is_readonly():
+            raise NotWriteableError()
+        data = await self._node.download_best_version()
+        if data.startswith(SHARDED_MAGIC):
+            return len(_ShardIndex(self, data).shards())
+
+        children = await self._list_children(self._unpack_lazily(data))
+        if shards is None:
+            shards = max(1, div_ceil(len(children), _CHILDREN_PER_SHARD))
+        precondition(shards > 0, shards)
+        storage_index = self.get_storage_index()
+        initial_children = [{} for i in range(shards)]
+        for (name, child) in children.items():
+            initial_children[_shard_number(storage_index, name, shards)][name] = child
+        del children
+        nodes = await gatherResults([
+            self._nodemaker.create_new_mutable_directory(kids, version=MDMF_VERSION)
+            for kids in initial_children
+        ])
+        new_contents = SHARDED_MAGIC + _pack_normalized_children(
+            {str(i): (node, {}) for (i, node) in enumerate(nodes)},
+            self._node.get_writekey())
+
+        def _replace(old_contents, servermap, first_time):
+            if old_contents == new_contents:
+                # an earlier attempt was published after all
+                return None
+            if old_contents != data:
+                raise DirectoryChangedError()
+            return new_contents
+        await self._node.modify(_replace)
+        self._cached_children = None
+        return shards
+
+
+    def deep_traverse(self, walker,
+                      concurrency=DEFAULT_TRAVERSAL_CONCURRENCY,
+                      frontier_in_memory=DEFAULT_FRONTIER_IN_MEMORY):
         """Perform a recursive walk, using this dirnode as a root, notifying
         the 'walker' instance of everything I encounter.
 
@@ -744,6 +1218,12 @@ class DirectoryNode(object):
         I call walker.add_node(node, path) for each node (both files and
         directories) I can reach. Most work should be done here.
 
+        The children of a sharded directory are found in its shards, which
+        are not themselves nodes of the tree: I give them to neither
+        add_node() nor enter_directory(), but if the walker has an
+        add_shard(node, path) method I call it for each shard, with the
+        sharded directory's path.
+
         I avoid loops by keeping track of verifier-caps and refusing to call
         walker.add_node() or traverse a node that I've seen before. This
         means that any file or directory will only be given to the walker
@@ -751,83 +1231,37 @@ class DirectoryNode(object):
         directory structure, this may appear to under-count or miss some of
         them.
 
+        I read up to 'concurrency' directories at a time, so the walker may
+        be working on nodes from several directories at once. Directories
+        waiting to be read are remembered by their caps; once there are
+        more than 'frontier_in_memory' of them, the rest are kept in a
+        temporary file.
+
         I return a Monitor which can be used to wait for the operation to
         finish, learn about its progress, or cancel the operation.
         """
 
-        # this is just a tree-walker, except that following each edge
-        # requires a Deferred. We used to use a ConcurrencyLimiter to limit
-        # fanout to 10 simultaneous operations, but the memory load of the
-        # queued operations was excessive (in one case, with 330k dirnodes,
-        # it caused the process to run into the 3.0GB-ish per-process 32bit
-        # linux memory limit, and crashed). So we use a single big Deferred
-        # chain, and do a strict depth-first traversal, one node at a time.
-        # This can be slower, because we aren't pipelining directory reads,
-        # but it brought the memory footprint down by roughly 50%.
+        # We used to use a ConcurrencyLimiter to limit fanout to 10
+        # simultaneous operations, but queueing an operation (and so a node
+        # object) for every directory found used too much memory (in one
+        # case, with 330k dirnodes, more than the 3.0GB-ish per-process
+        # 32bit linux memory limit). Then we did a strict depth-first
+        # traversal, one node at a time, which was slow. DeepTraversal
+        # queues caps instead, on disk if there are many, and remembers
+        # digests of verifier-caps rather than the caps themselves.
 
         monitor = Monitor()
         walker.set_monitor(monitor)
 
-        found = set([self.get_verify_cap()])
-        d = self._deep_traverse_dirnode(self, [], walker, monitor, found)
+        traversal = DeepTraversal(self._nodemaker, walker, monitor, set(),
+                                  concurrency, frontier_in_memory)
+        d = traversal.run(self)
         d.addCallback(lambda ignored: walker.finish())
         d.addBoth(monitor.finish)
         d.addErrback(lambda f: None)
 
         return monitor
 
-    def _deep_traverse_dirnode(self, node, path, walker, monitor, found):
-        # process this directory, then walk its children
-        monitor.raise_if_cancelled()
-        d = defer.maybeDeferred(walker.add_node, node, path)
-        d.addCallback(lambda ignored: node.list())
-        d.addCallback(self._deep_traverse_dirnode_children, node, path,
-                      walker, monitor, found)
-        return d
-
-    def _deep_traverse_dirnode_children(self, children, parent, path,
-                                        walker, monitor, found):
-        monitor.raise_if_cancelled()
-        d = defer.maybeDeferred(walker.enter_directory, parent, children)
-        # we process file-like children first, so we can drop their FileNode
-        # objects as quickly as possible. Tests suggest that a FileNode (held
-        # in the client's nodecache) consumes about 2440 bytes. dirnodes (not
-        # in the nodecache) seem to consume about 2000 bytes.
-        dirkids = []
-        filekids = []
-        for name, (child, metadata) in sorted(children.items()):
-            childpath = path + [name]
-            if isinstance(child, UnknownNode):
-                walker.add_node(child, childpath)
-                continue
-            verifier = child.get_verify_cap()
-            # allow LIT files (for which verifier==None) to be processed
-            if (verifier is not None) and (verifier in found):
-                continue
-            found.add(verifier)
-            if IDirectoryNode.providedBy(child):
-                dirkids.append( (child, childpath) )
-            else:
-                filekids.append( (child, childpath) )
-        for i, (child, childpath) in enumerate(filekids):
-            d.addCallback(lambda ignored, child=child, childpath=childpath:
-                          walker.add_node(child, childpath))
-            # to work around the Deferred tail-recursion problem
-            # (specifically the defer.succeed flavor) requires us to avoid
-            # doing more than 158 LIT files in a row. We insert a turn break
-            # once every 100 files (LIT or CHK) to preserve some stack space
-            # for other code. This is a different expression of the same
-            # Twisted problem as in #237.
-            if i % 100 == 99:
-                d.addCallback(lambda ignored: fireEventually())
-        for (child, childpath) in dirkids:
-            d.addCallback(lambda ignored, child=child, childpath=childpath:
-                          self._deep_traverse_dirnode(child, childpath,
-                                                      walker, monitor,
-                                                      found))
-        return d
-
-
     def build_manifest(self):
         """Return a Monitor, with a ['status'] that will be a list of (path,
         cap) tuples, for all nodes (directories and files) reachable from
@@ -864,6 +1298,12 @@ class ManifestWalker(DeepStats):
             self.verifycaps.add(v.to_string())
         return DeepStats.add_node(self, node, path)
 
+    def add_shard(self, node, path):
+        # Shards aren't in the manifest, but anything renewing leases on
+        # the storage indexes or verifycaps needs to know about them.
+        self.storage_index_strings.add(base32.b2a(node.get_storage_index()))
+        self.verifycaps.add(node.get_verify_cap().to_string())
+
     def get_results(self):
         stats = DeepStats.get_results(self)
         return {"manifest": self.manifest,
@@ -906,6 +1346,17 @@ class DeepChecker(object):
         d.addCallback(lambda ignored: self._stats.add_node(node, childpath))
         return d
 
+    def add_shard(self, node, path):
+        # A shard is checked (and repaired) like any directory, but it has
+        # no path of its own and isn't counted in the stats.
+        if self._repair:
+            d = node.check_and_repair(self.monitor, self._verify, self._add_lease)
+            d.addCallback(self._results.add_check_and_repair, None)
+        else:
+            d = node.check(self.monitor, self._verify, self._add_lease)
+            d.addCallback(self._results.add_check, None)
+        return d
+
     def enter_directory(self, parent, children):
         return self._stats.enter_directory(parent, children)
 
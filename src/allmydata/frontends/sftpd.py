@@ -4,6 +4,7 @@ Ported to Python 3.
 
 import six
 import heapq, traceback, stat, struct
+from collections import OrderedDict
 from stat import S_IFREG, S_IFDIR
 from time import time, strftime, localtime
 
@@ -31,9 +32,10 @@ from allmydata.util import deferredutil
 
 from allmydata.util.assertutil import _assert, precondition
 from allmydata.util.consumer import download_to_data
+from allmydata.util.observer import OneShotObserverList
 from allmydata.util.encodingutil import get_filesystem_encoding
 from allmydata.interfaces import IFileNode, IDirectoryNode, ExistingChildError, \
-     NoSuchChildError, ChildOfWrongTypeError
+     NoSuchChildError, ChildOfWrongTypeError, SDMF_VERSION
 from allmydata.mutable.common import NotWriteableError
 from allmydata.mutable.publish import MutableFileHandle
 from allmydata.immutable.upload import FileHandle
@@ -563,15 +565,23 @@ class OverwriteableFileConsumer(PrefixingLogMixin):
         self.log("producer unregistered", level=NOISY)
 
 
-SIZE_THRESHOLD = 1000
+# Read-only file handles fetch data in aligned chunks of CHUNK_SIZE bytes
+# (or, for SDMF files, all at once), and keep up to CACHED_CHUNKS of the most recently used chunks. When a handle
+# is being read sequentially, the READ_AHEAD_CHUNKS chunks after each read are
+# fetched before they are asked for.
+CHUNK_SIZE = 128*1024
+CACHED_CHUNKS = 8
+READ_AHEAD_CHUNKS = 4
 
 
 @implementer(ISFTPFile)
-class ShortReadOnlySFTPFile(PrefixingLogMixin):
+class ReadOnlySFTPFile(PrefixingLogMixin):
     """I represent a file handle to a particular file on an SFTP connection.
-    I am used only for short immutable files opened in read-only mode.
-    When I am created, the file contents start to be downloaded to memory.
-    self.async_ is used to delay read requests until the download has finished."""
+    I am used only for existing files opened in read-only mode.
+    Rather than downloading the whole file, I satisfy each read request with
+    range reads of the best readable version of the file, a chunk at a time.
+    self.async_ is used to delay read requests until that version has been
+    found."""
 
     def __init__(self, userpath, filenode, metadata):
         PrefixingLogMixin.__init__(self, facility="tahoe.sftp", prefix=userpath)
@@ -581,9 +591,78 @@ class ShortReadOnlySFTPFile(PrefixingLogMixin):
                      userpath=userpath, filenode=filenode)
         self.filenode = filenode
         self.metadata = metadata
-        self.async_ = download_to_data(filenode)
+        self.async_ = filenode.get_best_readable_version()
         self.closed = False
 
+        if filenode.is_mutable() and filenode.get_version() == SDMF_VERSION:
+            # An SDMF file is a single segment, which has to be retrieved
+            # whole to read any part of it, so read it in one chunk.
+            self._chunk_size = None
+        else:
+            self._chunk_size = CHUNK_SIZE
+        # chunk number -> OneShotObserverList, least recently used first
+        self._chunks = OrderedDict()
+        # the offset just past the end of the previous read
+        self._next_offset = None
+
+    def _get_chunk(self, version, chunknum, chunk_size):
+        if chunknum in self._chunks:
+            self._chunks.move_to_end(chunknum)
+            return self._chunks[chunknum].when_fired()
+
+        observer = self._chunks[chunknum] = OneShotObserverList()
+        while len(self._chunks) > CACHED_CHUNKS:
+            self._chunks.popitem(last=False)
+        d = observer.when_fired()
+
+        offset = chunknum * chunk_size
+        if noisy: self.log("fetching chunk %r at offset %r" % (chunknum, offset), level=NOISY)
+        d2 = download_to_data(version, offset, min(chunk_size, version.get_size() - offset))
+        def _fetched(res):
+            # Don't cache a failed read, so that it will be retried next time.
+            if isinstance(res, Failure) and self._chunks.get(chunknum) is observer:
+                del self._chunks[chunknum]
+            observer.fire(res)
+        d2.addBoth(_fetched)
+        return d
+
+    def _read(self, version, offset, length):
+        # "In response to this request, the server will read as many bytes as it
+        #  can from the file (up to 'len'), and return them in a SSH_FXP_DATA
+        #  message.  If an error occurs or EOF is encountered before reading any
+        #  data, the server will respond with SSH_FXP_STATUS.  For normal disk
+        #  files, it is guaranteed that this will read the specified number of
+        #  bytes, or up to end of file."
+        #
+        # i.e. we respond with an EOF error iff offset is already at EOF.
+
+        size = version.get_size()
+        if offset >= size:
+            raise createSFTPError(FX_EOF, "read at or past end of file")
+
+        end = min(offset + length, size)  # truncated if offset+length > size
+        if end == offset:
+            return b""
+
+        chunk_size = self._chunk_size or size
+        first = offset // chunk_size
+        last = (end - 1) // chunk_size
+        d = defer.gatherResults([self._get_chunk(version, n, chunk_size) for n in range(first, last + 1)],
+                                consumeErrors=True)
+
+        if offset == self._next_offset:
+            # This read follows on from the previous one, so fetch ahead.
+            num_chunks = (size + chunk_size - 1) // chunk_size
+            for n in range(last + 1, min(last + 1 + READ_AHEAD_CHUNKS, num_chunks)):
+                # A failed read-ahead isn't cached, so a later read of the
+                # chunk will try again and report the error.
+                self._get_chunk(version, n, chunk_size).addErrback(lambda f: None)
+        self._next_offset = end
+
+        start = first * chunk_size
+        d.addCallback(lambda chunks: b"".join(chunks)[offset - start:end - start])
+        return d
+
     def readChunk(self, offset, length):
         request = ".readChunk(%r, %r)" % (offset, length)
         self.log(request, level=OPERATIONAL)
@@ -593,24 +672,14 @@ class ShortReadOnlySFTPFile(PrefixingLogMixin):
             return defer.execute(_closed)
 
         d = defer.Deferred()
-        def _read(data):
-            if noisy: self.log("_read(<data of length %r>) in readChunk(%r, %r)" % (len(data), offset, length), level=NOISY)
-
-            # "In response to this request, the server will read as many bytes as it
-            #  can from the file (up to 'len'), and return them in a SSH_FXP_DATA
-            #  message.  If an error occurs or EOF is encountered before reading any
-            #  data, the server will respond with SSH_FXP_STATUS.  For normal disk
-            #  files, it is guaranteed that this will read the specified number of
-            #  bytes, or up to end of file."
-            #
-            # i.e. we respond with an EOF error iff offset is already at EOF.
+        def _got_version(version):
+            if noisy: self.log("_got_version(%r) in readChunk(%r, %r)" % (version, offset, length), level=NOISY)
 
-            if offset >= len(data):
-                eventually_errback(d)(Failure(createSFTPError(FX_EOF, "read at or past end of file")))
-            else:
-                eventually_callback(d)(data[offset:offset+length])  # truncated if offset+length > len(data)
-            return data
-        self.async_.addCallbacks(_read, eventually_errback(d))
+            d2 = defer.maybeDeferred(self._read, version, offset, length)
+            d2.addBoth(eventually_callback(d))
+            # It is correct to drop d2 here.
+            return version
+        self.async_.addCallbacks(_got_version, eventually_errback(d))
         d.addBoth(_convert_error, request)
         return d
 
@@ -624,6 +693,7 @@ class ShortReadOnlySFTPFile(PrefixingLogMixin):
         self.log(".close()", level=OPERATIONAL)
 
         self.closed = True
+        self._chunks.clear()
         return defer.succeed(None)
 
     def getAttrs(self):
@@ -647,11 +717,13 @@ class ShortReadOnlySFTPFile(PrefixingLogMixin):
 @implementer(ISFTPFile)
 class GeneralSFTPFile(PrefixingLogMixin):
     """I represent a file handle to a particular file on an SFTP connection.
-    I wrap an instance of OverwriteableFileConsumer, which is responsible for
-    storing the file contents. In order to allow write requests to be satisfied
-    immediately, there is effectively a FIFO queue between requests made to this
-    file handle, and requests to my OverwriteableFileConsumer. This queue is
-    implemented by the callback chain of self.async_.
+    I am used for files opened for writing (read-only handles are
+    ReadOnlySFTPFile). I wrap an instance of OverwriteableFileConsumer,
+    which is responsible for storing the file contents. In order to allow
+    write requests to be satisfied immediately, there is effectively a FIFO
+    queue between requests made to this file handle, and requests to my
+    OverwriteableFileConsumer. This queue is implemented by the callback
+    chain of self.async_.
 
     When first constructed, I am in an 'unopened' state that causes most
     operations to be delayed until 'open' is called."""
@@ -1267,8 +1339,8 @@ class SFTPUserHandler(ConchUser, PrefixingLogMixin):
 
         d = self._sync_heisenfiles(userpath, direntry, ignore=existing_file)
 
-        if not writing and (flags & FXF_READ) and filenode and not filenode.is_mutable() and filenode.get_size() <= SIZE_THRESHOLD:
-            d.addCallback(lambda ign: ShortReadOnlySFTPFile(userpath, filenode, metadata))
+        if not writing and (flags & FXF_READ) and filenode:
+            d.addCallback(lambda ign: ReadOnlySFTPFile(userpath, filenode, metadata))
         else:
             close_notify = None
             if writing:
@@ -49,10 +49,14 @@ or eat  your children, but it might.  Use at your own risk.
 Ported to Python 3.
 """
 
+import hashlib
+
 from allmydata.util import mathutil # from the pyutil library
 
 from allmydata.util import base32
-from allmydata.util.hashutil import tagged_hash, tagged_pair_hash
+from allmydata.util.hashutil import tagged_hash, tagged_pair_hash, \
+     CRYPTO_VAL_SIZE
+from allmydata.util.netstring import netstring
 
 __version__ = '1.0.0-allmydata'
 
@@ -175,8 +179,37 @@ def depth_of(i):
 def empty_leaf_hash(i):
     return tagged_hash(b'Merkle tree empty leaf', b"%d" % i)
 
+_PAIR_HASH_TAG = b'Merkle tree internal node'
+
 def pair_hash(a, b):
-    return tagged_pair_hash(b'Merkle tree internal node', a, b)
+    return tagged_pair_hash(_PAIR_HASH_TAG, a, b)
+
+# How many hashes CompactHashTree handles at a time: enough to make the
+# per-batch overhead negligible, few enough to keep temporary copies small.
+_BATCH_SIZE = 1024
+
+def _hash_level(children, parents):
+    """Fill in one level of a hash tree from the level below it, computing
+    the same thing as pair_hash() for each pair of children, but without
+    setting up the tag for every one. 'children' and 'parents' are buffers
+    of CRYPTO_VAL_SIZE-byte hashes, back to back, with twice as many
+    children as parents; 'parents' must be writable."""
+    size = CRYPTO_VAL_SIZE
+    tagged = hashlib.sha256(netstring(_PAIR_HASH_TAG))
+    sha256 = hashlib.sha256
+    length = b"%d:" % size
+    middle = b"," + length
+    batch = _BATCH_SIZE * size
+    for start in range(0, len(parents), batch):
+        pairs = bytes(children[2*start:2*(start+batch)])
+        digests = []
+        for i in range(0, len(pairs), 2 * size):
+            h = tagged.copy()
+            h.update(length + pairs[i:i+size] + middle +
+                     pairs[i+size:i+2*size] + b",")
+            # SHA-256d, as in hashutil
+            digests.append(sha256(h.digest()).digest())
+        parents[start:start+batch] = b"".join(digests)
 
 class HashTree(CompleteBinaryTreeMixin, list):
     """
@@ -255,6 +288,82 @@ class HashTree(CompleteBinaryTreeMixin, list):
         return needed
 
 
+class CompactHashTree(CompleteBinaryTreeMixin):
+    """
+    I am the same as a HashTree, with the same hashes at the same indices,
+    but I keep them in a single bytearray instead of a list of bytes
+    objects, and compute them a level at a time. This makes me much cheaper
+    to build for trees with many leaves, such as the block hash tree of a
+    large file.
+
+    All of my leaves must be CRYPTO_VAL_SIZE bytes long. Indexing me gives
+    bytes, as indexing a HashTree does, and list(me) == list(HashTree(L)).
+    """
+
+    def __init__(self, L):
+        """
+        Create complete binary tree from list of hash strings, augmented to
+        a power of 2 in length just as HashTree does.
+        """
+        size = CRYPTO_VAL_SIZE
+        for leaf in L:
+            if len(leaf) != size:
+                raise ValueError("leaves must be %d bytes long, not %d"
+                                 % (size, len(leaf)))
+        end = roundup_pow2(len(L))
+        self.first_leaf_num = end - 1
+        self._num_hashes = 2 * end - 1
+        self._hashes = bytearray(self._num_hashes * size)
+        hashes = memoryview(self._hashes)
+        first = self.first_leaf_num
+        for start in range(0, len(L), _BATCH_SIZE):
+            leaves = L[start:start+_BATCH_SIZE]
+            hashes[(first+start)*size:(first+start+len(leaves))*size] = \
+                b"".join(leaves)
+        for i in range(len(L), end):
+            hashes[(first+i)*size:(first+i+1)*size] = empty_leaf_hash(i)
+        # Each row of the tree starts at index first and ends at 2*first,
+        # and its parents are the row before it.
+        while first:
+            parents_first = (first - 1) // 2
+            _hash_level(hashes[first*size:(2*first+1)*size],
+                        hashes[parents_first*size:first*size])
+            first = parents_first
+
+    def __len__(self):
+        return self._num_hashes
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self._num_hashes))]
+        if i < 0:
+            i += self._num_hashes
+        if not 0 <= i < self._num_hashes:
+            raise IndexError('index out of range: ' + repr(i))
+        return bytes(self._hashes[i*CRYPTO_VAL_SIZE:(i+1)*CRYPTO_VAL_SIZE])
+
+    def __iter__(self):
+        for i in range(self._num_hashes):
+            yield self[i]
+
+    def needed_hashes(self, leafnum, include_leaf=False):
+        """Which hashes will someone need to validate a given data block?
+
+        I return the same set as HashTree.needed_hashes(), working it out
+        from the leaf's index alone.
+        """
+        if not 0 <= leafnum <= self.first_leaf_num:
+            raise IndexError('leaf out of range: ' + repr(leafnum))
+        i = self.first_leaf_num + leafnum
+        needed = set()
+        if include_leaf:
+            needed.add(i)
+        while i:
+            needed.add(i + 1 if i % 2 else i - 1)
+            i = (i - 1) // 2
+        return needed
+
+
 class NotEnoughHashesError(Exception):
     pass
 
@@ -285,18 +394,10 @@ class IncompleteHashTree(CompleteBinaryTreeMixin, list):
     """
 
     def __init__(self, num_leaves):
-        L = [None] * num_leaves
-        start = len(L)
-        end   = roundup_pow2(len(L))
+        end   = roundup_pow2(num_leaves)
         self.first_leaf_num = end - 1
-        L     = L + [None] * (end - start)
-        rows = [L]
-        while len(rows[-1]) != 1:
-            last = rows[-1]
-            rows += [[None for i in range(len(last)//2)]]
-        # Flatten the list of rows into a single list.
-        rows.reverse()
-        self[:] = sum(rows, [])
+        # Every row of the tree, from the root down to the leaves, is empty.
+        self[:] = [None] * (2 * end - 1)
 
 
     def needed_hashes(self, leafnum, include_leaf=False):
@@ -478,3 +579,56 @@ class IncompleteHashTree(CompleteBinaryTreeMixin, list):
             for i in remove_upon_failure:
                 self[i] = None
             raise
+
+
+def needed_for_update(num_leaves, leafnums):
+    """Which hashes do I need to recompute a hash tree when some leaves change?
+
+    I accept the number of leaves in a HashTree and the leaf numbers that are
+    changing, and return a set of 'hash index' values: the siblings of every
+    node on the way from those leaves up to the root, except for the nodes on
+    that way themselves, since their hashes are the ones that will change.
+    Together with the new leaf hashes, these are enough for update_hashes().
+    """
+    first_leaf_num = roundup_pow2(num_leaves) - 1
+    changing = set()
+    for leafnum in leafnums:
+        i = first_leaf_num + leafnum
+        while i not in changing:
+            changing.add(i)
+            if i == 0:
+                break
+            i = (i - 1) // 2
+    siblings = set(i + 1 if i % 2 else i - 1 for i in changing if i != 0)
+    return siblings - changing
+
+def update_hashes(num_leaves, hashes, leaves):
+    """Recompute the part of a hash tree which changes with some of its leaves.
+
+    'hashes' is a dictionary mapping 'hash index' values to the old hashes of
+    a HashTree with num_leaves leaves, which must include at least the ones
+    that needed_for_update() asks for. 'leaves' is a dictionary mapping leaf
+    numbers to their new hashes. I return a dictionary mapping the 'hash
+    index' of every hash that changes, from those leaves up to the root, to
+    its new value. If a hash that I need is missing, I raise
+    NotEnoughHashesError.
+    """
+    first_leaf_num = roundup_pow2(num_leaves) - 1
+    new_hashes = dict((first_leaf_num + leafnum, leafhash)
+                      for (leafnum, leafhash) in leaves.items())
+    level = set(new_hashes)
+    while level:
+        parents = set((i - 1) // 2 for i in level if i != 0)
+        for parentnum in parents:
+            children = []
+            for childnum in (2 * parentnum + 1, 2 * parentnum + 2):
+                if childnum in new_hashes:
+                    children.append(new_hashes[childnum])
+                elif childnum in hashes:
+                    children.append(hashes[childnum])
+                else:
+                    raise NotEnoughHashesError("unable to compute [%d]"
+                                               % parentnum)
+            new_hashes[parentnum] = pair_hash(*children)
+        level = parents
+    return new_hashes
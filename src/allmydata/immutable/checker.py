@@ -12,6 +12,7 @@ from allmydata.check_results import CheckResults
 from allmydata.uri import CHKFileVerifierURI
 from allmydata.util.assertutil import precondition
 from allmydata.util import base32, deferredutil, dictutil, log, mathutil
+from allmydata.util.cputhreadpool import defer_to_thread
 from allmydata.util.hashutil import file_renewal_secret_hash, \
      file_cancel_secret_hash, bucket_renewal_secret_hash, \
      bucket_cancel_secret_hash, uri_extension_hash, CRYPTO_VAL_SIZE, \
@@ -20,6 +21,13 @@ from allmydata.util.happinessutil import servers_of_happiness
 
 from allmydata.immutable import layout
 
+# When verifying, runs of adjacent blocks of a share are read together, in
+# reads of about this many bytes, and up to this many reads are kept
+# outstanding at each server (shared by all its shares), so that the blocks
+# of one read are hashed while the next ones are on their way.
+VERIFY_READ_SIZE = 1024 * 1024
+VERIFY_READS_PER_SERVER = 4
+
 class IntegrityCheckReject(Exception):
     pass
 class BadURIExtension(IntegrityCheckReject):
@@ -344,19 +352,51 @@ class ValidatedReadBucketProxy(log.PrefixingLogMixin):
         blockhashesneeded.discard(0)
         d2 = self.bucket.get_block_hashes(blockhashesneeded)
 
-        if blocknum < self.num_blocks-1:
-            thisblocksize = self.block_size
-        else:
-            thisblocksize = self.share_size % self.block_size
-            if thisblocksize == 0:
-                thisblocksize = self.block_size
-        d3 = self.bucket.get_block_data(blocknum,
-                                        self.block_size, thisblocksize)
+        d3 = self.bucket.get_block_data(blocknum, self.block_size,
+                                        self._get_block_size(blocknum))
 
         dl = deferredutil.gatherResults([d1, d2, d3])
         dl.addCallback(self._got_data, blocknum)
         return dl
 
+    def _get_block_size(self, blocknum):
+        if blocknum < self.num_blocks-1:
+            return self.block_size
+        thisblocksize = self.share_size % self.block_size
+        if thisblocksize == 0:
+            thisblocksize = self.block_size
+        return thisblocksize
+
+    def get_blocks(self, first, count):
+        """Retrieve and validate 'count' adjacent blocks, starting with block
+        number 'first', with a single read. The Verifier uses this after
+        get_all_blockhashes() has filled in the whole block hash tree, so
+        each block only has to be hashed (which is done on the CPU thread
+        pool) and compared with its leaf.
+
+        I return a Deferred which fires with a list of the blocks, or
+        errbacks upon failure, probably with BadOrMissingHash."""
+        precondition(0 <= first and first + count <= self.num_blocks,
+                     self, first, count, self.num_blocks)
+        d = self.bucket.get_blocks_data(first, count, self.block_size,
+                                        self._get_block_size(first + count - 1))
+        d.addCallback(self._got_blocks, first)
+        return d
+
+    @deferredutil.async_to_deferred
+    async def _got_blocks(self, blocks, first):
+        blockhashes = await defer_to_thread(_block_hashes, blocks)
+        for (blocknum, blockhash) in enumerate(blockhashes, first):
+            try:
+                self.block_hash_tree.set_hashes(leaves={blocknum: blockhash})
+            except (hashtree.BadHashError, hashtree.NotEnoughHashesError) as le:
+                self.log("hash failure in block=%d, shnum=%d on %s" %
+                         (blocknum, self.sharenum, self.bucket))
+                self.log(" block length: %d" % len(blocks[blocknum - first]))
+                self.log(" block hash: %r" % base32.b2a_or_none(blockhash))
+                raise BadOrMissingHash(le)
+        return blocks
+
     def _got_data(self, results, blocknum):
         precondition(blocknum < self.num_blocks,
                      self, blocknum, self.num_blocks)
@@ -444,6 +484,10 @@ class ValidatedReadBucketProxy(log.PrefixingLogMixin):
         return blockdata
 
 
+def _block_hashes(blocks):
+    return [block_hash(block) for block in blocks]
+
+
 class Checker(log.PrefixingLogMixin):
     """I query all servers to see if M uniquely-numbered shares are
     available.
@@ -562,10 +606,12 @@ class Checker(log.PrefixingLogMixin):
                 level=log.WEIRD, umid="hEGuQg")
 
 
-    def _download_and_verify(self, server, sharenum, bucket):
+    def _download_and_verify(self, server, sharenum, bucket, window):
         """Start an attempt to download and verify every block in this bucket
         and return a deferred that will eventually fire once the attempt
-        completes.
+        completes. The blocks are read in runs, as many at a time as
+        'window' (a DeferredSemaphore shared by all the shares on this
+        server) allows.
 
         If you download and verify every block then fire with (True,
         sharenum, None), else if the share data couldn't be parsed because it
@@ -619,27 +665,8 @@ class Checker(log.PrefixingLogMixin):
             return d
         d.addCallback(_got_ueb)
 
-        def _discard_result(r):
-            assert isinstance(r, bytes), r
-            # to free up the RAM
-            return None
-
-        def _get_blocks(vrbp):
-            def _get_block(ign, blocknum):
-                db = vrbp.get_block(blocknum)
-                db.addCallback(_discard_result)
-                return db
-
-            dbs = defer.succeed(None)
-            for blocknum in range(veup.num_segments):
-                dbs.addCallback(_get_block, blocknum)
-
-            # The Deferred we return will fire after every block of this
-            # share has been downloaded and verified successfully, or else it
-            # will errback as soon as the first error is observed.
-            return dbs
-
-        d.addCallback(_get_blocks)
+        d.addCallback(lambda vrbp: self._verify_blocks(
+            vrbp, veup.num_segments, veup.block_size, window))
 
         # if none of those errbacked, the blocks (and the hashes above them)
         # are good
@@ -670,6 +697,36 @@ class Checker(log.PrefixingLogMixin):
 
         return d
 
+    @deferredutil.async_to_deferred
+    async def _verify_blocks(self, vrbp, num_blocks, block_size, window):
+        """Download and verify every block of a share, keeping as many reads
+        outstanding as 'window' allows. I fire after every block has been
+        downloaded and verified successfully, or else errback as soon as
+        the first error is observed."""
+        blocks_per_read = max(1, VERIFY_READ_SIZE // block_size)
+        failed = []
+        reads = []
+
+        def _done(blocks):
+            window.release()
+            # to free up the RAM
+            return None
+
+        def _failed(f):
+            window.release()
+            failed.append(f)
+            return f
+
+        for first in range(0, num_blocks, blocks_per_read):
+            await window.acquire()
+            if failed:
+                window.release()
+                break
+            d = vrbp.get_blocks(first, min(blocks_per_read, num_blocks - first))
+            d.addCallbacks(_done, _failed)
+            reads.append(d)
+        await deferredutil.gatherResults(reads)
+
     def _verify_server_shares(self, s):
         """ Return a deferred which eventually fires with a tuple of
         (set(sharenum), server, set(corruptsharenum),
@@ -698,9 +755,10 @@ class Checker(log.PrefixingLogMixin):
         def _got_buckets(result):
             bucketdict, success = result
 
+            window = defer.DeferredSemaphore(VERIFY_READS_PER_SERVER)
             shareverds = []
             for (sharenum, bucket) in list(bucketdict.items()):
-                d = self._download_and_verify(s, sharenum, bucket)
+                d = self._download_and_verify(s, sharenum, bucket, window)
                 shareverds.append(d)
 
             dl = deferredutil.gatherResults(shareverds)
@@ -0,0 +1,103 @@
+"""
+A client-wide cache of recently downloaded immutable file segments.
+
+Every ``read()`` of an immutable file fetches the segments it needs from the
+grid, even if the same range was read a moment ago by another ``read()``:
+HTTP Range requests, SFTP random access and seeking in a video player all do
+this.  ``SegmentCache`` keeps the most recently used verified ciphertext
+segments, and the validated URI extension blocks needed to interpret them,
+so that every ``DownloadNode`` for the same file can use them.
+
+Entries are keyed by the URI extension hash from the verify cap rather than
+the storage index alone, since the same storage index could (in theory) have
+been uploaded more than once with different segment sizes.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Optional
+
+from zope.interface import implementer
+
+from allmydata.interfaces import IStatsProducer
+
+# Off by default: a new download of a file always goes back to the grid.
+DEFAULT_SEGMENT_CACHE_MAX_BYTES = 0
+
+
+@implementer(IStatsProducer)
+class SegmentCache(object):
+    """
+    An LRU of ciphertext segments, bounded by their total size.
+
+    :ivar max_bytes: The most segment data to keep.
+    :ivar max_uebs: How many URI extension blocks to keep.
+    """
+
+    def __init__(self, max_bytes: int, max_uebs: int = 1000):
+        self.max_bytes = max_bytes
+        self.max_uebs = max_uebs
+        # (UEB hash, segnum) -> segment, least recently used first:
+        self._segments: OrderedDict[tuple[bytes, int], bytes] = OrderedDict()
+        # UEB hash -> UEB, least recently used first:
+        self._uebs: OrderedDict[bytes, bytes] = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get_UEB(self, ueb_hash: bytes) -> Optional[bytes]:
+        """
+        Return the URI extension block with the given hash, if we have it.
+        """
+        UEB_s = self._uebs.get(ueb_hash)
+        if UEB_s is not None:
+            self._uebs.move_to_end(ueb_hash)
+        return UEB_s
+
+    def add_UEB(self, ueb_hash: bytes, UEB_s: bytes) -> None:
+        """
+        Remember a URI extension block which has been validated against its
+        hash.
+        """
+        self._uebs[ueb_hash] = UEB_s
+        self._uebs.move_to_end(ueb_hash)
+        while len(self._uebs) > self.max_uebs:
+            self._uebs.popitem(last=False)
+
+    def get_segment(self, ueb_hash: bytes, segnum: int) -> Optional[bytes]:
+        """
+        Return the ciphertext of the given segment, if we have it.
+        """
+        key = (ueb_hash, segnum)
+        segment = self._segments.get(key)
+        if segment is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+            self._segments.move_to_end(key)
+        return segment
+
+    def add_segment(self, ueb_hash: bytes, segnum: int, segment: bytes) -> None:
+        """
+        Remember the ciphertext of a segment which has been checked against
+        the ciphertext hash tree.
+        """
+        key = (ueb_hash, segnum)
+        if len(segment) > self.max_bytes or key in self._segments:
+            return
+        self._segments[key] = segment
+        self._bytes += len(segment)
+        while self._bytes > self.max_bytes:
+            (_, evicted) = self._segments.popitem(last=False)
+            self._bytes -= len(evicted)
+            self._evictions += 1
+
+    def get_stats(self) -> dict[str, int]:
+        return {
+            "downloader.segment_cache.hits": self._hits,
+            "downloader.segment_cache.misses": self._misses,
+            "downloader.segment_cache.evictions": self._evictions,
+            "downloader.segment_cache.bytes": self._bytes,
+        }
@@ -63,6 +63,13 @@ class SegmentFetcher(object):
             del self._shares, self._shares_from_server, self._active_share_map
             del self._share_observers
 
+    def is_running(self):
+        """
+        :return bool: Whether I'm still fetching my segment, rather than
+            finished (successfully or not) or stopped.
+        """
+        return self._running
+
 
     # called by our parent _Node
 
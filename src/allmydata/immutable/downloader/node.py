@@ -9,7 +9,7 @@ from twisted.python.failure import Failure
 from twisted.internet import defer
 from foolscap.api import eventually
 from allmydata import uri
-from allmydata.codec import CRSDecoder
+from allmydata.codec import CRSDecoder, join_decoded
 from allmydata.util import base32, log, hashutil, mathutil, observer
 from allmydata.interfaces import DEFAULT_IMMUTABLE_MAX_SEGMENT_SIZE
 from allmydata.hashtree import IncompleteHashTree, BadHashError, \
@@ -43,9 +43,16 @@ class DownloadNode(object):
 
     default_max_segment_size = DEFAULT_IMMUTABLE_MAX_SEGMENT_SIZE
 
+    # How many segments may be fetched at the same time. Each read() keeps
+    # up to this many of the segments it needs requested ahead of the one
+    # it is delivering, so that a sequential reader isn't limited to one
+    # segment per round trip. This also bounds the memory used by fetched
+    # but not yet delivered segments.
+    segment_window = 4
+
     # Share._node points to me
     def __init__(self, verifycap, storage_broker, secret_holder,
-                 terminator, history, download_status):
+                 terminator, history, download_status, segment_cache=None):
         assert isinstance(verifycap, uri.CHKFileVerifierURI)
         self._verifycap = verifycap
         self._storage_broker = storage_broker
@@ -62,6 +69,8 @@ class DownloadNode(object):
         self._secret_holder = secret_holder
         self._history = history
         self._download_status = download_status
+        # a SegmentCache shared by all downloads, or None
+        self._segment_cache = segment_cache
 
         self.share_hash_tree = IncompleteHashTree(self._verifycap.total_shares)
 
@@ -85,7 +94,9 @@ class DownloadNode(object):
 
         # _segment_requests can have duplicates
         self._segment_requests = [] # (segnum, d, cancel_handle, seg_ev, lp)
-        self._active_segment = None # a SegmentFetcher, with .segnum
+        # maps segnum to the SegmentFetcher working on it. A segment stays
+        # in here while its blocks are being decoded and checked.
+        self._active_segments = {}
 
         self._segsize_observers = observer.OneShotObserverList()
 
@@ -107,6 +118,13 @@ class DownloadNode(object):
                                         self._download_status, lp)
         self._shares = set()
 
+        # if this file was downloaded recently, we already know its real
+        # segment size and may have some of its segments
+        if self._segment_cache is not None:
+            UEB_s = self._segment_cache.get_UEB(verifycap.uri_extension_hash)
+            if UEB_s is not None:
+                self.validate_and_store_UEB(UEB_s)
+
     def _build_guessed_tables(self, max_segment_size):
         size = min(self._verifycap.size, max_segment_size)
         s = mathutil.next_multiple(size, self._verifycap.needed_shares)
@@ -123,8 +141,8 @@ class DownloadNode(object):
 
     def stop(self):
         # called by the Terminator at shutdown, mostly for tests
-        if self._active_segment:
-            seg, self._active_segment = self._active_segment, None
+        active, self._active_segments = self._active_segments, {}
+        for seg in active.values():
             seg.stop()
         self._sharefinder.stop()
 
@@ -209,6 +227,16 @@ class DownloadNode(object):
         seg_ev = self._download_status.add_segment_request(segnum, now())
         d = defer.Deferred()
         c = Cancel(self._cancel_request)
+        if self._segment_cache is not None and self.have_UEB:
+            segment = self._segment_cache.get_segment(
+                self._verifycap.uri_extension_hash, segnum)
+            if segment is not None:
+                offset = segnum * self.segment_size
+                when = now()
+                seg_ev.activate(when)
+                seg_ev.deliver(when, offset, len(segment), 0)
+                eventually(self._deliver, d, c, (offset, segment, 0))
+                return (d, c)
         self._segment_requests.append( (segnum, d, c, seg_ev, lp) )
         self._start_new_segment()
         return (d, c)
@@ -232,13 +260,22 @@ class DownloadNode(object):
     # arbitrary-sized read() calls into quantized segment fetches
 
     def _start_new_segment(self):
-        if self._active_segment is None and self._segment_requests:
-            (segnum, d, c, seg_ev, lp) = self._segment_requests[0]
+        # start fetchers for the oldest requested segments, up to
+        # segment_window of them. Until we've seen a valid UEB we might be
+        # asking for segments by a guessed segment size, so fetch just one
+        # at a time.
+        window = self.segment_window if self.have_UEB else 1
+        for (segnum, d, c, seg_ev, lp) in self._segment_requests:
+            if len(self._active_segments) >= window:
+                break
+            if segnum in self._active_segments:
+                continue
             k = self._verifycap.needed_shares
             log.msg(format="%(node)s._start_new_segment: segnum=%(segnum)d",
                     node=repr(self), segnum=segnum,
                     level=log.NOISY, parent=lp, umid="wAlnHQ")
-            self._active_segment = fetcher = SegmentFetcher(self, segnum, k, lp)
+            fetcher = SegmentFetcher(self, segnum, k, lp)
+            self._active_segments[segnum] = fetcher
             seg_ev.activate(now())
             active_shares = [s for s in self._shares if s.is_alive()]
             fetcher.add_shares(active_shares) # this triggers the loop
@@ -247,12 +284,16 @@ class DownloadNode(object):
     # called by our child ShareFinder
     def got_shares(self, shares):
         self._shares.update(shares)
-        if self._active_segment:
-            self._active_segment.add_shares(shares)
+        for fetcher in self._fetching_segments():
+            fetcher.add_shares(shares)
     def no_more_shares(self):
         self._no_more_shares = True
-        if self._active_segment:
-            self._active_segment.no_more_shares()
+        for fetcher in self._fetching_segments():
+            fetcher.no_more_shares()
+    def _fetching_segments(self):
+        # the active SegmentFetchers which haven't got their blocks yet
+        return [fetcher for fetcher in self._active_segments.values()
+                if fetcher.is_running()]
 
     # things called by our Share instances
 
@@ -266,6 +307,8 @@ class DownloadNode(object):
         # TODO: a malformed (but authentic) UEB could throw an assertion in
         # _parse_and_store_UEB, and we should abandon the download.
         self.have_UEB = True
+        if self._segment_cache is not None:
+            self._segment_cache.add_UEB(h, UEB_s)
 
         # inform the ShareFinder about our correct number of segments. This
         # will update the block-hash-trees in all existing CommonShare
@@ -401,8 +444,8 @@ class DownloadNode(object):
         self._sharefinder.hungry()
 
     def fetch_failed(self, sf, f):
-        assert sf is self._active_segment
-        self._active_segment = None
+        assert self._active_segments.get(sf.segnum) is sf
+        del self._active_segments[sf.segnum]
         # deliver error upwards
         for (d,c,seg_ev) in self._extract_requests(sf.segnum):
             seg_ev.error(now())
@@ -419,6 +462,7 @@ class DownloadNode(object):
                     level=log.OPERATIONAL, parent=self._lp,
                     umid="j60Ojg")
             when = now()
+            self._active_segments.pop(segnum, None)
             if isinstance(result, Failure):
                 # this catches failures in decode or ciphertext hash
                 for (d,c,seg_ev) in self._extract_requests(segnum):
@@ -426,7 +470,9 @@ class DownloadNode(object):
                     eventually(self._deliver, d, c, result)
             else:
                 (offset, segment, decodetime) = result
-                self._active_segment = None
+                if self._segment_cache is not None:
+                    self._segment_cache.add_segment(
+                        self._verifycap.uri_extension_hash, segnum, segment)
                 for (d,c,seg_ev) in self._extract_requests(segnum):
                     # when we have two requests for the same segment, the
                     # second one will not be "activated" before the data is
@@ -470,11 +516,12 @@ class DownloadNode(object):
         del shares
         def _process(buffers):
             decodetime = now() - start
-            segment = b"".join(buffers)
-            assert len(segment) == decoded_size
+            assert sum(len(b) for b in buffers) == decoded_size
+            # drop the tail segment's padding while joining, rather than
+            # slicing (and copying) the joined segment afterwards
+            segment_size = self.tail_segment_size if tail else decoded_size
+            segment = join_decoded(buffers, segment_size)
             del buffers
-            if tail:
-                segment = segment[:self.tail_segment_size]
             self._download_status.add_misc_event("decode", start, now())
             return (segment, decodetime)
         d.addCallback(_process)
@@ -483,7 +530,7 @@ class DownloadNode(object):
     def _check_ciphertext_hash(self, segment_and_decodetime, segnum):
         (segment, decodetime) = segment_and_decodetime
         start = now()
-        assert self._active_segment.segnum == segnum
+        assert segnum in self._active_segments
         assert self.segment_size is not None
         offset = segnum * self.segment_size
 
@@ -526,12 +573,13 @@ class DownloadNode(object):
                                   if t[2] != cancel]
         segnums = [segnum for (segnum,d,c,seg_ev,lp) in self._segment_requests]
 
-        # self._active_segment might be None in rare circumstances, so make
-        # sure we tolerate it
-        if self._active_segment and self._active_segment.segnum not in segnums:
-            seg, self._active_segment = self._active_segment, None
-            seg.stop()
-            self._start_new_segment()
+        # stop fetching any segment that nobody wants any more. Segments
+        # which are already being decoded are left to finish.
+        for segnum, fetcher in list(self._active_segments.items()):
+            if segnum not in segnums and fetcher.is_running():
+                del self._active_segments[segnum]
+                fetcher.stop()
+        self._start_new_segment()
 
     # called by ShareFinder to choose hashtree sizes in CommonShares, and by
     # SegmentFetcher to tell if it is still fetching a valid segnum.
@@ -4,7 +4,9 @@ Ported to Python 3.
 
 import time
 now = time.time
+from collections import deque
 from zope.interface import implementer
+from twisted.python.failure import Failure
 from twisted.internet import defer
 from twisted.internet.interfaces import IPushProducer
 from foolscap.api import eventually
@@ -14,23 +16,45 @@ from allmydata.interfaces import DownloadStopped
 
 from .common import BadSegmentNumberError, WrongSegmentError
 
+class _SegmentRequest(object):
+    """One outstanding DownloadNode.get_segment() call made by Segmentation.
+
+    :ivar result: ``None`` until the request is retired, then the
+        ``(offset, data, decodetime)`` tuple or a ``Failure``.
+    :ivar guessed: ``True`` if the segment number was computed from the
+        guessed segment size, in which case we may retry once with the real
+        one.
+    """
+    def __init__(self, segnum, guessed):
+        self.segnum = segnum
+        self.guessed = guessed
+        self.cancel = None
+        self.result = None
+
+
 @implementer(IPushProducer)
 class Segmentation(object):
     """I am responsible for a single offset+size read of the file. I handle
     segmentation: I figure out which segments are necessary, request them
     (from my CiphertextDownloader) in order, and trim the segments down to
-    match the offset+size span. I use the Producer/Consumer interface to only
-    request one segment at a time.
+    match the offset+size span. Once the real segment size is known, I keep
+    up to node.segment_window segments requested ahead of the one I am
+    delivering, so the fetches overlap. I use the Producer/Consumer interface
+    to stop requesting (and delivering) segments while my consumer is
+    paused.
     """
     def __init__(self, node, offset, size, consumer, read_ev, logparent=None):
         self._node = node
         self._hungry = True
-        self._active_segnum = None
-        self._cancel_segment_request = None
+        # outstanding (or arrived but not yet delivered) segment requests,
+        # in file order
+        self._requests = deque()
         # these are updated as we deliver data. At any given time, we still
         # want to download file[offset:offset+size]
         self._offset = offset
         self._size = size
+        # the first byte of the file not covered by self._requests
+        self._next_request_offset = offset
         assert offset+size <= node._verifycap.size
         self._consumer = consumer
         self._read_ev = read_ev
@@ -50,52 +74,78 @@ class Segmentation(object):
         return res
 
     def _maybe_fetch_next(self):
+        self._deliver_arrived()
         if not self._alive or not self._hungry:
             return
-        if self._active_segnum is not None:
-            return
-        self._fetch_next()
-
-    def _fetch_next(self):
         if self._size == 0:
             # done!
+            assert not self._requests
             self._alive = False
             self._hungry = False
             self._deferred.callback(self._consumer)
             return
         n = self._node
+        if n.segment_size is None or (self._requests and
+                                      self._requests[-1].guessed):
+            # we might be guessing the segment size, so only ask for one
+            # segment at a time until we've seen the real one
+            if not self._requests:
+                self._fetch_next()
+            return
+        end = self._offset + self._size
+        while (len(self._requests) < n.segment_window and
+               self._next_request_offset < end):
+            self._fetch_next()
+
+    def _fetch_next(self):
+        n = self._node
         have_actual_segment_size = n.segment_size is not None
         guess_s = ""
         if not have_actual_segment_size:
             guess_s = "probably "
         segment_size = n.segment_size or n.guessed_segment_size
-        if self._offset == 0:
+        if self._next_request_offset == 0:
             # great! we want segment0 for sure
             wanted_segnum = 0
         else:
             # this might be a guess
-            wanted_segnum = self._offset // segment_size
+            wanted_segnum = self._next_request_offset // segment_size
         log.msg(format="_fetch_next(offset=%(offset)d) %(guess)swants segnum=%(segnum)d",
-                offset=self._offset, guess=guess_s, segnum=wanted_segnum,
+                offset=self._next_request_offset, guess=guess_s,
+                segnum=wanted_segnum,
                 level=log.NOISY, parent=self._lp, umid="5WfN0w")
-        self._active_segnum = wanted_segnum
+        r = _SegmentRequest(wanted_segnum, not have_actual_segment_size)
+        self._requests.append(r)
+        self._next_request_offset = (wanted_segnum + 1) * segment_size
         d,c = n.get_segment(wanted_segnum, self._lp)
-        self._cancel_segment_request = c
-        d.addBoth(self._request_retired)
-        d.addCallback(self._got_segment, wanted_segnum)
-        if not have_actual_segment_size:
-            # we can retry once
-            d.addErrback(self._retry_bad_segment)
+        r.cancel = c
+        d.addBoth(self._request_retired, r)
         d.addErrback(self._error)
 
-    def _request_retired(self, res):
-        self._active_segnum = None
-        self._cancel_segment_request = None
-        return res
+    def _request_retired(self, res, r):
+        r.result = res
+        self._maybe_fetch_next()
+
+    def _deliver_arrived(self):
+        # hand segments to our consumer in file order, as long as it wants
+        # them
+        while self._alive and self._requests:
+            r = self._requests[0]
+            if r.result is None:
+                return # still waiting for it
+            if not isinstance(r.result, Failure) and not self._hungry:
+                return # hold on to it until we're resumed
+            self._requests.popleft()
+            if isinstance(r.result, Failure):
+                self._segment_failed(r, r.result)
+                continue
+            try:
+                self._got_segment(r.result, r.segnum)
+            except Exception:
+                self._segment_failed(r, Failure())
 
     def _got_segment(self, segment_args, wanted_segnum):
         (segment_start, segment, decodetime) = segment_args
-        self._cancel_segment_request = None
         # we got file[segment_start:segment_start+len(segment)]
         # we want file[self._offset:self._offset+self._size]
         log.msg(format="Segmentation got data:"
@@ -124,28 +174,43 @@ class Segmentation(object):
 
         self._offset += len(desired_data)
         self._size -= len(desired_data)
+        if not self._requests:
+            # if the segment size was a guess, our next request may have
+            # been computed with the wrong size: start again from here
+            self._next_request_offset = self._offset
         self._consumer.write(desired_data)
         # the consumer might call our .pauseProducing() inside that write()
         # call, setting self._hungry=False
         self._read_ev.update(len(desired_data), 0, 0)
         # note: filenode.DecryptingConsumer is responsible for calling
         # _read_ev.update with how much decrypt_time was consumed
-        self._maybe_fetch_next()
 
-    def _retry_bad_segment(self, f):
-        f.trap(WrongSegmentError, BadSegmentNumberError)
-        # we guessed the segnum wrong: either one that doesn't overlap with
-        # the start of our desired region, or one that's beyond the end of
-        # the world. Now that we have the right information, we're allowed to
-        # retry once.
-        assert self._node.segment_size is not None
-        return self._maybe_fetch_next()
+    def _segment_failed(self, r, f):
+        if r.guessed and f.check(WrongSegmentError, BadSegmentNumberError):
+            # we guessed the segnum wrong: either one that doesn't overlap
+            # with the start of our desired region, or one that's beyond the
+            # end of the world. Now that we have the right information, we're
+            # allowed to retry once.
+            assert self._node.segment_size is not None
+            assert not self._requests
+            self._next_request_offset = self._offset
+            return
+        self._error(f)
+
+    def _cancel_requests(self):
+        requests, self._requests = self._requests, deque()
+        for r in requests:
+            if r.result is None:
+                r.cancel.cancel()
 
     def _error(self, f):
         log.msg("Error in Segmentation", failure=f,
                 level=log.WEIRD, parent=self._lp, umid="EYlXBg")
+        if not self._alive:
+            return
         self._alive = False
         self._hungry = False
+        self._cancel_requests()
         self._deferred.errback(f)
 
     def stopProducing(self):
@@ -153,10 +218,8 @@ class Segmentation(object):
                 level=log.NOISY, parent=self._lp, umid="XIyL9w")
         self._hungry = False
         self._alive = False
-        # cancel any outstanding segment request
-        if self._cancel_segment_request:
-            self._cancel_segment_request.cancel()
-            self._cancel_segment_request = None
+        # cancel any outstanding segment requests
+        self._cancel_requests()
         e = DownloadStopped("our Consumer called stopProducing()")
         self._deferred.errback(e)
 
@@ -18,6 +18,9 @@ from allmydata.immutable.layout import make_write_bucket_proxy
 from allmydata.util.observer import EventStreamObserver
 from .common import COMPLETE, CORRUPT, DEAD, BADSEGNUM
 
+# The most (offset, length) ranges RIBucketReader.readv accepts in one call.
+MAX_READV_SPANS = 30
+
 
 class LayoutInvalid(Exception):
     pass
@@ -96,6 +99,10 @@ class Share(object):
         # is *not* ok (tahoe-1.3.0 or earlier), we need four RTT: 1=version,
         # 2=offset table, 3=UEB_length and everything else (hashes, block),
         # 4=UEB.
+        self._readv_ok = ver.get(b"immutable-read-vectors", False)
+        # If _readv_ok, all the spans we want in one pass of the loop (offset
+        # table, hashes, several blocks) can be asked for with a single
+        # "readv" request instead of one "read" request each.
 
         self.had_corruption = False # for unit tests
 
@@ -537,7 +544,9 @@ class Share(object):
         if tail:
             blocklen = self._node.tail_block_size
 
-        block = self._received.pop(blockstart, blocklen)
+        # A view into the received data, rather than a copy of it: blocks are
+        # only hashed and handed to zfec.
+        block = self._received.pop(blockstart, blocklen, view=True)
         if not block:
             log.msg("no data for block %s (want [%d:+%d])" % (repr(self),
                                                               blockstart, blocklen),
@@ -556,8 +565,10 @@ class Share(object):
                 # goes to SegmentFetcher._block_request_activity
                 o.notify(state=COMPLETE, block=block)
             # now clear our received data, to dodge the #1170 spans.py
-            # complexity bug
-            self._received = DataSpans()
+            # complexity bug. If later segments have been requested, their
+            # blocks may already be in there, so keep them.
+            if len(self._requested_blocks) == 1:
+                self._received = DataSpans()
         except (BadHashError, NotEnoughHashesError) as e:
             # rats, we have a corrupt block. Notify our clients that they
             # need to look elsewhere, and advise the server. Unlike
@@ -620,6 +631,15 @@ class Share(object):
                 # and _desire_data will tolerate that.
                 self._desire_block_hashes(desire, o, segnum)
                 self._desire_data(desire, o, r, segnum, segsize)
+            if self.actual_offsets and self._node.have_UEB:
+                # Once we're no longer guessing, ask for the blocks of the
+                # segments queued behind the active one too (the downloader
+                # reads ahead), so they arrive in the same round trip. They
+                # are still validated and delivered one at a time, in order.
+                for (later_segnum, observers) in self._requested_blocks[1:]:
+                    if later_segnum < r["num_segments"]:
+                        self._desire_block_hashes(desire, o, later_segnum)
+                        self._desire_data(desire, o, r, later_segnum, segsize)
 
         log.msg("end _desire: want_it=%s need_it=%s gotta=%s"
                 % (want_it.dump(), need_it.dump(), gotta_gotta_have_it.dump()),
@@ -739,6 +759,12 @@ class Share(object):
         # Reconsider the removal: maybe bring it back.
         ds = self._download_status
 
+        spans = list(ask)
+        if self._readv_ok and len(spans) > 1:
+            for i in range(0, len(spans), MAX_READV_SPANS):
+                self._send_batched_requests(spans[i:i+MAX_READV_SPANS])
+            return
+
         for (start, length) in ask:
             # TODO: quantize to reasonably-large blocks
             self._pending.add(start, length)
@@ -761,6 +787,37 @@ class Share(object):
     def _send_request(self, start, length):
         return self._rref.callRemote("read", start, length)
 
+    def _send_batched_requests(self, ask):
+        ds = self._download_status
+        requests = []
+        for (start, length) in ask:
+            self._pending.add(start, length)
+            lp = log.msg(format="%(share)s._send_request (batched)"
+                         " [%(start)d:+%(length)d]",
+                         share=repr(self),
+                         start=start, length=length,
+                         level=log.NOISY, parent=self._lp, umid="b6V9ZQ")
+            block_ev = ds.add_block_request(self._server, self._shnum,
+                                            start, length, now())
+            requests.append((start, length, block_ev, lp))
+        d = self._rref.callRemote("readv",
+                                  [(start, length)
+                                   for (start, length, _, _) in requests])
+        def _got_datav(datav):
+            for ((start, length, block_ev, lp), data) in zip(requests, datav):
+                self._got_data(data, start, length, block_ev, lp)
+        def _got_errorv(f):
+            for (_, _, block_ev, _) in requests[1:]:
+                block_ev.error(now())
+            (start, length, block_ev, lp) = requests[0]
+            self._got_error(f, start, length, block_ev, lp)
+        d.addCallbacks(_got_datav, _got_errorv)
+        d.addCallback(self._trigger_loop)
+        d.addErrback(lambda f:
+                     log.err(format="unhandled error during send_request",
+                             failure=f, parent=self._lp,
+                             level=log.WEIRD, umid="Jm3BxA"))
+
     def _got_data(self, data, start, length, block_ev, lp):
         block_ev.finished(len(data), now())
         if not self._alive:
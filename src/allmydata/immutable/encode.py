@@ -5,15 +5,17 @@ Ported to Python 3.
 """
 
 import time
+from collections import deque
 from zope.interface import implementer
 from twisted.internet import defer
 from foolscap.api import fireEventually
 from allmydata import uri
 from allmydata.storage.server import si_b2a
-from allmydata.hashtree import HashTree
+from allmydata.hashtree import CompactHashTree
 from allmydata.util import mathutil, hashutil, base32, log, happinessutil
 from allmydata.util.assertutil import _assert, precondition
-from allmydata.codec import CRSEncoder
+from allmydata.util.deferredutil import async_to_deferred
+from allmydata.codec import CRSEncoder, split_into_shares
 from allmydata.interfaces import IEncoder, IStorageBucketWriter, \
      IEncryptedUploadable, IUploadStatus, UploadUnhappinessError
 
@@ -42,9 +44,14 @@ log(number of segments)).
 Each segment (A,B,C) is read into memory, encrypted, and encoded into
 blocks. The 'share' (say, share #1) that makes it out to a host is a
 collection of these blocks (block A1, B1, C1), plus some hash-tree
-information necessary to validate the data upon retrieval. Only one segment
-is handled at a time: all blocks for segment A are delivered before any
-work is begun on segment B.
+information necessary to validate the data upon retrieval. Segments are
+read, encrypted and encoded strictly in order, and their blocks are handed to
+the shareholders in order, but the encoder does not wait for the blocks of
+segment A to be acknowledged before it starts encoding segment B: up to
+'pipeline_depth' segments (and no more than 'pipeline_max_bytes' of encoded
+blocks) may be in flight at once, so that the (threaded) erasure coding of
+one segment overlaps with the network transfer of the previous ones. A
+pipeline depth of 1 restores the old one-segment-at-a-time behavior.
 
 As blocks are created, we retain the hash of each one. The list of block hashes
 for a single share (say, hash(A1), hash(B1), hash(C1)) is used to form the base
@@ -78,11 +85,28 @@ GiB=1024*MiB
 TiB=1024*GiB
 PiB=1024*TiB
 
+# How many segments may be encoded but not yet acknowledged by every
+# shareholder, and how many bytes of encoded blocks those segments may add up
+# to. With the default 128KiB segments and 3-of-10 encoding each segment is
+# about 427KiB of blocks.
+DEFAULT_PIPELINE_DEPTH = 4
+DEFAULT_PIPELINE_MAX_BYTES = 32*MiB
+
 @implementer(IEncoder)
 class Encoder(object):
 
-    def __init__(self, log_parent=None, upload_status=None):
+    def __init__(self, log_parent=None, upload_status=None,
+                 pipeline_depth=DEFAULT_PIPELINE_DEPTH,
+                 pipeline_max_bytes=DEFAULT_PIPELINE_MAX_BYTES):
         object.__init__(self)
+        precondition(pipeline_depth >= 1, pipeline_depth)
+        precondition(pipeline_max_bytes >= 0, pipeline_max_bytes)
+        self._pipeline_depth = pipeline_depth
+        self._pipeline_max_bytes = pipeline_max_bytes
+        # the number of segments, and the bytes of encoded blocks, which are
+        # currently waiting for the shareholders to accept them
+        self._pipeline_segments = 0
+        self._pipeline_bytes = 0
         self.uri_extension_data = {}
         self._codec = None
         self._status = None
@@ -229,6 +253,7 @@ class Encoder(object):
         self._times = {
             "cumulative_encoding": 0.0,
             "cumulative_sending": 0.0,
+            "pipeline_stalled": 0.0,
             "hashes_and_close": 0.0,
             "total_encode_and_push": 0.0,
             }
@@ -238,18 +263,7 @@ class Encoder(object):
 
         d.addCallback(lambda res: self.start_all_shareholders())
 
-        for i in range(self.num_segments-1):
-            # note to self: this form doesn't work, because lambda only
-            # captures the slot, not the value
-            #d.addCallback(lambda res: self.do_segment(i))
-            # use this form instead:
-            d.addCallback(lambda res, i=i: self._encode_segment(i, is_tail=False))
-            d.addCallback(self._send_segment, i)
-            d.addCallback(self._turn_barrier)
-        last_segnum = self.num_segments - 1
-        d.addCallback(lambda res: self._encode_segment(last_segnum, is_tail=True))
-        d.addCallback(self._send_segment, last_segnum)
-        d.addCallback(self._turn_barrier)
+        d.addCallback(lambda res: self._encode_and_push_segments())
 
         d.addCallback(lambda res: self.finish_hashing())
 
@@ -297,6 +311,73 @@ class Encoder(object):
         return fireEventually(res)
 
 
+    def _pipeline_has_room(self, segment_bytes):
+        """
+        Return whether another segment, whose blocks will add up to
+        ``segment_bytes``, may be encoded before the shareholders have
+        accepted the segments already in flight. The pipeline always accepts
+        one segment when it is empty, however large that segment is.
+        """
+        if not self._pipeline_segments:
+            return True
+        if self._pipeline_segments >= self._pipeline_depth:
+            return False
+        return (self._pipeline_bytes + segment_bytes
+                <= self._pipeline_max_bytes)
+
+    @async_to_deferred
+    async def _encode_and_push_segments(self):
+        """
+        Encode every segment and send its blocks to the shareholders, keeping
+        the pipeline described in the module docstring full.
+
+        Reading, hashing and encoding happen in segment order, and
+        ``_send_segment`` is called in segment order (the bucket proxies
+        require their writes to arrive in order), but the encoding of a
+        segment does not wait for the previous segments' blocks to be
+        acknowledged.
+        """
+        in_flight = deque()
+        try:
+            for segnum in range(self.num_segments):
+                is_tail = (segnum == self.num_segments - 1)
+                codec = self._tail_codec if is_tail else self._codec
+                segment_bytes = codec.get_block_size() * self.num_shares
+                stalled = time.time()
+                while not self._pipeline_has_room(segment_bytes):
+                    await in_flight.popleft()
+                self._times["pipeline_stalled"] += time.time() - stalled
+
+                shares_and_shareids = await self._encode_segment(segnum, is_tail)
+                in_flight.append(self._push_segment(shares_and_shareids, segnum))
+                del shares_and_shareids
+                await self._turn_barrier(None)
+            while in_flight:
+                await in_flight.popleft()
+        finally:
+            # If we're bailing out early, nobody is going to wait for these
+            # any more. Their failures (if any) were already logged by
+            # _remove_shareholder.
+            for d in in_flight:
+                d.addErrback(lambda f: None)
+
+    def _push_segment(self, shares_and_shareids, segnum):
+        """
+        Send one encoded segment, counting its blocks against the pipeline
+        limits until every shareholder has accepted (or lost) them.
+        """
+        (shares, shareids) = shares_and_shareids
+        segment_bytes = sum(len(share) for share in shares)
+        self._pipeline_segments += 1
+        self._pipeline_bytes += segment_bytes
+        def _drained(res):
+            self._pipeline_segments -= 1
+            self._pipeline_bytes -= segment_bytes
+            return res
+        d = self._send_segment(shares_and_shareids, segnum)
+        d.addBoth(_drained)
+        return d
+
     def start_all_shareholders(self):
         self.log("starting shareholders", level=log.NOISY)
         self.set_status("Starting shareholders")
@@ -406,18 +487,16 @@ class Encoder(object):
             assert isinstance(data, (list,tuple))
             if self._aborted:
                 raise UploadAborted()
-            data = b"".join(data)
-            precondition(len(data) <= read_size, len(data), read_size)
+            length = sum(len(chunk) for chunk in data)
+            precondition(length <= read_size, length, read_size)
             if not allow_short:
-                precondition(len(data) == read_size, len(data), read_size)
-            crypttext_segment_hasher.update(data)
-            self._crypttext_hasher.update(data)
-            if allow_short and len(data) < read_size:
-                # padding
-                data += b"\x00" * (read_size - len(data))
-            encrypted_pieces = [data[i:i+input_chunk_size]
-                                for i in range(0, len(data), input_chunk_size)]
-            return encrypted_pieces
+                precondition(length == read_size, length, read_size)
+            for chunk in data:
+                crypttext_segment_hasher.update(chunk)
+                self._crypttext_hasher.update(chunk)
+            # this copies each chunk (and any padding, if allow_short)
+            # directly into the input piece it belongs to
+            return split_into_shares(data, num_chunks, input_chunk_size)
         d.addCallback(_got)
         return d
 
@@ -538,7 +617,7 @@ class Encoder(object):
         self.log("sending crypttext hash tree", level=log.NOISY)
         self.set_status("Sending Crypttext Hash Tree")
         self.set_encode_and_push_progress(extra=0.3)
-        t = HashTree(self._crypttext_hashes)
+        t = CompactHashTree(self._crypttext_hashes)
         all_hashes = list(t)
         self.uri_extension_data["crypttext_root_hash"] = t[0]
         dl = []
@@ -566,7 +645,7 @@ class Encoder(object):
         return self._gather_responses(dl)
 
     def send_one_block_hash_tree(self, shareid, block_hashes):
-        t = HashTree(block_hashes)
+        t = CompactHashTree(block_hashes)
         all_hashes = list(t)
         # all_hashes[0] is the root hash, == hash(ah[1]+ah[2])
         # all_hashes[1] is the left child, == hash(ah[3]+ah[4])
@@ -590,7 +669,7 @@ class Encoder(object):
         for h in self.share_root_hashes:
             assert h
         # create the share hash tree
-        t = HashTree(self.share_root_hashes)
+        t = CompactHashTree(self.share_root_hashes)
         # the root of this hash tree goes into our URI
         self.uri_extension_data['share_root_hash'] = t[0]
         # now send just the necessary pieces out to each shareholder
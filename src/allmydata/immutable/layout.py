@@ -446,6 +446,21 @@ class ReadBucketProxy(object):
         d.addCallback(self._get_block_data, blocknum, blocksize, thisblocksize)
         return d
 
+    def _get_blocks_data(self, unused, first, count, blocksize, lastblocksize):
+        offset = self._offsets['data'] + first * blocksize
+        d = self._read(offset, (count - 1) * blocksize + lastblocksize)
+        def _split(data):
+            return [data[i*blocksize:(i+1)*blocksize] for i in range(count - 1)] + \
+                   [data[(count-1)*blocksize:]]
+        d.addCallback(_split)
+        return d
+
+    def get_blocks_data(self, first, count, blocksize, lastblocksize):
+        d = self._start_if_needed()
+        d.addCallback(self._get_blocks_data, first, count, blocksize,
+                      lastblocksize)
+        return d
+
     def _str2l(self, s):
         """ split string (pulled from storage) into a list of blockids """
         return [ s[i:i+HASH_SIZE]
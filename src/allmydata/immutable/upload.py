@@ -1210,10 +1210,14 @@ class UploadStatus(object):
 
 class CHKUploader(object):
 
-    def __init__(self, storage_broker, secret_holder, reactor=None):
+    def __init__(self, storage_broker, secret_holder, reactor=None,
+                 pipeline_depth=encode.DEFAULT_PIPELINE_DEPTH,
+                 pipeline_max_bytes=encode.DEFAULT_PIPELINE_MAX_BYTES):
         # server_selector needs storage_broker and secret_holder
         self._storage_broker = storage_broker
         self._secret_holder = secret_holder
+        self._pipeline_depth = pipeline_depth
+        self._pipeline_max_bytes = pipeline_max_bytes
         self._log_number = self.log("CHKUploader starting", parent=None)
         self._encoder = None
         self._storage_index = None
@@ -1274,6 +1278,8 @@ class CHKUploader(object):
         self._encoder = encode.Encoder(
             self._log_number,
             self._upload_status,
+            pipeline_depth=self._pipeline_depth,
+            pipeline_max_bytes=self._pipeline_max_bytes,
         )
         # this just returns itself
         yield self._encoder.set_encrypted_uploadable(eu)
@@ -1836,6 +1842,38 @@ class Data(FileHandle):
         assert convergence is None or isinstance(convergence, bytes), (convergence, type(convergence))
         FileHandle.__init__(self, BytesIO(data), convergence=convergence)
 
+@implementer(IUploadable)
+class StreamingFileHandle(BaseUploadable):
+
+    def __init__(self, stream, size):
+        """
+        Upload data which may still be arriving, from an object whose
+        read(length) returns a Deferred that fires with a list of strings
+        once that much is available (or the stream ends).  The size must be
+        known in advance.
+
+        Convergent encryption would need to hash all of the plaintext before
+        the first byte could be encrypted, so a random encryption key is
+        always used.
+        """
+        self._stream = stream
+        self._size = size
+        self._key = None
+
+    def get_encryption_key(self):
+        if self._key is None:
+            self._key = os.urandom(16)
+        return defer.succeed(self._key)
+
+    def get_size(self):
+        return defer.succeed(self._size)
+
+    def read(self, length):
+        return self._stream.read(length)
+
+    def close(self):
+        pass
+
 @implementer(IUploader)
 class Uploader(service.MultiService, log.PrefixingLogMixin):
     """I am a service that allows file uploading. I am a service-child of the
@@ -1846,10 +1884,14 @@ class Uploader(service.MultiService, log.PrefixingLogMixin):
     name = "uploader"  # type: ignore[assignment]
     URI_LIT_SIZE_THRESHOLD = 55
 
-    def __init__(self, helper_furl=None, stats_provider=None, history=None):
+    def __init__(self, helper_furl=None, stats_provider=None, history=None,
+                 pipeline_depth=encode.DEFAULT_PIPELINE_DEPTH,
+                 pipeline_max_bytes=encode.DEFAULT_PIPELINE_MAX_BYTES):
         self._helper_furl = helper_furl
         self.stats_provider = stats_provider
         self._history = history
+        self._pipeline_depth = pipeline_depth
+        self._pipeline_max_bytes = pipeline_max_bytes
         self._helper = None
         self._all_uploads = weakref.WeakKeyDictionary() # for debugging
         log.PrefixingLogMixin.__init__(self, facility="tahoe.immutable.upload")
@@ -1918,7 +1960,11 @@ class Uploader(service.MultiService, log.PrefixingLogMixin):
                 else:
                     storage_broker = self.parent.get_storage_broker()
                     secret_holder = self.parent._secret_holder
-                    uploader = CHKUploader(storage_broker, secret_holder, reactor=reactor)
+                    uploader = CHKUploader(
+                        storage_broker, secret_holder, reactor=reactor,
+                        pipeline_depth=self._pipeline_depth,
+                        pipeline_max_bytes=self._pipeline_max_bytes,
+                    )
                     d2.addCallback(lambda x: uploader.start(eu))
 
                 self._all_uploads[uploader] = None
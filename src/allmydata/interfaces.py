@@ -78,6 +78,14 @@ class RIBucketReader(RemoteInterface):
     def read(offset=Offset, length=ReadSize):
         return ShareData
 
+    def readv(readv=ListOf(TupleOf(Offset, ReadSize))):
+        """Read several (offset, length) ranges of the share in one call,
+        returning a list with the data for each range. Only servers which
+        advertise 'immutable-read-vectors' in their version dict provide
+        this method.
+        """
+        return ListOf(ShareData)
+
     def advise_corrupt_share(reason=bytes):
         """Clients who discover hash failures in shares that they have
         downloaded from me will use this method to inform me about the
@@ -443,6 +451,18 @@ class IStorageBucketReader(Interface):
         @return: ShareData
         """
 
+    def get_blocks_data(first, count, blocksize, lastblocksize):
+        """Read 'count' adjacent blocks, starting with block number 'first',
+        in a single request. All but the last of them are 'blocksize' long;
+        the last is 'lastblocksize' long.
+
+        @param first=int
+        @param count=int
+        @param blocksize=int
+        @param lastblocksize=int
+        @return: ListOf(ShareData)
+        """
+
     def get_crypttext_hashes():
         """
         @return: ListOf(Hash)
@@ -1097,6 +1117,16 @@ class IMutableFileNode(IFileNode):
     only be retrieved and updated all-at-once, as a single big string. Future
     versions of our mutable files will remove this restriction.
     """
+    def download_best_version_if_changed(known_version):
+        """Like download_best_version(), but skip the download if the best
+        version is 'known_version', a version returned by an earlier call
+        (or None).
+
+        I return a Deferred that fires with a (version, contents) tuple,
+        where 'version' identifies the best version and 'contents' is a
+        byte string, or None if 'version' is 'known_version'.
+        """
+
     def get_best_mutable_version():
         """Return a Deferred that fires with an IMutableFileVersion for
         the 'best' available version of the file. The best version is
@@ -1409,6 +1439,24 @@ class IDirectoryNode(IFilesystemNode):
         operation finishes. The child name must be a unicode string. I raise
         NoSuchChildError if I do not have a child by that name."""
 
+    def shard(shards=None):
+        """I move my children into 'shards' new MDMF directories, chosen by
+        a hash of each child's name, and replace my contents with a list of
+        those directories, so that adding, removing or changing a child only
+        rewrites the directory holding it. By default I choose the number of
+        shards from the number of children. I still behave as one directory
+        for all the other methods of IDirectoryNode. Clients older than this
+        can't read a sharded directory.
+
+        I return a Deferred that fires with the number of shards. I fail
+        with NotWriteableError if I am read-only or immutable."""
+
+    def list_for_traversal():
+        """I return a Deferred that fires with (children, shards). If I am
+        sharded, children is an empty dict and shards is a list of the
+        directory nodes holding my children. Otherwise children is the same
+        as list() gives and shards is empty."""
+
     def build_manifest():
         """I generate a table of everything reachable from this directory.
         I also compute deep-stats as described below.
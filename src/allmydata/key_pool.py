@@ -0,0 +1,244 @@
+"""
+A pool of pre-generated RSA keypairs for new mutable files and directories.
+
+Creating a mutable file or directory needs a fresh 2048-bit RSA keypair,
+and generating one takes tens to hundreds of milliseconds of CPU, which is
+most of the latency of a ``mkdir``.  ``KeyPool`` generates keypairs ahead of
+time, one at a time on the CPU thread pool, whenever nothing has been taken
+from it for a little while, so a burst of creations can be served straight
+from the pool.  When the pool is empty a keypair is generated on demand, just
+as ``KeyGenerator`` does.
+
+So that a restart doesn't throw the pool away, it is written to the private
+directory when the node stops, encrypted and authenticated with keys derived
+from a node secret.  The file is removed as soon as it has been read back in,
+so that a keypair can never be handed out twice, even if the node crashes
+after using it.
+"""
+
+from __future__ import annotations
+
+import os
+from typing import Optional
+
+from zope.interface import implementer
+from twisted.application import service
+from twisted.internet.defer import Deferred
+from twisted.internet.interfaces import IReactorTime
+
+from allmydata.crypto import aes, rsa
+from allmydata.interfaces import IStatsProducer
+from allmydata.util import fileutil, log
+from allmydata.util.cputhreadpool import defer_to_thread
+from allmydata.util.deferredutil import async_to_deferred
+from allmydata.util.hashutil import hmac, tagged_hash, timing_safe_compare
+from allmydata.util.netstring import netstring, split_netstring
+
+KEY_SIZE = 2048
+
+# How long nothing must be taken from the pool before it is refilled, in
+# seconds, so that refilling doesn't compete with a burst of creations.
+DEFAULT_IDLE_DELAY = 5.0
+
+_ENCRYPTION_TAG = b"allmydata_key_pool_encryption_v1"
+_MAC_TAG = b"allmydata_key_pool_mac_v1"
+_IV_LENGTH = 16
+_MAC_LENGTH = 32
+
+
+def _keys_from_secret(secret: bytes) -> tuple[bytes, bytes]:
+    return (tagged_hash(_ENCRYPTION_TAG, secret, 32),
+            tagged_hash(_MAC_TAG, secret))
+
+
+def seal_private_keys(secret: bytes, private_keys: list[rsa.PrivateKey]) -> bytes:
+    """
+    Serialize ``private_keys``, encrypted and authenticated with keys derived
+    from ``secret``.
+    """
+    encryption_key, mac_key = _keys_from_secret(secret)
+    plaintext = b"".join(
+        netstring(rsa.der_string_from_signing_key(private_key))
+        for private_key in private_keys
+    )
+    iv = os.urandom(_IV_LENGTH)
+    encryptor = aes.create_encryptor(encryption_key, iv)
+    ciphertext = iv + aes.encrypt_data(encryptor, plaintext)
+    return ciphertext + hmac(mac_key, ciphertext)
+
+
+def unseal_private_keys(secret: bytes, data: bytes) -> list[rsa.PrivateKey]:
+    """
+    Undo ``seal_private_keys``.
+
+    :raise ValueError: if ``data`` was not sealed with ``secret`` or has been
+        tampered with.
+    """
+    encryption_key, mac_key = _keys_from_secret(secret)
+    if len(data) < _IV_LENGTH + _MAC_LENGTH:
+        raise ValueError("key pool is truncated")
+    ciphertext, mac = data[:-_MAC_LENGTH], data[-_MAC_LENGTH:]
+    if not timing_safe_compare(hmac(mac_key, ciphertext), mac):
+        raise ValueError("key pool failed authentication")
+    decryptor = aes.create_decryptor(encryption_key, ciphertext[:_IV_LENGTH])
+    plaintext = aes.decrypt_data(decryptor, ciphertext[_IV_LENGTH:])
+    private_keys = []
+    position = 0
+    while position < len(plaintext):
+        (der,), position = split_netstring(plaintext, 1, position)
+        private_key, _ = rsa.create_signing_keypair_from_string(der)
+        private_keys.append(private_key)
+    return private_keys
+
+
+@implementer(IStatsProducer)
+class KeyPool(service.Service):
+    """
+    I create RSA keys for mutable files, like ``KeyGenerator``, but keep up
+    to ``size`` of them generated in advance.
+
+    :ivar size: The number of keypairs to keep ready.
+    :ivar idle_delay: How many seconds to wait after a keypair is taken
+        before generating more.
+    """
+    name = "key-pool"
+
+    def __init__(self, size: int, path: Optional[str] = None,
+                 secret: Optional[bytes] = None,
+                 idle_delay: float = DEFAULT_IDLE_DELAY,
+                 clock: Optional[IReactorTime] = None):
+        """
+        :param path: Where to keep the pool while the node isn't running, or
+            ``None`` not to keep it.
+        :param secret: The secret the kept pool is encrypted with.
+        """
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.size = size
+        self.idle_delay = idle_delay
+        self._path = path
+        self._secret = secret
+        self._clock = clock
+        self._private_keys: list[rsa.PrivateKey] = []
+        self._refill_call = None
+        self._generating: Optional[Deferred] = None
+        self._hits = 0
+        self._misses = 0
+
+    def startService(self):
+        service.Service.startService(self)
+        self._load()
+        self._schedule_refill()
+
+    def stopService(self):
+        # Not running from here on, so nothing more is generated.
+        service.Service.stopService(self)
+        if self._refill_call is not None and self._refill_call.active():
+            self._refill_call.cancel()
+        self._refill_call = None
+        d = self._generating
+        if d is None:
+            self._save()
+            return None
+        # Let the keypair being generated finish rather than leave a thread
+        # behind, and keep it with the rest.
+        d.addCallback(lambda ignored: self._save())
+        return d
+
+    def __len__(self) -> int:
+        return len(self._private_keys)
+
+    @async_to_deferred
+    async def generate(self) -> tuple[rsa.PublicKey, rsa.PrivateKey]:
+        """
+        I return a Deferred that fires with a (verifyingkey, signingkey)
+        pair, from the pool if there is one ready.  The returned key will be
+        2048 bit.
+        """
+        if self._private_keys:
+            self._hits += 1
+            private = self._private_keys.pop(0)
+            self._schedule_refill()
+            return private.public_key(), private
+        self._misses += 1
+        self._schedule_refill()
+        private, public = await defer_to_thread(
+            rsa.create_signing_keypair, KEY_SIZE
+        )
+        return public, private
+
+    def _schedule_refill(self) -> None:
+        """
+        Arrange to generate another keypair once the pool has been left alone
+        for ``idle_delay`` seconds, putting it off if that's already
+        arranged.
+        """
+        if not self.running or self._generating is not None:
+            return
+        if self._refill_call is not None and self._refill_call.active():
+            self._refill_call.reset(self.idle_delay)
+            return
+        if len(self._private_keys) < self.size:
+            self._refill_call = self._clock.callLater(
+                self.idle_delay, self._refill,
+            )
+
+    def _refill(self) -> None:
+        self._refill_call = None
+        if not self.running:
+            return
+        requests = self._hits + self._misses
+        d = Deferred.fromCoroutine(
+            defer_to_thread(rsa.create_signing_keypair, KEY_SIZE)
+        )
+        self._generating = d
+
+        def _generated(keypair):
+            self._generating = None
+            self._private_keys.append(keypair[0])
+            if not self.running:
+                # stopService() saves it with the rest
+                return
+            if self._hits + self._misses == requests:
+                # Still idle, so carry on, going back to the reactor first.
+                if len(self._private_keys) < self.size:
+                    self._refill_call = self._clock.callLater(0, self._refill)
+            else:
+                self._schedule_refill()
+
+        def _failed(f):
+            self._generating = None
+            log.err(f, "failed to generate a keypair for the key pool",
+                    level=log.UNUSUAL)
+        d.addCallbacks(_generated, _failed)
+
+    def _load(self) -> None:
+        if self._path is None or not os.path.exists(self._path):
+            return
+        data = fileutil.read(self._path)
+        # Before anything is handed out, so nothing can be handed out twice.
+        fileutil.remove(self._path)
+        try:
+            private_keys = unseal_private_keys(self._secret, data)
+        except ValueError as e:
+            log.msg("discarding unreadable key pool %r: %s" % (self._path, e),
+                    level=log.UNUSUAL)
+            return
+        self._private_keys.extend(private_keys[:self.size])
+
+    def _save(self) -> None:
+        if self._path is None or not self._private_keys:
+            return
+        fileutil.write(self._path,
+                       seal_private_keys(self._secret, self._private_keys))
+        self._private_keys = []
+
+    def get_stats(self) -> dict[str, float]:
+        requests = self._hits + self._misses
+        return {
+            "key_pool.size": self.size,
+            "key_pool.depth": len(self._private_keys),
+            "key_pool.hits": self._hits,
+            "key_pool.misses": self._misses,
+            "key_pool.miss_rate": self._misses / requests if requests else 0.0,
+        }
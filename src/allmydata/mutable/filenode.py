@@ -4,14 +4,16 @@ Ported to Python 3.
 from __future__ import annotations
 
 import random
+import time
 
 from zope.interface import implementer
 from twisted.internet import defer, reactor
 from foolscap.api import eventually
 
+from allmydata import hashtree
 from allmydata.interfaces import IMutableFileNode, ICheckable, ICheckResults, \
      NotEnoughSharesError, MDMF_VERSION, SDMF_VERSION, IMutableUploadable, \
-     IMutableFileVersion, IWriteable
+     IMutableFileVersion, IWriteable, DownloadStopped
 from allmydata.util import hashutil, log, consumer, deferredutil, mathutil
 from allmydata.util.assertutil import precondition
 from allmydata.util.cputhreadpool import defer_to_thread
@@ -21,6 +23,7 @@ from allmydata.monitor import Monitor
 from allmydata.mutable.publish import Publish, MutableData,\
                                       TransformingUploadable
 from allmydata.mutable.common import (
+    MODE_ANYTHING,
     MODE_READ,
     MODE_WRITE,
     MODE_CHECK,
@@ -56,13 +59,38 @@ class BackoffAgent(object):
         reactor.callLater(self._delay, d.callback, None)
         return d
 
+# By default every read starts with a fresh servermap update.
+DEFAULT_SERVERMAP_CACHE_TTL = 0
+
+
+class _StoppableConsumer(consumer.MemoryConsumer):
+    """
+    A ``MemoryConsumer`` whose producer can be stopped, even before it has
+    been registered.
+    """
+    producer = None
+    stopped = False
+
+    def registerProducer(self, p, streaming):
+        consumer.MemoryConsumer.registerProducer(self, p, streaming)
+        if self.stopped:
+            p.stopProducing()
+
+    def stop(self):
+        self.stopped = True
+        if self.producer is not None and not self.done:
+            self.producer.stopProducing()
+
+
 # use nodemaker.create_mutable_file() to make one of these
 
 @implementer(IMutableFileNode, ICheckable)
 class MutableFileNode(object):
 
     def __init__(self, storage_broker, secret_holder,
-                 default_encoding_parameters, history):
+                 default_encoding_parameters, history,
+                 servermap_cache_ttl=DEFAULT_SERVERMAP_CACHE_TTL,
+                 optimistic_reads=False):
         self._storage_broker = storage_broker
         self._secret_holder = secret_holder
         self._default_encoding_parameters = default_encoding_parameters
@@ -94,6 +122,16 @@ class MutableFileNode(object):
         # init_from_cap method if necessary.
         self._downloader_hints = {}
 
+        # The most recent servermap we've built. Reads may use it instead of
+        # updating a new one for servermap_cache_ttl seconds after it was
+        # updated. With optimistic_reads, a read also starts downloading the
+        # version it names, from the servers it names, while the new
+        # servermap is being updated: if that's still the best version, the
+        # download has a head start. Anything we publish makes it stale.
+        self._servermap_cache_ttl = servermap_cache_ttl
+        self._optimistic_reads = optimistic_reads
+        self._cached_servermap = None
+
     def __repr__(self):
         if hasattr(self, '_uri'):
             return "<%s %x %s %r>" % (self.__class__.__name__, id(self), self.is_readonly() and 'RO' or 'RW', self._uri.abbrev())
@@ -387,6 +425,8 @@ class MutableFileNode(object):
         recoverable version that I can find in there.
         """
         # XXX: wording ^^^^
+        if not servermap and mode == MODE_READ:
+            servermap = self._get_cached_servermap()
         if servermap and servermap.get_last_update()[0] == mode:
             d = defer.succeed(servermap)
         else:
@@ -409,16 +449,37 @@ class MutableFileNode(object):
         I return a Deferred that fires with the contents of the best
         version of this mutable file.
         """
-        return self._do_serialized(self._download_best_version)
+        d = self._do_serialized(self._download_best_version_if_changed, None)
+        d.addCallback(lambda version_and_contents: version_and_contents[1])
+        return d
 
 
-    def _download_best_version(self):
+    def download_best_version_if_changed(self, known_version):
         """
-        I am the serialized sibling of download_best_version.
+        I return a Deferred that fires with (version, contents) for the
+        best version of this mutable file, where contents is None (and
+        nothing was downloaded) if that version is known_version.
+        """
+        return self._do_serialized(self._download_best_version_if_changed,
+                                   known_version)
+
+
+    def _download_best_version_if_changed(self, known_version):
         """
+        I am the serialized sibling of download_best_version and
+        download_best_version_if_changed.
+        """
+        optimistic = self._start_optimistic_download(known_version)
         d = self.get_best_readable_version()
         d.addCallback(self._record_size)
-        d.addCallback(lambda version: version.download_to_data())
+        def _download(mfv):
+            if known_version is not None and mfv._version == known_version:
+                self._stop_optimistic_download(optimistic)
+                return (known_version, None)
+            d = self._download_version_to_data(mfv, optimistic)
+            d.addCallback(lambda data: (mfv._version, data))
+            return d
+        d.addCallback(_download)
 
         # It is possible that the download will fail because there
         # aren't enough shares to be had. If so, we will try again after
@@ -429,17 +490,83 @@ class MutableFileNode(object):
         # with a servermap that was last updated in MODE_WRITE, as we
         # want. If this fails, then we give up.
         def _maybe_retry(failure):
+            self._stop_optimistic_download(optimistic)
             failure.trap(NotEnoughSharesError)
 
             d = self.get_best_mutable_version()
             d.addCallback(self._record_size)
-            d.addCallback(lambda version: version.download_to_data())
+            d.addCallback(lambda version: version.download_to_data().addCallback(
+                lambda data: (version._version, data)))
             return d
 
         d.addErrback(_maybe_retry)
         return d
 
 
+    def _start_optimistic_download(self, known_version=None):
+        """
+        If optimistic reads are enabled and we have an expired servermap,
+        start downloading the best version it knows about, unless that is
+        known_version.
+
+        :return: None, or a tuple of the version being downloaded, a
+            Deferred that fires with (True, contents) or (False, Failure),
+            and the ``_StoppableConsumer`` it is downloaded into.
+        """
+        if not self._optimistic_reads:
+            return None
+        servermap = self._cached_servermap
+        if servermap is None or self._get_cached_servermap() is not None:
+            # nothing to go on, or we'll use the cached servermap anyway
+            return None
+        version = servermap.best_recoverable_version()
+        if not version or version == known_version:
+            return None
+        mfv = MutableFileVersion(self,
+                                 servermap,
+                                 version,
+                                 self._storage_index,
+                                 self._storage_broker,
+                                 self._readkey,
+                                 history=self._history)
+        mfv.set_downloader_hints(self._downloader_hints)
+        c = _StoppableConsumer()
+        d = mfv.read(c)
+        # Whether or not we end up using it, don't let a failure go
+        # unhandled.
+        d.addCallbacks(lambda mc: (True, b"".join(mc.chunks)),
+                       lambda f: (False, f))
+        return (version, d, c)
+
+
+    def _stop_optimistic_download(self, optimistic):
+        """
+        Stop an optimistic download which isn't going to be used, so that
+        the file isn't downloaded twice.
+        """
+        if optimistic is not None:
+            (version, d, c) = optimistic
+            c.stop()
+
+
+    def _download_version_to_data(self, mfv, optimistic):
+        """
+        Download the contents of a MutableFileVersion, or take them from an
+        optimistic download of the same version.
+        """
+        if optimistic is not None:
+            (version, d, c) = optimistic
+            if version == mfv._version:
+                def _got(result):
+                    (succeeded, data) = result
+                    if succeeded:
+                        return data
+                    return mfv.download_to_data()
+                return d.addCallback(_got)
+            self._stop_optimistic_download(optimistic)
+        return mfv.download_to_data()
+
+
     def _record_size(self, mfv):
         """
         I record the size of a mutable file version.
@@ -613,9 +740,51 @@ class MutableFileNode(object):
         # more data about us.
         if not self._most_recent_size:
             d.addCallback(self._get_size_from_servermap)
+        if mode != MODE_ANYTHING:
+            # MODE_ANYTHING stops at the first share it finds
+            d.addCallback(self._cache_servermap)
         return d
 
 
+    def _cache_servermap(self, servermap):
+        """
+        Remember a servermap for later reads, if it found something we could
+        read.
+        """
+        if servermap.best_recoverable_version():
+            self._cached_servermap = servermap
+        return servermap
+
+
+    def _get_cached_servermap(self):
+        """
+        Return the cached servermap if it is recent enough to read from, or
+        None.
+        """
+        servermap = self._cached_servermap
+        if servermap is None or not self._servermap_cache_ttl:
+            return None
+        (mode, when) = servermap.get_last_update()
+        if time.time() - when > self._servermap_cache_ttl:
+            return None
+        # Reads only need a map that was updated in MODE_READ, and the more
+        # thorough modes find at least as much. Make a copy that says so,
+        # so that nothing treats a map updated in MODE_WRITE or MODE_CHECK
+        # as one it can publish with.
+        servermap = servermap.copy()
+        servermap.set_last_update(MODE_READ, when)
+        return servermap
+
+
+    def _forget_servermap(self, res=None):
+        """
+        Stop using the cached servermap: we've published (or are about to
+        publish) a new version, or a read from it failed.
+        """
+        self._cached_servermap = None
+        return res
+
+
     def _get_size_from_servermap(self, servermap):
         """
         I extract the size of the best version of this file and record
@@ -680,12 +849,14 @@ class MutableFileNode(object):
 
         # Define IPublishInvoker with a set_downloader_hints method?
         # Then have the publisher call that method when it's done publishing?
+        self._forget_servermap()
         p = Publish(self, self._storage_broker, servermap)
         if self._history:
             self._history.notify_publish(p.get_status(),
                                          new_contents.get_size())
         d = p.publish(new_contents)
         d.addCallback(self._did_upload, new_contents.get_size())
+        d.addBoth(self._forget_servermap)
         return d
 
 
@@ -980,6 +1151,13 @@ class MutableFileVersion(object):
         if self._history:
             self._history.notify_retrieve(r.get_status())
         d = r.download(consumer, offset, size)
+        def _failed(f):
+            # whatever went wrong, unless the download was just stopped, the
+            # next read should look for shares again
+            if not f.check(DownloadStopped):
+                self._node._forget_servermap()
+            return f
+        d.addErrback(_failed)
         return d
 
 
@@ -1004,12 +1182,14 @@ class MutableFileVersion(object):
 
     def _upload(self, new_contents):
         #assert self._pubkey, "update_servermap must be called before publish"
+        self._node._forget_servermap()
         p = Publish(self._node, self._storage_broker, self._servermap)
         if self._history:
             self._history.notify_publish(p.get_status(),
                                          new_contents.get_size())
         d = p.publish(new_contents)
         d.addCallback(self._did_upload, new_contents.get_size())
+        d.addBoth(self._node._forget_servermap)
         return d
 
 
@@ -1093,36 +1273,71 @@ class MutableFileVersion(object):
         assert offset <= self.get_size()
 
         segsize = self._version[3]
-        # We'll need the segment that the data starts in, regardless of
-        # what we'll do later.
+        old_size = self.get_size()
+        end_data = offset + data.get_size()
+        new_size = max(old_size, end_data)
+        # The new data starts in this segment...
         start_segment = offset // segsize
 
-        # We only need the end segment if the data we append does not go
-        # beyond the current end-of-file.
+        # ...and the last segment with old data after the new data is
+        # this one, if the new data doesn't go beyond the current
+        # end-of-file.
         end_segment = start_segment
-        if offset + data.get_size() < self.get_size():
-            end_data = offset + data.get_size()
+        if end_data < old_size:
             # The last byte we touch is the end_data'th byte, which is actually
             # byte end_data - 1 because bytes are zero-indexed.
-            end_data -= 1
-            end_segment = end_data // segsize
+            end_segment = (end_data - 1) // segsize
 
         self._start_segment = start_segment
         self._end_segment = end_segment
 
-        # Now ask for the servermap to be updated in MODE_WRITE with
-        # this update range.
-        return self._update_servermap(update_range=(start_segment,
-                                                    end_segment))
+        # We only need the old contents of the segments which the new
+        # data covers partly: the one it starts in, unless it starts on a
+        # segment boundary, and the one it ends in, if that one has old
+        # data after the new data.
+        boundary_segments = set()
+        if offset % segsize:
+            boundary_segments.add(start_segment)
+        if end_data < old_size and end_data % segsize:
+            boundary_segments.add(end_segment)
+        self._boundary_segments = boundary_segments
+
+        # These are the segments that will be published again, whose
+        # leaves in the block hash tree change.
+        changed_segments = range(start_segment, (end_data - 1) // segsize + 1)
+
+        num_segments = mathutil.div_ceil(old_size, segsize)
+        first_leaf = hashtree.roundup_pow2(num_segments) - 1
+        if new_size == old_size:
+            # The shares stay the same size, so the block hash tree stays
+            # where it is: we only need the hashes to recompute the ones
+            # that change, the old leaves of the boundary segments to
+            # check their blocks, and the root if nothing changes at all.
+            needed = hashtree.needed_for_update(num_segments,
+                                                changed_segments)
+            needed.update(first_leaf + segnum for segnum in boundary_segments)
+            if not changed_segments:
+                needed.add(0)
+        else:
+            # The block hash tree comes after the share data, so it must
+            # move, and we need all of it to write it again.
+            needed = None
+
+        # Now ask for the servermap to be updated in MODE_WRITE, fetching
+        # those from each share.
+        return self._update_servermap(update_segments=boundary_segments,
+                                      update_blockhashes=needed)
 
 
-    def _decode_and_decrypt_segments(self, ignored, data, offset):
+    @deferredutil.async_to_deferred
+    async def _decode_and_decrypt_segments(self, ignored, data, offset):
         """
         After the servermap update, I take the encrypted and encoded
         data that the servermap fetched while doing its update and
         transform it into decoded-and-decrypted plaintext that can be
         used by the new uploadable. I return a Deferred that fires with
-        the segments.
+        the plaintext of the start and end segments and the block hashes
+        of each share.
         """
         r = Retrieve(self._node, self._storage_broker, self._servermap,
                      self._version)
@@ -1132,16 +1347,16 @@ class MutableFileVersion(object):
         # existing infrastructure within the Retrieve class to avoid
         # duplicating code.
         sm = self._servermap
-        # XXX: If the methods in the servermap don't work as
-        # abstractions, you should rewrite them instead of going around
-        # them.
-        update_data = sm.update_data
-        start_segments = {} # shnum -> start segment
-        end_segments = {} # shnum -> end segment
-        blockhashes = {} # shnum -> blockhash tree
-        for (shnum, original_data) in list(update_data.items()):
+        k = self._version[5]
+        num_segments = mathutil.div_ceil(self._version[4], self._version[3])
+        first_leaf = hashtree.roundup_pow2(num_segments) - 1
+        blocks = {} # segnum -> {shnum: (block, salt)}
+        blockhashes = {} # shnum -> {hash index: hash}
+        for (shnum, original_data) in list(sm.update_data.items()):
             data = [d[1] for d in original_data if d[0] == self._version]
-            # data is [(blockhashes,start,end)..]
+            if not data:
+                continue
+            # data is [(blocks,blockhashes)..]
 
             # Every data entry in our list should now be share shnum for
             # a particular version of the mutable file, so all of the
@@ -1149,15 +1364,55 @@ class MutableFileVersion(object):
             datum = data[0]
             assert [x for x in data if x != datum] == []
 
-            # datum is (blockhashes,start,end)
-            blockhashes[shnum] = datum[0]
-            start_segments[shnum] = datum[1] # (block,salt) bytestrings
-            end_segments[shnum] = datum[2]
-
-        d1 = r.decode(start_segments, self._start_segment)
-        d2 = r.decode(end_segments, self._end_segment)
-        d3 = defer.succeed(blockhashes)
-        return deferredutil.gatherResults([d1, d2, d3])
+            share_blocks, blockhashes[shnum] = datum
+            for (segnum, block_and_salt) in share_blocks.items():
+                if self._is_valid_block(block_and_salt,
+                                        blockhashes[shnum].get(first_leaf + segnum)):
+                    blocks.setdefault(segnum, {})[shnum] = block_and_salt
+
+        # Only the first k shares were asked for their blocks. If some of
+        # those were missing or bad, we get the rest from other shares.
+        for segnum in sorted(self._boundary_segments):
+            segment_blocks = blocks.setdefault(segnum, {})
+            for ((verinfo, _, _, shnum), reader) in list(sm.proxies.items()):
+                if len(segment_blocks) >= k:
+                    break
+                if verinfo != self._version or shnum in segment_blocks:
+                    continue
+                try:
+                    block_and_salt = await reader.get_block_and_salt(segnum)
+                except Exception as e:
+                    log.msg("failed to read segment %d of share %d for an "
+                            "update: %s" % (segnum, shnum, e),
+                            level=log.UNUSUAL)
+                    continue
+                if self._is_valid_block(block_and_salt,
+                                        blockhashes.get(shnum, {}).get(first_leaf + segnum)):
+                    segment_blocks[shnum] = block_and_salt
+            if len(segment_blocks) < k:
+                raise NotEnoughSharesError(
+                    "only found %d good blocks of segment %d, need %d"
+                    % (len(segment_blocks), segnum, k))
+
+        async def plaintext(segnum):
+            if segnum not in self._boundary_segments:
+                return b""
+            return await r.decode(blocks[segnum], segnum)
+
+        start = await plaintext(self._start_segment)
+        end = await plaintext(self._end_segment)
+        return [start, end, blockhashes]
+
+
+    def _is_valid_block(self, block_and_salt, leaf):
+        """
+        Does this (block, salt) from a share match the leaf of the block
+        hash tree that came from the same share?
+        """
+        if leaf is None:
+            return False
+        block, salt = block_and_salt
+        return hashutil.block_hash(salt + block) == leaf
 
 
     def _build_uploadable_and_finish(self, segments_and_bht, data, offset):
@@ -1172,24 +1427,24 @@ class MutableFileVersion(object):
                                    self._version[3],
                                    segments_and_bht[0],
                                    segments_and_bht[1])
+        self._node._forget_servermap()
         p = Publish(self._node, self._storage_broker, self._servermap)
-        return p.update(u, offset, segments_and_bht[2], self._version)
+        d = p.update(u, offset, segments_and_bht[2], self._version)
+        d.addBoth(self._node._forget_servermap)
+        return d
 
 
-    def _update_servermap(self, mode=MODE_WRITE, update_range=None):
+    def _update_servermap(self, mode=MODE_WRITE, update_segments=None,
+                          update_blockhashes=None):
         """
         I update the servermap. I return a Deferred that fires when the
         servermap update is done.
         """
-        if update_range:
-            u = ServermapUpdater(self._node, self._storage_broker, Monitor(),
-                                 self._servermap,
-                                 mode=mode,
-                                 update_range=update_range)
-        else:
-            u = ServermapUpdater(self._node, self._storage_broker, Monitor(),
-                                 self._servermap,
-                                 mode=mode)
+        u = ServermapUpdater(self._node, self._storage_broker, Monitor(),
+                             self._servermap,
+                             mode=mode,
+                             update_segments=update_segments,
+                             update_blockhashes=update_blockhashes)
         return u.update()
 
     # https://tahoe-lafs.org/trac/tahoe-lafs/ticket/3562
@@ -7,6 +7,7 @@ from allmydata.mutable.common import NeedMoreDataError, UnknownVersionError, \
      BadShareError
 from allmydata.interfaces import HASH_SIZE, SALT_SIZE, SDMF_VERSION, \
                                  MDMF_VERSION, IMutableSlotWriter
+from allmydata import hashtree
 from allmydata.util import mathutil
 from twisted.python import failure
 from twisted.internet import defer
@@ -833,6 +834,10 @@ class MDMFSlotWriteProxy(object):
         self._offsets['block_hash_tree'] = self._offsets['share_data'] + \
                     data_size
 
+        # When updating a share in place, these are the offsets of the
+        # share as it was; see set_old_offsets.
+        self._old_offsets = None
+
         # Done. We can snow start writing.
 
 
@@ -882,6 +887,26 @@ class MDMFSlotWriteProxy(object):
             self._testvs.append((0, len(checkstring), checkstring))
 
 
+    def set_old_offsets(self, offsets):
+        """
+        Tell me the offsets of the share that I am updating in place (as
+        found in its verinfo), so that I don't write the encrypted private
+        key or the verification key again if they would go exactly where
+        they already are.
+        """
+        self._old_offsets = dict(offsets)
+
+
+    def _already_in_place(self, start, end):
+        """
+        Is the field between the offsets named start and end where it
+        was in the share I am updating?
+        """
+        return (self._old_offsets is not None and
+                self._old_offsets.get(start) == self._offsets[start] and
+                self._old_offsets.get(end) == self._offsets[end])
+
+
     def __repr__(self):
         return "MDMFSlotWriteProxy for share %d" % self.shnum
 
@@ -948,6 +973,8 @@ class MDMFSlotWriteProxy(object):
         self._offsets['share_hash_chain'] = self._offsets['enc_privkey'] + \
                 len(encprivkey)
 
+        if self._already_in_place('enc_privkey', 'share_hash_chain'):
+            return
         self._writevs.append(tuple([self._offsets['enc_privkey'], encprivkey]))
 
 
@@ -974,6 +1001,44 @@ class MDMFSlotWriteProxy(object):
                                   blockhashes_s]))
 
 
+    def put_changed_blockhashes(self, blockhashes):
+        """
+        I queue write vectors to put just some of the block hash tree onto
+        the remote server, for an update which leaves the rest of the tree
+        where it was. blockhashes is a dict mapping 'hash index' values to
+        the hashes that changed; runs of adjacent hashes are written
+        together.
+
+        Like put_blockhashes, I must be called after put_encprivkey, and
+        before put_sharehashes.
+        """
+        assert self._offsets
+        assert "block_hash_tree" in self._offsets
+        assert isinstance(blockhashes, dict)
+
+        num_hashes = 2 * hashtree.roundup_pow2(self._num_segments) - 1
+        self._offsets['EOF'] = self._offsets['block_hash_tree'] + \
+            num_hashes * HASH_SIZE
+
+        run_start = None
+        run = []
+        for i in sorted(blockhashes):
+            if i >= num_hashes:
+                raise LayoutInvalid("Not a valid block hash index")
+            if run and run_start + len(run) != i:
+                self._writevs.append(tuple([
+                    self._offsets['block_hash_tree'] + run_start * HASH_SIZE,
+                    b"".join(run)]))
+                run = []
+            if not run:
+                run_start = i
+            run.append(blockhashes[i])
+        if run:
+            self._writevs.append(tuple([
+                self._offsets['block_hash_tree'] + run_start * HASH_SIZE,
+                b"".join(run)]))
+
+
     def put_sharehashes(self, sharehashes):
         """
         I queue a write vector to put the share hash chain in my
@@ -1097,6 +1162,8 @@ class MDMFSlotWriteProxy(object):
         self._offsets['verification_key_end'] = \
             self._offsets['verification_key'] + len(verification_key)
         assert self._offsets['verification_key_end'] <= self._offsets['share_data']
+        if self._already_in_place('verification_key', 'verification_key_end'):
+            return
         self._writevs.append(tuple([self._offsets['verification_key'],
                             verification_key]))
 
@@ -1390,53 +1457,119 @@ class MDMFSlotReadProxy(object):
         salt is the salt used to encrypt that segment.
         """
         d = self._maybe_fetch_offsets_and_header()
-        def _then(ignored):
-            base_share_offset = self._offsets['share_data']
+        d.addCallback(lambda ignored: self._read([self._block_readv(segnum)]))
+        def _process_results(results):
+            if self.shnum not in results:
+                raise BadShareError("no data for shnum %d" % self.shnum)
+            return self._parse_block_and_salt(results[self.shnum])
+        d.addCallback(_process_results)
+        return d
 
-            if segnum + 1 > self._num_segments:
-                raise LayoutInvalid("Not a valid segment number")
 
-            if self._version_number == 0:
-                share_offset = base_share_offset + self._block_size * segnum
+    def _block_readv(self, segnum):
+        """
+        I return the read vector for the block (and, in MDMF, the salt) of
+        segment segnum. The offsets and header must have been fetched.
+        """
+        base_share_offset = self._offsets['share_data']
+
+        if segnum + 1 > self._num_segments:
+            raise LayoutInvalid("Not a valid segment number")
+
+        if self._version_number == 0:
+            share_offset = base_share_offset + self._block_size * segnum
+        else:
+            share_offset = base_share_offset + (self._block_size + \
+                                                SALT_SIZE) * segnum
+        if segnum + 1 == self._num_segments:
+            data = self._tail_block_size
+        else:
+            data = self._block_size
+
+        if self._version_number == 1:
+            data += SALT_SIZE
+
+        return (share_offset, data)
+
+
+    def _parse_block_and_salt(self, data):
+        """
+        I turn what was read with a read vector from _block_readv into
+        (block, salt).
+        """
+        if self._version_number == 0:
+            # We only read the share data, but we know the salt from
+            # when we fetched the header
+            if not data:
+                data = b""
             else:
-                share_offset = base_share_offset + (self._block_size + \
-                                                    SALT_SIZE) * segnum
-            if segnum + 1 == self._num_segments:
-                data = self._tail_block_size
+                if len(data) != 1:
+                    raise BadShareError("got %d vectors, not 1" % len(data))
+                data = data[0]
+            salt = self._salt
+        else:
+            if not data:
+                salt = data = b""
             else:
-                data = self._block_size
+                salt_and_data = data[0]
+                salt = salt_and_data[:SALT_SIZE]
+                data = salt_and_data[SALT_SIZE:]
+        return data, salt
 
-            if self._version_number == 1:
-                data += SALT_SIZE
 
-            readvs = [(share_offset, data)]
-            return readvs
-        d.addCallback(_then)
-        d.addCallback(lambda readvs: self._read(readvs))
-        def _process_results(results):
+    def get_update_data(self, segnums, needed=None):
+        """
+        I return what an in-place update of an MDMF file needs from this
+        share, read in a single request: a dict mapping each of segnums to
+        (block, salt) for that segment, and a dict mapping the 'hash index'
+        of each block hash in needed (or of every one, if needed is None)
+        to that hash. Runs of adjacent hashes are read together.
+        """
+        d = self._maybe_fetch_offsets_and_header()
+        def _then(ignored):
+            segments = sorted(set(segnums))
+            readvs = [self._block_readv(segnum) for segnum in segments]
+            blockhashes_offset = self._offsets['block_hash_tree']
+            if self._version_number == 1:
+                blockhashes_end = self._offsets['EOF']
+            else:
+                blockhashes_end = self._offsets['share_data']
+            if needed is None:
+                runs = [(0, (blockhashes_end - blockhashes_offset) // HASH_SIZE)]
+            else:
+                runs = []
+                for i in sorted(needed):
+                    if runs and runs[-1][0] + runs[-1][1] == i:
+                        runs[-1] = (runs[-1][0], runs[-1][1] + 1)
+                    else:
+                        runs.append((i, 1))
+            for (first, count) in runs:
+                if blockhashes_offset + (first + count) * HASH_SIZE > blockhashes_end:
+                    raise LayoutInvalid("Not a valid block hash index")
+                readvs.append((blockhashes_offset + first * HASH_SIZE,
+                               count * HASH_SIZE))
+            d2 = self._read(readvs)
+            d2.addCallback(_process_results, segments, runs)
+            return d2
+        def _process_results(results, segments, runs):
             if self.shnum not in results:
                 raise BadShareError("no data for shnum %d" % self.shnum)
-            if self._version_number == 0:
-                # We only read the share data, but we know the salt from
-                # when we fetched the header
-                data = results[self.shnum]
-                if not data:
-                    data = b""
-                else:
-                    if len(data) != 1:
-                        raise BadShareError("got %d vectors, not 1" % len(data))
-                    data = data[0]
-                salt = self._salt
-            else:
-                data = results[self.shnum]
-                if not data:
-                    salt = data = b""
-                else:
-                    salt_and_data = results[self.shnum][0]
-                    salt = salt_and_data[:SALT_SIZE]
-                    data = salt_and_data[SALT_SIZE:]
-            return data, salt
-        d.addCallback(_process_results)
+            data = results[self.shnum]
+            if len(data) != len(segments) + len(runs):
+                raise BadShareError("got %d vectors, not %d"
+                                    % (len(data), len(segments) + len(runs)))
+            blocks = {}
+            for (segnum, block_data) in zip(segments, data):
+                blocks[segnum] = self._parse_block_and_salt([block_data])
+            blockhashes = {}
+            for ((first, count), rawhashes) in zip(runs, data[len(segments):]):
+                if len(rawhashes) != count * HASH_SIZE:
+                    raise BadShareError("block hash tree is truncated")
+                for j in range(count):
+                    blockhashes[first + j] = \
+                        rawhashes[j * HASH_SIZE:(j + 1) * HASH_SIZE]
+            return blocks, blockhashes
+        d.addCallback(_then)
         return d
 
 
@@ -131,6 +131,9 @@ class Publish(object):
         self._running = True
         self._first_write_error = None
         self._last_failure = None
+        # Set by update(); a full publish builds each block hash tree
+        # from scratch.
+        self._old_blockhashes = None
 
         self._status = PublishStatus()
         self._status.set_storage_index(self._storage_index)
@@ -301,6 +304,7 @@ class Publish(object):
             writer.set_checkstring(old_seqnum,
                                    old_root_hash,
                                    old_salt)
+            writer.set_old_offsets(old_offsets_tuple)
 
         # Our remote shares will not have a complete checkstring until
         # after we are done writing share data and have started to write
@@ -313,31 +317,14 @@ class Publish(object):
         # First, we encrypt, encode, and publish the shares that we need
         # to encrypt, encode, and publish.
 
-        # Our update process fetched these for us. We need to update
-        # them in place as publishing happens.
-        self.blockhashes = {} # (shnum, [blochashes])
-        for (i, bht) in list(blockhashes.items()):
-            # We need to extract the leaves from our old hash tree.
-            old_segcount = mathutil.div_ceil(version[4],
-                                             version[3])
-            h = hashtree.IncompleteHashTree(old_segcount)
-            bht = dict(enumerate(bht))
-            h.set_hashes(bht)
-            leaves = h[h.get_leaf_index(0):]
-            for j in range(self.num_segments - len(leaves)):
-                leaves.append(None)
-
-            assert len(leaves) >= self.num_segments
-            self.blockhashes[i] = leaves
-            # This list will now be the leaves that were set during the
-            # initial upload + enough empty hashes to make it a
-            # power-of-two. If we exceed a power of two boundary, we
-            # should be encoding the file over again, and should not be
-            # here. So, we have
-            #assert len(self.blockhashes[i]) == \
-            #    hashtree.roundup_pow2(self.num_segments), \
-            #        len(self.blockhashes[i])
-            # XXX: Except this doesn't work. Figure out why.
+        # Our update process fetched these for us: for each share, as
+        # much of the old block hash tree as we need to work out the new
+        # one. self.blockhashes collects the new leaves as publishing
+        # happens.
+        self._old_blockhashes = blockhashes # shnum -> {hash index: hash}
+        self._old_num_segments = mathutil.div_ceil(version[4], version[3])
+        self._old_datalength = version[4]
+        self.blockhashes = dict((shnum, {}) for shnum in blockhashes)
 
         # These are filled in later, after we've modified the block hash
         # tree suitably.
@@ -810,7 +797,10 @@ class Publish(object):
         self.sharehash_leaves = [None] * len(self.blockhashes)
         self._status.set_status("Building and pushing block hash tree")
         for shnum, blockhashes in list(self.blockhashes.items()):
-            t = hashtree.HashTree(blockhashes)
+            if self._old_blockhashes is not None:
+                self._push_updated_blockhashes(shnum, blockhashes)
+                continue
+            t = hashtree.CompactHashTree(blockhashes)
             self.blockhashes[shnum] = list(t)
             # set the leaf for future use.
             self.sharehash_leaves[shnum] = t[0]
@@ -820,9 +810,50 @@ class Publish(object):
                 writer.put_blockhashes(self.blockhashes[shnum])
 
 
+    def _push_updated_blockhashes(self, shnum, new_leaves):
+        """
+        I work out the new block hash tree of a share that is being
+        updated from its old one and the leaves of the segments that were
+        pushed again, and push as much of it as has to be written.
+        """
+        old_hashes = self._old_blockhashes[shnum]
+        if (hashtree.roundup_pow2(self.num_segments) ==
+            hashtree.roundup_pow2(self._old_num_segments)):
+            # The tree keeps its shape, so only the hashes above the
+            # changed leaves change.
+            changed = hashtree.update_hashes(self.num_segments, old_hashes,
+                                             new_leaves)
+            root = changed.get(0, old_hashes.get(0))
+            if self.datalength == self._old_datalength:
+                # The share is the same size, so the rest of the tree is
+                # still where it should be.
+                for writer in self.writers[shnum]:
+                    writer.put_changed_blockhashes(changed)
+            else:
+                tree = dict(old_hashes)
+                tree.update(changed)
+                tree = [tree[i] for i in range(len(tree))]
+                for writer in self.writers[shnum]:
+                    writer.put_blockhashes(tree)
+        else:
+            # The file has grown past a power of two segments, so the
+            # tree has grown, and is built again from its leaves.
+            first_leaf = hashtree.roundup_pow2(self._old_num_segments) - 1
+            leaves = [old_hashes[first_leaf + i]
+                      for i in range(self._old_num_segments)]
+            leaves += [None] * (self.num_segments - len(leaves))
+            for (segnum, leaf) in new_leaves.items():
+                leaves[segnum] = leaf
+            t = hashtree.CompactHashTree(leaves)
+            root = t[0]
+            for writer in self.writers[shnum]:
+                writer.put_blockhashes(list(t))
+        self.sharehash_leaves[shnum] = root
+
+
     def push_sharehashes(self):
         self._status.set_status("Building and pushing share hash chain")
-        share_hash_tree = hashtree.HashTree(self.sharehash_leaves)
+        share_hash_tree = hashtree.CompactHashTree(self.sharehash_leaves)
         for shnum in range(len(self.sharehash_leaves)):
             needed_indices = share_hash_tree.needed_hashes(shnum)
             self.sharehashes[shnum] = dict( [ (i, share_hash_tree[i])
@@ -282,6 +282,8 @@ class Retrieve(object):
 
     def loop(self):
         d = fireEventually(None) # avoid #237 recursion limit problem
+        # don't fetch anything more once stopped
+        d.addCallback(self._check_for_stopped)
         d.addCallback(lambda ign: self._activate_enough_servers())
         d.addCallback(lambda ign: self._download_current_segment())
         # when we're done, _download_current_segment will call _done. If we
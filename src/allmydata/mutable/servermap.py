@@ -15,7 +15,7 @@ from foolscap.api import DeadReferenceError, RemoteException, eventually, \
                          fireEventually
 from allmydata.crypto.error import BadSignature
 from allmydata.crypto import rsa
-from allmydata.util import base32, hashutil, log, deferredutil
+from allmydata.util import base32, hashutil, log
 from allmydata.util.dictutil import DictOfSets
 from allmydata.storage.server import si_b2a
 from allmydata.interfaces import IServermapUpdaterStatus
@@ -126,10 +126,10 @@ class ServerMap(object):
         self._last_update_mode = None
         self._last_update_time = 0
         self.proxies = {}
-        self.update_data = {} # shnum -> [(verinfo,(blockhashes,start,end)),..]
-        # where blockhashes is a list of bytestrings (the result of
-        # layout.MDMFSlotReadProxy.get_blockhashes), and start/end are both
-        # (block,salt) tuple-of-bytestrings from get_block_and_salt()
+        self.update_data = {} # shnum -> [(verinfo,(blocks,blockhashes)),..]
+        # where blocks maps segnum to a (block,salt) tuple-of-bytestrings
+        # and blockhashes maps hash index to hash (the results of
+        # layout.MDMFSlotReadProxy.get_update_data)
 
     def copy(self):
         s = ServerMap()
@@ -387,10 +387,17 @@ class ServerMap(object):
 
 class ServermapUpdater(object):
     def __init__(self, filenode, storage_broker, monitor, servermap,
-                 mode=MODE_READ, add_lease=False, update_range=None):
+                 mode=MODE_READ, add_lease=False, update_segments=None,
+                 update_blockhashes=None):
         """I update a servermap, locating a sufficient number of useful
         shares and remembering where they are located.
 
+        In MODE_WRITE, if update_segments is given, I also fetch what an
+        in-place update of an MDMF file needs from each share: the blocks
+        of those segments (only from the first k shares, which are the
+        cheapest to decode and all that is needed), and the block hashes
+        in update_blockhashes (or the whole block hash tree, if that is
+        None).
         """
 
         self._node = filenode
@@ -442,14 +449,12 @@ class ServermapUpdater(object):
         # publish.
 
         self.fetch_update_data = False
-        if mode == MODE_WRITE and update_range:
+        if mode == MODE_WRITE and update_segments is not None:
             # We're updating the servermap in preparation for an
             # in-place file update, so we need to fetch some additional
             # data from each share that we find.
-            assert len(update_range) == 2
-
-            self.start_segment = update_range[0]
-            self.end_segment = update_range[1]
+            self.update_segments = update_segments
+            self.update_blockhashes = update_blockhashes
             self.fetch_update_data = True
 
         prefix = si_b2a(self._storage_index)[:5]
@@ -741,20 +746,10 @@ class ServermapUpdater(object):
 
 
             if self.fetch_update_data:
-                # fetch the block hash tree and first + last segment, as
-                # configured earlier.
-                # Then set them in wherever we happen to want to set
-                # them.
-                ds = []
-                # XXX: We do this above, too. Is there a good way to
-                # make the two routines share the value without
-                # introducing more roundtrips?
-                ds.append(reader.get_verinfo())
-                ds.append(reader.get_blockhashes())
-                ds.append(reader.get_block_and_salt(self.start_segment))
-                ds.append(reader.get_block_and_salt(self.end_segment))
-                d5 = deferredutil.gatherResults(ds)
-                d5.addCallback(self._got_update_results_one_share, shnum)
+                # fetch the parts of the block hash tree and the
+                # boundary segments, as configured earlier, in one read.
+                d5 = reader.get_verinfo()
+                d5.addCallback(self._fetch_update_data, reader, shnum)
             else:
                 d5 = defer.succeed(None)
 
@@ -921,17 +916,22 @@ class ServermapUpdater(object):
                    offsets_tuple)
         return verinfo
 
-    def _got_update_results_one_share(self, results, share):
+    def _fetch_update_data(self, verinfo, reader, shnum):
         """
-        I record the update results in results.
+        I fetch what an in-place update needs from one share, and record
+        it in the servermap.
         """
-        assert len(results) == 4
-        verinfo, blockhashes, start, end = results
-        verinfo = self._make_verinfo_hashable(verinfo)
-        update_data = (blockhashes, start, end)
-        self._servermap.set_update_data_for_share_and_verinfo(share,
-                                                              verinfo,
-                                                              update_data)
+        k = verinfo[5]
+        if shnum < k:
+            segments = self.update_segments
+        else:
+            segments = ()
+        d = reader.get_update_data(segments, self.update_blockhashes)
+        def _got(update_data):
+            self._servermap.set_update_data_for_share_and_verinfo(
+                shnum, self._make_verinfo_hashable(verinfo), update_data)
+        d.addCallback(_got)
+        return d
 
     def _deserialize_pubkey(self, pubkey_s):
         verifier = rsa.create_verifying_key_from_string(pubkey_s)
@@ -0,0 +1,121 @@
+"""
+A client-wide cache of recently used mutable file and directory nodes.
+
+``NodeMaker`` only keeps weak references to the mutable nodes it makes, so
+a node is dropped as soon as the request that used it is finished, and with
+it everything it learned: the keys derived from its cap, the servermap of
+the mutable file, the unpacked children of a directory.  The next request
+for the same cap starts again from nothing.  ``NodeCache`` keeps strong
+references to the most recently used nodes, bounded both by how many there
+are and by a rough estimate of how much memory they use.
+
+Immutable file nodes are never reused (see ticket #1679); their segments
+can be kept by ``allmydata.immutable.downloader.cache.SegmentCache``
+instead.
+
+The estimate is only rough: every node is counted as ``NODE_OVERHEAD``
+bytes, and a directory also as what it keeps of the children it last read
+(see ``DirectoryNode.estimate_memory``), which grows as more of them are
+unpacked.  A node's size is estimated again each time it is used, since a
+directory node made from a cap knows nothing of its children until it is
+read.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+
+from zope.interface import implementer
+
+from allmydata.interfaces import IStatsProducer, IDirectoryNode
+
+DEFAULT_NODE_CACHE_MAX_ENTRIES = 1000
+DEFAULT_NODE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# What a node with no contents of its own is counted as, including its caps,
+# keys and servermap.
+NODE_OVERHEAD = 4096
+
+
+def _estimate_size(node) -> int:
+    size = NODE_OVERHEAD
+    if IDirectoryNode.providedBy(node):
+        size += node.estimate_memory()
+    return size
+
+
+@implementer(IStatsProducer)
+class NodeCache(object):
+    """
+    An LRU of mutable filesystem nodes, keyed by the cap they were made from,
+    bounded by their number and estimated total size.
+
+    :ivar max_entries: The most nodes to keep.
+    :ivar max_bytes: The most estimated node memory to keep.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_NODE_CACHE_MAX_ENTRIES,
+                 max_bytes: int = DEFAULT_NODE_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # key -> (node, estimated size), least recently used first:
+        self._nodes: OrderedDict[bytes, tuple[object, int]] = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def hit(self) -> None:
+        """
+        Count a node found without making a new one, whether it came from
+        here or was still in use elsewhere.
+        """
+        self._hits += 1
+
+    def miss(self) -> None:
+        """
+        Count a node which had to be made from scratch.
+        """
+        self._misses += 1
+
+    def get(self, key: bytes):
+        """
+        Return the node remembered for ``key``, or ``None``.
+        """
+        entry = self._nodes.get(key)
+        if entry is None:
+            return None
+        self.add(key, entry[0])
+        return entry[0]
+
+    def add(self, key: bytes, node) -> None:
+        """
+        Remember ``node`` as the most recently used, and forget the least
+        recently used nodes until the cache is within its bounds again.
+        """
+        old = self._nodes.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        size = _estimate_size(node)
+        if size > self.max_bytes or self.max_entries < 1:
+            return
+        self._nodes[key] = (node, size)
+        self._bytes += size
+        while len(self._nodes) > self.max_entries or self._bytes > self.max_bytes:
+            (_, (_, evicted)) = self._nodes.popitem(last=False)
+            self._bytes -= evicted
+            self._evictions += 1
+
+    def get_stats(self) -> dict[str, float]:
+        lookups = self._hits + self._misses
+        return {
+            "nodemaker.node_cache.hits": self._hits,
+            "nodemaker.node_cache.misses": self._misses,
+            "nodemaker.node_cache.hit_rate": self._hits / lookups if lookups else 0.0,
+            "nodemaker.node_cache.evictions": self._evictions,
+            "nodemaker.node_cache.entries": len(self._nodes),
+            "nodemaker.node_cache.bytes": self._bytes,
+        }
@@ -12,7 +12,10 @@ from allmydata.interfaces import INodeMaker
 from allmydata.immutable.literal import LiteralFileNode
 from allmydata.immutable.filenode import ImmutableFileNode, CiphertextFileNode
 from allmydata.immutable.upload import Data
-from allmydata.mutable.filenode import MutableFileNode
+from allmydata.mutable.filenode import (
+    MutableFileNode,
+    DEFAULT_SERVERMAP_CACHE_TTL,
+)
 from allmydata.mutable.publish import MutableData
 from allmydata.dirnode import DirectoryNode, pack_children
 from allmydata.unknown import UnknownNode
@@ -27,7 +30,9 @@ class NodeMaker(object):
     def __init__(self, storage_broker, secret_holder, history,
                  uploader, terminator,
                  default_encoding_parameters, mutable_file_default,
-                 key_generator, blacklist=None):
+                 key_generator, blacklist=None, segment_cache=None,
+                 servermap_cache_ttl=DEFAULT_SERVERMAP_CACHE_TTL,
+                 optimistic_mutable_reads=False, node_cache=None):
         self.storage_broker = storage_broker
         self.secret_holder = secret_holder
         self.history = history
@@ -37,21 +42,31 @@ class NodeMaker(object):
         self.mutable_file_default = mutable_file_default
         self.key_generator = key_generator
         self.blacklist = blacklist
+        self.segment_cache = segment_cache
+        self.servermap_cache_ttl = servermap_cache_ttl
+        self.optimistic_mutable_reads = optimistic_mutable_reads
 
         self._node_cache = weakref.WeakValueDictionary() # uri -> node
+        # keeps recently used nodes alive after everything else is done with
+        # them, if given
+        self.node_cache = node_cache
 
     def _create_lit(self, cap):
         return LiteralFileNode(cap)
     def _create_immutable(self, cap):
         return ImmutableFileNode(cap, self.storage_broker, self.secret_holder,
-                                 self.terminator, self.history)
+                                 self.terminator, self.history,
+                                 self.segment_cache)
     def _create_immutable_verifier(self, cap):
         return CiphertextFileNode(cap, self.storage_broker, self.secret_holder,
-                                  self.terminator, self.history)
+                                  self.terminator, self.history,
+                                  self.segment_cache)
     def _create_mutable(self, cap):
         n = MutableFileNode(self.storage_broker, self.secret_holder,
                             self.default_encoding_parameters,
-                            self.history)
+                            self.history,
+                            self.servermap_cache_ttl,
+                            self.optimistic_mutable_reads)
         return n.init_from_cap(cap)
     def _create_dirnode(self, filenode):
         return DirectoryNode(filenode, self, self.uploader)
@@ -74,9 +89,18 @@ class NodeMaker(object):
             memokey = b"I" + bigcap
         else:
             memokey = b"M" + bigcap
-        try:
-            node = self._node_cache[memokey]
-        except KeyError:
+        node = self._node_cache.get(memokey)
+        if self.node_cache is not None:
+            if node is None:
+                node = self.node_cache.get(memokey)
+                if node is not None and node.is_mutable():
+                    self._node_cache[memokey] = node
+            else:
+                # still in use elsewhere, and now used again
+                self.node_cache.add(memokey, node)
+            if node is not None:
+                self.node_cache.hit()
+        if node is None:
             cap = uri.from_string(bigcap, deep_immutable=deep_immutable,
                                   name=name)
             node = self._create_from_single_cap(cap)
@@ -90,6 +114,9 @@ class NodeMaker(object):
                                    deep_immutable=deep_immutable, name=name)
             elif node.is_mutable():
                 self._node_cache[memokey] = node  # note: WeakValueDictionary
+                if self.node_cache is not None:
+                    self.node_cache.miss()
+                    self.node_cache.add(memokey, node)
 
         if self.blacklist:
             si = node.get_storage_index()
@@ -126,7 +153,9 @@ class NodeMaker(object):
         if version is None:
             version = self.mutable_file_default
         n = MutableFileNode(self.storage_broker, self.secret_holder,
-                            self.default_encoding_parameters, self.history)
+                            self.default_encoding_parameters, self.history,
+                            self.servermap_cache_ttl,
+                            self.optimistic_mutable_reads)
         if keypair is None:
             d = self.key_generator.generate()
         else:
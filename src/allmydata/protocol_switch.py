@@ -20,7 +20,6 @@ from typing import cast
 
 from twisted.internet.protocol import Protocol
 from twisted.internet.interfaces import IDelayedCall, IReactorFromThreads
-from twisted.internet.ssl import CertificateOptions
 from twisted.web.server import Site
 from twisted.protocols.tls import TLSMemoryBIOFactory
 from twisted.internet import reactor
@@ -29,7 +28,7 @@ from hyperlink import DecodedURL
 from foolscap.negotiate import Negotiation
 from foolscap.api import Tub
 
-from .storage.http_server import HTTPServer, build_nurl
+from .storage.http_server import HTTPServer, build_nurl, server_certificate_options
 from .storage.server import StorageServer
 
 
@@ -85,9 +84,9 @@ class _FoolscapOrHttps(Protocol, metaclass=_PretendToBeNegotiation):
 
         # Tub.myCertificate is a twisted.internet.ssl.PrivateCertificate
         # instance.
-        certificate_options = CertificateOptions(
-            privateKey=cls.tub.myCertificate.privateKey.original,
-            certificate=cls.tub.myCertificate.original,
+        certificate_options = server_certificate_options(
+            cls.tub.myCertificate.privateKey.original,
+            cls.tub.myCertificate.original,
         )
 
         http_storage_server = HTTPServer(cast(IReactorFromThreads, reactor), storage_server, swissnum)
@@ -15,6 +15,7 @@ from allmydata.scripts.common import (
 from allmydata.storage import (
     crawler,
     expirer,
+    shareindex,
 )
 from allmydata.scripts.types_ import SubCommands
 from allmydata.client import read_config
@@ -90,6 +91,27 @@ class MigrateCrawlerOptions(BasedirOptions):
         return t
 
 
+class RebuildShareIndexOptions(BasedirOptions):
+    optFlags = [
+        ("verify", None, "Only compare the index against the share files, "
+         "reporting any differences, without changing it."),
+    ]
+
+    def getSynopsis(self):
+        return "Usage: tahoe [global-options] admin rebuild-share-index [--verify]"
+
+    def getUsage(self, width=None):
+        t = BasedirOptions.getUsage(self, width)
+        t += (
+            "Rebuild the storage server's share index"
+            " (storage/share_index.sqlite) from the share files, or with"
+            " --verify check it against them.\n\nRebuilding should only be"
+            " done while the node is stopped.  A rebuilt index is used as"
+            " soon as the node is started with [storage]share_index = true."
+        )
+        return t
+
+
 class AddGridManagerCertOptions(BaseOptions):
     """
     Options for add-grid-manager-cert
@@ -170,6 +192,38 @@ def migrate_crawler(options):
                 print("Not found: '{}'".format(fp.path), file=out)
 
 
+def rebuild_share_index(options):
+    out = options.stdout
+    storage = FilePath(options['basedir']).child("storage")
+    sharedir = storage.child("shares")
+    if not sharedir.isdir():
+        print("No share directory at '{}'".format(sharedir.path),
+              file=options.stderr)
+        return 1
+    index_path = storage.child(shareindex.SHARE_INDEX_FILENAME)
+    if options["verify"] and not index_path.exists():
+        print("No share index at '{}'".format(index_path.path),
+              file=options.stderr)
+        return 1
+    index = shareindex.ShareIndex(index_path.path)
+    try:
+        if options["verify"]:
+            problems = shareindex.verify(index, sharedir.path)
+            for problem in problems:
+                print(problem, file=out)
+            if problems:
+                print("{} problems found".format(len(problems)), file=out)
+                return 1
+            print("Share index is accurate", file=out)
+            return 0
+        count = shareindex.rebuild(index, sharedir.path)
+        print("Indexed {} buckets in '{}'".format(count, index_path.path),
+              file=out)
+        return 0
+    finally:
+        index.close()
+
+
 def add_grid_manager_cert(options):
     """
     Add a new Grid Manager certificate to our config
@@ -216,6 +270,8 @@ class AdminCommand(BaseOptions):
          "Derive a public key from a private key."),
         ("migrate-crawler", None, MigrateCrawlerOptions,
          "Write the crawler-history data as JSON."),
+        ("rebuild-share-index", None, RebuildShareIndexOptions,
+         "Rebuild or verify the storage server's share index."),
         ("add-grid-manager-cert", None, AddGridManagerCertOptions,
          "Add a Grid Manager-provided certificate to a storage "
          "server's config."),
@@ -238,6 +294,7 @@ subDispatch = {
     "generate-keypair": print_keypair,
     "derive-pubkey": derive_pubkey,
     "migrate-crawler": migrate_crawler,
+    "rebuild-share-index": rebuild_share_index,
     "add-grid-manager-cert": add_grid_manager_cert,
 }
 
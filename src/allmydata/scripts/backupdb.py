@@ -2,7 +2,8 @@
 Ported to Python 3.
 """
 
-import os.path, sys, time, random, stat
+import os.path, sys, time, random, stat, threading
+from functools import wraps
 
 from allmydata.util.netstring import netstring
 from allmydata.util.hashutil import backupdb_dirhash
@@ -73,13 +74,23 @@ def get_backupdb(dbfile, stderr=sys.stderr,
     # exist.
     try:
         (sqlite3, db) = get_db(dbfile, stderr, create_version, updaters=UPDATERS,
-                               just_create=just_create, dbname="backupdb")
+                               just_create=just_create, dbname="backupdb",
+                               check_same_thread=False)
         return BackupDB_v2(sqlite3, db)
     except DBError as e:
         print(e, file=stderr)
         return None
 
 
+def _serialized(method):
+    # 'tahoe backup --jobs' uses the database from several threads
+    @wraps(method)
+    def serialized(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return serialized
+
+
 class FileResult(object):
     def __init__(self, bdb, filecap, should_check,
                  path, mtime, ctime, size):
@@ -139,7 +150,9 @@ class BackupDB_v2(object):
         self.sqlite_module = sqlite_module
         self.connection = connection
         self.cursor = connection.cursor()
+        self._lock = threading.RLock()
 
+    @_serialized
     def check_file(self, path, use_timestamps=True):
         """I will tell you if a given local file needs to be uploaded or not,
         by looking in a database and seeing if I have a record of this file
@@ -176,53 +189,88 @@ class BackupDB_v2(object):
         """
 
         path = abspath_expanduser_unicode(path)
-
         # TODO: consider using get_pathinfo.
         s = os.stat(path)
-        size = s[stat.ST_SIZE]
-        ctime = s[stat.ST_CTIME]
-        mtime = s[stat.ST_MTIME]
+        return self._check_files([(path, s)], use_timestamps)[path]
+
+    @_serialized
+    def check_files(self, paths, use_timestamps=True):
+        """I am like check_file(), but look up a batch of files at once, in
+        a single query and transaction.
 
+        I return a dictionary mapping each path (as given) to its
+        FileResults object. Files which can't be stat'ed are left out, so
+        the caller will find out what's wrong with them when it tries to
+        upload them.
+        """
+        stats = []
+        abspaths = {}
+        for path in paths:
+            abspath = abspath_expanduser_unicode(path)
+            try:
+                s = os.stat(abspath)
+            except EnvironmentError:
+                continue
+            stats.append((abspath, s))
+            abspaths[path] = abspath
+        results = {}
+        # stay well inside SQLite's limit on the number of parameters
+        for i in range(0, len(stats), 500):
+            results.update(self._check_files(stats[i:i+500], use_timestamps))
+        return {path: results[abspath] for (path, abspath) in abspaths.items()}
+
+    def _check_files(self, stats, use_timestamps):
         now = time.time()
         c = self.cursor
-
-        c.execute("SELECT size,mtime,ctime,fileid"
+        c.execute("SELECT local_files.path, local_files.size,"
+                  " local_files.mtime, local_files.ctime,"
+                  " caps.filecap, last_upload.last_checked"
                   " FROM local_files"
-                  " WHERE path=?",
-                  (path,))
-        row = self.cursor.fetchone()
-        if not row:
-            return FileResult(self, None, False, path, mtime, ctime, size)
-        (last_size,last_mtime,last_ctime,last_fileid) = row
-
-        c.execute("SELECT caps.filecap, last_upload.last_checked"
-                  " FROM caps,last_upload"
-                  " WHERE caps.fileid=? AND last_upload.fileid=?",
-                  (last_fileid, last_fileid))
-        row2 = c.fetchone()
-
-        if ((last_size != size
-             or not use_timestamps
-             or last_mtime != mtime
-             or last_ctime != ctime) # the file has been changed
-            or (not row2) # we somehow forgot where we put the file last time
-            ):
-            c.execute("DELETE FROM local_files WHERE path=?", (path,))
+                  " LEFT JOIN caps ON caps.fileid=local_files.fileid"
+                  " LEFT JOIN last_upload ON last_upload.fileid=local_files.fileid"
+                  " WHERE local_files.path IN (%s)" % ",".join("?" * len(stats)),
+                  [path for (path, s) in stats])
+        rows = {row[0]: row[1:] for row in c.fetchall()}
+
+        results = {}
+        changed = []
+        for (path, s) in stats:
+            size = s[stat.ST_SIZE]
+            ctime = s[stat.ST_CTIME]
+            mtime = s[stat.ST_MTIME]
+            row = rows.get(path)
+            if not row:
+                results[path] = FileResult(self, None, False, path, mtime, ctime, size)
+                continue
+            (last_size, last_mtime, last_ctime, filecap, last_checked) = row
+
+            if ((last_size != size
+                 or not use_timestamps
+                 or last_mtime != mtime
+                 or last_ctime != ctime) # the file has been changed
+                or filecap is None or last_checked is None # we somehow forgot where we put the file last time
+                ):
+                changed.append((path,))
+                results[path] = FileResult(self, None, False, path, mtime, ctime, size)
+                continue
+
+            # at this point, we're allowed to assume the file hasn't been changed
+            age = now - last_checked
+
+            probability = ((age - self.NO_CHECK_BEFORE) /
+                           (self.ALWAYS_CHECK_AFTER - self.NO_CHECK_BEFORE))
+            probability = min(max(probability, 0.0), 1.0)
+            should_check = bool(random.random() < probability)
+
+            results[path] = FileResult(self, to_bytes(filecap), should_check,
+                                       path, mtime, ctime, size)
+
+        if changed:
+            c.executemany("DELETE FROM local_files WHERE path=?", changed)
             self.connection.commit()
-            return FileResult(self, None, False, path, mtime, ctime, size)
-
-        # at this point, we're allowed to assume the file hasn't been changed
-        (filecap, last_checked) = row2
-        age = now - last_checked
-
-        probability = ((age - self.NO_CHECK_BEFORE) /
-                       (self.ALWAYS_CHECK_AFTER - self.NO_CHECK_BEFORE))
-        probability = min(max(probability, 0.0), 1.0)
-        should_check = bool(random.random() < probability)
-
-        return FileResult(self, to_bytes(filecap), should_check,
-                          path, mtime, ctime, size)
+        return results
 
+    @_serialized
     def get_or_allocate_fileid_for_cap(self, filecap):
         # find an existing fileid for this filecap, or insert a new one. The
         # caller is required to commit() afterwards.
@@ -243,6 +291,7 @@ class BackupDB_v2(object):
         fileid = foundrow[0]
         return fileid
 
+    @_serialized
     def did_upload_file(self, filecap, path, mtime, ctime, size):
         now = time.time()
         fileid = self.get_or_allocate_fileid_for_cap(filecap)
@@ -264,6 +313,7 @@ class BackupDB_v2(object):
                                 (size, mtime, ctime, fileid, path))
         self.connection.commit()
 
+    @_serialized
     def did_check_file_healthy(self, filecap, results):
         now = time.time()
         fileid = self.get_or_allocate_fileid_for_cap(filecap)
@@ -273,6 +323,7 @@ class BackupDB_v2(object):
                             (now, fileid))
         self.connection.commit()
 
+    @_serialized
     def check_directory(self, contents):
         """I will tell you if a new directory needs to be created for a given
         set of directory contents, or if I know of an existing (immutable)
@@ -325,6 +376,7 @@ class BackupDB_v2(object):
 
         return DirectoryResult(self, dirhash_s, to_bytes(dircap), should_check)
 
+    @_serialized
     def did_create_directory(self, dircap, dirhash):
         now = time.time()
         # if the dirhash is already present (i.e. we've re-uploaded an
@@ -334,6 +386,7 @@ class BackupDB_v2(object):
                             (dirhash, dircap, now, now))
         self.connection.commit()
 
+    @_serialized
     def did_check_directory_healthy(self, dircap, results):
         now = time.time()
         self.cursor.execute("UPDATE directories"
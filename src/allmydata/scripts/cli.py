@@ -16,6 +16,13 @@ NODEURL_RE=re.compile("http(s?)://([^:]*)(:([1-9][0-9]*))?")
 
 _default_nodedir = get_default_nodedir()
 
+def _jobs(value):
+    jobs = int(value)
+    if jobs < 1:
+        raise ValueError("--jobs must be at least 1")
+    return jobs
+_jobs.coerceDoc = "Must be at least 1." # type: ignore
+
 class FileStoreOptions(BaseOptions):
     optParameters : Parameters = [
         ["node-url", "u", None,
@@ -231,6 +238,9 @@ class CpOptions(FileStoreOptions):
          "When copying to local files, write out filecaps instead of actual "
          "data (only useful for debugging and tree-comparison purposes)."),
         ]
+    optParameters = [
+        ("jobs", "j", 1, "Copy up to this many files at once.", _jobs),
+        ]
 
     def parseArgs(self, *args):
         if len(args) < 2:
@@ -333,6 +343,9 @@ class BackupOptions(FileStoreOptions):
         ("verbose", "v", "Be noisy about what is happening."),
         ("ignore-timestamps", None, "Do not use backupdb timestamps to decide whether a local file is unchanged."),
         ]
+    optParameters = [
+        ("jobs", "j", 1, "Upload up to this many files at once.", _jobs),
+        ]
 
     vcs_patterns = ('CVS', 'RCS', 'SCCS', '.git', '.gitignore', '.cvsignore',
                     '.svn', '.arch-ids','{arch}', '=RELEASE-ID',
@@ -472,6 +485,29 @@ class DeepCheckOptions(FileStoreOptions):
     (which must be a directory), like 'tahoe check' but for multiple files.
     Optionally repair any problems found."""
 
+def _shards(value):
+    shards = int(value)
+    if shards < 1:
+        raise ValueError("--shards must be at least 1")
+    return shards
+_shards.coerceDoc = "Must be at least 1." # type: ignore
+
+class ShardOptions(FileStoreOptions):
+    optParameters = [
+        ("shards", None, None, "Spread the children across this many shards "
+         "(default: about one per thousand children).", _shards),
+        ]
+    def parseArgs(self, where):
+        self.where = argv_to_unicode(where)
+
+    synopsis = "[options] REMOTE_DIR"
+    description = """
+    Convert a large mutable directory into a sharded directory, whose
+    children are kept in several smaller directories (shards) so that
+    changing one of them doesn't rewrite the whole directory. The directory
+    keeps its caps. Clients older than this version of Tahoe can't read a
+    sharded directory."""
+
 subCommands : SubCommands = [
     ("mkdir", None, MakeDirectoryOptions, "Create a new directory."),
     ("add-alias", None, AddAliasOptions, "Add a new alias cap."),
@@ -490,6 +526,7 @@ subCommands : SubCommands = [
     ("stats", None, StatsOptions, "Print statistics about all files/directories in a subtree."),
     ("check", None, CheckOptions, "Check a single file or directory."),
     ("deep-check", None, DeepCheckOptions, "Check all files/directories reachable from a starting point."),
+    ("shard", None, ShardOptions, "Convert a large directory into a sharded directory."),
     ("status", None, TahoeStatusCommand, "Various status information."),
     ]
 
@@ -590,6 +627,11 @@ def deepcheck(options):
     rc = tahoe_check.deepcheck(options)
     return rc
 
+def shard(options):
+    from allmydata.scripts import tahoe_shard
+    rc = tahoe_shard.shard(options)
+    return rc
+
 def status(options):
     from allmydata.scripts import tahoe_status
     return tahoe_status.do_status(options)
@@ -613,5 +655,6 @@ dispatch = {
     "stats": stats,
     "check": check,
     "deep-check": deepcheck,
+    "shard": shard,
     "status": status,
     }
@@ -4,10 +4,12 @@
 Ported to Python 3.
 """
 
-from typing import Union, Optional
+from typing import Union, Optional, Callable, Iterable, Iterator, TypeVar
 
 import os, sys, textwrap
 import codecs
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from os.path import join
 import urllib.parse
 
@@ -23,6 +25,9 @@ from allmydata.util.encodingutil import quote_output, \
 from allmydata.scripts.default_nodedir import _default_nodedir
 from .types_ import Parameters
 
+T = TypeVar("T")
+R = TypeVar("R")
+
 
 def get_default_nodedir():
     return _default_nodedir
@@ -288,3 +293,36 @@ def escape_path(path: Union[str, bytes]) -> str:
         "ascii"
     )
     return result
+
+
+def map_in_order(f: Callable[[T], R], items: Iterable[T], jobs: int) -> Iterator[R]:
+    """
+    Like ``map(f, items)``, but make up to ``jobs`` calls to ``f`` at once,
+    in worker threads.
+
+    Results are still produced in the order of ``items``, so callers can
+    report them in the same order as a serial run would, and ``f`` is never
+    called more than ``2 * jobs`` items ahead of the result being consumed.
+    If a call raises an exception it is raised here in place of its result,
+    and the calls that haven't started yet are abandoned.
+    """
+    if jobs <= 1:
+        yield from map(f, items)
+        return
+    items = iter(items)
+    pending: deque = deque()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        try:
+            while True:
+                while len(pending) < 2 * jobs:
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        break
+                    pending.append(executor.submit(f, item))
+                if not pending:
+                    return
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
@@ -3,6 +3,8 @@ Blocking HTTP client APIs.
 """
 
 import os
+import threading
+from collections import defaultdict
 from io import BytesIO
 from http import client as http_client
 import urllib
@@ -40,6 +42,85 @@ class BadResponse(object):
         return ""
 
 
+class ConnectionPool(object):
+    """
+    Keep-alive connections to the web API, for reuse by every request made
+    by one CLI command.
+
+    A connection goes back into the pool only once the response to its last
+    request has been read to the end (or the server closed it).  Requests can
+    be made from several threads at once; each one gets a connection of its
+    own.
+
+    :ivar max_idle: How many idle connections to keep for each server.
+    """
+
+    def __init__(self, max_idle=8):
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        # (scheme, host, port) -> [(connection, last response)]
+        self._connections = defaultdict(list)
+
+    def get_connection(self, scheme, host, port, timeout):
+        """
+        Return a connection to the given server, and whether it has been
+        used before.
+        """
+        key = (scheme, host, port)
+        with self._lock:
+            connections = self._connections[key]
+            for i, (c, resp) in enumerate(connections):
+                if resp is None or resp.isclosed():
+                    del connections[i]
+                    return c, True
+        if scheme == "http":
+            c = http_client.HTTPConnection(host, port, timeout=timeout, blocksize=65536)
+        elif scheme == "https":
+            c = http_client.HTTPSConnection(host, port, timeout=timeout, blocksize=65536)
+        else:
+            raise ValueError("unknown scheme '%s', need http or https" % scheme)
+        return c, False
+
+    def put_connection(self, scheme, host, port, c, resp):
+        """
+        Return a connection to the pool.  It will not be reused until
+        ``resp`` has been read.
+        """
+        with self._lock:
+            connections = self._connections[(scheme, host, port)]
+            connections.append((c, resp))
+            if len(connections) > self.max_idle:
+                # Forget the oldest one.  If its response is still being
+                # read the connection closes once that's done with.
+                connections.pop(0)
+
+    def close(self):
+        """
+        Close every connection in the pool.
+        """
+        with self._lock:
+            connections = self._connections
+            self._connections = defaultdict(list)
+        for pooled in connections.values():
+            for (c, resp) in pooled:
+                c.close()
+
+
+_pool = ConnectionPool()
+
+# Requests which can be made again when a reused connection fails after they
+# were sent, because the server doing them twice does no harm.
+_RETRYABLE_METHODS = frozenset(["GET", "HEAD"])
+
+
+def close_connections():
+    """
+    Close the connections kept open by ``do_http``.  The CLI does this when
+    each command is done.
+    """
+    _pool.close()
+
+
 def do_http(method, url, body=b""):
     if isinstance(body, bytes):
         body = BytesIO(body)
@@ -60,17 +141,44 @@ def do_http(method, url, body=b""):
     if timeout is not None:
         timeout = float(timeout)
 
-    if scheme == "http":
-        c = http_client.HTTPConnection(host, port, timeout=timeout, blocksize=65536)
-    elif scheme == "https":
-        c = http_client.HTTPSConnection(host, port, timeout=timeout, blocksize=65536)
-    else:
-        raise ValueError("unknown scheme '%s', need http or https" % scheme)
+    start = body.tell()
+    c, reused = _pool.get_connection(scheme, host, port, timeout)
+    sent = False
+    try:
+        resp = _send_request(c, method, url, host, path, body)
+        if resp is None:
+            sent = True
+            resp = c.getresponse()
+    except ConnectionError:
+        # If the whole request went out, the server may have acted on it
+        # before the connection failed, and doing it again may not be safe.
+        if not reused or (sent and method not in _RETRYABLE_METHODS):
+            raise
+        resp = None
+    if reused and (resp is None or isinstance(resp, BadResponse)):
+        # The server may have closed the connection while it was idle, so
+        # try once more on a new one.
+        c.close()
+        body.seek(start)
+        resp = _send_request(c, method, url, host, path, body)
+        if resp is None:
+            resp = c.getresponse()
+    if not isinstance(resp, BadResponse):
+        _pool.put_connection(scheme, host, port, c, resp)
+    return resp
+
+
+def _send_request(c, method, url, host, path, body):
+    """
+    Send a request, without waiting for the response.
+
+    :return: A ``BadResponse`` if the headers could not be sent, otherwise
+        ``None``.
+    """
     c.putrequest(method, path)
     c.putheader("Hostname", host)
     c.putheader("User-Agent", allmydata.__full_version__ + " (tahoe-client)")
     c.putheader("Accept", "text/plain, application/octet-stream")
-    c.putheader("Connection", "close")
 
     old = body.tell()
     body.seek(0, os.SEEK_END)
@@ -88,8 +196,7 @@ def do_http(method, url, body=b""):
         if not data:
             break
         c.send(data)
-
-    return c.getresponse()
+    return None
 
 
 def format_http_success(resp):
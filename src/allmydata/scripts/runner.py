@@ -6,6 +6,7 @@ from twisted.python import usage
 from twisted.internet import defer, task, threads
 
 from allmydata.scripts.common import get_default_nodedir
+from allmydata.scripts.common_http import close_connections
 from allmydata.scripts import debug, create_node, cli, \
     admin, tahoe_run, tahoe_invite
 from allmydata.scripts.types_ import SubCommands
@@ -179,7 +180,7 @@ def dispatch(config,
     elif command in cli.dispatch:
         # these are blocking, and must be run in a thread
         f0 = cli.dispatch[command]
-        f = lambda so: threads.deferToThread(f0, so)
+        f = lambda so: threads.deferToThread(_run_cli_command, f0, so)
     elif command in tahoe_invite.dispatch:
         f = tahoe_invite.dispatch[command]
     else:
@@ -196,6 +197,13 @@ def dispatch(config,
     d.addCallback(_raise_sys_exit)
     return d
 
+def _run_cli_command(f, so):
+    try:
+        return f(so)
+    finally:
+        # the web API connections are only shared within one command
+        close_connections()
+
 def _maybe_enable_eliot_logging(options, reactor):
     if options.get("destinations"):
         service = eliot_logging_service(reactor, options["destinations"])
@@ -4,11 +4,12 @@ Ported to Python 3.
 
 import os.path
 import time
+import threading
 from urllib.parse import quote as url_quote
 import datetime
 
 from allmydata.scripts.common import get_alias, escape_path, DEFAULT_ALIAS, \
-                                     UnknownAliasError
+                                     UnknownAliasError, map_in_order
 from allmydata.scripts.common_http import do_http, HTTPError, format_http_error
 from allmydata.util import time_format, jsonbytes as json
 from allmydata.scripts import backupdb
@@ -72,6 +73,10 @@ class BackerUpper(object):
         self.options = options
         self._files_checked = 0
         self._directories_checked = 0
+        # files are checked from worker threads with --jobs
+        self._lock = threading.Lock()
+        # holds the verbose messages of uploads running in worker threads
+        self._output = threading.local()
 
     def run(self):
         options = self.options
@@ -131,6 +136,9 @@ class BackerUpper(object):
             targets=targets,
             start_timestamp=start_timestamp,
             stdout=stdout,
+            jobs=options["jobs"],
+            upload_file_ahead=self.upload_ahead,
+            lookup_files=self.lookup_files,
         )
         new_backup_dircap = completed.dircap
 
@@ -155,7 +163,11 @@ class BackerUpper(object):
     def verboseprint(self, msg):
         precondition(isinstance(msg, str), msg)
         if self.verbosity >= 2:
-            print(msg, file=self.options.stdout)
+            messages = getattr(self._output, "messages", None)
+            if messages is not None:
+                messages.append(msg)
+            else:
+                print(msg, file=self.options.stdout)
 
     def warn(self, msg):
         precondition(isinstance(msg, str), msg)
@@ -175,11 +187,24 @@ class BackerUpper(object):
             return False, r.was_created()
 
 
-    def check_backupdb_file(self, childpath):
+    def lookup_files(self, childpaths):
+        """
+        Look up a batch of files in the backupdb.
+
+        :return: A dict mapping each of ``childpaths`` which the backupdb
+            could look up to its ``FileResult``.
+        """
         if not self.backupdb:
-            return True, None
+            return {}
         use_timestamps = not self.options["ignore-timestamps"]
-        r = self.backupdb.check_file(childpath, use_timestamps)
+        return self.backupdb.check_files(childpaths, use_timestamps)
+
+    def check_backupdb_file(self, childpath, r=None):
+        if not self.backupdb:
+            return True, None
+        if r is None:
+            use_timestamps = not self.options["ignore-timestamps"]
+            r = self.backupdb.check_file(childpath, use_timestamps)
 
         if not r.was_uploaded():
             return True, r
@@ -194,7 +219,8 @@ class BackerUpper(object):
         self.verboseprint("checking %s" % quote_output(filecap))
         nodeurl = self.options['node-url']
         checkurl = nodeurl + "uri/%s?t=check&output=JSON" % url_quote(filecap)
-        self._files_checked += 1
+        with self._lock:
+            self._files_checked += 1
         resp = do_http("POST", checkurl)
         if resp.status != 200:
             # can't check, so we must assume it's bad
@@ -243,14 +269,14 @@ class BackerUpper(object):
         return False, r
 
     # This function will raise an IOError exception when called on an unreadable file
-    def upload(self, childpath):
+    def upload(self, childpath, bdb_results=None):
         precondition_abspath(childpath)
 
         #self.verboseprint("uploading %s.." % quote_local_unicode_path(childpath))
         metadata = get_local_metadata(childpath)
 
         # we can use the backupdb here
-        must_upload, bdb_results = self.check_backupdb_file(childpath)
+        must_upload, bdb_results = self.check_backupdb_file(childpath, bdb_results)
 
         if must_upload:
             self.verboseprint("uploading %s.." % quote_local_unicode_path(childpath))
@@ -274,6 +300,33 @@ class BackerUpper(object):
             self.verboseprint("skipping %s.." % quote_local_unicode_path(childpath))
             return False, bdb_results.was_uploaded(), metadata
 
+    def upload_ahead(self, childpath, bdb_results=None):
+        """
+        Upload a file like ``upload``, from a worker thread, and return a
+        function to use in place of ``upload`` for it later: that prints
+        whatever ``upload`` would have, and returns (or raises) whatever it
+        did.
+        """
+        messages = self._output.messages = []
+        try:
+            result = self.upload(childpath, bdb_results)
+        except EnvironmentError as e:
+            error = e
+            def uploaded(childpath):
+                self._print_messages(messages)
+                raise error
+        else:
+            def uploaded(childpath):
+                self._print_messages(messages)
+                return result
+        finally:
+            del self._output.messages
+        return uploaded
+
+    def _print_messages(self, messages):
+        for msg in messages:
+            self.verboseprint(msg)
+
 
 def backup(options):
     bu = BackerUpper(options)
@@ -319,19 +372,70 @@ def run_backup(
         targets,
         start_timestamp,
         stdout,
+        jobs=1,
+        upload_file_ahead=None,
+        lookup_files=None,
 ):
+    """
+    Back up each of ``targets``, which lists every directory after its
+    children, in a pipeline of stages:
+
+    * If ``lookup_files`` is given, the backupdb records for the file targets
+      are looked up in batches of ``LOOKUP_BATCH_SIZE``.  It is given a list
+      of paths and returns a dict mapping (some of) them to their records.
+
+    * If ``upload_file_ahead`` is given, the files are uploaded ahead of
+      their turn, up to ``jobs`` at once in worker threads.  It is given the
+      path of a file and its record (or ``None``), and returns the function
+      to use as ``upload_file`` for that target.
+
+    * Finally the targets are backed up in order, with ``upload_directory``
+      creating each directory once its children are done, and progress is
+      reported.
+    """
+    if lookup_files is None:
+        lookup_files = lambda paths: {}
+    looked_up = _look_up_files(targets, lookup_files)
+
+    def file_uploader(target_and_record):
+        (target, bdb_results) = target_and_record
+        if upload_file_ahead is not None and isinstance(target, FileTarget):
+            return upload_file_ahead(target._path, bdb_results)
+        return upload_file
+
+    uploaders = map_in_order(file_uploader, looked_up, jobs)
     progress = BackupProgress(warn, start_timestamp, len(targets))
-    for target in targets:
+    for target, uploader in zip(targets, uploaders):
         # Pass in the progress and get back a progress.  It would be great if
         # progress objects were immutable.  Then the target's backup would
         # make a new progress with the desired changes and return it to us.
         # Currently, BackupProgress is mutable, though, and everything just
         # mutates it.
-        progress = target.backup(progress, upload_file, upload_directory)
+        progress = target.backup(progress, uploader, upload_directory)
         print(progress.report(datetime.datetime.now()), file=stdout)
     return progress.backup_finished()
 
 
+# How many files to look up in the backupdb at once.
+LOOKUP_BATCH_SIZE = 200
+
+def _look_up_files(targets, lookup_files):
+    """
+    Yield ``(target, backupdb record)`` for each of ``targets``, looking up
+    the records of the file targets in batches.
+    """
+    for i in range(0, len(targets), LOOKUP_BATCH_SIZE):
+        batch = targets[i:i+LOOKUP_BATCH_SIZE]
+        records = lookup_files([
+            target._path for target in batch if isinstance(target, FileTarget)
+        ])
+        for target in batch:
+            if isinstance(target, FileTarget):
+                yield (target, records.get(target._path))
+            else:
+                yield (target, None)
+
+
 class FileTarget(object):
     def __init__(self, path):
         self._path = path
@@ -9,7 +9,7 @@ from io import BytesIO
 
 from twisted.python.failure import Failure
 from allmydata.scripts.common import get_alias, escape_path, \
-                                     DefaultAliasMarker, TahoeError
+                                     DefaultAliasMarker, TahoeError, map_in_order
 from allmydata.scripts.common_http import do_http, HTTPError
 from allmydata import uri
 from allmydata.util import fileutil
@@ -837,15 +837,37 @@ class Copier(object):
         files_copied = 0
         targets_finished = 0
 
+        # Each target's files, followed by (None, target) once they've all
+        # been copied.
+        jobs = self.options["jobs"]
+        copies = []
         for target, sources in list(targetmap.items()):
             _assert(isinstance(target, DirectoryTargets), target)
+            if jobs > 1 and isinstance(target, TahoeDirectoryTarget):
+                # put_file() would do this, but it's not safe to do from
+                # several threads at once
+                target.populate(recurse=False)
             for source in sources:
                 _assert(isinstance(source, FileSources), source)
+                copies.append((source, target))
+            copies.append((None, target))
+
+        def copy(source_and_target):
+            (source, target) = source_and_target
+            if source is not None:
                 self.copy_file_into_dir(source, source.basename(), target)
+            return source_and_target
+
+        # With --jobs the files are copied concurrently, but they're still
+        # reported in order, and a directory's children are only set once
+        # all of its files have been copied.
+        for (source, target) in map_in_order(copy, copies, jobs):
+            if source is not None:
                 files_copied += 1
                 self.progress("%d/%d files, %d/%d directories" %
                               (files_copied, files_to_copy,
                                targets_finished, len(targetmap)))
+                continue
             target.set_children()
             targets_finished += 1
             self.progress("%d/%d directories" %
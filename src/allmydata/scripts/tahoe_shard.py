@@ -0,0 +1,39 @@
+"""
+Convert a directory into a sharded directory.
+"""
+
+from urllib.parse import quote as url_quote
+
+from allmydata.scripts.common import get_alias, DEFAULT_ALIAS, escape_path, \
+                                     UnknownAliasError
+from allmydata.scripts.common_http import do_http, format_http_error
+from allmydata.util.encodingutil import quote_output
+
+
+def shard(options):
+    nodeurl = options['node-url']
+    stdout = options.stdout
+    stderr = options.stderr
+    if not nodeurl.endswith("/"):
+        nodeurl += "/"
+    try:
+        rootcap, path = get_alias(options.aliases, options.where, DEFAULT_ALIAS)
+    except UnknownAliasError as e:
+        e.display(stderr)
+        return 1
+    path = str(path, "utf-8")
+    url = nodeurl + "uri/%s" % url_quote(rootcap)
+    if path:
+        url += "/" + escape_path(path)
+    url += "?t=shard"
+    if options["shards"]:
+        url += "&shards=%d" % (options["shards"],)
+
+    resp = do_http("POST", url)
+    if resp.status != 200:
+        print(format_http_error("Error during shard", resp), file=stderr)
+        return 1
+    shards = int(resp.read().strip())
+    print("%s is now sharded into %d shards" % (quote_output(options.where), shards),
+          file=stdout)
+    return 0
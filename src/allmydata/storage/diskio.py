@@ -0,0 +1,196 @@
+"""
+Run blocking share-file I/O off the reactor thread.
+
+Every ``open()``/``seek()``/``read()`` on a share file blocks whatever thread
+does it.  When that thread is the reactor, one slow disk stalls every other
+client connection.  ``DiskIOExecutor`` gives each storage directory its own
+small thread pool to which the storage server, ``BucketWriter``,
+``BucketReader`` and the HTTP storage API hand off their file operations.
+
+The queue in front of the pool is bounded: once ``max_queue_depth``
+operations are outstanding further submissions fail with ``DiskQueueFull``,
+so a stalled disk sheds load instead of accumulating an unbounded backlog of
+requests (and their data) in memory.
+
+Operations submitted with the same ``key`` are run one at a time in the order
+they were submitted.  This is used to keep e.g. the writes to a single share,
+or the test-and-set operations on a single slot, from overlapping.
+"""
+
+from __future__ import annotations
+
+from typing import Callable, Optional, Any, Hashable
+import threading
+
+from twisted.application import service
+from twisted.internet.defer import Deferred, DeferredLock, maybeDeferred, fail
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+
+
+class DiskQueueFull(Exception):
+    """
+    Too many disk operations are already queued for this storage directory.
+    """
+
+
+class DiskIOExecutor(service.Service):
+    """
+    A bounded queue plus thread pool dedicated to the disk I/O of one storage
+    directory.
+
+    With ``threads=0`` operations are run synchronously in the calling
+    thread; the returned ``Deferred`` has already fired.  This is the default
+    for directly constructed ``StorageServer`` instances so that synchronous
+    unit tests keep working.
+
+    :ivar record: Called on the reactor thread with ``(category, value)``
+        pairs for the ``disk-io-queue-depth``, ``disk-io-wait`` and
+        ``disk-io-run`` statistics.
+    """
+
+    def __init__(
+        self,
+        record: Callable[[str, float], None],
+        clock: Any,
+        threads: int = 0,
+        max_queue_depth: int = 1000,
+        name: str = "TahoeDiskIO",
+        reactor: Optional[Any] = None,
+    ):
+        if threads < 0:
+            raise ValueError("threads must be >= 0, not {}".format(threads))
+        if max_queue_depth < 1:
+            raise ValueError(
+                "max_queue_depth must be >= 1, not {}".format(max_queue_depth)
+            )
+        self._record = record
+        self._clock = clock
+        self.threads = threads
+        self.max_queue_depth = max_queue_depth
+        if reactor is None:
+            from twisted.internet import reactor
+        self._reactor = reactor
+        self._pool: Optional[ThreadPool] = None
+        if threads:
+            self._pool = ThreadPool(minthreads=0, maxthreads=threads, name=name)
+        # Number of operations submitted but not yet finished:
+        self._outstanding = 0
+        # Per-key serialization:
+        self._locks: dict[Hashable, DeferredLock] = {}
+        self._local = threading.local()
+
+    def startService(self):
+        service.Service.startService(self)
+        if self._pool is not None:
+            self._pool.start()
+
+    def stopService(self):
+        if self._pool is not None:
+            self._pool.stop()
+        return service.Service.stopService(self)
+
+    def queue_depth(self) -> int:
+        """
+        Return the number of operations which have been submitted and have
+        not yet finished, including those currently running.
+        """
+        return self._outstanding
+
+    def in_io_thread(self) -> bool:
+        """
+        Return whether the caller is running inside one of our worker threads.
+        """
+        return getattr(self._local, "active", False)
+
+    def call_in_reactor(self, f: Callable[..., Any], *args: Any, **kwargs: Any) -> None:
+        """
+        Call ``f`` on the reactor thread: directly if that's where we are
+        already, otherwise via ``callFromThread``.
+        """
+        if self.in_io_thread():
+            self._reactor.callFromThread(f, *args, **kwargs)
+        else:
+            f(*args, **kwargs)
+
+    def submit(
+        self,
+        f: Callable[..., Any],
+        *args: Any,
+        key: Optional[Hashable] = None,
+        **kwargs: Any,
+    ) -> Deferred:
+        """
+        Run ``f(*args, **kwargs)`` on a disk I/O thread.
+
+        :param key: If not ``None``, ``f`` will not start until every
+            previously submitted operation with an equal key has finished.
+
+        :return: A ``Deferred`` that fires (on the reactor thread) with the
+            result of ``f``, or fails with ``DiskQueueFull`` if the queue is
+            full.
+        """
+        if self._outstanding >= self.max_queue_depth:
+            self._record("disk-io-queue-depth", self._outstanding)
+            return fail(DiskQueueFull(
+                "{} disk operations already outstanding".format(self._outstanding)
+            ))
+        self._outstanding += 1
+        self._record("disk-io-queue-depth", self._outstanding)
+        submitted = self._clock.seconds()
+
+        def release(result):
+            self._outstanding -= 1
+            return result
+
+        if key is None:
+            d = self._dispatch(submitted, f, args, kwargs)
+        else:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = DeferredLock()
+            d = lock.run(self._dispatch, submitted, f, args, kwargs)
+
+            def forget_lock(result):
+                if not lock.locked and not lock.waiting:
+                    if self._locks.get(key) is lock:
+                        del self._locks[key]
+                return result
+
+            d.addBoth(forget_lock)
+        d.addBoth(release)
+        return d
+
+    def _dispatch(self, submitted, f, args, kwargs) -> Deferred:
+        """
+        Hand one operation to the thread pool (or run it right away, when we
+        have no threads) and record how long it queued and ran for.
+        """
+        timing = {}
+
+        def run():
+            started = self._clock.seconds()
+            self._local.active = self._pool is not None
+            try:
+                return f(*args, **kwargs)
+            finally:
+                self._local.active = False
+                timing["wait"] = started - submitted
+                timing["run"] = self._clock.seconds() - started
+
+        if self._pool is None:
+            d = maybeDeferred(run)
+        else:
+            d = deferToThreadPool(self._reactor, self._pool, run)
+
+        def record(result):
+            if timing:
+                self._record("disk-io-wait", timing["wait"])
+                self._record("disk-io-run", timing["run"])
+            return result
+
+        d.addBoth(record)
+        return d
+
+
+__all__ = ["DiskIOExecutor", "DiskQueueFull"]
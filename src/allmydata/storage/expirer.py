@@ -10,7 +10,7 @@ from allmydata.storage.crawler import (
 )
 from allmydata.storage.shares import get_share_file
 from allmydata.storage.common import UnknownMutableContainerVersionError, \
-     UnknownImmutableContainerVersionError
+     UnknownImmutableContainerVersionError, si_a2b
 from twisted.python import log as twlog
 from twisted.python.filepath import FilePath
 
@@ -99,6 +99,9 @@ class LeaseCheckingCrawler(ShareCrawler):
 
     All cycle-to-date values remain valid until the start of the next cycle.
 
+    If expiration is enabled and the server has a complete share index, I
+    only examine the buckets which the index says have a lease that may have
+    expired, so the statistics above only cover those buckets.
     """
 
     slow_start = 360 # wait 6 minutes after startup
@@ -161,6 +164,35 @@ class LeaseCheckingCrawler(ShareCrawler):
     def stat(self, fn):
         return os.stat(fn)
 
+    def expiration_threshold(self, now):
+        """
+        Return a time such that, under the configured expiration mode, only
+        leases expiring at or before it can be considered expired at
+        ``now``.
+        """
+        # Leases are granted or renewed for 31 days; see
+        # LeaseInfo.get_grant_renew_time_time().
+        lease_duration = 31*24*60*60
+        if self.mode == "age":
+            if self.override_lease_duration is None:
+                # process_share() compares the age against the expiration
+                # time itself.
+                return (now + lease_duration) / 2
+            return now + lease_duration - self.override_lease_duration
+        return self.cutoff_date + lease_duration
+
+    def process_prefixdir(self, cycle, prefix, prefixdir, buckets, start_slice):
+        share_index = getattr(self.server, "share_index", None)
+        if (self.expiration_enabled and share_index is not None
+                and share_index.is_complete()):
+            candidates = share_index.buckets_with_leases_expiring_by(
+                prefix, self.expiration_threshold(time.time()),
+            )
+            buckets = [b for b in buckets if b in candidates]
+        ShareCrawler.process_prefixdir(
+            self, cycle, prefix, prefixdir, buckets, start_slice,
+        )
+
     def process_bucket(self, cycle, prefix, prefixdir, storage_index_b32):
         bucketdir = os.path.join(prefixdir, storage_index_b32)
         s = self.stat(bucketdir)
@@ -205,6 +237,9 @@ class LeaseCheckingCrawler(ShareCrawler):
             self.increment_bucketspace("configured", bucket_diskbytes, sharetype)
         if sum([wks[2] for wks in would_keep_shares]) == 0:
             self.increment_bucketspace("actual", bucket_diskbytes, sharetype)
+        if self.expiration_enabled:
+            # We may have cancelled leases and deleted shares.
+            self.server.reindex_bucket(si_a2b(storage_index_b32.encode("ascii")))
 
     def process_share(self, sharefilename):
         # first, find out what kind of a share it is
@@ -16,6 +16,7 @@ from typing import (
     Dict,
     Callable,
     ClassVar,
+    Union,
 )
 from base64 import b64encode
 from io import BytesIO
@@ -131,6 +132,21 @@ _SCHEMAS: Mapping[str, Schema] = {
     response = #6.258([0*256 uint])
     """
     ),
+    "add_or_renew_leases": Schema(
+        """
+        response = {
+          "renewed": [* (bool / {"error": tstr})]
+        }
+        """
+    ),
+    "immutable_read_share_chunks": Schema(
+        """
+        response = {
+          "data": {0*256 share_number: [0* bstr]}
+        }
+        share_number = uint
+        """
+    ),
     "mutable_read_test_write": Schema(
         """
         response = {
@@ -253,7 +269,10 @@ class _TLSContextFactory(CertificateOptions):
 
     def __init__(self, expected_spki_hash: bytes):
         self.expected_spki_hash = expected_spki_hash
-        CertificateOptions.__init__(self)
+        # Accept session tickets, so that later connections to the same
+        # server can resume the TLS session instead of doing a full
+        # handshake.
+        CertificateOptions.__init__(self, enableSessionTickets=True)
 
     def getContext(self) -> SSL.Context:
         def always_validate(conn, cert, errno, depth, preverify_ok):
@@ -302,6 +321,13 @@ class _StorageClientHTTPSPolicy:
 
     expected_spki_hash: bytes
 
+    # Every connection made with this policy shares one context, and resumes
+    # the most recent TLS session.  Sessions are only ever set up after the
+    # server's certificate has been validated against the pinned hash, so
+    # resuming one (which skips that validation) is safe.
+    _context: Optional[SSL.Context] = field(default=None, init=False, eq=False)
+    _session: Optional[SSL.Session] = field(default=None, init=False, eq=False)
+
     # IPolicyForHTTPS
     def creatorForNetloc(self, hostname: str, port: int) -> _StorageClientHTTPSPolicy:
         return self
@@ -310,9 +336,27 @@ class _StorageClientHTTPSPolicy:
     def clientConnectionForTLS(
         self, tlsProtocol: TLSMemoryBIOProtocol
     ) -> SSL.Connection:
-        return SSL.Connection(
-            _TLSContextFactory(self.expected_spki_hash).getContext(), None
-        )
+        if self._context is None:
+            self._context = _TLSContextFactory(self.expected_spki_hash).getContext()
+            self._context.set_info_callback(self._remember_session)
+        connection = SSL.Connection(self._context, None)
+        if self._session is not None:
+            connection.set_session(self._session)
+        return connection
+
+    def _remember_session(self, connection: SSL.Connection, where: int, ret: int) -> None:
+        # Called whenever OpenSSL has finished processing handshake messages:
+        # with TLS 1.3 the session tickets that make a session resumable
+        # arrive after the handshake itself is complete.
+        if where & SSL.SSL_CB_CONNECT_EXIT == SSL.SSL_CB_CONNECT_EXIT and ret == 1:
+            self._session = connection.get_session()
+
+
+# How many idle connections to keep open to each storage server.  Twisted
+# opens as many connections as there are concurrent requests; any beyond
+# this many are closed once they're done, and the next burst of requests pays
+# for new connections (and TLS handshakes) again.
+DEFAULT_HTTP_CONNECTIONS_PER_SERVER = 10
 
 
 @define
@@ -330,6 +374,7 @@ class StorageClientFactory:
     _tor_provider: Optional[TorProvider]
     # Cache the Tor instance created by the provider, if relevant.
     _tor_instance: Optional[Tor] = None
+    _connections_per_server: int = DEFAULT_HTTP_CONNECTIONS_PER_SERVER
 
     # If set, we're doing unit testing and we should call this with any
     # HTTPConnectionPool that gets passed/created to ``create_agent()``.
@@ -395,7 +440,7 @@ class StorageClientFactory:
         assert nurl.scheme in ("pb", "pb+tor")
         if pool is None:
             pool = HTTPConnectionPool(reactor)
-            pool.maxPersistentPerHost = 10
+            pool.maxPersistentPerHost = self._connections_per_server
 
         certificate_hash = nurl.user.encode("ascii")
         agent = await self._create_agent(
@@ -617,6 +662,10 @@ class StorageClientGeneral(object):
                 b"delete-mutable-shares-with-zero-length-writev": True,
                 b"fills-holes-with-zero-bytes": True,
                 b"prevents-read-past-end-of-share-data": True,
+                # Servers predating the batched immutable read API don't have
+                # it, in which case _HTTPBucketReader.readv() falls back to
+                # individual reads.
+                b"immutable-read-vectors": True,
             }
         )
         return decoded_response
@@ -657,6 +706,56 @@ class StorageClientGeneral(object):
         else:
             raise ClientException(response.code)
 
+    @async_to_deferred
+    async def add_or_renew_leases(
+        self, leases: Sequence[tuple[bytes, bytes, bytes]]
+    ) -> list[bool | str]:
+        """
+        Add or renew leases on the shares of many storage indexes with a
+        single request.
+
+        :param leases: ``(storage_index, renew_secret, cancel_secret)``
+            tuples, at most ``MAX_LEASES_PER_REQUEST`` of them.
+
+        :return: For each lease, whether the server had any shares to put it
+            on, or a description of the error the server hit doing so.
+        """
+        with start_action(
+            action_type="allmydata:storage:http-client:add-or-renew-leases",
+            count=len(leases),
+        ):
+            return await self._add_or_renew_leases(leases)
+
+    async def _add_or_renew_leases(
+        self, leases: Sequence[tuple[bytes, bytes, bytes]]
+    ) -> list[bool | str]:
+        """Implementation of ``add_or_renew_leases()``."""
+        url = self._client.relative_url("/storage/v1/lease")
+        message = {
+            "leases": [
+                {
+                    "storage-index": storage_index,
+                    "renew-secret": renew_secret,
+                    "cancel-secret": cancel_secret,
+                }
+                for (storage_index, renew_secret, cancel_secret) in leases
+            ]
+        }
+        response = await self._client.request("POST", url, message_to_serialize=message)
+        if response.code == http.OK:
+            result = cast(
+                Mapping[str, list[Union[bool, Mapping[str, str]]]],
+                await self._client.decode_cbor(
+                    response, _SCHEMAS["add_or_renew_leases"]
+                ),
+            )
+            return [
+                renewed["error"] if isinstance(renewed, Mapping) else renewed
+                for renewed in result["renewed"]
+            ]
+        else:
+            raise ClientException(response.code, (await response.content()))
+
 
 @define
 class UploadProgress(object):
@@ -998,6 +1097,58 @@ class StorageClientImmutables(object):
             ctx.add_success_fields(data_len=len(result))
             return result
 
+    @async_to_deferred
+    async def read_share_chunks(
+        self,
+        storage_index: bytes,
+        read_vectors: Mapping[int, Sequence[tuple[int, int]]],
+    ) -> Dict[int, list[bytes]]:
+        """
+        Download several chunks of data from several shares with a single
+        request.
+
+        :param read_vectors: Map share numbers to a list of ``(offset,
+            length)`` tuples.
+
+        :return: Map share numbers to a list of the data read for each
+            range, in order.  Shares the server doesn't have are omitted.
+        """
+        with start_action(
+            action_type="allmydata:storage:http-client:immutable:read-share-chunks",
+            storage_index=si_to_human_readable(storage_index),
+            share_numbers=sorted(read_vectors),
+        ):
+            return await self._read_share_chunks(storage_index, read_vectors)
+
+    async def _read_share_chunks(
+        self,
+        storage_index: bytes,
+        read_vectors: Mapping[int, Sequence[tuple[int, int]]],
+    ) -> Dict[int, list[bytes]]:
+        """Implementation of ``read_share_chunks()``."""
+        url = self._client.relative_url(
+            "/storage/v1/immutable/{}/read".format(_encode_si(storage_index))
+        )
+        message = {
+            "read-vectors": {
+                share_number: [
+                    {"offset": offset, "size": size} for (offset, size) in readv
+                ]
+                for (share_number, readv) in read_vectors.items()
+            }
+        }
+        response = await self._client.request("POST", url, message_to_serialize=message)
+        if response.code == http.OK:
+            result = cast(
+                Mapping[str, Dict[int, list[bytes]]],
+                await self._client.decode_cbor(
+                    response, _SCHEMAS["immutable_read_share_chunks"]
+                ),
+            )
+            return result["data"]
+        else:
+            raise ClientException(response.code, (await response.content()))
+
     @async_to_deferred
     async def list_shares(self, storage_index: bytes) -> Set[int]:
         """
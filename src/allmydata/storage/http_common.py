@@ -16,6 +16,9 @@ from twisted.web.iweb import IResponse
 
 CBOR_MIME_TYPE = "application/cbor"
 
+# The most leases which may be added or renewed with a single request.
+MAX_LEASES_PER_REQUEST = 1000
+
 
 def get_content_type(headers: Headers) -> Optional[str]:
     """
@@ -32,12 +32,13 @@ from twisted.web import http
 from twisted.internet.interfaces import (
     IListeningPort,
     IStreamServerEndpoint,
-    IPullProducer,
+    IPushProducer,
     IProtocolFactory,
 )
 from twisted.internet.address import IPv4Address, IPv6Address
-from twisted.internet.defer import Deferred
+from twisted.internet.defer import Deferred, maybeDeferred
 from twisted.internet.ssl import CertificateOptions, Certificate, PrivateCertificate
+from OpenSSL.crypto import PKey, X509
 from twisted.internet.interfaces import IReactorFromThreads
 from twisted.web.server import Site, Request
 from twisted.web.iweb import IRequest
@@ -65,10 +66,12 @@ from .http_common import (
     get_content_type,
     CBOR_MIME_TYPE,
     get_spki_hash,
+    MAX_LEASES_PER_REQUEST,
 )
 
 from .common import si_a2b
 from .immutable import BucketWriter, ConflictingWriteError
+from .diskio import DiskQueueFull
 from ..util.hashutil import timing_safe_compare
 from ..util.base32 import rfc3548_alphabet
 from ..util.deferredutil import async_to_deferred
@@ -380,6 +383,27 @@ _SCHEMAS = {
     }
     """
     ),
+    "add_or_renew_leases": Schema(
+        """
+        request = {
+            "leases": [1*%d {
+                "storage-index": bstr .size 16
+                "renew-secret": bstr .size 32
+                "cancel-secret": bstr .size 32
+            }]
+        }
+        """ % (MAX_LEASES_PER_REQUEST,)
+    ),
+    "immutable_read_share_chunks": Schema(
+        """
+        request = {
+            "read-vectors": {
+                0*256 share_number : [1*30 {"offset": uint, "size": uint}]
+            }
+        }
+        share_number = uint
+        """
+    ),
     "mutable_read_test_write": Schema(
         """
         request = {
@@ -398,104 +422,128 @@ _SCHEMAS = {
 }
 
 
-# Callable that takes offset and length, returns the data at that range.
-ReadData = Callable[[int, int], bytes]
+# The most data a single batched immutable read may return. Larger reads
+# should use the streaming single-range API.
+MAX_READ_SHARE_CHUNKS_SIZE = 16 * 1024 * 1024
+
 
+# Callable that takes offset and length, returns the data at that range,
+# either directly or (when the read is done on a disk I/O thread) via a
+# ``Deferred``.
+ReadData = Callable[[int, int], Union[bytes, Deferred[bytes]]]
 
-@implementer(IPullProducer)
+
+@implementer(IPushProducer)
 @define
-class _ReadAllProducer:
+class _ReadProducer:
     """
-    Producer that calls a read function repeatedly to read all the data, and
-    writes to a request.
+    Producer that calls a read function repeatedly to read data, and writes
+    it to a request.
+
+    If ``remaining`` is ``None`` it reads until the read function returns an
+    empty result, otherwise it reads exactly ``remaining`` bytes.
+
+    This is a streaming producer: reads may complete asynchronously, and we
+    only issue the next read once the previous one has been written, and not
+    while the transport has asked us to pause.
     """
 
-    request: Request
+    request: Optional[Request]
     read_data: ReadData
-    result: Deferred = Factory(Deferred)
-    start: int = field(default=0)
+    result: Optional[Deferred[bytes]]
+    start: int
+    remaining: Optional[int]
+    _paused: bool = field(default=False)
+    _reading: bool = field(default=False)
+    _looping: bool = field(default=False)
 
     @classmethod
-    def produce_to(cls, request: Request, read_data: ReadData) -> Deferred[bytes]:
+    def produce_to(
+        cls,
+        request: Request,
+        read_data: ReadData,
+        start: int = 0,
+        remaining: Optional[int] = None,
+    ) -> Deferred[bytes]:
         """
         Create and register the producer, returning ``Deferred`` that should be
         returned from a HTTP server endpoint.
         """
-        producer = cls(request, read_data)
-        request.registerProducer(producer, False)
-        return producer.result
+        d: Deferred[bytes] = Deferred()
+        producer = cls(request, read_data, d, start, remaining)
+        request.registerProducer(producer, True)
+        producer._read_more()
+        return d
 
-    def resumeProducing(self) -> None:
-        data = self.read_data(self.start, 65536)
-        if not data:
-            self.request.unregisterProducer()
-            d = self.result
-            del self.result
-            d.callback(b"")
+    def _read_more(self) -> None:
+        """
+        Issue reads until we are paused, finished, or waiting for a read that
+        didn't complete synchronously.
+        """
+        if self._looping:
             return
-        self.request.write(data)
-        self.start += len(data)
-
-    def pauseProducing(self) -> None:
-        pass
-
-    def stopProducing(self) -> None:
-        pass
-
-
-@implementer(IPullProducer)
-@define
-class _ReadRangeProducer:
-    """
-    Producer that calls a read function to read a range of data, and writes to
-    a request.
-    """
-
-    request: Optional[Request]
-    read_data: ReadData
-    result: Optional[Deferred[bytes]]
-    start: int
-    remaining: int
-
-    def resumeProducing(self) -> None:
+        self._looping = True
+        try:
+            while (
+                not self._paused and not self._reading and self.result is not None
+            ):
+                to_read = 65536
+                if self.remaining is not None:
+                    to_read = min(self.remaining, to_read)
+                self._reading = True
+                d = maybeDeferred(self.read_data, self.start, to_read)
+                d.addCallbacks(self._got_data, self._failed)
+        finally:
+            self._looping = False
+
+    def _got_data(self, data: bytes) -> None:
+        self._reading = False
         if self.result is None or self.request is None:
             return
 
-        to_read = min(self.remaining, 65536)
-        data = self.read_data(self.start, to_read)
-        assert len(data) <= to_read
-
-        if not data and self.remaining > 0:
-            d, self.result = self.result, None
-            d.errback(
-                ValueError(
-                    f"Should be {self.remaining} bytes left, but we got an empty read"
+        if self.remaining is None:
+            if not data:
+                self.stopProducing()
+                return
+        else:
+            if not data and self.remaining > 0:
+                self._failed(
+                    ValueError(
+                        f"Should be {self.remaining} bytes left, but we got an empty read"
+                    )
                 )
-            )
-            self.stopProducing()
-            return
+                return
 
-        if len(data) > self.remaining:
-            d, self.result = self.result, None
-            d.errback(
-                ValueError(
-                    f"Should be {self.remaining} bytes left, but we got more than that ({len(data)})!"
+            if len(data) > self.remaining:
+                self._failed(
+                    ValueError(
+                        f"Should be {self.remaining} bytes left, but we got more than that ({len(data)})!"
+                    )
                 )
-            )
-            self.stopProducing()
-            return
+                return
+            self.remaining -= len(data)
 
         self.start += len(data)
-        self.remaining -= len(data)
-        assert self.remaining >= 0
-
         self.request.write(data)
 
         if self.remaining == 0:
             self.stopProducing()
+            return
+        self._read_more()
+
+    def _failed(self, reason: Union[Failure, Exception]) -> None:
+        self._reading = False
+        d, self.result = self.result, None
+        self.stopProducing()
+        if d is not None:
+            d.errback(reason)
 
     def pauseProducing(self) -> None:
-        pass
+        self._paused = True
+
+    def resumeProducing(self) -> None:
+        self._paused = False
+        self._read_more()
 
     def stopProducing(self) -> None:
         if self.request is not None:
@@ -509,7 +557,7 @@ class _ReadRangeProducer:
 
 def read_range(
     request: Request, read_data: ReadData, share_length: int
-) -> Union[Deferred[bytes], bytes]:
+) -> Deferred[bytes]:
     """
     Read an optional ``Range`` header, reads data appropriately via the given
     callable, writes the data to the request.
@@ -525,16 +573,17 @@ def read_range(
     The resulting data is written to the request.
     """
 
-    def read_data_with_error_handling(offset: int, length: int) -> bytes:
-        try:
-            return read_data(offset, length)
-        except _HTTPError as e:
-            request.setResponseCode(e.code)
-            # Empty read means we're done.
-            return b""
+    def handle_error(failure: Failure) -> bytes:
+        failure.trap(_HTTPError)
+        request.setResponseCode(failure.value.code)
+        # Empty read means we're done.
+        return b""
+
+    def read_data_with_error_handling(offset: int, length: int) -> Deferred[bytes]:
+        return maybeDeferred(read_data, offset, length).addErrback(handle_error)
 
     if request.getHeader("range") is None:
-        return _ReadAllProducer.produce_to(request, read_data_with_error_handling)
+        return _ReadProducer.produce_to(request, read_data_with_error_handling)
 
     range_header = parse_range_header(request.getHeader("range"))
     if (
@@ -566,14 +615,9 @@ def read_range(
         ContentRange("bytes", offset, end).to_header(),
     )
 
-    d: Deferred[bytes] = Deferred()
-    request.registerProducer(
-        _ReadRangeProducer(
-            request, read_data_with_error_handling, d, offset, end - offset
-        ),
-        False,
+    return _ReadProducer.produce_to(
+        request, read_data_with_error_handling, offset, end - offset
     )
-    return d
 
 
 def _add_error_handling(app: Klein) -> None:
@@ -589,6 +633,14 @@ def _add_error_handling(app: Klein) -> None:
         else:
             return b""
 
+    @app.handle_errors(DiskQueueFull)
+    def _disk_queue_full(
+        self: Any, request: IRequest, failure: Failure
+    ) -> KleinRenderable:
+        """Handle an overloaded disk by asking the client to try later."""
+        request.setResponseCode(http.SERVICE_UNAVAILABLE)
+        return b""
+
     @app.handle_errors(CDDLValidationError)
     def _cddl_validation_error(
         self: Any, request: IRequest, failure: Failure
@@ -691,7 +743,7 @@ class HTTPServer(BaseApp):
                 f.seek(offset)
                 return f.read(length)
 
-            return _ReadAllProducer.produce_to(request, read_data)
+            return _ReadProducer.produce_to(request, read_data)
         else:
             # TODO Might want to optionally send JSON someday:
             # https://tahoe-lafs.org/trac/tahoe-lafs/ticket/3861
@@ -773,7 +825,8 @@ class HTTPServer(BaseApp):
         "/storage/v1/immutable/<storage_index:storage_index>/<int(signed=False):share_number>/abort",
         methods=["PUT"],
     )
-    def abort_share_upload(
+    @async_to_deferred
+    async def abort_share_upload(
         self,
         request: Request,
         authorization: SecretsDict,
@@ -789,11 +842,8 @@ class HTTPServer(BaseApp):
             if e.code == http.NOT_FOUND:
                 # It may be we've already uploaded this, in which case error
                 # should be method not allowed (405).
-                try:
-                    self._storage_server.get_buckets(storage_index)[share_number]
-                except KeyError:
-                    pass
-                else:
+                buckets = await self._storage_server.get_buckets_async(storage_index)
+                if share_number in buckets:
                     # Already uploaded, so we can't abort.
                     raise _HTTPError(http.NOT_ALLOWED)
             raise
@@ -810,7 +860,8 @@ class HTTPServer(BaseApp):
         "/storage/v1/immutable/<storage_index:storage_index>/<int(signed=False):share_number>",
         methods=["PATCH"],
     )
-    def write_share_data(
+    @async_to_deferred
+    async def write_share_data(
         self,
         request: Request,
         authorization: SecretsDict,
@@ -838,7 +889,7 @@ class HTTPServer(BaseApp):
             data = request.content.read(min(remaining, 65536))
             assert data, "uploaded data length doesn't match range"
             try:
-                finished = bucket.write(offset, data)
+                finished = await bucket.write_async(offset, data)
             except ConflictingWriteError:
                 request.setResponseCode(http.CONFLICT)
                 return b""
@@ -846,7 +897,7 @@ class HTTPServer(BaseApp):
             offset += len(data)
 
         if finished:
-            bucket.close()
+            await bucket.close_async()
             request.setResponseCode(http.CREATED)
         else:
             request.setResponseCode(http.OK)
@@ -854,7 +905,7 @@ class HTTPServer(BaseApp):
         required = []
         for start, end, _ in bucket.required_ranges().ranges():
             required.append({"begin": start, "end": end})
-        return self._send_encoded(request, {"required": required})
+        return await self._send_encoded(request, {"required": required})
 
     @_authorized_route(
         _app,
@@ -862,14 +913,15 @@ class HTTPServer(BaseApp):
         "/storage/v1/immutable/<storage_index:storage_index>/shares",
         methods=["GET"],
     )
-    def list_shares(
+    @async_to_deferred
+    async def list_shares(
         self, request: Request, authorization: SecretsDict, storage_index: bytes
     ) -> KleinRenderable:
         """
         List shares for the given storage index.
         """
-        share_numbers = set(self._storage_server.get_buckets(storage_index).keys())
-        return self._send_encoded(request, share_numbers)
+        buckets = await self._storage_server.get_buckets_async(storage_index)
+        return await self._send_encoded(request, set(buckets.keys()))
 
     @_authorized_route(
         _app,
@@ -877,7 +929,8 @@ class HTTPServer(BaseApp):
         "/storage/v1/immutable/<storage_index:storage_index>/<int(signed=False):share_number>",
         methods=["GET"],
     )
-    def read_share_chunk(
+    @async_to_deferred
+    async def read_share_chunk(
         self,
         request: Request,
         authorization: SecretsDict,
@@ -886,13 +939,58 @@ class HTTPServer(BaseApp):
     ) -> KleinRenderable:
         """Read a chunk for an already uploaded immutable."""
         request.setHeader("content-type", "application/octet-stream")
+        buckets = await self._storage_server.get_buckets_async(storage_index)
         try:
-            bucket = self._storage_server.get_buckets(storage_index)[share_number]
+            bucket = buckets[share_number]
         except KeyError:
             request.setResponseCode(http.NOT_FOUND)
             return b""
 
-        return read_range(request, bucket.read, bucket.get_length())
+        return await read_range(request, bucket.read_async, bucket.get_length())
+
+    @_authorized_route(
+        _app,
+        set(),
+        "/storage/v1/immutable/<storage_index:storage_index>/read",
+        methods=["POST"],
+    )
+    @async_to_deferred
+    async def read_share_chunks(
+        self, request: Request, authorization: SecretsDict, storage_index: bytes
+    ) -> KleinRenderable:
+        """
+        Read several ranges from several shares of an already uploaded
+        immutable in a single request.
+        """
+        read_request = await read_encoded(
+            self._reactor,
+            request,
+            _SCHEMAS["immutable_read_share_chunks"],
+            max_size=32768,
+        )
+        buckets = await self._storage_server.get_buckets_async(storage_index)
+        # Shares we don't have are left out of the response, like
+        # slot_readv() does for mutables.
+        readvs = {
+            share_number: [(d["offset"], d["size"]) for d in readv]
+            for (share_number, readv) in read_request["read-vectors"].items()
+            if share_number in buckets
+        }
+        # The whole response is built in memory, so bound its size. Reads
+        # past the end of a share are truncated, so only count what we'd
+        # actually return.
+        total = 0
+        for share_number, readv in readvs.items():
+            share_length = buckets[share_number].get_length()
+            for offset, size in readv:
+                total += max(0, min(offset + size, share_length) - offset)
+        if total > MAX_READ_SHARE_CHUNKS_SIZE:
+            raise _HTTPError(http.REQUEST_ENTITY_TOO_LARGE)
+
+        data = {}
+        for share_number, readv in readvs.items():
+            data[share_number] = await buckets[share_number].readv_async(readv)
+        return await self._send_encoded(request, {"data": data})
 
     @_authorized_route(
         _app,
@@ -900,15 +998,16 @@ class HTTPServer(BaseApp):
         "/storage/v1/lease/<storage_index:storage_index>",
         methods=["PUT"],
     )
-    def add_or_renew_lease(
+    @async_to_deferred
+    async def add_or_renew_lease(
         self, request: Request, authorization: SecretsDict, storage_index: bytes
     ) -> KleinRenderable:
         """Update the lease for an immutable or mutable share."""
-        if not list(self._storage_server.get_shares(storage_index)):
+        if not await self._storage_server.list_shares_async(storage_index):
             raise _HTTPError(http.NOT_FOUND)
 
         # Checking of the renewal secret is done by the backend.
-        self._storage_server.add_lease(
+        await self._storage_server.add_lease_async(
             storage_index,
             authorization[Secrets.LEASE_RENEW],
             authorization[Secrets.LEASE_CANCEL],
@@ -917,6 +1016,42 @@ class HTTPServer(BaseApp):
         request.setResponseCode(http.NO_CONTENT)
         return b""
 
+    @_authorized_route(
+        _app,
+        set(),
+        "/storage/v1/lease",
+        methods=["POST"],
+    )
+    @async_to_deferred
+    async def add_or_renew_leases(
+        self, request: Request, authorization: SecretsDict
+    ) -> KleinRenderable:
+        """
+        Update the leases for the shares of many storage indexes in a single
+        request.
+
+        A storage index whose leases couldn't be updated gets an error item
+        in the response, rather than failing the whole request.
+        """
+        message = await read_encoded(
+            self._reactor,
+            request,
+            _SCHEMAS["add_or_renew_leases"],
+            max_size=MAX_LEASES_PER_REQUEST * 256,
+        )
+        # Checking of the renewal secrets is done by the backend.
+        renewed = await self._storage_server.add_leases_async([
+            (lease["storage-index"], lease["renew-secret"], lease["cancel-secret"])
+            for lease in message["leases"]
+        ])
+        return await self._send_encoded(request, {"renewed": [
+            # Only the type of the exception is sent: its message may
+            # include details of the server's filesystem.
+            {"error": type(result).__name__}
+            if isinstance(result, Exception) else result
+            for result in renewed
+        ]})
+
     @_authorized_route(
         _app,
         set(),
@@ -932,8 +1067,9 @@ class HTTPServer(BaseApp):
         share_number: int,
     ) -> KleinRenderable:
         """Indicate that given share is corrupt, with a text reason."""
+        buckets = await self._storage_server.get_buckets_async(storage_index)
         try:
-            bucket = self._storage_server.get_buckets(storage_index)[share_number]
+            bucket = buckets[share_number]
         except KeyError:
             raise _HTTPError(http.NOT_FOUND)
 
@@ -973,7 +1109,7 @@ class HTTPServer(BaseApp):
             authorization[Secrets.LEASE_CANCEL],
         )
         try:
-            success, read_data = self._storage_server.slot_testv_and_readv_and_writev(
+            success, read_data = await self._storage_server.slot_testv_and_readv_and_writev_async(
                 storage_index,
                 secrets,
                 {
@@ -1001,7 +1137,8 @@ class HTTPServer(BaseApp):
         "/storage/v1/mutable/<storage_index:storage_index>/<int(signed=False):share_number>",
         methods=["GET"],
     )
-    def read_mutable_chunk(
+    @async_to_deferred
+    async def read_mutable_chunk(
         self,
         request: Request,
         authorization: SecretsDict,
@@ -1012,21 +1149,25 @@ class HTTPServer(BaseApp):
         request.setHeader("content-type", "application/octet-stream")
 
         try:
-            share_length = self._storage_server.get_mutable_share_length(
-                storage_index, share_number
+            share_length = await self._storage_server.disk_io.submit(
+                self._storage_server.get_mutable_share_length,
+                storage_index,
+                share_number,
             )
         except KeyError:
             raise _HTTPError(http.NOT_FOUND)
 
-        def read_data(offset, length):
+        @async_to_deferred
+        async def read_data(offset, length):
+            datavs = await self._storage_server.slot_readv_async(
+                storage_index, [share_number], [(offset, length)]
+            )
             try:
-                return self._storage_server.slot_readv(
-                    storage_index, [share_number], [(offset, length)]
-                )[share_number][0]
+                return datavs[share_number][0]
             except KeyError:
                 raise _HTTPError(http.NOT_FOUND)
 
-        return read_range(request, read_data, share_length)
+        return await read_range(request, read_data, share_length)
 
     @_authorized_route(
         _app,
@@ -1034,10 +1175,13 @@ class HTTPServer(BaseApp):
         "/storage/v1/mutable/<storage_index:storage_index>/shares",
         methods=["GET"],
     )
-    def enumerate_mutable_shares(self, request, authorization, storage_index):
+    @async_to_deferred
+    async def enumerate_mutable_shares(self, request, authorization, storage_index):
         """List mutable shares for a storage index."""
-        shares = self._storage_server.enumerate_mutable_shares(storage_index)
-        return self._send_encoded(request, shares)
+        shares = await self._storage_server.disk_io.submit(
+            self._storage_server.enumerate_mutable_shares, storage_index
+        )
+        return await self._send_encoded(request, shares)
 
     @_authorized_route(
         _app,
@@ -1054,9 +1198,8 @@ class HTTPServer(BaseApp):
         share_number: int,
     ) -> KleinRenderable:
         """Indicate that given share is corrupt, with a text reason."""
-        if share_number not in {
-            shnum for (shnum, _) in self._storage_server.get_shares(storage_index)
-        }:
+        shares = await self._storage_server.list_shares_async(storage_index)
+        if share_number not in {shnum for (shnum, _) in shares}:
             raise _HTTPError(http.NOT_FOUND)
 
         # The reason can be a string with explanation, so in theory it could be
@@ -1070,6 +1213,28 @@ class HTTPServer(BaseApp):
         return b""
 
 
+# If Twisted's HTTP/2 support is installed, offer it to clients, which can
+# then multiplex concurrent requests over a single connection.
+_ALPN_PROTOCOLS = [b"h2", b"http/1.1"] if http.H2_ENABLED else None
+
+
+def server_certificate_options(
+    private_key: PKey, certificate: X509
+) -> CertificateOptions:
+    """
+    Create the TLS configuration for a HTTPS storage server with the given
+    private key and certificate.
+    """
+    return CertificateOptions(
+        privateKey=private_key,
+        certificate=certificate,
+        # Let clients resume TLS sessions, rather than paying for a full
+        # handshake on every new connection.
+        enableSessionTickets=True,
+        acceptableProtocols=_ALPN_PROTOCOLS,
+    )
+
+
 @implementer(IStreamServerEndpoint)
 @define
 class _TLSEndpointWrapper(object):
@@ -1097,10 +1262,10 @@ class _TLSEndpointWrapper(object):
         private_key = PrivateCertificate.loadPEM(
             cert_path.getContent() + b"\n" + private_key_path.getContent()
         ).privateKey.original
-        certificate_options = CertificateOptions(
-            privateKey=private_key, certificate=certificate
+        return cls(
+            endpoint=endpoint,
+            context_factory=server_certificate_options(private_key, certificate),
         )
-        return cls(endpoint=endpoint, context_factory=certificate_options)
 
     def listen(self, factory: IProtocolFactory) -> Deferred[IListeningPort]:
         return self.endpoint.listen(
@@ -8,6 +8,8 @@ from collections_extended import RangeMap
 
 from foolscap.api import Referenceable
 
+from twisted.internet.defer import DeferredLock, succeed
+
 from zope.interface import implementer
 from allmydata.interfaces import (
     RIBucketWriter, RIBucketReader, ConflictingWriteError,
@@ -16,6 +18,7 @@ from allmydata.interfaces import (
 )
 from allmydata.util import base32, fileutil, log
 from allmydata.util.assertutil import precondition
+from allmydata.util.deferredutil import async_to_deferred
 from allmydata.storage.common import UnknownImmutableContainerVersionError
 
 from .immutable_schema import (
@@ -361,6 +364,7 @@ class BucketWriter(object):
         self.incominghome = incominghome
         self.finalhome = finalhome
         self._max_size = max_size # don't allow the client to write more than this
+        self.lease_expiration = lease_info.get_expiration_time()
         self.closed = False
         self.throw_out_all_data = False
         self._sharefile = ShareFile(incominghome, create=True, max_size=max_size)
@@ -370,6 +374,9 @@ class BucketWriter(object):
         self._already_written = RangeMap()
         self._clock = clock
         self._timeout = clock.callLater(30 * 60, self._abort_due_to_timeout)
+        # Serializes the operations done on the disk I/O executor, so that
+        # _already_written is only updated between them:
+        self._lock = DeferredLock()
 
     def required_ranges(self):  # type: () -> RangeMap
         """
@@ -397,7 +404,35 @@ class BucketWriter(object):
         if self.throw_out_all_data:
             return False
 
-        # Make sure we're not conflicting with existing data:
+        self._write_share_data(offset, data)
+        return self._written(start, offset, data)
+
+    def write_async(self, offset, data):
+        """
+        Like ``write``, but the share file is checked and written on the
+        storage server's disk I/O executor.
+
+        :return Deferred[bool]: Whether the upload is complete.
+        """
+        self._timeout.reset(30 * 60)
+        precondition(not self.closed)
+        if self.throw_out_all_data:
+            return succeed(False)
+        return self._lock.run(self._write_async, offset, data)
+
+    @async_to_deferred
+    async def _write_async(self, offset, data):
+        # We may have been closed or aborted while waiting for the lock.
+        precondition(not self.closed)
+        start = self._clock.seconds()
+        await self.ss.disk_io.submit(self._write_share_data, offset, data)
+        return self._written(start, offset, data)
+
+    def _write_share_data(self, offset, data):
+        """
+        Make sure we're not conflicting with existing data, then write it.
+        This only does file I/O, so it can run on a disk I/O thread.
+        """
         end = offset + len(data)
         for (chunk_start, chunk_stop, _) in self._already_written.ranges(offset, end):
             chunk_len = chunk_stop - chunk_start
@@ -409,7 +444,11 @@ class BucketWriter(object):
                 )
         self._sharefile.write_share_data(offset, data)
 
-        self._already_written.set(True, offset, end)
+    def _written(self, start, offset, data):
+        """
+        Record a successful write, return whether the upload is complete.
+        """
+        self._already_written.set(True, offset, offset + len(data))
         self.ss.add_latency("write", self._clock.seconds() - start)
         self.ss.count("write")
         return self._is_finished()
@@ -427,7 +466,42 @@ class BucketWriter(object):
         precondition(not self.closed)
         self._timeout.cancel()
         start = self._clock.seconds()
+        filelen = self._move_to_final_home()
+        self._closed(start, filelen)
+
+    def close_async(self):
+        """
+        Like ``close``, but the share file is moved into place on the storage
+        server's disk I/O executor, after any pending writes have finished.
 
+        :return Deferred[None]:
+        """
+        precondition(not self.closed)
+        return self._lock.run(self._close_async)
+
+    @async_to_deferred
+    async def _close_async(self):
+        precondition(not self.closed)
+        self._timeout.cancel()
+        start = self._clock.seconds()
+        # Consider ourselves closed right away, so that an abort (e.g. due to
+        # disconnection) can't remove the file while we're renaming it.
+        self.closed = True
+        try:
+            filelen = await self.ss.disk_io.submit(self._move_to_final_home)
+        except BaseException:
+            self._sharefile = None
+            self.ss.bucket_writer_closed(self, 0)
+            raise
+        self._closed(start, filelen)
+
+    def _move_to_final_home(self):
+        """
+        Move the finished share from incoming/ to its final location.  This
+        only does file I/O, so it can run on a disk I/O thread.
+
+        :return int: The size of the share file.
+        """
         fileutil.make_dirs(os.path.dirname(self.finalhome))
         fileutil.rename(self.incominghome, self.finalhome)
         try:
@@ -454,10 +528,11 @@ class BucketWriter(object):
             # exceptions, those are normal consequences of the
             # above-mentioned conditions.
             pass
+        return os.stat(self.finalhome)[stat.ST_SIZE]
+
+    def _closed(self, start, filelen):
         self._sharefile = None
         self.closed = True
-
-        filelen = os.stat(self.finalhome)[stat.ST_SIZE]
         self.ss.bucket_writer_closed(self, filelen)
         self.ss.add_latency("close", self._clock.seconds() - start)
         self.ss.count("close")
@@ -509,10 +584,12 @@ class FoolscapBucketWriter(Referenceable):  # type: ignore # warner/foolscap#78
         self._bucket_writer = bucket_writer
 
     def remote_write(self, offset, data):
-        self._bucket_writer.write(offset, data)
+        d = self._bucket_writer.write_async(offset, data)
+        d.addCallback(lambda finished: None)
+        return d
 
     def remote_close(self):
-        return self._bucket_writer.close()
+        return self._bucket_writer.close_async()
 
     def remote_abort(self):
         return self._bucket_writer.abort()
@@ -525,7 +602,11 @@ class BucketReader(object):
 
     def __init__(self, ss, sharefname, storage_index=None, shnum=None):
         self.ss = ss
-        self._share_file = ShareFile(sharefname)
+        read_cache = getattr(ss, "read_cache", None)
+        if read_cache is None:
+            self._share_file = ShareFile(sharefname)
+        else:
+            self._share_file = read_cache.open(sharefname)
         self.storage_index = storage_index
         self.shnum = shnum
 
@@ -541,6 +622,47 @@ class BucketReader(object):
         self.ss.count("read")
         return data
 
+    def read_async(self, offset, length):
+        """
+        Like ``read``, but the share file is read on the storage server's
+        disk I/O executor.
+
+        :return Deferred[bytes]:
+        """
+        start = time.time()
+        d = self.ss.disk_io.submit(
+            self._share_file.read_share_data, offset, length,
+        )
+        def _record(data):
+            self.ss.add_latency("read", time.time() - start)
+            self.ss.count("read")
+            return data
+        d.addCallback(_record)
+        return d
+
+    def readv_async(self, readv):
+        """
+        Read several ranges of the share with a single operation on the
+        storage server's disk I/O executor.
+
+        :param readv: A list of ``(offset, length)`` tuples.
+
+        :return Deferred[list[bytes]]: The data for each range, in order.
+            Like ``read``, ranges extending past the end of the share are
+            truncated.
+        """
+        start = time.time()
+        d = self.ss.disk_io.submit(
+            lambda: [self._share_file.read_share_data(offset, length)
+                     for (offset, length) in readv],
+        )
+        def _record(datav):
+            self.ss.add_latency("read", time.time() - start)
+            self.ss.count("read", len(readv))
+            return datav
+        d.addCallback(_record)
+        return d
+
     def advise_corrupt_share(self, reason):
         return self.ss.advise_corrupt_share(b"immutable",
                                             self.storage_index,
@@ -564,7 +686,10 @@ class FoolscapBucketReader(Referenceable):  # type: ignore # warner/foolscap#78
         self._bucket_reader = bucket_reader
 
     def remote_read(self, offset, length):
-        return self._bucket_reader.read(offset, length)
+        return self._bucket_reader.read_async(offset, length)
+
+    def remote_readv(self, readv):
+        return self._bucket_reader.readv_async(readv)
 
     def remote_advise_corrupt_share(self, reason):
         return self._bucket_reader.advise_corrupt_share(reason)
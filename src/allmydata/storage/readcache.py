@@ -0,0 +1,241 @@
+"""
+An in-memory cache for reads of popular immutable shares.
+
+Without it every read request for an immutable share opens the share file,
+parses its header to find where the share data ends, and reads the requested
+range from disk.  For a small set of popular files that work is repeated for
+every download, and the ranges asked for are almost always the same: the
+first segment's blocks and the hash trees.
+
+``ShareReadCache`` keeps a bounded number of share files open (with their
+headers already parsed) and an LRU of fixed-size blocks of share data, within
+a configurable byte budget.  An open share file is only reused while the
+file at its path has the same device, inode, size and modification and
+change times, and cached blocks belong to the open file they were read
+through, so a share that is deleted and uploaded again is never served from
+stale cache entries.  (Changing a share's leases also counts as replacing
+it, which costs a re-read but is otherwise harmless.)
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from itertools import count
+from collections import OrderedDict
+from typing import BinaryIO, Optional
+
+from allmydata.storage.immutable import ShareFile
+from allmydata.util.assertutil import precondition
+
+
+class ShareReadCache(object):
+    """
+    Cache open immutable share files and blocks of their data.
+
+    Reads happen on the storage server's disk I/O threads, so all of the
+    bookkeeping is done under a lock; the disk reads themselves are not.
+
+    :ivar max_bytes: The most share data to keep in memory.
+    :ivar block_size: Share data is cached in aligned blocks of this size.
+    :ivar max_open_files: How many share files to keep open.
+    :ivar max_cached_read: Reads larger than this bypass the block cache, so
+        that one large download doesn't evict the hot set.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        block_size: int = 64 * 1024,
+        max_open_files: int = 128,
+        max_cached_read: int = 1024 * 1024,
+    ):
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.max_open_files = max_open_files
+        self.max_cached_read = max_cached_read
+        self._lock = threading.Lock()
+        # filename -> CachedShareFile, least recently used first:
+        self._files: OrderedDict[str, CachedShareFile] = OrderedDict()
+        # (open file number, block number) -> data, least recently used
+        # first:
+        self._blocks: OrderedDict[tuple[int, int], bytes] = OrderedDict()
+        # open file number -> the block numbers cached for it:
+        self._file_blocks: dict[int, set[int]] = {}
+        self._file_numbers = count()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def open(self, filename: str) -> CachedShareFile:
+        """
+        Return a ``ShareFile``-like reader for the immutable share at the
+        given path, reusing an already open one if the file hasn't been
+        replaced since.
+        """
+        st = os.stat(filename)
+        identity = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns,
+                    st.st_ctime_ns)
+        with self._lock:
+            share = self._files.get(filename)
+            if share is not None and share.identity == identity:
+                self._files.move_to_end(filename)
+                return share
+            number = next(self._file_numbers)
+
+        share = CachedShareFile(self, ShareFile(filename), number)
+        with self._lock:
+            evicted = [self._files.pop(filename, None)]
+            self._files[filename] = share
+            while len(self._files) > self.max_open_files:
+                evicted.append(self._files.popitem(last=False)[1])
+            for old in evicted:
+                if old is not None:
+                    old.evicted = True
+                    self._forget_blocks(old.number)
+        for old in evicted:
+            if old is not None:
+                # BucketReaders still using it can go on reading it.
+                old.close()
+        return share
+
+    def get_stats(self) -> dict[str, int]:
+        """
+        :return: Counters for the storage server's statistics.
+        """
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "bytes": self._bytes,
+                "open_files": len(self._files),
+            }
+
+    def _forget_blocks(self, number: int) -> None:
+        # Called with the lock held.
+        for blocknum in self._file_blocks.pop(number, ()):
+            self._bytes -= len(self._blocks.pop((number, blocknum)))
+
+    def _get_block(self, key: tuple[int, int]) -> Optional[bytes]:
+        with self._lock:
+            data = self._blocks.get(key)
+            if data is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+                self._blocks.move_to_end(key)
+            return data
+
+    def _add_block(self, share: CachedShareFile, blocknum: int,
+                   data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        key = (share.number, blocknum)
+        with self._lock:
+            if share.evicted or key in self._blocks:
+                # If its file has been evicted, nothing could find the block
+                # again.
+                return
+            self._blocks[key] = data
+            self._file_blocks.setdefault(share.number, set()).add(blocknum)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                ((evicted_number, evicted_blocknum), evicted) = self._blocks.popitem(last=False)
+                self._file_blocks[evicted_number].discard(evicted_blocknum)
+                self._bytes -= len(evicted)
+                self._evictions += 1
+
+
+class CachedShareFile(object):
+    """
+    The parts of ``ShareFile`` that ``BucketReader`` uses, reading share data
+    through a ``ShareReadCache`` and a file handle which stays open until the
+    cache evicts it.
+
+    :ivar identity: The ``os.stat()`` fields that must be unchanged for the
+        file at ``home`` to still be this one.
+    :ivar number: Identifies this open file, and so its blocks, in the cache.
+    :ivar evicted: Whether the cache has let go of this file.
+    """
+
+    def __init__(self, cache: ShareReadCache, share_file: ShareFile,
+                 number: int):
+        self._cache = cache
+        self._share_file = share_file
+        self.number = number
+        self.evicted = False
+        self.home = share_file.home
+        self._file: BinaryIO = open(share_file.home, "rb")
+        st = os.fstat(self._file.fileno())
+        self.identity = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns,
+                         st.st_ctime_ns)
+        # Guards the file handle: how many reads are using it, and (where
+        # there's no os.pread()) its position.
+        self._file_lock = threading.Lock()
+        self._reads = 0
+        self._closed = False
+        # Leases are stored after the share data, so adding them doesn't
+        # move its end.
+        self._data_offset = share_file._data_offset
+        self._data_end = share_file._data_offset + share_file.get_length()
+
+    def get_length(self) -> int:
+        return self._share_file.get_length()
+
+    def close(self) -> None:
+        """
+        Close the file handle, as soon as no reads are using it.  Any later
+        reads open the file afresh, as ``ShareFile`` does.
+        """
+        with self._file_lock:
+            self._closed = True
+            if not self._reads:
+                self._file.close()
+
+    def _read(self, offset: int, length: int) -> bytes:
+        with self._file_lock:
+            if not self._closed:
+                if not hasattr(os, "pread"):
+                    self._file.seek(offset)
+                    return self._file.read(length)
+                self._reads += 1
+                fileno = self._file.fileno()
+            else:
+                fileno = None
+        if fileno is None:
+            with open(self.home, "rb") as f:
+                f.seek(offset)
+                return f.read(length)
+        try:
+            return os.pread(fileno, length, offset)
+        finally:
+            with self._file_lock:
+                self._reads -= 1
+                if self._closed and not self._reads:
+                    self._file.close()
+
+    def read_share_data(self, offset: int, length: int) -> bytes:
+        precondition(offset >= 0)
+        # Same truncation rules as ShareFile.read_share_data().
+        start = self._data_offset + offset
+        end = min(start + length, self._data_end)
+        if end <= start:
+            return b""
+        if end - start > self._cache.max_cached_read:
+            return self._read(start, end - start)
+
+        block_size = self._cache.block_size
+        pieces = []
+        for blocknum in range(start // block_size, (end - 1) // block_size + 1):
+            block = self._cache._get_block((self.number, blocknum))
+            if block is None:
+                block_start = blocknum * block_size
+                block = self._read(
+                    block_start, min(block_size, self._data_end - block_start),
+                )
+                self._cache._add_block(self, blocknum, block)
+            pieces.append(block)
+        first = (start // block_size) * block_size
+        return b"".join(pieces)[start - first:end - first]
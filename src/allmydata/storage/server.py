@@ -15,6 +15,7 @@ from twisted.internet import reactor
 from zope.interface import implementer
 from allmydata.interfaces import RIStorageServer, IStatsProducer
 from allmydata.util import fileutil, idlib, log, time_format
+from allmydata.util.deferredutil import async_to_deferred, gatherResults
 import allmydata # for __full_version__
 
 from allmydata.storage.common import si_b2a, si_a2b, storage_index_to_dir
@@ -29,6 +30,15 @@ from allmydata.storage.immutable import (
 )
 from allmydata.storage.crawler import BucketCountingCrawler
 from allmydata.storage.expirer import LeaseCheckingCrawler
+from allmydata.storage.diskio import DiskIOExecutor
+from allmydata.storage.readcache import ShareReadCache
+from allmydata.storage.shareindex import (
+    SHARE_INDEX_FILENAME,
+    IndexedShare,
+    ShareIndex,
+    ShareIndexCrawler,
+    lease_expirations,
+)
 
 # storage/
 # storage/shares/incoming
@@ -48,6 +58,10 @@ NUM_RE=re.compile("^[0-9]+$")
 # For now it's not actually configurable, but maybe someday.
 DEFAULT_RENEWAL_TIME = 31 * 24 * 60 * 60
 
+# How many storage indexes add_leases_async() updates at once.  The rest of
+# a batch waits, rather than filling the disk I/O queue.
+MAX_CONCURRENT_LEASE_UPDATES = 16
+
 
 @implementer(IStatsProducer)
 class StorageServer(service.MultiService):
@@ -68,7 +82,11 @@ class StorageServer(service.MultiService):
                  expiration_override_lease_duration=None,
                  expiration_cutoff_date=None,
                  expiration_sharetypes=("mutable", "immutable"),
-                 clock=reactor):
+                 clock=reactor,
+                 disk_io_threads=0,
+                 disk_io_max_queue_depth=1000,
+                 share_index=False,
+                 read_cache_size=0):
         service.MultiService.__init__(self)
         assert isinstance(nodeid, bytes)
         assert len(nodeid) == 20
@@ -107,9 +125,35 @@ class StorageServer(service.MultiService):
                           "add-lease": [], # both
                           "renew": [],
                           "cancel": [],
+                          "disk-io-queue-depth": [], # disk I/O executor
+                          "disk-io-wait": [],
+                          "disk-io-run": [],
                           }
+        self._clock = clock
+
+        # Share file I/O done on behalf of remote clients happens here, so
+        # that a slow disk doesn't block the reactor:
+        self.disk_io = DiskIOExecutor(
+            self.add_latency,
+            clock,
+            threads=disk_io_threads,
+            max_queue_depth=disk_io_max_queue_depth,
+        )
+        self.disk_io.setServiceParent(self)
+
         self.add_bucket_counter()
 
+        # Optionally, share lookups are answered from an on-disk index
+        # instead of by listing bucket directories:
+        self.share_index = None
+        if share_index:
+            self.add_share_index()
+
+        # Optionally, popular immutable shares are read from memory:
+        self.read_cache = None
+        if read_cache_size:
+            self.read_cache = ShareReadCache(read_cache_size)
+
         statefile = os.path.join(self.storedir, "lease_checker.state")
         historyfile = os.path.join(self.storedir, "lease_checker.history")
         klass = self.LeaseCheckerClass
@@ -119,7 +163,6 @@ class StorageServer(service.MultiService):
                                    expiration_cutoff_date,
                                    expiration_sharetypes)
         self.lease_checker.setServiceParent(self)
-        self._clock = clock
 
         # Map in-progress filesystem path -> BucketWriter:
         self._bucket_writers = {}  # type: Dict[str,BucketWriter]
@@ -146,6 +189,86 @@ class StorageServer(service.MultiService):
         self.bucket_counter = BucketCountingCrawler(self, statefile)
         self.bucket_counter.setServiceParent(self)
 
+    def add_share_index(self):
+        self.share_index = ShareIndex(
+            os.path.join(self.storedir, SHARE_INDEX_FILENAME)
+        )
+        statefile = os.path.join(self.storedir, "share_index.state")
+        self.share_index_crawler = ShareIndexCrawler(
+            self, statefile, self.share_index
+        )
+        self.share_index_crawler.setServiceParent(self)
+
+    def _use_share_index(self):
+        return self.share_index is not None and self.share_index.is_complete()
+
+    def _share_index_key(self, filename):
+        """
+        :return tuple[bytes, int]: The storage index and share number of the
+            share file with the given name.
+        """
+        bucketdir, shnum_s = os.path.split(filename)
+        return si_a2b(os.path.basename(bucketdir).encode("ascii")), int(shnum_s)
+
+    def _index_share(self, filename, sharetype, length, lease_expirations=None):
+        """
+        Record in the share index, if any, that a share was created or
+        modified.
+
+        :param Optional[list[int]] lease_expirations: The expiration times of
+            all of the share's leases, if known.
+        """
+        if self.share_index is not None:
+            storage_index, shnum = self._share_index_key(filename)
+            self.share_index.add_share(storage_index, IndexedShare(
+                shnum=shnum,
+                sharetype=sharetype,
+                length=length,
+                lease_expiration=max(lease_expirations or [], default=0),
+            ), lease_expirations)
+
+    def _unindex_share(self, filename):
+        """
+        Record in the share index, if any, that a share was deleted.
+        """
+        if self.share_index is not None:
+            self.share_index.remove_share(*self._share_index_key(filename))
+
+    def _index_leases(self, share):
+        """
+        Record in the share index, if any, the leases of a share after one
+        was added or renewed.
+        """
+        if self.share_index is not None:
+            storage_index, shnum = self._share_index_key(share.home)
+            self.share_index.set_leases(
+                storage_index, shnum, lease_expirations(share),
+            )
+
+    def get_lease_age_histogram(self):
+        """
+        Count the leases on this server by age, using the share index.
+
+        :return: ``None`` if the share index isn't enabled and complete,
+            otherwise a list of ``(min_age, max_age, count)`` tuples in
+            one-day buckets.
+        """
+        if not self._use_share_index():
+            return None
+        return self.share_index.lease_age_histogram(self._clock.seconds())
+
+    def reindex_bucket(self, storage_index):
+        """
+        Bring the share index, if any, up to date with the share files for
+        the given storage index.  The lease checker calls this after it may
+        have deleted some.
+        """
+        if self.share_index is not None:
+            self.share_index.reindex_bucket(
+                storage_index,
+                os.path.join(self.sharedir, storage_index_to_dir(storage_index)),
+            )
+
     def count(self, name, delta=1):
         if self.stats_provider:
             self.stats_provider.count("storage_server." + name, delta)
@@ -166,7 +289,12 @@ class StorageServer(service.MultiService):
         samples for a given percentile to be interpreted unambiguously
         that percentile will be reported as None. If no samples have been
         collected for the given category, then that category name will
-        not be present in the return value. """
+        not be present in the return value.
+
+        The disk I/O executor contributes three categories: the time
+        operations spent queued (disk-io-wait), the time they took to run
+        (disk-io-run), and the number of outstanding operations seen by each
+        new submission (disk-io-queue-depth, a count rather than seconds). """
         # note that Amazon's Dynamo paper says they use 99.9% percentile.
         output = {}
         for category in self.latencies:
@@ -199,6 +327,10 @@ class StorageServer(service.MultiService):
     def log(self, *args, **kwargs):
         if "facility" not in kwargs:
             kwargs["facility"] = "tahoe.storage"
+        if self.disk_io.in_io_thread():
+            # Logging isn't thread-safe; let the reactor thread do it.
+            self.disk_io.call_in_reactor(log.msg, *args, **kwargs)
+            return None
         return log.msg(*args, **kwargs)
 
     def _clean_incomplete(self):
@@ -209,6 +341,10 @@ class StorageServer(service.MultiService):
         # contains numeric values.
         stats = { 'storage_server.allocated': self.allocated_size(), }
         stats['storage_server.reserved_space'] = self.reserved_space
+        stats['storage_server.disk_io.queue_depth'] = self.disk_io.queue_depth()
+        if self.read_cache is not None:
+            for name, v in self.read_cache.get_stats().items():
+                stats['storage_server.read_cache.%s' % (name,)] = v
         for category,ld in self.get_latencies().items():
             for name,v in ld.items():
                 stats['storage_server.latencies.%s.%s' % (category, name)] = v
@@ -234,8 +370,11 @@ class StorageServer(service.MultiService):
             writeable = False
 
         stats['storage_server.accepting_immutable_shares'] = int(writeable)
-        s = self.bucket_counter.get_state()
-        bucket_count = s.get("last-complete-bucket-count")
+        if self._use_share_index():
+            bucket_count = self.share_index.bucket_count()
+        else:
+            s = self.bucket_counter.get_state()
+            bucket_count = s.get("last-complete-bucket-count")
         if bucket_count:
             stats['storage_server.total_bucket_count'] = bucket_count
         return stats
@@ -270,6 +409,7 @@ class StorageServer(service.MultiService):
                       b"delete-mutable-shares-with-zero-length-writev": True,
                       b"fills-holes-with-zero-bytes": True,
                       b"prevents-read-past-end-of-share-data": True,
+                      b"immutable-read-vectors": True,
                       },
                     b"application-version": allmydata.__full_version__.encode("utf-8"),
                     }
@@ -365,6 +505,16 @@ class StorageServer(service.MultiService):
         return set(alreadygot), bucketwriters
 
     def _iter_share_files(self, storage_index):
+        if self._use_share_index():
+            # The index knows the share types, so skip the header reads.
+            storagedir = os.path.join(self.sharedir, storage_index_to_dir(storage_index))
+            for share in self.share_index.get_shares(storage_index):
+                filename = os.path.join(storagedir, "%d" % share.shnum)
+                if share.sharetype == "mutable":
+                    yield MutableShareFile(filename, self)
+                else:
+                    yield ShareFile(filename)
+            return
         for shnum, filename in self.get_shares(storage_index):
             with open(filename, 'rb') as f:
                 header = f.read(32)
@@ -393,6 +543,69 @@ class StorageServer(service.MultiService):
         self.add_latency("add-lease", self._clock.seconds() - start)
         return None
 
+    def add_lease_async(self, storage_index, renew_secret, cancel_secret,
+                        owner_num=1):
+        """
+        Like ``add_lease``, but the share files are read and updated on the
+        disk I/O executor.
+
+        :return Deferred[None]:
+        """
+        self.count("add-lease")
+        new_expire_time = self._clock.seconds() + DEFAULT_RENEWAL_TIME
+        lease_info = LeaseInfo(owner_num,
+                               renew_secret, cancel_secret,
+                               new_expire_time, self.my_nodeid)
+        return self._timed_disk_io(
+            "add-lease",
+            self._add_or_renew_leases,
+            self._iter_share_files(storage_index),
+            lease_info,
+            key=storage_index,
+        ).addCallback(lambda found: None)
+
+    @async_to_deferred
+    async def add_leases_async(self, leases, owner_num=1):
+        """
+        Like ``add_lease_async``, for many storage indexes at once.
+
+        :param leases: ``(storage_index, renew_secret, cancel_secret)``
+            tuples.
+
+        :return Deferred[list[bool | Exception]]: For each lease, whether
+            there were any shares to put it on, or the exception raised while
+            doing so.  A failure for one storage index (a corrupt share file,
+            say) doesn't stop the others being updated.
+        """
+        self.count("add-lease", len(leases))
+        new_expire_time = self._clock.seconds() + DEFAULT_RENEWAL_TIME
+        results = []
+        for i in range(0, len(leases), MAX_CONCURRENT_LEASE_UPDATES):
+            updates = [
+                self._timed_disk_io(
+                    "add-lease",
+                    self._add_or_renew_leases,
+                    self._iter_share_files(storage_index),
+                    LeaseInfo(owner_num, renew_secret, cancel_secret,
+                              new_expire_time, self.my_nodeid),
+                    key=storage_index,
+                ).addErrback(self._lease_update_failed, storage_index)
+                for (storage_index, renew_secret, cancel_secret)
+                in leases[i:i + MAX_CONCURRENT_LEASE_UPDATES]
+            ]
+            results.extend(await gatherResults(updates))
+        return results
+
+    def _lease_update_failed(self, failure, storage_index):
+        """
+        Log a failure to update the leases of one storage index in
+        ``add_leases_async``, and return its exception as that index's result.
+        """
+        log.msg(format="storage: failed to add a lease to %(si)s",
+                si=si_b2a(storage_index), failure=failure,
+                level=log.UNUSUAL, facility="tahoe.storage")
+        return failure.value
+
     def renew_lease(self, storage_index, renew_secret):
         start = self._clock.seconds()
         self.count("renew")
@@ -401,6 +614,7 @@ class StorageServer(service.MultiService):
         for sf in self._iter_share_files(storage_index):
             found_buckets = True
             sf.renew_lease(renew_secret, new_expire_time)
+            self._index_leases(sf)
         self.add_latency("renew", self._clock.seconds() - start)
         if not found_buckets:
             raise IndexError("no such lease to renew")
@@ -409,6 +623,10 @@ class StorageServer(service.MultiService):
         if self.stats_provider:
             self.stats_provider.count('storage_server.bytes_added', consumed_size)
         del self._bucket_writers[bw.incominghome]
+        if consumed_size:
+            # (Zero means the share never made it to its final home.)
+            self._index_share(bw.finalhome, "immutable", bw.allocated_size(),
+                              [int(bw.lease_expiration)])
         for handler in self._call_on_bucket_writer_close:
             handler(bw)
 
@@ -418,6 +636,32 @@ class StorageServer(service.MultiService):
         """
         self._call_on_bucket_writer_close.append(handler)
 
+    def _timed_disk_io(self, category, f, *args, **kwargs):
+        """
+        Run ``f`` on the disk I/O executor, recording how long it took
+        (including time spent queued) under the given latency category.
+
+        :return Deferred: Fires with the result of ``f``.
+        """
+        start = self._clock.seconds()
+        d = self.disk_io.submit(f, *args, **kwargs)
+        def _record(result):
+            self.add_latency(category, self._clock.seconds() - start)
+            return result
+        d.addCallback(_record)
+        return d
+
+    def list_shares_async(self, storage_index):
+        """
+        Like ``get_shares``, but the directory is listed on the disk I/O
+        executor.
+
+        :return Deferred[list[tuple[int, str]]]:
+        """
+        return self.disk_io.submit(
+            lambda: list(self.get_shares(storage_index)),
+        )
+
     def get_shares(self, storage_index) -> Iterable[tuple[int, str]]:
         """
         Return an iterable of (shnum, pathname) tuples for files that hold
@@ -425,6 +669,10 @@ class StorageServer(service.MultiService):
         the integer form of the last component of 'pathname'.
         """
         storagedir = os.path.join(self.sharedir, storage_index_to_dir(storage_index))
+        if self._use_share_index():
+            for share in self.share_index.get_shares(storage_index):
+                yield (share.shnum, os.path.join(storagedir, "%d" % share.shnum))
+            return
         try:
             for f in os.listdir(storagedir):
                 if NUM_RE.match(f):
@@ -442,11 +690,33 @@ class StorageServer(service.MultiService):
         self.count("get")
         si_s = si_b2a(storage_index)
         log.msg("storage: get_buckets %r" % si_s)
+        bucketreaders = self._open_bucket_readers(storage_index)
+        self.add_latency("get", self._clock.seconds() - start)
+        return bucketreaders
+
+    def get_buckets_async(self, storage_index):
+        """
+        Like ``get_buckets``, but the directory listing and share header
+        reads happen on the disk I/O executor.
+
+        :return Deferred[dict[int, BucketReader]]:
+        """
+        self.count("get")
+        si_s = si_b2a(storage_index)
+        log.msg("storage: get_buckets %r" % si_s)
+        return self._timed_disk_io(
+            "get", self._open_bucket_readers, storage_index,
+        )
+
+    def _open_bucket_readers(self, storage_index):
+        """
+        :return dict[int, BucketReader]: Readers for all of the immutable
+            shares held for the given storage index.
+        """
         bucketreaders = {} # k: sharenum, v: BucketReader
         for shnum, filename in self.get_shares(storage_index):
             bucketreaders[shnum] = BucketReader(self, filename,
                                                 storage_index, shnum)
-        self.add_latency("get", self._clock.seconds() - start)
         return bucketreaders
 
     def get_leases(self, storage_index):
@@ -479,12 +749,11 @@ class StorageServer(service.MultiService):
             return share.get_leases()
         return []
 
-    def _collect_mutable_shares_for_storage_index(self, bucketdir, write_enabler, si_s):
+    def _collect_mutable_shares_for_storage_index(self, storage_index, write_enabler, si_s):
         """
         Gather up existing mutable shares for the given storage index.
 
-        :param bytes bucketdir: The filesystem path containing shares for the
-            given storage index.
+        :param bytes storage_index: The storage index.
 
         :param bytes write_enabler: The write enabler secret for the shares.
 
@@ -497,17 +766,10 @@ class StorageServer(service.MultiService):
             from integer share numbers to ``MutableShareFile`` instances.
         """
         shares = {}
-        if os.path.isdir(bucketdir):
-            # shares exist if there is a file for them
-            for sharenum_s in os.listdir(bucketdir):
-                try:
-                    sharenum = int(sharenum_s)
-                except ValueError:
-                    continue
-                filename = os.path.join(bucketdir, sharenum_s)
-                msf = MutableShareFile(filename, self)
-                msf.check_write_enabler(write_enabler, si_s)
-                shares[sharenum] = msf
+        for sharenum, filename in self.get_shares(storage_index):
+            msf = MutableShareFile(filename, self)
+            msf.check_write_enabler(write_enabler, si_s)
+            shares[sharenum] = msf
         return shares
 
     def _evaluate_test_vectors(self, test_and_write_vectors, shares):
@@ -582,6 +844,7 @@ class StorageServer(service.MultiService):
             if new_length == 0:
                 if sharenum in shares:
                     shares[sharenum].unlink()
+                    self._unindex_share(shares[sharenum].home)
             else:
                 if sharenum not in shares:
                     # allocate a new share
@@ -591,6 +854,9 @@ class StorageServer(service.MultiService):
                     shares[sharenum] = share
                 shares[sharenum].writev(datav, new_length)
                 remaining_shares[sharenum] = shares[sharenum]
+                if self.share_index is not None:
+                    self._index_share(shares[sharenum].home, "mutable",
+                                      shares[sharenum].get_length())
 
             if new_length == 0:
                 # delete bucket directories that exist but are empty.  They
@@ -619,9 +885,15 @@ class StorageServer(service.MultiService):
             to put the lease onto.
 
         :param LeaseInfo lease_info: The lease to put on the shares.
+
+        :return bool: Whether there were any shares.
         """
+        found = False
         for share in shares:
+            found = True
             share.add_or_renew_lease(self.get_available_space(), lease_info)
+            self._index_leases(share)
+        return found
 
     def slot_testv_and_readv_and_writev(  # type: ignore # warner/foolscap#78
             self,
@@ -647,6 +919,56 @@ class StorageServer(service.MultiService):
         self.count("writev")
         si_s = si_b2a(storage_index)
         log.msg("storage: slot_writev %r" % si_s)
+        result = self._apply_slot_vectors(
+            storage_index,
+            secrets,
+            test_and_write_vectors,
+            read_vector,
+            renew_leases,
+        )
+        self.add_latency("writev", self._clock.seconds() - start)
+        return result
+
+    def slot_testv_and_readv_and_writev_async(
+            self,
+            storage_index,
+            secrets,
+            test_and_write_vectors,
+            read_vector,
+            renew_leases=True,
+    ):
+        """
+        Like ``slot_testv_and_readv_and_writev``, but the share files are
+        read and written on the disk I/O executor.  Operations on the same
+        slot are never run concurrently.
+
+        :return Deferred: Fires with the same result as the synchronous
+            version.
+        """
+        self.count("writev")
+        si_s = si_b2a(storage_index)
+        log.msg("storage: slot_writev %r" % si_s)
+        return self._timed_disk_io(
+            "writev",
+            self._apply_slot_vectors,
+            storage_index,
+            secrets,
+            test_and_write_vectors,
+            read_vector,
+            renew_leases,
+            key=storage_index,
+        )
+
+    def _apply_slot_vectors(self, storage_index, secrets,
+                            test_and_write_vectors, read_vector,
+                            renew_leases):
+        """
+        Do the filesystem part of ``slot_testv_and_readv_and_writev``.
+
+        :return tuple[bool, dict[int, list[bytes]]]: Whether the test vectors
+            passed, and the data read before any writes were applied.
+        """
+        si_s = si_b2a(storage_index)
         si_dir = storage_index_to_dir(storage_index)
         (write_enabler, renew_secret, cancel_secret) = secrets
         bucketdir = os.path.join(self.sharedir, si_dir)
@@ -654,7 +976,7 @@ class StorageServer(service.MultiService):
         # If collection succeeds we know the write_enabler is good for all
         # existing shares.
         shares = self._collect_mutable_shares_for_storage_index(
-            bucketdir,
+            storage_index,
             write_enabler,
             si_s,
         )
@@ -684,7 +1006,6 @@ class StorageServer(service.MultiService):
                 self._add_or_renew_leases(remaining_shares.values(), lease_info)
 
         # all done
-        self.add_latency("writev", self._clock.seconds() - start)
         return (testv_is_good, read_data)
 
     def _allocate_slot_share(self, bucketdir, secrets, sharenum,
@@ -699,18 +1020,8 @@ class StorageServer(service.MultiService):
 
     def enumerate_mutable_shares(self, storage_index: bytes) -> set[int]:
         """Return all share numbers for the given mutable."""
-        si_dir = storage_index_to_dir(storage_index)
         # shares exist if there is a file for them
-        bucketdir = os.path.join(self.sharedir, si_dir)
-        if not os.path.isdir(bucketdir):
-            return set()
-        result = set()
-        for sharenum_s in os.listdir(bucketdir):
-            try:
-                result.add(int(sharenum_s))
-            except ValueError:
-                continue
-        return result
+        return set(sharenum for (sharenum, _) in self.get_shares(storage_index))
 
     def slot_readv(self, storage_index, shares, readv):
         start = self._clock.seconds()
@@ -718,25 +1029,48 @@ class StorageServer(service.MultiService):
         si_s = si_b2a(storage_index)
         lp = log.msg("storage: slot_readv %r %r" % (si_s, shares),
                      facility="tahoe.storage", level=log.OPERATIONAL)
-        si_dir = storage_index_to_dir(storage_index)
-        # shares exist if there is a file for them
-        bucketdir = os.path.join(self.sharedir, si_dir)
-        if not os.path.isdir(bucketdir):
-            self.add_latency("readv", self._clock.seconds() - start)
-            return {}
+        datavs = self._read_slot_vectors(storage_index, shares, readv)
+        log.msg("returning shares %s" % (list(datavs.keys()),),
+                facility="tahoe.storage", level=log.NOISY, parent=lp)
+        self.add_latency("readv", self._clock.seconds() - start)
+        return datavs
+
+    def slot_readv_async(self, storage_index, shares, readv):
+        """
+        Like ``slot_readv``, but the share files are read on the disk I/O
+        executor.
+
+        :return Deferred[dict[int, list[bytes]]]:
+        """
+        self.count("readv")
+        si_s = si_b2a(storage_index)
+        lp = log.msg("storage: slot_readv %r %r" % (si_s, shares),
+                     facility="tahoe.storage", level=log.OPERATIONAL)
+        d = self._timed_disk_io(
+            "readv",
+            self._read_slot_vectors,
+            storage_index,
+            shares,
+            readv,
+            key=storage_index,
+        )
+        def _log(datavs):
+            log.msg("returning shares %s" % (list(datavs.keys()),),
+                    facility="tahoe.storage", level=log.NOISY, parent=lp)
+            return datavs
+        d.addCallback(_log)
+        return d
+
+    def _read_slot_vectors(self, storage_index, shares, readv):
+        """
+        Do the filesystem part of ``slot_readv``.
+        """
         datavs = {}
-        for sharenum_s in os.listdir(bucketdir):
-            try:
-                sharenum = int(sharenum_s)
-            except ValueError:
-                continue
+        # shares exist if there is a file for them
+        for sharenum, filename in self.get_shares(storage_index):
             if sharenum in shares or not shares:
-                filename = os.path.join(bucketdir, sharenum_s)
                 msf = MutableShareFile(filename, self)
                 datavs[sharenum] = msf.readv(readv)
-        log.msg("returning shares %s" % (list(datavs.keys()),),
-                facility="tahoe.storage", level=log.NOISY, parent=lp)
-        self.add_latency("readv", self._clock.seconds() - start)
         return datavs
 
     def _share_exists(self, storage_index, shnum):
@@ -862,22 +1196,25 @@ class FoolscapStorageServer(Referenceable):  # type: ignore # warner/foolscap#78
 
     def remote_add_lease(self, storage_index, renew_secret, cancel_secret,
                          owner_num=1):
-        return self._server.add_lease(storage_index, renew_secret, cancel_secret)
+        return self._server.add_lease_async(storage_index, renew_secret,
+                                            cancel_secret)
 
     def remote_renew_lease(self, storage_index, renew_secret):
         return self._server.renew_lease(storage_index, renew_secret)
 
     def remote_get_buckets(self, storage_index):
-        return {
+        d = self._server.get_buckets_async(storage_index)
+        d.addCallback(lambda buckets: {
             k: FoolscapBucketReader(bucket)
-            for (k, bucket) in self._server.get_buckets(storage_index).items()
-        }
+            for (k, bucket) in buckets.items()
+        })
+        return d
 
     def remote_slot_testv_and_readv_and_writev(self, storage_index,
                                                secrets,
                                                test_and_write_vectors,
                                                read_vector):
-        return self._server.slot_testv_and_readv_and_writev(
+        return self._server.slot_testv_and_readv_and_writev_async(
             storage_index,
             secrets,
             test_and_write_vectors,
@@ -886,7 +1223,7 @@ class FoolscapStorageServer(Referenceable):  # type: ignore # warner/foolscap#78
         )
 
     def remote_slot_readv(self, storage_index, shares, readv):
-        return self._server.slot_readv(storage_index, shares, readv)
+        return self._server.slot_readv_async(storage_index, shares, readv)
 
     def remote_advise_corrupt_share(self, share_type, storage_index, shnum,
                                     reason):
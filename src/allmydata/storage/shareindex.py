@@ -0,0 +1,553 @@
+"""
+An on-disk index of the shares held by a storage server.
+
+Finding the shares for a storage index normally means listing its bucket
+directory and reading the header of every share file in it.  On a server
+with tens of millions of shares the kernel can't keep all of those
+directory entries cached, so every lookup (including the very common ones
+for storage indexes we don't hold at all) goes to disk.
+
+``ShareIndex`` keeps a SQLite table mapping each storage index to its share
+numbers, share types, lengths and latest lease expiration time, plus a table
+with the expiration time of every lease, so that the lease checker can find
+shares with expired leases with a range query instead of by opening every
+share file.  The storage server updates it whenever a share or lease is
+created, modified or deleted, and ``ShareIndexCrawler`` builds it in the
+background and then periodically reconciles it with what is actually on
+disk.  The index is only consulted
+once it is *complete*, that is once a full crawl (or ``tahoe admin
+rebuild-share-index``) has finished; until then lookups use the filesystem.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Iterable, Optional, Sequence
+
+from attrs import frozen
+
+from allmydata.storage.common import si_a2b, si_b2a
+from allmydata.storage.crawler import ShareCrawler
+from allmydata.storage.shares import get_share_file
+from allmydata.util import dbutil
+
+SHARE_INDEX_FILENAME = "share_index.sqlite"
+
+SCHEMA_v1 = """
+CREATE TABLE version
+(
+ version INTEGER  -- contains one row, set to 1
+);
+
+CREATE TABLE shares
+(
+ storage_index VARCHAR(26) NOT NULL, -- base32
+ shnum INTEGER NOT NULL,
+ sharetype VARCHAR(9) NOT NULL,      -- 'immutable' or 'mutable'
+ length INTEGER NOT NULL,            -- length of the share data
+ lease_expiration INTEGER NOT NULL,  -- latest lease expiration time, or 0
+ PRIMARY KEY (storage_index, shnum)
+);
+
+CREATE TABLE state
+(
+ name VARCHAR(32) PRIMARY KEY,
+ value INTEGER
+);
+"""
+
+TABLE_LEASES = """
+CREATE TABLE leases
+(
+ storage_index VARCHAR(26) NOT NULL,
+ shnum INTEGER NOT NULL,
+ expiration_time INTEGER NOT NULL
+);
+
+CREATE INDEX leases_by_share ON leases (storage_index, shnum);
+CREATE INDEX leases_by_expiration ON leases (expiration_time);
+"""
+
+SCHEMA_v2 = SCHEMA_v1 + TABLE_LEASES
+
+# An index built before leases were recorded has to be rebuilt.
+UPDATE_v1_to_v2 = TABLE_LEASES + """
+UPDATE state SET value=0 WHERE name='complete';
+UPDATE version SET version=2;
+"""
+
+UPDATERS = {
+    2: UPDATE_v1_to_v2,
+}
+
+# Lease ages are a guess, based on the fixed lease duration (see
+# ``LeaseInfo.get_grant_renew_time_time``).
+_LEASE_DURATION = 31*24*60*60
+
+
+@frozen
+class IndexedShare(object):
+    """
+    What the index knows about one share.
+    """
+    shnum: int
+    sharetype: str
+    length: int
+    lease_expiration: int
+
+
+def _si_key(storage_index: bytes) -> str:
+    return str(si_b2a(storage_index), "ascii")
+
+
+def lease_expirations(sharefile) -> list[int]:
+    """
+    Return the expiration times of the leases on an open share file.
+    """
+    return [int(lease.get_expiration_time()) for lease in sharefile.get_leases()]
+
+
+def read_bucket(bucketdir: str) -> list[tuple[IndexedShare, list[int]]]:
+    """
+    Read the index entries, and the expiration time of each lease, for the
+    shares in one bucket directory from disk.  Files that aren't share files
+    are ignored.
+    """
+    try:
+        names = os.listdir(bucketdir)
+    except OSError:
+        return []
+    shares = []
+    for name in names:
+        try:
+            shnum = int(name)
+        except ValueError:
+            continue
+        try:
+            sf = get_share_file(os.path.join(bucketdir, name))
+            length = sf.get_length()
+            expirations = lease_expirations(sf)
+        except Exception:
+            # Corrupt or otherwise unreadable; the lease checker reports
+            # these.  Leave it out rather than guessing.
+            continue
+        shares.append((IndexedShare(
+            shnum=shnum,
+            sharetype=sf.sharetype,
+            length=length,
+            lease_expiration=max(expirations, default=0),
+        ), expirations))
+    return shares
+
+
+class ShareIndex(object):
+    """
+    The SQLite share index for one storage directory.
+
+    All methods are safe to call from the disk I/O threads as well as the
+    reactor thread.
+    """
+
+    def __init__(self, dbfile: str):
+        (self._sqlite, self._db) = dbutil.get_db(
+            dbfile, create_version=(SCHEMA_v2, 2), updaters=UPDATERS,
+            dbname="share index", check_same_thread=False,
+        )
+        self._lock = threading.Lock()
+        self._complete = self._get_state("complete") == 1
+        # Computed on first use, then maintained incrementally:
+        self._bucket_count: Optional[int] = None
+        # (computed-at, histogram), see lease_age_histogram():
+        self._lease_age_histogram: Optional[tuple[float, list[tuple[int, int, int]]]] = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def _get_state(self, name: str) -> Optional[int]:
+        c = self._db.cursor()
+        c.execute("SELECT value FROM state WHERE name=?", (name,))
+        row = c.fetchone()
+        return None if row is None else row[0]
+
+    def is_complete(self) -> bool:
+        """
+        Return whether the index covers every share on disk, and so may be
+        used instead of the filesystem.
+        """
+        return self._complete
+
+    def set_complete(self, complete: bool) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO state (name, value) VALUES ('complete', ?)",
+                (int(complete),),
+            )
+            self._db.commit()
+            self._complete = complete
+
+    def get_shares(self, storage_index: bytes) -> list[IndexedShare]:
+        """
+        Return the indexed shares for the given storage index, ordered by
+        share number.
+        """
+        with self._lock:
+            c = self._db.cursor()
+            c.execute(
+                "SELECT shnum, sharetype, length, lease_expiration FROM shares"
+                " WHERE storage_index=? ORDER BY shnum",
+                (_si_key(storage_index),),
+            )
+            return [IndexedShare(*row) for row in c.fetchall()]
+
+    def _has_bucket(self, c, si_key: str) -> bool:
+        c.execute("SELECT 1 FROM shares WHERE storage_index=? LIMIT 1", (si_key,))
+        return c.fetchone() is not None
+
+    def _adjust_bucket_count(self, had_bucket: bool, has_bucket: bool) -> None:
+        if self._bucket_count is not None:
+            self._bucket_count += int(has_bucket) - int(had_bucket)
+
+    def _set_leases(self, c, si_key: str, shnum: int,
+                    expirations: Sequence[int]) -> None:
+        c.execute(
+            "DELETE FROM leases WHERE storage_index=? AND shnum=?",
+            (si_key, shnum),
+        )
+        c.executemany(
+            "INSERT INTO leases (storage_index, shnum, expiration_time)"
+            " VALUES (?,?,?)",
+            [(si_key, shnum, int(expiration)) for expiration in expirations],
+        )
+
+    def _add(self, c, si_key: str, share: IndexedShare,
+             expirations: Optional[Sequence[int]] = None) -> None:
+        if expirations is not None:
+            self._set_leases(c, si_key, share.shnum, expirations)
+        c.execute(
+            "INSERT INTO shares"
+            " (storage_index, shnum, sharetype, length, lease_expiration)"
+            " VALUES (?,?,?,?,?)"
+            " ON CONFLICT (storage_index, shnum) DO UPDATE SET"
+            "  sharetype=excluded.sharetype, length=excluded.length,"
+            "  lease_expiration=MAX(lease_expiration, excluded.lease_expiration)",
+            (si_key, share.shnum, share.sharetype, share.length,
+             share.lease_expiration),
+        )
+
+    def add_share(self, storage_index: bytes, share: IndexedShare,
+                  lease_expirations: Optional[Sequence[int]] = None) -> None:
+        """
+        Record that a share was created or modified.  The recorded lease
+        expiration time only ever moves forward; ``set_leases`` and
+        ``reindex_bucket`` lower it.
+
+        :param lease_expirations: If given, the expiration times of all of
+            the share's leases.
+        """
+        si_key = _si_key(storage_index)
+        with self._lock:
+            c = self._db.cursor()
+            had_bucket = self._has_bucket(c, si_key)
+            self._add(c, si_key, share, lease_expirations)
+            self._db.commit()
+            self._adjust_bucket_count(had_bucket, True)
+
+    def remove_share(self, storage_index: bytes, shnum: int) -> None:
+        """
+        Record that a share was deleted.
+        """
+        si_key = _si_key(storage_index)
+        with self._lock:
+            c = self._db.cursor()
+            had_bucket = self._has_bucket(c, si_key)
+            c.execute(
+                "DELETE FROM shares WHERE storage_index=? AND shnum=?",
+                (si_key, shnum),
+            )
+            self._set_leases(c, si_key, shnum, [])
+            self._db.commit()
+            self._adjust_bucket_count(had_bucket, self._has_bucket(c, si_key))
+
+    def set_leases(
+        self, storage_index: bytes, shnum: int, expirations: Sequence[int]
+    ) -> None:
+        """
+        Record the expiration times of all of a share's leases, after one
+        was added, renewed or cancelled.
+        """
+        si_key = _si_key(storage_index)
+        with self._lock:
+            c = self._db.cursor()
+            c.execute(
+                "SELECT 1 FROM shares WHERE storage_index=? AND shnum=?",
+                (si_key, shnum),
+            )
+            if c.fetchone() is None:
+                # e.g. a lease added to a share still being uploaded; its
+                # leases are recorded when it's added.
+                return
+            self._set_leases(c, si_key, shnum, expirations)
+            c.execute(
+                "UPDATE shares SET lease_expiration=?"
+                " WHERE storage_index=? AND shnum=?",
+                (int(max(expirations, default=0)), si_key, shnum),
+            )
+            self._db.commit()
+
+    def get_leases(self, storage_index: bytes) -> dict[int, list[int]]:
+        """
+        Return the sorted lease expiration times for each share of the given
+        storage index.
+        """
+        with self._lock:
+            c = self._db.cursor()
+            c.execute(
+                "SELECT shnum, expiration_time FROM leases"
+                " WHERE storage_index=? ORDER BY shnum, expiration_time",
+                (_si_key(storage_index),),
+            )
+            result: dict[int, list[int]] = {}
+            for (shnum, expiration) in c.fetchall():
+                result.setdefault(shnum, []).append(expiration)
+            return result
+
+    def buckets_with_leases_expiring_by(
+        self, prefix: str, expiration_time: float
+    ) -> set[str]:
+        """
+        Return the base32 storage indexes, starting with ``prefix``, which
+        have a share with a lease expiring at or before the given time.
+        """
+        with self._lock:
+            c = self._db.cursor()
+            c.execute(
+                "SELECT DISTINCT storage_index FROM leases"
+                " WHERE expiration_time <= ?"
+                " AND storage_index >= ? AND storage_index < ?",
+                (int(expiration_time), prefix, prefix + "\x7f"),
+            )
+            return set(si_key for (si_key,) in c.fetchall())
+
+    def lease_age_histogram(
+        self, now: Optional[float] = None, max_staleness: float = 10*60,
+    ) -> list[tuple[int, int, int]]:
+        """
+        Count leases by age, in one-day buckets.  This reads every lease, so
+        the result is reused for up to ``max_staleness`` seconds.
+
+        :return: ``(min_age, max_age, count)`` tuples sorted by age, like the
+            lease checker's ``lease-age-histogram``.
+        """
+        if now is None:
+            now = time.time()
+        cached = self._lease_age_histogram
+        if cached is not None and 0 <= now - cached[0] < max_staleness:
+            return cached[1]
+        interval = 24*60*60
+        with self._lock:
+            c = self._db.cursor()
+            c.execute(
+                "SELECT MAX(0, (? - expiration_time) / ?) AS bucket, COUNT(*)"
+                " FROM leases GROUP BY bucket ORDER BY bucket",
+                (int(now) + _LEASE_DURATION, interval),
+            )
+            histogram = [
+                (bucket * interval, (bucket + 1) * interval, count)
+                for (bucket, count) in c.fetchall()
+            ]
+        self._lease_age_histogram = (now, histogram)
+        return histogram
+
+    def clear(self) -> None:
+        """
+        Forget every share.
+        """
+        with self._lock:
+            self._db.execute("DELETE FROM shares")
+            self._db.execute("DELETE FROM leases")
+            self._db.commit()
+            self._bucket_count = 0
+
+    def reindex_bucket(self, storage_index: bytes, bucketdir: str) -> None:
+        """
+        Make the entries for one storage index match the share files in the
+        given bucket directory.
+
+        The directory is read while holding the index lock, so that a share
+        created or deleted concurrently (which updates the index after
+        touching the filesystem) can't be lost.
+        """
+        si_key = _si_key(storage_index)
+        with self._lock:
+            shares = read_bucket(bucketdir)
+            c = self._db.cursor()
+            had_bucket = self._has_bucket(c, si_key)
+            c.execute("DELETE FROM shares WHERE storage_index=?", (si_key,))
+            c.execute("DELETE FROM leases WHERE storage_index=?", (si_key,))
+            for (share, expirations) in shares:
+                self._add(c, si_key, share, expirations)
+            self._db.commit()
+            self._adjust_bucket_count(had_bucket, bool(shares))
+
+    def retain_buckets(self, prefix: str, storage_indexes_b32: Iterable[str]) -> None:
+        """
+        Forget every storage index starting with ``prefix`` that isn't one of
+        the given (base32) storage indexes.
+        """
+        keep = set(storage_indexes_b32)
+        with self._lock:
+            c = self._db.cursor()
+            c.execute(
+                "SELECT DISTINCT storage_index FROM shares"
+                " WHERE storage_index >= ? AND storage_index < ?",
+                (prefix, prefix + "\x7f"),
+            )
+            stale = [si_key for (si_key,) in c.fetchall() if si_key not in keep]
+            for si_key in stale:
+                c.execute("DELETE FROM shares WHERE storage_index=?", (si_key,))
+                c.execute("DELETE FROM leases WHERE storage_index=?", (si_key,))
+            self._db.commit()
+            if self._bucket_count is not None:
+                self._bucket_count -= len(stale)
+
+    def bucket_count(self) -> int:
+        """
+        Return the number of storage indexes with at least one share.
+        """
+        with self._lock:
+            if self._bucket_count is None:
+                c = self._db.cursor()
+                c.execute("SELECT COUNT(DISTINCT storage_index) FROM shares")
+                self._bucket_count = c.fetchone()[0]
+            return self._bucket_count
+
+    def all_buckets(self) -> dict[str, list[IndexedShare]]:
+        """
+        Return every indexed share, keyed by base32 storage index.  This is
+        for offline verification; it reads the whole index into memory.
+        """
+        with self._lock:
+            c = self._db.cursor()
+            c.execute(
+                "SELECT storage_index, shnum, sharetype, length, lease_expiration"
+                " FROM shares ORDER BY storage_index, shnum"
+            )
+            result: dict[str, list[IndexedShare]] = {}
+            for (si_key, *rest) in c.fetchall():
+                result.setdefault(si_key, []).append(IndexedShare(*rest))
+            return result
+
+
+def _iter_buckets(sharedir: str) -> Iterable[tuple[str, str]]:
+    """
+    Yield ``(storage_index_b32, bucketdir)`` for every bucket directory.
+    """
+    for prefix in sorted(os.listdir(sharedir)):
+        if prefix == "incoming":
+            continue
+        prefixdir = os.path.join(sharedir, prefix)
+        if not os.path.isdir(prefixdir):
+            continue
+        for si_b32 in sorted(os.listdir(prefixdir)):
+            yield si_b32, os.path.join(prefixdir, si_b32)
+
+
+def rebuild(index: ShareIndex, sharedir: str) -> int:
+    """
+    Rebuild the index from the share files under ``sharedir`` and mark it
+    complete.  Meant to be run while the storage server is stopped.
+
+    :return: The number of buckets indexed.
+    """
+    index.set_complete(False)
+    index.clear()
+    count = 0
+    for si_b32, bucketdir in _iter_buckets(sharedir):
+        index.reindex_bucket(si_a2b(si_b32.encode("ascii")), bucketdir)
+        count += 1
+    index.set_complete(True)
+    return count
+
+
+def verify(index: ShareIndex, sharedir: str) -> list[str]:
+    """
+    Compare the index against the share files under ``sharedir``.
+
+    :return: A human-readable description of each discrepancy; empty if the
+        index is accurate.
+    """
+    problems = []
+    if not index.is_complete():
+        problems.append("index is not marked complete")
+    indexed = index.all_buckets()
+    for si_b32, bucketdir in _iter_buckets(sharedir):
+        bucket = read_bucket(bucketdir)
+        on_disk = {share.shnum: share for (share, _) in bucket}
+        on_disk_leases = {
+            share.shnum: sorted(expirations) for (share, expirations) in bucket
+        }
+        in_index = {share.shnum: share for share in indexed.pop(si_b32, [])}
+        in_index_leases = index.get_leases(si_a2b(si_b32.encode("ascii")))
+        for shnum in sorted(set(on_disk) | set(in_index)):
+            if shnum not in in_index:
+                problems.append("{} sh{}: missing from index".format(si_b32, shnum))
+            elif shnum not in on_disk:
+                problems.append("{} sh{}: indexed but not on disk".format(si_b32, shnum))
+            elif on_disk[shnum] != in_index[shnum]:
+                problems.append("{} sh{}: index has {}, disk has {}".format(
+                    si_b32, shnum, in_index[shnum], on_disk[shnum],
+                ))
+            elif on_disk_leases[shnum] != in_index_leases.get(shnum, []):
+                problems.append("{} sh{}: index has leases expiring {}, disk has {}".format(
+                    si_b32, shnum, in_index_leases.get(shnum, []),
+                    on_disk_leases[shnum],
+                ))
+    for si_b32 in sorted(indexed):
+        problems.append("{}: indexed but not on disk".format(si_b32))
+    return problems
+
+
+class ShareIndexCrawler(ShareCrawler):
+    """
+    I populate a new ``ShareIndex`` from the share files on disk, marking it
+    complete once I've been through every bucket, and afterwards keep
+    reconciling it with the disk in case anything was changed behind the
+    storage server's back.
+    """
+
+    slow_start = 60
+    minimum_cycle_time = 24*60*60 # once complete, reconcile once a day
+
+    def __init__(self, server, statefile, index: ShareIndex):
+        ShareCrawler.__init__(self, server, statefile)
+        self.index = index
+
+    def add_initial_state(self):
+        # ["building-cycle"] = the cycle which, when finished, will have
+        #                      indexed every bucket (None once complete)
+        self.state.setdefault("building-cycle", None)
+
+    def started_cycle(self, cycle):
+        if not self.index.is_complete():
+            self.state["building-cycle"] = cycle
+
+    def process_prefixdir(self, cycle, prefix, prefixdir, buckets, start_slice):
+        # Buckets that have disappeared entirely won't be visited by
+        # process_bucket(), so drop them here.
+        self.index.retain_buckets(prefix, buckets)
+        ShareCrawler.process_prefixdir(self, cycle, prefix, prefixdir,
+                                       buckets, start_slice)
+
+    def process_bucket(self, cycle, prefix, prefixdir, storage_index_b32):
+        self.index.reindex_bucket(
+            si_a2b(storage_index_b32.encode("ascii")),
+            os.path.join(prefixdir, storage_index_b32),
+        )
+
+    def finished_cycle(self, cycle):
+        if self.state["building-cycle"] == cycle:
+            self.index.set_complete(True)
+            self.state["building-cycle"] = None
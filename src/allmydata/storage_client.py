@@ -89,14 +89,15 @@ from allmydata.util.observer import ObserverList
 from allmydata.util.rrefutil import add_version_to_remote_reference
 from allmydata.util.hashutil import permute_server_hash
 from allmydata.util.dictutil import BytesKeyDict, UnicodeKeyDict
-from allmydata.util.deferredutil import async_to_deferred, race
+from allmydata.util.deferredutil import async_to_deferred, race, gatherResults
 from allmydata.util.attrs_provides import provides
 from allmydata.storage.http_client import (
     StorageClient, StorageClientImmutables, StorageClientGeneral,
     ClientException as HTTPClientException, StorageClientMutables,
     ReadVector, TestWriteVectors, WriteVector, TestVector, ClientException,
-    StorageClientFactory
+    StorageClientFactory, DEFAULT_HTTP_CONNECTIONS_PER_SERVER,
 )
+from allmydata.storage.http_common import MAX_LEASES_PER_REQUEST
 from .node import _Config
 
 _log = Logger()
@@ -138,10 +139,14 @@ class StorageClientConfig(object):
         this list, we'll upload to any storage server. Otherwise, we will
         only upload to a storage-server that has a valid certificate
         signed by at least one of these keys.
+
+    :ivar int http_connections_per_server: How many idle HTTPS connections to
+        keep open to each storage server, for reuse by later requests.
     """
     preferred_peers : Iterable[bytes] = attr.ib(default=())
     storage_plugins : dict[str, dict[str, str]] = attr.ib(default=attr.Factory(dict))
     grid_manager_keys : list[ed25519.Ed25519PublicKey] = attr.ib(default=attr.Factory(list))
+    http_connections_per_server : int = attr.ib(default=DEFAULT_HTTP_CONNECTIONS_PER_SERVER)
 
     @classmethod
     def from_node_config(cls, config):
@@ -179,11 +184,22 @@ class StorageClientConfig(object):
                 ed25519.verifying_key_from_string(gm_key.encode("ascii"))
             )
 
+        http_connections_per_server = int(config.get_config(
+            "client",
+            "storage.http_connections_per_server",
+            DEFAULT_HTTP_CONNECTIONS_PER_SERVER,
+        ))
+        if http_connections_per_server < 1:
+            raise ValueError(
+                "config error: storage.http_connections_per_server must be "
+                "at least 1, not %d" % (http_connections_per_server,)
+            )
 
         return cls(
             preferred_peers,
             storage_plugins,
             grid_manager_keys,
+            http_connections_per_server,
         )
 
     def get_configured_storage_plugins(self) -> dict[str, IFoolscapStoragePlugin]:
@@ -357,7 +373,8 @@ class StorageFarmBroker(service.MultiService):
                 server["ann"],
                 grid_manager_verifier=gm_verifier,
                 default_connection_handlers=self._default_connection_handlers,
-                tor_provider=self._tor_provider
+                tor_provider=self._tor_provider,
+                connections_per_server=self.storage_client_config.http_connections_per_server,
             )
             s.on_status_changed(lambda _: self._got_connection())
             return s
@@ -1136,7 +1153,7 @@ class HTTPNativeStorageServer(service.MultiService):
     "connected".
     """
 
-    def __init__(self, server_id: bytes, announcement, default_connection_handlers: dict[str,str], reactor=reactor, grid_manager_verifier=None, tor_provider: Optional[TorProvider]=None):
+    def __init__(self, server_id: bytes, announcement, default_connection_handlers: dict[str,str], reactor=reactor, grid_manager_verifier=None, tor_provider: Optional[TorProvider]=None, connections_per_server: int=DEFAULT_HTTP_CONNECTIONS_PER_SERVER):
         service.MultiService.__init__(self)
         assert isinstance(server_id, bytes)
         self._server_id = server_id
@@ -1145,7 +1162,8 @@ class HTTPNativeStorageServer(service.MultiService):
         self._reactor = reactor
         self._grid_manager_verifier = grid_manager_verifier
         self._storage_client_factory = StorageClientFactory(
-            default_connection_handlers, tor_provider
+            default_connection_handlers, tor_provider,
+            connections_per_server=connections_per_server,
         )
 
         furl = announcement["anonymous-storage-FURL"].encode("utf-8")
@@ -1554,12 +1572,41 @@ class _HTTPBucketReader(object):
     client = attr.ib(type=StorageClientImmutables)
     storage_index = attr.ib(type=bytes)
     share_number = attr.ib(type=int)
+    # Set to False once we learn the server predates the batched read API:
+    _readv_supported = attr.ib(type=bool, default=True, eq=False, hash=False)
 
     def read(self, offset, length):
         return self.client.read_share_chunk(
             self.storage_index, self.share_number, offset, length
         )
 
+    @async_to_deferred
+    async def readv(self, readv):
+        """
+        Read several ranges of the share, returning a list with the data for
+        each range.
+        """
+        if self._readv_supported:
+            try:
+                result = await self.client.read_share_chunks(
+                    self.storage_index, {self.share_number: readv}
+                )
+            except HTTPClientException as e:
+                if e.code == http.NOT_FOUND:
+                    # Either an older server without the batched read API, or
+                    # the share went away; the single-range reads below will
+                    # tell us which.
+                    self._readv_supported = False
+                elif e.code != http.REQUEST_ENTITY_TOO_LARGE:
+                    raise
+            else:
+                if self.share_number not in result:
+                    raise HTTPClientException(http.NOT_FOUND, "No such share")
+                return result[self.share_number]
+        return await gatherResults(
+            [self.read(offset, length) for (offset, length) in readv]
+        )
+
     def advise_corrupt_share(self, reason):
        return self.client.advise_corrupt_share(
            self.storage_index, self.share_number,
@@ -1567,6 +1614,100 @@ class _HTTPBucketReader(object):
        ).addErrback(_ignore_404)
 
 
+@attr.s
+class _LeaseRenewals(object):
+    """
+    Send the leases ``add_lease()`` is asked for to one HTTP storage server
+    in as few requests as possible.
+
+    A lease is sent straight away unless a request is already in progress,
+    in which case it waits for that to finish and then goes with every
+    other lease asked for in the meantime.  So an occasional lease renewal
+    costs no extra latency, while the many renewals of a deep-check with
+    ``add_lease`` share requests.
+    """
+    _client = attr.ib(type=StorageClientGeneral)
+    # ((storage_index, renew_secret, cancel_secret), Deferred) pairs:
+    _waiting = attr.ib(factory=list)
+    _requests_in_progress = attr.ib(default=0)
+    # Set to False once we learn the server predates the bulk lease API:
+    _bulk_supported = attr.ib(default=True)
+
+    def add_lease(self, storage_index, renew_secret, cancel_secret) -> defer.Deferred[None]:
+        """
+        Add or renew a lease, doing nothing if the server has no shares for
+        the storage index.
+        """
+        result: defer.Deferred[None] = defer.Deferred()
+        self._waiting.append(((storage_index, renew_secret, cancel_secret), result))
+        if (self._requests_in_progress == 0
+                or len(self._waiting) >= MAX_LEASES_PER_REQUEST):
+            self._send()
+        return result
+
+    def _send(self) -> None:
+        batch = self._waiting[:MAX_LEASES_PER_REQUEST]
+        del self._waiting[:MAX_LEASES_PER_REQUEST]
+        self._requests_in_progress += 1
+
+        def sent(_):
+            self._requests_in_progress -= 1
+            if self._waiting and self._requests_in_progress == 0:
+                self._send()
+
+        self._renew(batch).addBoth(sent)
+
+    @async_to_deferred
+    async def _renew(self, batch) -> None:
+        if self._bulk_supported:
+            try:
+                renewed = await self._client.add_or_renew_leases(
+                    [lease for (lease, _) in batch]
+                )
+            except ClientException as e:
+                if e.code != http.NOT_FOUND:
+                    failure = Failure()
+                    for (_, result) in batch:
+                        result.errback(failure)
+                    return
+                # A server that predates the bulk API; ask for each lease
+                # separately from now on.
+                self._bulk_supported = False
+            except Exception:
+                failure = Failure()
+                for (_, result) in batch:
+                    result.errback(failure)
+                return
+            else:
+                for ((_, result), found) in zip(batch, renewed):
+                    if isinstance(found, str):
+                        # The server couldn't update this lease, though it
+                        # may have updated the rest.
+                        result.errback(Failure(
+                            ClientException(http.INTERNAL_SERVER_ERROR, found)
+                        ))
+                    else:
+                        result.callback(None)
+                return
+
+        await defer.DeferredList([
+            self._add_lease(*lease).addBoth(result.callback)
+            for (lease, result) in batch
+        ])
+
+    @async_to_deferred
+    async def _add_lease(self, storage_index, renew_secret, cancel_secret) -> None:
+        try:
+            await self._client.add_or_renew_lease(
+                storage_index, renew_secret, cancel_secret
+            )
+        except ClientException as e:
+            if e.code == http.NOT_FOUND:
+                # Silently do nothing, as is the case for the Foolscap client
+                return
+            raise
+
+
 # WORK IN PROGRESS, for now it doesn't actually implement whole thing.
 @implementer(IStorageServer)  # type: ignore
 @attr.s
@@ -1575,6 +1716,11 @@ class _HTTPStorageServer(object):
     Talk to remote storage server over HTTP.
     """
     _http_client = attr.ib(type=StorageClient)
+    _lease_renewals = attr.ib(init=False, eq=False)
+
+    @_lease_renewals.default
+    def _make_lease_renewals(self) -> _LeaseRenewals:
+        return _LeaseRenewals(StorageClientGeneral(self._http_client))
 
     @staticmethod
     def from_http_client(http_client: StorageClient) -> _HTTPStorageServer:
@@ -1631,23 +1777,15 @@ class _HTTPStorageServer(object):
             for share_num in share_numbers
         })
 
-    @async_to_deferred
-    async def add_lease(
+    def add_lease(
         self,
         storage_index,
         renew_secret,
         cancel_secret
     ):
-        client = StorageClientGeneral(self._http_client)
-        try:
-            await client.add_or_renew_lease(
-                storage_index, renew_secret, cancel_secret
-            )
-        except ClientException as e:
-            if e.code == http.NOT_FOUND:
-                # Silently do nothing, as is the case for the Foolscap client
-                return
-            raise
+        return self._lease_renewals.add_lease(
+            storage_index, renew_secret, cancel_secret
+        )
 
     def advise_corrupt_share(
         self,
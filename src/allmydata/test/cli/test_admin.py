@@ -19,7 +19,9 @@ from testtools.matchers import (
 from allmydata.scripts.admin import (
     migrate_crawler,
     add_grid_manager_cert,
+    rebuild_share_index,
 )
+from allmydata.storage.server import StorageServer
 from allmydata.scripts.runner import (
     Options,
 )
@@ -86,6 +88,54 @@ class AdminMigrateCrawler(SyncTestCase):
         )
 
 
+class AdminRebuildShareIndex(SyncTestCase):
+    """
+    Tests for 'tahoe admin rebuild-share-index'
+    """
+
+    def run_command(self, basedir, *args):
+        top = Options()
+        top.parseOptions([
+            "admin", "rebuild-share-index",
+            "--basedir", basedir.path,
+        ] + list(args))
+        options = top.subOptions
+        while hasattr(options, "subOptions"):
+            options = options.subOptions
+        options.stdout = StringIO()
+        options.stderr = StringIO()
+        return rebuild_share_index(options), options.stdout.getvalue()
+
+    def test_rebuild_and_verify(self):
+        """
+        The index can be rebuilt from the share files, after which verifying
+        it finds no problems; verifying it after a share is deleted behind
+        its back reports that.
+        """
+        root = FilePath(self.mktemp())
+        ss = StorageServer(root.child("storage").path, b"\x00" * 20)
+        _, writers = ss.allocate_buckets(
+            b"si1", b"r" * 32, b"c" * 32, {0, 1}, 10,
+        )
+        for bw in writers.values():
+            bw.write(0, b"a" * 10)
+            bw.close()
+
+        code, out = self.run_command(root)
+        self.assertEqual(code, 0)
+        self.assertThat(out, Contains("Indexed 1 buckets"))
+
+        code, out = self.run_command(root, "--verify")
+        self.assertEqual(code, 0)
+        self.assertThat(out, Contains("Share index is accurate"))
+
+        share = ss.get_buckets(b"si1")[1]
+        FilePath(share._share_file.home).remove()
+        code, out = self.run_command(root, "--verify")
+        self.assertEqual(code, 1)
+        self.assertThat(out, Contains("sh1: indexed but not on disk"))
+
+
 fake_cert = {
     "certificate": "{\"expires\":1601687822,\"public_key\":\"pub-v0-cbq6hcf3pxcz6ouoafrbktmkixkeuywpcpbcomzd3lqbkq4nmfga\",\"version\":1}",
     "signature": "fvjd3uvvupf2v6tnvkwjd473u3m3inyqkwiclhp7balmchkmn3px5pei3qyfjnhymq4cjcwvbpqmcwwnwswdtrfkpnlaxuih2zbdmda"
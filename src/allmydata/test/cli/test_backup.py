@@ -9,6 +9,8 @@ import re
 
 from twisted.trial import unittest
 from twisted.python.monkey import MonkeyPatcher
+from twisted.python import usage
+from twisted.internet import defer
 
 from allmydata.util import fileutil
 from allmydata.util.fileutil import abspath_expanduser_unicode
@@ -309,6 +311,83 @@ class Backup(GridTestMixin, CLITestMixin, StallMixin, unittest.TestCase):
 
         return d
 
+    @defer.inlineCallbacks
+    def test_backup_jobs(self):
+        """
+        ``tahoe backup --jobs`` uploads several files at once, but reports on
+        them in the same order as a serial backup.
+        """
+        self.basedir = "cli/Backup/backup_jobs"
+        self.set_up_grid(oneshare=True)
+        source = os.path.join(self.basedir, "home")
+        for i in range(8):
+            self.writeto("dir%d/file%d.txt" % (i % 3, i), "data %d\n" % i * (i + 1))
+
+        yield self.do_cli("create-alias", "tahoe")
+        rc, out, err = yield self.do_cli(
+            "backup", "--verbose", "--jobs", "4", source, "tahoe:backups",
+        )
+        self.assertEqual((rc, err), (0, ""))
+        # files uploaded, directories created
+        self.assertEqual(self.count_output(out)[0], 8)
+        self.assertEqual(self.count_output(out)[3], 4)
+
+        # Each file's messages come together, and before the progress
+        # report for it.
+        lines = out.splitlines()
+        uploads = [i for (i, line) in enumerate(lines) if line.startswith("uploading ")]
+        self.assertEqual(len(uploads), 8)
+        for i in uploads:
+            path = lines[i][len("uploading "):-len("..")]
+            self.assertTrue(lines[i + 1].startswith(" %s -> URI:" % path.strip("'")), lines[i + 1])
+            self.assertTrue(lines[i + 2].startswith("Backing up "), lines[i + 2])
+
+        rc, out, err = yield self.do_cli("get", "tahoe:backups/Latest/dir1/file4.txt")
+        self.assertEqual((rc, out), (0, "data 4\n" * 5))
+
+        # the second time around everything comes from the backupdb
+        rc, out, err = yield self.do_cli(
+            "backup", "--jobs", "4", source, "tahoe:backups",
+        )
+        self.assertEqual((rc, err), (0, ""))
+        self.assertEqual(self.count_output(out)[:2], [0, 8])
+
+    @defer.inlineCallbacks
+    def test_backupdb_lookups_batched(self):
+        """
+        ``tahoe backup`` looks up all of the files in a small tree in the
+        backupdb with one batched query.
+        """
+        self.basedir = "cli/Backup/backupdb_lookups_batched"
+        self.set_up_grid(oneshare=True)
+        source = os.path.join(self.basedir, "home")
+        for i in range(5):
+            self.writeto("dir%d/file%d.txt" % (i % 2, i), "data %d" % i)
+
+        calls = []
+        def counted(name):
+            original = getattr(backupdb.BackupDB_v2, name)
+            def method(bdb, *args, **kwargs):
+                calls.append(name)
+                return original(bdb, *args, **kwargs)
+            self.patch(backupdb.BackupDB_v2, name, method)
+        counted("check_file")
+        counted("check_files")
+
+        yield self.do_cli("create-alias", "tahoe")
+        for expected in ([5, 0], [0, 5]):
+            del calls[:]
+            rc, out, err = yield self.do_cli(
+                "backup", "--jobs", "2", source, "tahoe:backups",
+            )
+            self.assertEqual((rc, err), (0, ""))
+            self.assertEqual(self.count_output(out)[:2], expected)
+            self.assertEqual(calls, ["check_files"])
+
+    def test_jobs_must_be_positive(self):
+        o = cli.BackupOptions()
+        self.assertRaises(usage.UsageError, o.parseOptions, ["--jobs", "0", "from", "to"])
+
     def _check_filtering(self, filtered, all, included, excluded):
         filtered = set(filtered)
         all = set(all)
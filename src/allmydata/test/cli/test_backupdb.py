@@ -142,6 +142,46 @@ class BackupDB(unittest.TestCase):
         r = bdb.check_file(foo_fn)
         self.failUnlessEqual(r.was_uploaded(), False)
 
+    def test_check_files(self):
+        """
+        ``check_files`` looks up a batch of files, with the same results as
+        ``check_file`` would give for each of them.
+        """
+        self.basedir = basedir = os.path.join("backupdb", "check_files")
+        fileutil.make_dirs(basedir)
+        dbfile = os.path.join(basedir, "dbfile")
+        bdb = self.create(dbfile)
+
+        # more than fit in one query
+        paths = [self.writeto("file%d" % i, "data %d" % i) for i in range(510)]
+        missing = os.path.join(basedir, "missing")
+        for i, path in enumerate(paths[:300]):
+            bdb.check_file(path).did_upload(b"cap-%d" % i)
+
+        results = bdb.check_files(paths + [missing])
+        self.assertEqual(sorted(results), sorted(paths))
+        for i, path in enumerate(paths):
+            expected = bdb.check_file(path)
+            self.assertEqual(
+                (results[path].was_uploaded(), results[path].path),
+                (expected.was_uploaded(), expected.path),
+            )
+            if i < 300:
+                self.assertEqual(results[path].was_uploaded(), b"cap-%d" % i)
+            else:
+                self.assertEqual(results[path].was_uploaded(), False)
+
+        # a changed file needs to be uploaded again
+        time.sleep(1.0) # make sure the timestamp changes
+        self.writeto("file0", "NEW")
+        results = bdb.check_files(paths[:2])
+        self.assertEqual(results[paths[0]].was_uploaded(), False)
+        self.assertEqual(results[paths[1]].was_uploaded(), b"cap-1")
+        self.assertEqual(bdb.check_file(paths[0]).was_uploaded(), False)
+
+        results = bdb.check_files(paths[:2], use_timestamps=False)
+        self.assertEqual(results[paths[1]].was_uploaded(), False)
+
     def test_wrong_version(self):
         self.basedir = basedir = os.path.join("backupdb", "wrong_version")
         fileutil.make_dirs(basedir)
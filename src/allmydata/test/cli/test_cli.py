@@ -3,13 +3,17 @@ Ported to Python 3.
 """
 
 from io import StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import re
+import socket
+import threading
 from six import ensure_text
 
 import os.path
 from urllib.parse import quote as url_quote
 
 from twisted.trial import unittest
+from twisted.internet import defer, threads
 from twisted.internet.testing import (
     MemoryReactor,
 )
@@ -589,6 +593,11 @@ class Help(unittest.TestCase):
         self.failUnlessIn("[options] [REMOTE_DIR]", help)
         self.failUnlessInNormalized("Create a new directory", help)
 
+    def test_shard(self):
+        help = str(cli.ShardOptions())
+        self.failUnlessIn("[options] REMOTE_DIR", help)
+        self.failUnlessInNormalized("Convert a large mutable directory", help)
+
     def test_backup(self):
         help = str(cli.BackupOptions())
         self.failUnlessIn("[options] FROM ALIAS:TO", help)
@@ -809,6 +818,182 @@ class Errors(GridTestMixin, CLITestMixin, unittest.TestCase):
         return d
 
 
+class KeepAlive(GridTestMixin, CLITestMixin, unittest.TestCase):
+    def count_connections(self):
+        connections = []
+        HTTPConnection = allmydata.scripts.common_http.http_client.HTTPConnection
+        original_connect = HTTPConnection.connect
+        def connect(c):
+            connections.append(c)
+            return original_connect(c)
+        self.patch(HTTPConnection, "connect", connect)
+        return connections
+
+    @defer.inlineCallbacks
+    def test_one_connection_per_command(self):
+        """
+        All of the requests made by one command share a connection, which is
+        closed when the command is done.
+        """
+        self.basedir = "cli/KeepAlive/one_connection_per_command"
+        self.set_up_grid(oneshare=True)
+        paths = []
+        for i in range(3):
+            paths.append(os.path.join(self.basedir, "file%d" % i))
+            fileutil.write(paths[-1], "contents %d" % i)
+        yield self.do_cli("create-alias", "tahoe")
+
+        connections = self.count_connections()
+        rc, out, err = yield self.do_cli("cp", *(paths + ["tahoe:"]))
+        self.assertEqual((rc, err), (0, ""))
+        self.assertEqual(len(connections), 1)
+        self.assertIs(connections[0].sock, None)
+
+    @defer.inlineCallbacks
+    def test_reconnect(self):
+        """
+        If the server has closed an idle connection, the request is made
+        again on a new one.
+        """
+        self.basedir = "cli/KeepAlive/reconnect"
+        self.set_up_grid(oneshare=True)
+        nodeurl = fileutil.read(
+            os.path.join(self.get_clientdir(), "node.url"), mode="r",
+        ).strip()
+        do_http = allmydata.scripts.common_http.do_http
+        connections = self.count_connections()
+
+        def get():
+            resp = do_http("GET", nodeurl + "/")
+            resp.read()
+            return resp.status
+
+        def requests():
+            try:
+                first = get()
+                connections[0].sock.shutdown(socket.SHUT_RDWR)
+                return first, get()
+            finally:
+                allmydata.scripts.common_http.close_connections()
+
+        statuses = yield threads.deferToThread(requests)
+        self.assertEqual(statuses, (200, 200))
+        self.assertEqual(len(connections), 2)
+
+
+class _DroppingHandler(BaseHTTPRequestHandler):
+    """
+    Answer the first request on each connection.  Later ones are received
+    in full but the connection is closed instead of answering them, as a
+    server might do if it failed part way through.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.answered = False
+
+    def handle_request(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.server.done.append((self.command, self.rfile.read(length)))
+        if self.answered:
+            self.close_connection = True
+            return
+        self.answered = True
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    do_GET = do_POST = handle_request
+
+    def log_message(self, *args):
+        pass
+
+
+class Retry(unittest.TestCase):
+    """
+    Tests for ``do_http`` making a request again when a reused connection
+    fails.
+    """
+    def setUp(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _DroppingHandler)
+        server.done = []
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(allmydata.scripts.common_http.close_connections)
+        self.server = server
+        self.url = "http://127.0.0.1:%d/" % (server.server_address[1],)
+
+    def request(self, method, body=b""):
+        resp = allmydata.scripts.common_http.do_http(method, self.url, body)
+        return resp.status, resp.read()
+
+    def test_post_not_retried(self):
+        """
+        A ``POST`` which the server received in full before the connection
+        failed isn't made again: the server may have done it already.
+        """
+        self.assertEqual(self.request("GET"), (200, b"ok"))
+        self.assertRaises(ConnectionError, self.request, "POST", b"mkdir")
+        self.assertEqual(self.server.done, [("GET", b""), ("POST", b"mkdir")])
+
+    def test_get_retried(self):
+        """
+        A ``GET`` is made again on a new connection if the reused one fails,
+        even after the server received it.
+        """
+        self.assertEqual(self.request("GET"), (200, b"ok"))
+        self.assertEqual(self.request("GET"), (200, b"ok"))
+        self.assertEqual(self.server.done, [("GET", b"")] * 3)
+
+
+class MapInOrder(unittest.TestCase):
+    def test_serial(self):
+        """
+        With one job, ``map_in_order`` calls the function in the caller's
+        thread, only as results are needed.
+        """
+        called = []
+        def f(x):
+            called.append((x, threading.current_thread()))
+            return x * 2
+        results = common.map_in_order(f, [1, 2, 3], 1)
+        self.assertEqual(called, [])
+        self.assertEqual(next(results), 2)
+        self.assertEqual(called, [(1, threading.current_thread())])
+        self.assertEqual(list(results), [4, 6])
+
+    def test_concurrent(self):
+        """
+        With several jobs, ``map_in_order`` runs that many calls at once, and
+        still produces the results in order.
+        """
+        barrier = threading.Barrier(3, timeout=10)
+        def f(x):
+            if x < 3:
+                # only returns once all three calls have started
+                barrier.wait()
+            return x * 2
+        self.assertEqual(list(common.map_in_order(f, range(10), 3)),
+                         [x * 2 for x in range(10)])
+
+    def test_error(self):
+        """
+        An exception raised by one call is raised in place of its result.
+        """
+        def f(x):
+            if x == 3:
+                raise ValueError(x)
+            return x
+        results = common.map_in_order(f, range(10), 4)
+        self.assertEqual([next(results) for _ in range(3)], [0, 1, 2])
+        self.assertRaises(ValueError, next, results)
+
+
 class Get(GridTestMixin, CLITestMixin, unittest.TestCase):
     def test_get_without_alias(self):
         # 'tahoe get' should output a useful error message when invoked
@@ -1124,6 +1309,43 @@ class Stats(GridTestMixin, CLITestMixin, unittest.TestCase):
         return d
 
 
+class Shard(GridTestMixin, CLITestMixin, unittest.TestCase):
+    @defer.inlineCallbacks
+    def test_shard(self):
+        """
+        'tahoe shard' shards a directory, which still has all its children.
+        """
+        self.basedir = "cli/Shard/shard"
+        self.set_up_grid(oneshare=True)
+        c0 = self.g.clients[0]
+        kids = {
+            "kid%d" % i: (c0.create_node_from_uri(
+                uri.LiteralFileURI(b"data %d" % i).to_string()), {})
+            for i in range(10)
+        }
+        n = yield c0.create_dirnode(kids)
+        rc, out, err = yield self.do_cli("shard", "--shards=3", n.get_uri())
+        self.assertEqual((rc, err), (0, ""))
+        self.assertIn("3 shards", out)
+
+        n = c0.create_node_from_uri(n.get_uri())
+        children, shards = yield n.list_for_traversal()
+        self.assertEqual(len(shards), 3)
+        self.assertEqual(sorted((yield n.list())), sorted(kids))
+
+    def test_shard_with_nonexistent_alias(self):
+        self.basedir = "cli/Shard/shard_with_nonexistent_alias"
+        self.set_up_grid(oneshare=True)
+        d = self.do_cli("shard", "havasu:")
+        def _check(args):
+            (rc, out, err) = args
+            self.failUnlessReallyEqual(rc, 1)
+            self.failUnlessIn("error:", err)
+            self.assertEqual(out, "")
+        d.addCallback(_check)
+        return d
+
+
 class Webopen(GridTestMixin, CLITestMixin, unittest.TestCase):
     def test_webopen_with_nonexistent_alias(self):
         # when invoked with an alias that doesn't exist, 'tahoe webopen'
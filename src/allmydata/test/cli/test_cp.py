@@ -679,6 +679,46 @@ starting copy, 2 files, 1 directories
         d.addCallback(_check)
         return d
 
+    @defer.inlineCallbacks
+    def test_cp_jobs(self):
+        """
+        ``tahoe cp --jobs`` copies several files at once, in both directions,
+        and reports progress the same way as a serial copy.
+        """
+        self.basedir = "cli/Cp/cp_jobs"
+        self.set_up_grid(oneshare=True)
+        source = os.path.join(self.basedir, "source")
+        for i in range(6):
+            fileutil.make_dirs(os.path.join(source, "dir%d" % (i % 2)))
+            fileutil.write(os.path.join(source, "dir%d" % (i % 2), "file%d" % i),
+                           "contents %d" % i * 100)
+
+        yield self.do_cli("create-alias", "tahoe")
+        rc, out, err = yield self.do_cli(
+            "cp", "--verbose", "--jobs", "4", "-r", source, "tahoe:")
+        self.assertEqual(rc, 0, str((out, err)))
+        progress = [line for line in err.splitlines() if "/" in line and "directories" in line]
+        self.assertEqual(progress, [
+            "1/6 files, 0/2 directories",
+            "2/6 files, 0/2 directories",
+            "3/6 files, 0/2 directories",
+            "1/2 directories",
+            "4/6 files, 1/2 directories",
+            "5/6 files, 1/2 directories",
+            "6/6 files, 1/2 directories",
+            "2/2 directories",
+        ])
+
+        target = os.path.join(self.basedir, "target")
+        rc, out, err = yield self.do_cli(
+            "cp", "--jobs", "4", "-r", "tahoe:source", target)
+        self.assertEqual((rc, err), (0, ""))
+        for i in range(6):
+            self.assertEqual(
+                fileutil.read(os.path.join(target, "source", "dir%d" % (i % 2), "file%d" % i)),
+                b"contents %d" % i * 100,
+            )
+
     def test_cp_copies_dir(self):
         # This test ensures that a directory is copied using
         # tahoe cp -r. Refer to ticket #712:
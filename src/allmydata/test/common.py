@@ -790,6 +790,13 @@ class FakeMutableFileNode(object):  # type: ignore # incomplete implementation
     def download_best_version(self):
         return defer.succeed(self._download_best_version())
 
+    def download_best_version_if_changed(self, known_version):
+        data = self._download_best_version()
+        version = hashutil.tagged_hash(b"fake-mutable-version", data)
+        if version == known_version:
+            data = None
+        return defer.succeed((version, data))
+
 
     def _download_best_version(self, ignored=None):
         if isinstance(self.my_uri, uri.LiteralFileURI):
@@ -10,15 +10,17 @@ from testtools.matchers import (
     Contains,
     HasLength,
     Is,
+    Not,
     IsInstance,
 )
 from allmydata import uri, client
 from allmydata.util.consumer import MemoryConsumer
 from allmydata.interfaces import SDMF_VERSION, MDMF_VERSION, DownloadStopped
+from allmydata.mutable import filenode, retrieve
 from allmydata.mutable.filenode import MutableFileNode, BackoffAgent
 from allmydata.mutable.common import MODE_ANYTHING, MODE_WRITE, MODE_READ, UncoordinatedWriteError
 
-from allmydata.mutable.publish import MutableData
+from allmydata.mutable.publish import MutableData, DEFAULT_MUTABLE_MAX_SEGMENT_SIZE
 from ..test_download import PausingConsumer, PausingAndStoppingConsumer, \
      StoppingConsumer, ImmediatelyStoppingConsumer
 from .. import common_util as testutil
@@ -695,3 +697,145 @@ class Filenode(AsyncBrokenTestCase, testutil.ShouldFailMixin):
         d.addCallback(lambda ignored:
             self.assertThat(self.n.get_size(), Equals(9)))
         return d
+
+    def _count_servermap_updates(self, n):
+        updates = []
+        original = n._update_servermap
+        def _update_servermap(servermap, mode):
+            updates.append(mode)
+            return original(servermap, mode)
+        n._update_servermap = _update_servermap
+        return updates
+
+    def _count_retrieves(self):
+        retrieves = []
+        original = filenode.MutableFileVersion._read
+        def _read(mfv, *args, **kwargs):
+            retrieves.append(mfv.get_sequence_number())
+            return original(mfv, *args, **kwargs)
+        self.patch(filenode.MutableFileVersion, "_read", _read)
+        return retrieves
+
+    async def test_servermap_cache(self):
+        """
+        With a servermap cache TTL, repeated reads of a mutable file reuse
+        the servermap from the first one, until something is published.
+        """
+        self.nodemaker.servermap_cache_ttl = 3600
+        n = await self.nodemaker.create_mutable_file(MutableData(b"first"))
+        updates = self._count_servermap_updates(n)
+
+        self.assertThat(await n.download_best_version(), Equals(b"first"))
+        self.assertThat(await n.download_best_version(), Equals(b"first"))
+        self.assertThat(updates, Equals([MODE_READ]))
+
+        await n.overwrite(MutableData(b"second"))
+        self.assertThat(await n.download_best_version(), Equals(b"second"))
+        self.assertThat(updates, Equals([MODE_READ, MODE_WRITE, MODE_READ]))
+
+    async def test_servermap_cache_expires(self):
+        """
+        A cached servermap older than the TTL is not used.
+        """
+        self.nodemaker.servermap_cache_ttl = 3600
+        n = await self.nodemaker.create_mutable_file(MutableData(b"first"))
+        updates = self._count_servermap_updates(n)
+        await n.download_best_version()
+        n._cached_servermap.set_last_update(MODE_READ, 0)
+        await n.download_best_version()
+        self.assertThat(updates, Equals([MODE_READ, MODE_READ]))
+
+    async def test_servermap_cache_disabled(self):
+        """
+        By default every read updates a new servermap.
+        """
+        n = await self.nodemaker.create_mutable_file(MutableData(b"first"))
+        updates = self._count_servermap_updates(n)
+        await n.download_best_version()
+        await n.download_best_version()
+        self.assertThat(updates, Equals([MODE_READ, MODE_READ]))
+
+    async def test_download_if_changed(self):
+        """
+        ``download_best_version_if_changed`` only downloads the contents if
+        the best version isn't the one it was given.
+        """
+        n = await self.nodemaker.create_mutable_file(MutableData(b"first"))
+        retrieves = self._count_retrieves()
+        (version, contents) = await n.download_best_version_if_changed(None)
+        self.assertThat(contents, Equals(b"first"))
+        self.assertThat(
+            await n.download_best_version_if_changed(version),
+            Equals((version, None)),
+        )
+        self.assertThat(retrieves, Equals([1]))
+
+        await n.overwrite(MutableData(b"second"))
+        (new_version, contents) = await n.download_best_version_if_changed(version)
+        self.assertThat(contents, Equals(b"second"))
+        self.assertThat(new_version, Not(Equals(version)))
+
+    async def test_optimistic_read(self):
+        """
+        With optimistic reads, the download started from the previous
+        servermap is used if the new servermap agrees it is the best version.
+        """
+        self.nodemaker.optimistic_mutable_reads = True
+        n = await self.nodemaker.create_mutable_file(MutableData(b"first"))
+        await n.download_best_version()
+        retrieves = self._count_retrieves()
+        self.assertThat(await n.download_best_version(), Equals(b"first"))
+        self.assertThat(retrieves, Equals([1]))
+
+    async def test_optimistic_read_superseded(self):
+        """
+        If the file was changed elsewhere, the optimistic download is discarded
+        and the new best version is downloaded instead.
+        """
+        self.nodemaker.optimistic_mutable_reads = True
+        n = await self.nodemaker.create_mutable_file(MutableData(b"first"))
+        await n.download_best_version()
+        # another node for the same file, as another client would have
+        other = self.nodemaker._create_mutable(n.get_cap())
+        await other.overwrite(MutableData(b"second"))
+
+        retrieves = self._count_retrieves()
+        self.assertThat(await n.download_best_version(), Equals(b"second"))
+        self.assertThat(retrieves, Equals([1, 2]))
+
+    async def test_optimistic_read_superseded_stopped(self):
+        """
+        An optimistic download of a version which turns out not to be the
+        best one is stopped, rather than downloading the file twice.
+        """
+        self.nodemaker.optimistic_mutable_reads = True
+        segments = 4
+        first = b"1" * (DEFAULT_MUTABLE_MAX_SEGMENT_SIZE * segments)
+        second = b"2" * len(first)
+        n = await self.nodemaker.create_mutable_file(MutableData(first),
+                                                     version=MDMF_VERSION)
+        await n.download_best_version()
+        other = self.nodemaker._create_mutable(n.get_cap())
+        await other.overwrite(MutableData(second))
+
+        fetched = []
+        original = retrieve.Retrieve._process_segment
+        def _process_segment(r, segnum):
+            fetched.append(r.verinfo[0])
+            return original(r, segnum)
+        self.patch(retrieve.Retrieve, "_process_segment", _process_segment)
+        optimistic = []
+        original_start = n._start_optimistic_download
+        def _start_optimistic_download(known_version):
+            optimistic.append(original_start(known_version))
+            return optimistic[-1]
+        n._start_optimistic_download = _start_optimistic_download
+
+        self.assertThat(await n.download_best_version(), Equals(second))
+        [(version, d, c)] = optimistic
+        (succeeded, result) = await d
+        self.assertThat(succeeded, Equals(False))
+        result.trap(DownloadStopped)
+        self.assertThat(fetched.count(2), Equals(segments))
+        # the first segment was already being fetched
+        self.assertThat(fetched.count(1), Equals(1))
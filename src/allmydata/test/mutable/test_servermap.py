@@ -18,13 +18,15 @@ class Servermap(AsyncTestCase, PublishMixin):
         return self.publish_one()
 
     def make_servermap(self, mode=MODE_CHECK, fn=None, sb=None,
-                       update_range=None):
+                       update_segments=None, update_blockhashes=None):
         if fn is None:
             fn = self._fn
         if sb is None:
             sb = self._storage_broker
         smu = ServermapUpdater(fn, sb, Monitor(),
-                               ServerMap(), mode, update_range=update_range)
+                               ServerMap(), mode,
+                               update_segments=update_segments,
+                               update_blockhashes=update_blockhashes)
         d = smu.update()
         return d
 
@@ -218,13 +220,40 @@ class Servermap(AsyncTestCase, PublishMixin):
         d.addCallback(lambda ignored:
             self.publish_mdmf())
         d.addCallback(lambda ignored:
-            self.make_servermap(mode=MODE_WRITE, update_range=(1, 2)))
+            self.make_servermap(mode=MODE_WRITE, update_segments={1, 2}))
         def _check_servermap(sm):
             # 10 shares
             self.assertThat(sm.update_data, HasLength(10))
             # one version
-            for data in sm.update_data.values():
+            for shnum, data in sm.update_data.items():
                 self.assertThat(data, HasLength(1))
+                [(verinfo, (blocks, blockhashes))] = data
+                # the blocks only come from the first k=3 shares
+                if shnum < 3:
+                    self.assertThat(sorted(blocks), Equals([1, 2]))
+                else:
+                    self.assertThat(blocks, Equals({}))
+                # and the whole block hash tree of 16 segments from each
+                self.assertThat(sorted(blockhashes), Equals(list(range(31))))
+        d.addCallback(_check_servermap)
+        return d
+
+    def test_fetch_update_some_blockhashes(self):
+        """
+        Only the block hashes asked for are fetched for an update.
+        """
+        d = defer.succeed(None)
+        d.addCallback(lambda ignored:
+            self.publish_mdmf())
+        d.addCallback(lambda ignored:
+            self.make_servermap(mode=MODE_WRITE, update_segments=set(),
+                                update_blockhashes={2, 3, 4, 16}))
+        def _check_servermap(sm):
+            self.assertThat(sm.update_data, HasLength(10))
+            for data in sm.update_data.values():
+                [(verinfo, (blocks, blockhashes))] = data
+                self.assertThat(blocks, Equals({}))
+                self.assertThat(sorted(blockhashes), Equals([2, 3, 4, 16]))
         d.addCallback(_check_servermap)
         return d
 
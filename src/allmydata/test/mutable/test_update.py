@@ -8,13 +8,16 @@ from testtools.matchers import (
     Equals,
     IsInstance,
     GreaterThan,
+    LessThan,
 )
 from twisted.internet import defer
 from allmydata.interfaces import MDMF_VERSION
 from allmydata.mutable.filenode import MutableFileNode
 from allmydata.mutable.publish import MutableData, DEFAULT_MUTABLE_MAX_SEGMENT_SIZE
+from allmydata.util import mathutil
 from ..no_network import GridTestMixin
 from .. import common_util as testutil
+from .util import PublishMixin, corrupt
 
 # We should really force a smaller segsize for the duration of the tests, to
 # let them run faster, but Many of them tests depend upon a specific segment
@@ -243,3 +246,79 @@ class Update(GridTestMixin, AsyncTestCase, testutil.ShouldFailMixin):
             return d
         d0.addCallback(_run)
         return d0
+
+
+class UpdateTraffic(AsyncTestCase, PublishMixin):
+    """
+    In-place updates of an MDMF file only move the segments they change.
+    """
+    # The segment size is rounded up to a multiple of k.
+    segsize = mathutil.next_multiple(DEFAULT_MUTABLE_MAX_SEGMENT_SIZE, 3)
+    block_size = segsize // 3
+
+    def setUp(self):
+        super(UpdateTraffic, self).setUp()
+        return self.publish_mdmf(b"0123456789" * (16 * SEGSIZE // 10))
+
+    def update(self, offset, new_data):
+        """
+        Write new_data at offset, check the file has the right contents
+        afterwards, and return how many bytes the update read and wrote.
+        """
+        expected = (self.CONTENTS[:offset] + new_data +
+                    self.CONTENTS[offset+len(new_data):])
+        d = self._fn.get_best_mutable_version()
+        def _update(mv):
+            self._storage.bytes_read = self._storage.bytes_written = 0
+            return mv.update(MutableData(new_data), offset)
+        d.addCallback(_update)
+        def _moved(ign):
+            self.moved = (self._storage.bytes_read, self._storage.bytes_written)
+        d.addCallback(_moved)
+        d.addCallback(lambda ign: self._fn.download_best_version())
+        d.addCallback(lambda results: self.assertThat(results, Equals(expected)))
+        d.addCallback(lambda ign: self.moved)
+        return d
+
+    def test_overwrite(self):
+        # Only the first k shares send the changed segment's block (on
+        # top of the few kB of each share read to find it), and each
+        # share only gets its new block, not the rest of the share.
+        d = self.update(5 * self.segsize + 100, b"replaced")
+        def _check(moved):
+            (read, written) = moved
+            self.assertThat(read, LessThan(5 * self.block_size))
+            self.assertThat(written, LessThan(10 * (self.block_size + 1024)))
+        d.addCallback(_check)
+        return d
+
+    def test_overwrite_segments(self):
+        # No blocks need to be read to overwrite whole segments.
+        d = self.update(5 * self.segsize, b"a" * (2 * self.segsize))
+        def _check(moved):
+            (read, written) = moved
+            self.assertThat(read, LessThan(self.block_size))
+            self.assertThat(written, LessThan(20 * (self.block_size + 1024)))
+        d.addCallback(_check)
+        return d
+
+    def test_append(self):
+        # Appending moves the block hash tree, so that is read and
+        # written whole, but the last segment is still only read from the
+        # first k shares.
+        d = self.update(len(self.CONTENTS), b"appended")
+        def _check(moved):
+            (read, written) = moved
+            self.assertThat(read, LessThan(5 * self.block_size))
+            self.assertThat(written, LessThan(10 * (self.block_size + 2048)))
+        d.addCallback(_check)
+        return d
+
+    def test_corrupt_block(self):
+        # If the changed segment's block is bad in some of the first k
+        # shares, it is read from other shares instead.
+        d = corrupt(None, self._storage, "share_data", [0, 2],
+                    offset_offset=5 * (self.block_size + 16) + 100)
+        d.addCallback(lambda ign: self.update(5 * self.segsize + 100,
+                                              b"replaced"))
+        return d
@@ -51,6 +51,10 @@ class FakeStorage(object):
         self._sequence = None
         self._pending = {}
         self._pending_timer = None
+        # The share data sent back by reads and received by writes, so
+        # tests can see how much an operation moves.
+        self.bytes_read = 0
+        self.bytes_written = 0
 
     def read(self, peerid, storage_index):
         shares = self._peers.get(peerid, {})
@@ -80,6 +84,7 @@ class FakeStorage(object):
         if peerid not in self._peers:
             self._peers[peerid] = {}
         shares = self._peers[peerid]
+        self.bytes_written += len(data)
         f = BytesIO()
         f.write(shares.get(shnum, b""))
         f.seek(offset)
@@ -130,6 +135,7 @@ class FakeStorageServer(object):
                     assert isinstance(offset, int), offset
                     assert isinstance(length, int), length
                     vector.append(shares[shnum][offset:offset+length])
+                    self.storage.bytes_read += len(vector[-1])
             return response
         d.addCallback(_read)
         return d
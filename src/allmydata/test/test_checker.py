@@ -770,6 +770,8 @@ class AddLease(GridTestMixin, unittest.TestCase):
                 raise KeyError("intentional failure, should be ignored")
             assert self.g.servers_by_number[0].add_lease
             self.g.servers_by_number[0].add_lease = broken_add_lease
+            # Remote callers reach it through the disk I/O variant:
+            self.g.servers_by_number[0].add_lease_async = broken_add_lease
         d.addCallback(_break_add_lease)
 
         # and confirm that the files still look healthy
@@ -785,6 +787,10 @@ class CounterHolder(object):
     def __init__(self):
         self._num_active_block_fetches = 0
         self._max_active_block_fetches = 0
+        # serverid -> number active, most active
+        self._active_per_server = {}
+        self._max_active_per_server = {}
+        self._reads = []
 
 from allmydata.immutable.checker import ValidatedReadBucketProxy
 class MockVRBP(ValidatedReadBucketProxy):
@@ -794,13 +800,21 @@ class MockVRBP(ValidatedReadBucketProxy):
                                           block_size, share_size)
         self.counterholder = counterholder
 
-    def get_block(self, blocknum):
-        self.counterholder._num_active_block_fetches += 1
-        if self.counterholder._num_active_block_fetches > self.counterholder._max_active_block_fetches:
-            self.counterholder._max_active_block_fetches = self.counterholder._num_active_block_fetches
-        d = ValidatedReadBucketProxy.get_block(self, blocknum)
+    def get_blocks(self, first, count):
+        ch = self.counterholder
+        serverid = self.bucket.get_peerid()
+        ch._reads.append((self.sharenum, first, count))
+        ch._num_active_block_fetches += 1
+        if ch._num_active_block_fetches > ch._max_active_block_fetches:
+            ch._max_active_block_fetches = ch._num_active_block_fetches
+        active = ch._active_per_server.get(serverid, 0) + 1
+        ch._active_per_server[serverid] = active
+        if active > ch._max_active_per_server.get(serverid, 0):
+            ch._max_active_per_server[serverid] = active
+        d = ValidatedReadBucketProxy.get_blocks(self, first, count)
         def _mark_no_longer_active(res):
-            self.counterholder._num_active_block_fetches -= 1
+            ch._num_active_block_fetches -= 1
+            ch._active_per_server[serverid] -= 1
             return res
         d.addBoth(_mark_no_longer_active)
         return d
@@ -810,12 +824,14 @@ class TooParallel(GridTestMixin, unittest.TestCase):
     # blocks of all shares at the same time, blowing our memory budget and
     # crashing with MemoryErrors on >1GB files.
 
-    def test_immutable(self):
+    def _verify(self, num_servers):
+        """
+        Upload an 80-block file with 1-of-4 encoding to num_servers servers,
+        then verify it, counting the block reads in a CounterHolder.
+        """
         import allmydata.immutable.checker
         origVRBP = allmydata.immutable.checker.ValidatedReadBucketProxy
 
-        self.basedir = "checker/TooParallel/immutable"
-
         # If any code asks to instantiate a ValidatedReadBucketProxy,
         # we give them a MockVRBP which is configured to use our
         # CounterHolder.
@@ -826,10 +842,10 @@ class TooParallel(GridTestMixin, unittest.TestCase):
 
         d = defer.succeed(None)
         def _start(ign):
-            self.set_up_grid(num_servers=4)
+            self.set_up_grid(num_servers=num_servers)
             self.c0 = self.g.clients[0]
             self.c0.encoding_params = { "k": 1,
-                                        "happy": 4,
+                                        "happy": num_servers,
                                         "n": 4,
                                         "max_segment_size": 5,
                                       }
@@ -842,13 +858,44 @@ class TooParallel(GridTestMixin, unittest.TestCase):
             return n.check(Monitor(), verify=True)
         d.addCallback(_do_check)
         def _check(cr):
-            # the verifier works on all 4 shares in parallel, but only
-            # fetches one block from each share at a time, so we expect to
-            # see 4 parallel fetches
-            self.failUnlessEqual(counterholder._max_active_block_fetches, 4)
+            self.failUnless(cr.is_healthy())
+            return counterholder
         d.addCallback(_check)
         def _clean_up(res):
             allmydata.immutable.checker.ValidatedReadBucketProxy = origVRBP
             return res
         d.addBoth(_clean_up)
         return d
+
+    def test_immutable(self):
+        self.basedir = "checker/TooParallel/immutable"
+        d = self._verify(num_servers=4)
+        def _check(counterholder):
+            # the verifier works on all 4 shares in parallel, and the blocks
+            # of each share are few enough to read at once, so we expect to
+            # see 4 parallel fetches
+            self.failUnlessEqual(counterholder._max_active_block_fetches, 4)
+            self.failUnlessEqual(sorted(counterholder._reads),
+                                 [(sharenum, 0, 80) for sharenum in range(4)])
+        d.addCallback(_check)
+        return d
+
+    def test_window(self):
+        # With runs of 10 blocks per read, each share takes 8 reads, and
+        # no more than VERIFY_READS_PER_SERVER are outstanding at each
+        # server, however many shares it has.
+        import allmydata.immutable.checker
+        self.patch(allmydata.immutable.checker, "VERIFY_READ_SIZE", 50)
+        self.patch(allmydata.immutable.checker, "VERIFY_READS_PER_SERVER", 3)
+        self.basedir = "checker/TooParallel/window"
+        d = self._verify(num_servers=2)
+        def _check(counterholder):
+            self.failUnlessEqual(
+                sorted(counterholder._reads),
+                [(sharenum, first, 10)
+                 for sharenum in range(4) for first in range(0, 80, 10)])
+            self.failUnlessEqual(
+                sorted(counterholder._max_active_per_server.values()),
+                [3, 3])
+        d.addCallback(_check)
+        return d
@@ -55,7 +55,7 @@ from allmydata.nodemaker import (
     NodeMaker,
 )
 from allmydata.node import OldConfigError, UnescapedHashError, create_node_dir
-from allmydata import client
+from allmydata import client, dirnode, uri
 from allmydata.storage_client import (
     StorageClientConfig,
     StorageFarmBroker,
@@ -396,6 +396,140 @@ class Basic(testutil.ReallyEqualMixin, unittest.TestCase):
         with self.assertRaises(ValueError):
             yield client.create_client(basedir)
 
+    @defer.inlineCallbacks
+    def test_upload_pipeline(self):
+        """
+        upload.pipeline_depth and upload.pipeline_max_bytes are passed on to
+        the uploader.
+        """
+        basedir = "client.Basic.test_upload_pipeline"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"),
+                       BASECONFIG +
+                       "upload.pipeline_depth = 7\n" +
+                       "upload.pipeline_max_bytes = 10MiB\n")
+        c = yield client.create_client(basedir)
+        uploader = c.getServiceNamed("uploader")
+        self.assertEqual(uploader._pipeline_depth, 7)
+        self.assertEqual(uploader._pipeline_max_bytes, 10*1024*1024)
+
+    @defer.inlineCallbacks
+    def test_upload_pipeline_bad(self):
+        """
+        upload.pipeline_depth must be positive.
+        """
+        basedir = "client.Basic.test_upload_pipeline_bad"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"),
+                       BASECONFIG +
+                       "upload.pipeline_depth = 0\n")
+        with self.assertRaises(ValueError):
+            yield client.create_client(basedir)
+
+    @defer.inlineCallbacks
+    def test_segment_cache(self):
+        """
+        download.segment_cache_max_bytes gives the node maker a segment cache
+        of that size, whose statistics are reported.
+        """
+        basedir = "client.Basic.test_segment_cache"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"),
+                       BASECONFIG +
+                       "download.segment_cache_max_bytes = 10MiB\n")
+        c = yield client.create_client(basedir)
+        self.assertEqual(c.nodemaker.segment_cache.max_bytes, 10*1024*1024)
+        self.assertEqual(
+            c.stats_provider.get_stats()["stats"]["downloader.segment_cache.hits"],
+            0,
+        )
+
+    @defer.inlineCallbacks
+    def test_segment_cache_disabled(self):
+        """
+        By default there is no segment cache.
+        """
+        basedir = "client.Basic.test_segment_cache_disabled"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"), BASECONFIG)
+        c = yield client.create_client(basedir)
+        self.assertIs(c.nodemaker.segment_cache, None)
+
+    @defer.inlineCallbacks
+    def test_node_cache(self):
+        """
+        node_cache.max_entries and node_cache.max_bytes give the node maker a
+        node cache of that size, whose statistics are reported.
+        """
+        basedir = "client.Basic.test_node_cache"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"),
+                       BASECONFIG +
+                       "node_cache.max_entries = 50\n"
+                       "node_cache.max_bytes = 1MiB\n")
+        c = yield client.create_client(basedir)
+        self.assertEqual(c.nodemaker.node_cache.max_entries, 50)
+        self.assertEqual(c.nodemaker.node_cache.max_bytes, 1024*1024)
+        self.assertEqual(
+            c.stats_provider.get_stats()["stats"]["nodemaker.node_cache.hits"],
+            0,
+        )
+
+    @defer.inlineCallbacks
+    def test_node_cache_disabled(self):
+        """
+        Setting node_cache.max_entries to 0 turns the node cache off.
+        """
+        basedir = "client.Basic.test_node_cache_disabled"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"),
+                       BASECONFIG + "node_cache.max_entries = 0\n")
+        c = yield client.create_client(basedir)
+        self.assertIs(c.nodemaker.node_cache, None)
+
+    @defer.inlineCallbacks
+    def test_mutable_read_options(self):
+        """
+        mutable.servermap_cache_ttl and mutable.optimistic_reads are passed
+        to the node maker, for the mutable file nodes it makes.
+        """
+        basedir = "client.Basic.test_mutable_read_options"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"),
+                       BASECONFIG +
+                       "mutable.servermap_cache_ttl = 60\n"
+                       "mutable.optimistic_reads = true\n")
+        c = yield client.create_client(basedir)
+        self.assertEqual(c.nodemaker.servermap_cache_ttl, 60)
+        self.assertTrue(c.nodemaker.optimistic_mutable_reads)
+
+    @defer.inlineCallbacks
+    def test_key_pool(self):
+        """
+        mutable.key_pool_size gives the node maker a key pool of that size,
+        whose statistics are reported.
+        """
+        basedir = "client.Basic.test_key_pool"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"),
+                       BASECONFIG + "mutable.key_pool_size = 5\n")
+        c = yield client.create_client(basedir)
+        self.assertEqual(c.nodemaker.key_generator.size, 5)
+        self.assertEqual(
+            c.stats_provider.get_stats()["stats"]["key_pool.depth"], 0,
+        )
+
+    @defer.inlineCallbacks
+    def test_key_pool_disabled(self):
+        """
+        By default new keypairs are only generated when they are needed.
+        """
+        basedir = "client.Basic.test_key_pool_disabled"
+        os.mkdir(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"), BASECONFIG)
+        c = yield client.create_client(basedir)
+        self.assertIsInstance(c.nodemaker.key_generator, client.KeyGenerator)
+
     @defer.inlineCallbacks
     def test_web_apiauthtoken(self):
         """
@@ -1180,6 +1314,31 @@ class NodeMakerTests(testutil.ReallyEqualMixin, AsyncBrokenTestCase):
         self.failUnlessReallyEqual(n.get_write_uri(), unknown_rw)
         self.failUnlessReallyEqual(n.get_readonly_uri(), b"ro." + unknown_ro)
 
+    @defer.inlineCallbacks
+    def test_directory_children_not_reused(self):
+        """
+        A directory hands out a new node for a CHK child each time it is
+        asked, even though it remembers its unpacked children between reads
+        (see #1679 in ``test_maker``).
+        """
+        basedir = "client/NodeMaker/directory_children_not_reused"
+        fileutil.make_dirs(basedir)
+        fileutil.write(os.path.join(basedir, "tahoe.cfg"), BASECONFIG)
+        c = yield client.create_client(basedir)
+
+        chk = c.create_node_from_uri(b"URI:CHK:6nmrpsubgbe57udnexlkiwzmlu:bjt7j6hshrlmadjyr7otq3dc24end5meo5xcr5xe5r663po6itmq:3:10:7277")
+        packed = dirnode.pack_children({u"f": (chk, {})}, None, deep_immutable=True)
+        d = c.create_node_from_uri(uri.LiteralDirectoryURI(uri.LiteralFileURI(packed)).to_string())
+
+        first = yield d.get(u"f")
+        second = yield d.get(u"f")
+        self.failUnlessReallyEqual(first.get_uri(), chk.get_uri())
+        self.failIf(first is second, (first, second))
+
+        listing = yield d.list()
+        self.failIf(listing[u"f"][0] is first)
+        listing_again = yield d.list()
+        self.failIf(listing_again[u"f"][0] is listing[u"f"][0])
 
 
 def matches_dummy_announcement(name, value):
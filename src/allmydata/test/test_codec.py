@@ -7,7 +7,9 @@ Ported to Python 3.
 import os
 from twisted.trial import unittest
 from twisted.python import log
-from allmydata.codec import CRSEncoder, CRSDecoder, parse_params
+from allmydata.codec import (
+    CRSEncoder, CRSDecoder, parse_params, split_into_shares, join_decoded,
+)
 import random
 from allmydata.util import mathutil
 
@@ -102,3 +104,27 @@ class T(unittest.TestCase):
 
     def test_encode2(self):
         return self.do_test(125, 25, 100, 90)
+
+
+class Buffers(unittest.TestCase):
+    def test_split_into_shares(self):
+        chunks = [b"abcde", b"", b"fg", b"hijklmn"]
+        self.assertEqual(split_into_shares(chunks, 3, 5),
+                         [b"abcde", b"fghij", b"klmn\x00"])
+        self.assertEqual(split_into_shares([b"ab"], 3, 2),
+                         [b"ab", b"\x00\x00", b"\x00\x00"])
+        self.assertRaises(AssertionError, split_into_shares, [b"abcde"], 2, 2)
+
+    def test_split_into_shares_returns_bytes(self):
+        # primary shares are passed through zfec untouched, and must be
+        # something we can send to a storage server
+        for share in split_into_shares([bytearray(b"abcdef")], 2, 3):
+            self.assertIsInstance(share, bytes)
+
+    def test_join_decoded(self):
+        buffers = [b"abc", memoryview(b"def"), b"ghi"]
+        self.assertEqual(join_decoded(buffers, 9), b"abcdefghi")
+        self.assertEqual(join_decoded(buffers, 8), b"abcdefgh")
+        self.assertEqual(join_decoded(buffers, 5), b"abcde")
+        self.assertIsInstance(join_decoded(buffers, 7), bytes)
+        self.assertRaises(AssertionError, join_decoded, buffers, 10)
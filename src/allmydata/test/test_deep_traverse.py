@@ -0,0 +1,288 @@
+"""
+Tests for ``allmydata.deep_traverse``.
+"""
+
+from zope.interface import implementer
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from allmydata.deep_traverse import DeepTraversal, _Frontier
+from allmydata.interfaces import IDirectoryNode
+from allmydata.monitor import Monitor
+
+
+class FakeVerifyCap(object):
+    def __init__(self, cap):
+        self._cap = cap
+
+    def to_string(self):
+        return b"verify:" + self._cap
+
+
+class FakeFile(object):
+    def __init__(self, cap):
+        self.cap = cap
+
+    def get_verify_cap(self):
+        return FakeVerifyCap(self.cap)
+
+
+@implementer(IDirectoryNode)
+class FakeDirectory(object):
+    """
+    A directory whose ``list_for_traversal()`` doesn't answer until the test
+    says so.
+    """
+    def __init__(self, cap, reads):
+        self.cap = cap
+        self._reads = reads
+
+    def get_verify_cap(self):
+        return FakeVerifyCap(self.cap)
+
+    def get_write_uri(self):
+        return None
+
+    def get_readonly_uri(self):
+        return self.cap
+
+    def list_for_traversal(self):
+        d = defer.Deferred()
+        self._reads.append((self.cap, d))
+        return d
+
+
+class FakeNodeMaker(object):
+    def __init__(self):
+        self.reads = []
+
+    def create_from_cap(self, writecap, readcap):
+        return FakeDirectory(readcap, self.reads)
+
+
+class RecordingWalker(object):
+    def __init__(self):
+        self.added = []
+        self.entered = []
+
+    def add_node(self, node, path):
+        self.added.append((node.cap, tuple(path)))
+
+    def enter_directory(self, parent, children):
+        self.entered.append(parent.cap)
+
+
+class ShardRecordingWalker(RecordingWalker):
+    def __init__(self):
+        RecordingWalker.__init__(self)
+        self.shards = []
+
+    def add_shard(self, node, path):
+        self.shards.append((node.cap, tuple(path)))
+
+
+class DeepTraversalTests(unittest.SynchronousTestCase):
+    """
+    Tests for ``DeepTraversal``.
+    """
+
+    def setUp(self):
+        self.nodemaker = FakeNodeMaker()
+        self.walker = ShardRecordingWalker()
+
+    def traverse(self, concurrency=2, frontier_in_memory=100):
+        traversal = DeepTraversal(
+            self.nodemaker, self.walker, Monitor(), set(),
+            concurrency, frontier_in_memory,
+        )
+        return traversal.run(FakeDirectory(b"root", self.nodemaker.reads))
+
+    def reading(self):
+        return [cap for (cap, _) in self.nodemaker.reads]
+
+    def answer(self, cap, children, shards=()):
+        """
+        Answer the outstanding ``list_for_traversal()`` of the directory
+        ``cap``.
+        """
+        [d] = [d for (c, d) in self.nodemaker.reads if c == cap]
+        self.nodemaker.reads = [
+            (c, d) for (c, d) in self.nodemaker.reads if c != cap
+        ]
+        d.callback((
+            {name: (child, {}) for (name, child) in children.items()},
+            list(shards),
+        ))
+
+    def directory(self, cap):
+        return FakeDirectory(cap, self.nodemaker.reads)
+
+    def test_concurrency(self):
+        """
+        No more than ``concurrency`` directories are read at once, and every
+        node is given to the walker once, with its path.
+        """
+        d = self.traverse(concurrency=2)
+        self.assertEqual(self.reading(), [b"root"])
+        self.answer(b"root", {
+            "d%d" % i: self.directory(b"d%d" % i) for i in range(5)
+        })
+        self.assertEqual(len(self.reading()), 2)
+
+        answered = set()
+        while self.reading():
+            self.assertLessEqual(len(self.reading()), 2)
+            cap = self.reading()[0]
+            answered.add(cap)
+            self.answer(cap, {"f": FakeFile(cap + b"-file")})
+        self.assertIsNone(self.successResultOf(d))
+
+        self.assertEqual(answered, {b"d%d" % i for i in range(5)})
+        self.assertEqual(
+            sorted(self.walker.added),
+            sorted(
+                [(b"root", ())]
+                + [(b"d%d" % i, ("d%d" % i,)) for i in range(5)]
+                + [(b"d%d-file" % i, ("d%d" % i, "f")) for i in range(5)]
+            ),
+        )
+        self.assertEqual(len(self.walker.entered), 6)
+
+    def test_duplicates(self):
+        """
+        Nodes found more than once, including the root, are only given to
+        the walker the first time.
+        """
+        d = self.traverse()
+        self.answer(b"root", {
+            "a": self.directory(b"a"),
+            "b": self.directory(b"a"),
+            "f1": FakeFile(b"f"),
+            "f2": FakeFile(b"f"),
+        })
+        self.answer(b"a", {
+            "up": self.directory(b"root"),
+            "f": FakeFile(b"f"),
+        })
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(
+            self.walker.added,
+            [(b"root", ()), (b"f", ("f1",)), (b"a", ("a",))],
+        )
+
+    def test_shards(self):
+        """
+        The shards of a sharded directory are read, once each, and their
+        children are given to the walker as the directory's children. The
+        shards are only given to ``add_shard()``.
+        """
+        d = self.traverse()
+        self.answer(b"root", {"d": self.directory(b"d")})
+        self.answer(b"d", {}, shards=[
+            self.directory(b"s0"), self.directory(b"s1"), self.directory(b"s1"),
+        ])
+        self.assertEqual(sorted(self.reading()), [b"s0", b"s1"])
+        self.answer(b"s0", {"f0": FakeFile(b"f0")})
+        self.answer(b"s1", {"f1": FakeFile(b"f1")})
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(
+            sorted(self.walker.added),
+            [(b"d", ("d",)), (b"f0", ("d", "f0")), (b"f1", ("d", "f1")),
+             (b"root", ())],
+        )
+        self.assertEqual(sorted(self.walker.entered), [b"d", b"root"])
+        self.assertEqual(
+            sorted(self.walker.shards), [(b"s0", ("d",)), (b"s1", ("d",))],
+        )
+
+    def test_shards_without_add_shard(self):
+        """
+        A walker doesn't need an ``add_shard()`` method.
+        """
+        self.walker = RecordingWalker()
+        d = self.traverse()
+        self.answer(b"root", {}, shards=[self.directory(b"s0")])
+        self.answer(b"s0", {"f0": FakeFile(b"f0")})
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(
+            sorted(self.walker.added), [(b"f0", ("f0",)), (b"root", ())],
+        )
+
+    def test_spilled_frontier(self):
+        """
+        A traversal finds everything even when most of the directories
+        waiting to be read are kept on disk.
+        """
+        d = self.traverse(concurrency=1, frontier_in_memory=3)
+        self.answer(b"root", {
+            "d%02d" % i: self.directory(b"d%02d" % i) for i in range(20)
+        })
+        while self.reading():
+            self.answer(self.reading()[0], {})
+        self.assertIsNone(self.successResultOf(d))
+        self.assertEqual(len(self.walker.entered), 21)
+
+    def test_failure(self):
+        """
+        If a directory can't be read the traversal fails, once the
+        directories already being read are finished, without starting any
+        more.
+        """
+        d = self.traverse(concurrency=2)
+        self.answer(b"root", {
+            "d%d" % i: self.directory(b"d%d" % i) for i in range(4)
+        })
+        [(first, first_d), (second, _)] = self.nodemaker.reads
+        self.nodemaker.reads = self.nodemaker.reads[1:]
+        first_d.errback(ZeroDivisionError())
+        self.assertNoResult(d)
+        self.answer(second, {})
+        self.assertEqual(self.reading(), [])
+        self.failureResultOf(d, ZeroDivisionError)
+
+    def test_cancelled(self):
+        """
+        Cancelling the traversal's monitor stops it.
+        """
+        monitor = Monitor()
+        traversal = DeepTraversal(
+            self.nodemaker, self.walker, monitor, set(), 2, 100,
+        )
+        d = traversal.run(FakeDirectory(b"root", self.nodemaker.reads))
+        monitor.cancel()
+        self.answer(b"root", {"d": self.directory(b"d")})
+        self.assertEqual(self.reading(), [])
+        self.failureResultOf(d)
+
+
+class FrontierTests(unittest.TestCase):
+    """
+    Tests for ``_Frontier``.
+    """
+
+    def test_spill(self):
+        """
+        Entries beyond what's kept in memory are written to disk, and all of
+        them come back out.
+        """
+        frontier = _Frontier(3)
+        self.addCleanup(frontier.close)
+        entries = [
+            (b"URI:DIR2:%d" % i if i % 2 else None, b"URI:DIR2-RO:%d" % i,
+             ["a", "\N{SNOWMAN}%d" % i], i % 3 == 0)
+            for i in range(10)
+        ]
+        for entry in entries:
+            frontier.push(*entry)
+            self.assertLessEqual(len(frontier._in_memory), 3)
+        self.assertEqual(len(frontier), 10)
+
+        popped = []
+        while len(frontier):
+            popped.append(frontier.pop())
+            self.assertLessEqual(len(frontier._in_memory), 3)
+            if len(popped) == 5:
+                # Adding more while some are still on disk works too.
+                frontier.push(*entries[0])
+                entries.append(entries[0])
+        self.assertEqual(sorted(popped, key=repr), sorted(entries, key=repr))
@@ -4,6 +4,7 @@ Ported to Python 3.
 """
 
 import time
+import threading
 import unicodedata
 from zope.interface import implementer
 from twisted.trial import unittest
@@ -1375,6 +1376,31 @@ class Dirnode(GridTestMixin, unittest.TestCase,
         d.addCallback(_then)
         return d
 
+    @defer.inlineCallbacks
+    def test_deep_check_sharded(self):
+        """
+        Deep-check and deep-check-and-repair check the shards of a sharded
+        directory, without giving them paths of their own.
+        """
+        self.basedir = "dirnode/Dirnode/test_deep_check_sharded"
+        self.set_up_grid(oneshare=True)
+        c = self.g.clients[0]
+        root = yield c.create_dirnode()
+        big = yield root.create_subdirectory(u"big")
+        for i in range(6):
+            yield big.add_file(u"file%d" % i, upload.Data(b"data %d" % i * 20, None))
+        yield big.shard(3)
+        paths = sorted([(), (u"big",)] + [(u"big", u"file%d" % i) for i in range(6)])
+
+        r = yield root.start_deep_check().when_done()
+        self.failUnlessReallyEqual(r.get_counters()["count-objects-checked"], 2 + 3 + 6)
+        self.failUnlessReallyEqual(r.get_counters()["count-objects-healthy"], 2 + 3 + 6)
+        self.failUnlessReallyEqual(sorted(r.get_all_results()), paths)
+
+        r = yield root.start_deep_check_and_repair().when_done()
+        self.failUnlessReallyEqual(r.get_counters()["count-objects-checked"], 2 + 3 + 6)
+        self.failUnlessReallyEqual(sorted(r.get_all_results()), paths)
+
     def test_create_subdirectory(self):
         self.basedir = "dirnode/Dirnode/test_create_subdirectory"
         self.set_up_grid(oneshare=True)
@@ -1595,9 +1621,18 @@ class FakeMutableFile(object):  # type: ignore # incomplete implementation
     def download_best_version(self):
         return defer.succeed(self.data)
 
+    def download_best_version_if_changed(self, known_version):
+        # the contents will do as a version
+        if self.data == known_version:
+            return defer.succeed((known_version, None))
+        return defer.succeed((self.data, self.data))
+
     def get_writekey(self):
         return b"writekey"
 
+    def get_size(self):
+        return len(self.data)
+
     def is_readonly(self):
         return False
 
@@ -1823,6 +1858,322 @@ class Dirnode2(testutil.ReallyEqualMixin, testutil.ShouldFailMixin, unittest.Tes
 
 
 
+class LazyChildren(unittest.TestCase):
+    """
+    Directories unpack only the children that are asked for, and don't
+    unpack the same contents twice.
+    """
+    def setUp(self):
+        self.nodemaker = FakeClient2().nodemaker
+        self.decoded = []
+        original = dirnode._decode_entries
+        def _decode_entries(entries, writekey, mutable):
+            self.decoded.extend(name for (name, entry) in entries)
+            return original(entries, writekey, mutable)
+        self.patch(dirnode, "_decode_entries", _decode_entries)
+
+    @defer.inlineCallbacks
+    def make_directory(self, count):
+        self.uris = {u"kid%d" % i: make_chk_file_uri(i + 1) for i in range(count)}
+        kids = {
+            name: (self.nodemaker.create_from_cap(cap), {})
+            for (name, cap) in self.uris.items()
+        }
+        n = yield self.nodemaker.create_new_mutable_directory(kids)
+        del self.decoded[:]
+        defer.returnValue(n)
+
+    @defer.inlineCallbacks
+    def test_get_one_child(self):
+        """
+        Looking up a child unpacks only that child.
+        """
+        n = yield self.make_directory(10)
+        child = yield n.get(u"kid3")
+        self.assertEqual(child.get_uri(), self.uris[u"kid3"])
+        self.assertEqual(self.decoded, [u"kid3"])
+        self.assertTrue((yield n.has_child(u"kid5")))
+        self.assertFalse((yield n.has_child(u"nope")))
+        self.assertEqual(self.decoded, [u"kid3", u"kid5"])
+
+    @defer.inlineCallbacks
+    def test_modify(self):
+        """
+        Adding, replacing, and deleting children only unpacks the children
+        concerned, and keeps the others as they were.
+        """
+        n = yield self.make_directory(10)
+        new_uri = make_chk_file_uri(100)
+        replacement_uri = make_chk_file_uri(101)
+        yield n.set_uri(u"new", new_uri, None)
+        yield n.set_uri(u"kid1", replacement_uri, None, overwrite=True)
+        yield n.delete(u"kid2")
+        # kid1 and kid2 are unpacked to check what's being replaced or
+        # deleted.
+        self.assertEqual(sorted(self.decoded), [u"kid1", u"kid2"])
+
+        children = yield n.list()
+        self.assertEqual(
+            {name: child.get_uri() for (name, (child, metadata)) in children.items()},
+            dict(
+                {name: cap for (name, cap) in self.uris.items() if name != u"kid2"},
+                kid1=replacement_uri,
+                new=new_uri,
+            ),
+        )
+
+    @defer.inlineCallbacks
+    def test_unchanged_not_reparsed(self):
+        """
+        Listing a directory whose contents haven't changed since it was last
+        read doesn't unpack its children again, but each listing gets its own
+        nodes and metadata.
+        """
+        n = yield self.make_directory(5)
+        first = yield n.list()
+        self.assertEqual(len(self.decoded), 5)
+        first[u"kid0"][1]["mine"] = True
+        second = yield n.list()
+        self.assertEqual(len(self.decoded), 5)
+        self.assertEqual(sorted(first), sorted(second))
+        self.assertNotIn("mine", second[u"kid0"][1])
+        self.assertIsNot(first[u"kid0"][0], second[u"kid0"][0])
+
+        yield n.set_uri(u"new", make_chk_file_uri(100), None)
+        third = yield n.list()
+        self.assertIn(u"new", third)
+        self.assertEqual(len(third), 6)
+
+    @defer.inlineCallbacks
+    def test_large_directory(self):
+        """
+        The children of large directories are unpacked in the CPU thread
+        pool.
+        """
+        self.patch(dirnode, "_UNPACK_IN_THREAD_MINIMUM", 3)
+        unpacked_in = []
+        original = dirnode._decode_entries
+        def _decode_entries(*args):
+            unpacked_in.append(threading.current_thread())
+            return original(*args)
+        self.patch(dirnode, "_decode_entries", _decode_entries)
+
+        n = yield self.make_directory(5)
+        children = yield n.list()
+        self.assertEqual(len(children), 5)
+        self.assertNotEqual(unpacked_in, [threading.current_thread()])
+
+
+class RememberingNodeMaker(FakeNodeMaker):
+    """
+    A FakeNodeMaker which gives back the FakeMutableFiles it made when asked
+    for a node for their caps.
+    """
+    def __init__(self, *args):
+        FakeNodeMaker.__init__(self, *args)
+        self._files = {}
+
+    def create_mutable_file(self, contents=b"", keysize=None, version=None, keypair=None):
+        d = FakeNodeMaker.create_mutable_file(self, contents, keysize, version, keypair)
+        def _created(n):
+            self._files[n.get_uri()] = n
+            return n
+        d.addCallback(_created)
+        return d
+
+    def _create_mutable(self, cap):
+        return self._files[cap.to_string()]
+
+
+class Sharding(testutil.ShouldFailMixin, unittest.TestCase):
+    """
+    Sharded directories behave like any other directory, and changing one
+    of their children only rewrites the shard holding it.
+    """
+    def setUp(self):
+        self.nodemaker = RememberingNodeMaker(None, None, None, None, None,
+                                              {"k": 3, "n": 10}, None, None)
+
+    @defer.inlineCallbacks
+    def make_sharded_directory(self, count, shards):
+        self.uris = {u"kid%d" % i: make_chk_file_uri(i + 1) for i in range(count)}
+        kids = {
+            name: (self.nodemaker.create_from_cap(cap), {"n": name})
+            for (name, cap) in self.uris.items()
+        }
+        n = yield self.nodemaker.create_new_mutable_directory(kids)
+        result = yield n.shard(shards)
+        self.assertEqual(result, shards)
+        defer.returnValue(n)
+
+    def contents(self, n):
+        return n._node.data
+
+    @defer.inlineCallbacks
+    def uris_of(self, n):
+        children = yield n.list()
+        defer.returnValue(
+            {name: child.get_uri() for (name, (child, metadata)) in children.items()}
+        )
+
+    @defer.inlineCallbacks
+    def test_read(self):
+        """
+        A sharded directory lists, and looks up, the same children as before
+        it was sharded.
+        """
+        n = yield self.make_sharded_directory(50, 4)
+        self.assertTrue(self.contents(n).startswith(dirnode.SHARDED_MAGIC))
+        self.assertEqual((yield self.uris_of(n)), self.uris)
+        child, metadata = yield n.get_child_and_metadata(u"kid7")
+        self.assertEqual(child.get_uri(), self.uris[u"kid7"])
+        self.assertEqual(metadata["n"], u"kid7")
+        self.assertEqual((yield n.get_metadata_for(u"kid8"))["n"], u"kid8")
+        self.assertTrue((yield n.has_child(u"kid9")))
+        self.assertFalse((yield n.has_child(u"nope")))
+        yield self.shouldFail(NoSuchChildError, "get", "nope", n.get, u"nope")
+
+        children, shards = yield n.list_for_traversal()
+        self.assertEqual(children, {})
+        self.assertEqual(len(shards), 4)
+        shard_sizes = []
+        for shard in shards:
+            shard_sizes.append(len((yield shard.list())))
+        self.assertEqual(sum(shard_sizes), 50)
+        self.assertNotIn(50, shard_sizes)
+
+    @defer.inlineCallbacks
+    def test_modify_one_shard(self):
+        """
+        Adding, changing and deleting a child only rewrites the shard holding
+        it.
+        """
+        n = yield self.make_sharded_directory(50, 4)
+        index = self.contents(n)
+        children, shards = yield n.list_for_traversal()
+
+        for change in [
+                lambda: n.set_uri(u"new", make_chk_file_uri(100), None),
+                lambda: n.set_metadata_for(u"kid3", {"changed": True}),
+                lambda: n.delete(u"kid4"),
+        ]:
+            before = [self.contents(shard) for shard in shards]
+            yield change()
+            after = [self.contents(shard) for shard in shards]
+            self.assertEqual(sum(b != a for (b, a) in zip(before, after)), 1)
+        self.assertEqual(self.contents(n), index)
+
+        uris = yield self.uris_of(n)
+        self.assertIn(u"new", uris)
+        self.assertNotIn(u"kid4", uris)
+        self.assertEqual(len(uris), 50)
+        self.assertTrue((yield n.get_metadata_for(u"kid3"))["changed"])
+
+    @defer.inlineCallbacks
+    def test_set_nodes(self):
+        """
+        Adding several children at once adds each to its shard, and
+        overwrite=False still refuses to replace an existing child.
+        """
+        n = yield self.make_sharded_directory(10, 3)
+        new = {u"new%d" % i: make_chk_file_uri(100 + i) for i in range(10)}
+        yield n.set_children({name: (cap, None) for (name, cap) in new.items()})
+        self.assertEqual((yield self.uris_of(n)), dict(self.uris, **new))
+        yield self.shouldFail(
+            ExistingChildError, "set_uri", None,
+            n.set_uri, u"kid1", make_chk_file_uri(200), None, overwrite=False,
+        )
+
+    @defer.inlineCallbacks
+    def test_set_children_refused(self):
+        """
+        If overwrite=False refuses one of the children given to
+        set_children(), none of them are added, whichever shards they
+        belong to.
+        """
+        n = yield self.make_sharded_directory(10, 3)
+        children, shards = yield n.list_for_traversal()
+        before = [self.contents(shard) for shard in shards]
+        new = {u"new%d" % i: (make_chk_file_uri(100 + i), None) for i in range(10)}
+        new[u"kid1"] = (make_chk_file_uri(200), None)
+        yield self.shouldFail(
+            ExistingChildError, "set_children", None,
+            n.set_children, new, overwrite=False,
+        )
+        self.assertEqual([self.contents(shard) for shard in shards], before)
+        self.assertEqual((yield self.uris_of(n)), self.uris)
+
+    @defer.inlineCallbacks
+    def test_nested(self):
+        """
+        A shard can itself be sharded.
+        """
+        n = yield self.make_sharded_directory(20, 2)
+        children, shards = yield n.list_for_traversal()
+        yield shards[0].shard(3)
+        replacement = make_chk_file_uri(100)
+        yield n.set_children({name: (replacement, None) for name in self.uris})
+        for name in sorted(self.uris)[:5]:
+            yield n.delete(name)
+        self.assertEqual(
+            (yield self.uris_of(n)),
+            {name: replacement for name in sorted(self.uris)[5:]},
+        )
+        nested_children, nested_shards = yield shards[0].list_for_traversal()
+        self.assertEqual(len(nested_shards), 3)
+
+    @defer.inlineCallbacks
+    def test_manifest(self):
+        """
+        A deep traversal finds every child of a sharded directory, at the
+        directory's path. The shards aren't listed or counted as
+        directories, but their verifycaps and storage indexes are reported.
+        """
+        n = yield self.make_sharded_directory(20, 4)
+        children, shards = yield n.list_for_traversal()
+        root = yield self.nodemaker.create_new_mutable_directory({u"big": (n, {})})
+        results = yield root.build_manifest().when_done()
+        paths = [path for (path, cap) in results["manifest"]]
+        self.assertEqual(
+            sorted(paths),
+            sorted([(), (u"big",)] + [(u"big", name) for name in self.uris]),
+        )
+        self.assertEqual(results["stats"]["count-directories"], 2)
+        self.assertEqual(results["stats"]["largest-directory-children"], 1)
+        for shard in shards:
+            self.assertIn(shard.get_verify_cap().to_string(), results["verifycaps"])
+
+    @defer.inlineCallbacks
+    def test_already_sharded(self):
+        """
+        Sharding a sharded directory leaves it as it is.
+        """
+        n = yield self.make_sharded_directory(10, 2)
+        index = self.contents(n)
+        self.assertEqual((yield n.shard(5)), 2)
+        self.assertEqual(self.contents(n), index)
+
+    @defer.inlineCallbacks
+    def test_changed_while_sharding(self):
+        """
+        If the directory changes while it's being sharded, it's left as it
+        is.
+        """
+        n = yield self.nodemaker.create_new_mutable_directory()
+        original = self.nodemaker.create_new_mutable_directory
+        def create_new_mutable_directory(*args, **kwargs):
+            n._node.data += dirnode.pack_children(
+                {u"late": (self.nodemaker.create_from_cap(make_chk_file_uri(1)), {})},
+                n._node.get_writekey(),
+            )
+            return original(*args, **kwargs)
+        self.patch(self.nodemaker, "create_new_mutable_directory",
+                   create_new_mutable_directory)
+        yield self.shouldFail(dirnode.DirectoryChangedError, "shard", None,
+                              n.shard, 1)
+        self.assertEqual(list((yield n.list())), [u"late"])
+
+
 class DeepStats(testutil.ReallyEqualMixin, unittest.TestCase):
     def test_stats(self):
         ds = dirnode.DeepStats(None)
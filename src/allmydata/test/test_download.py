@@ -25,6 +25,7 @@ from allmydata.interfaces import NotEnoughSharesError, NoSharesError, \
 from allmydata.immutable.downloader.common import BadSegmentNumberError, \
      BadCiphertextHashError, COMPLETE, OVERDUE, DEAD
 from allmydata.immutable.downloader.status import DownloadStatus
+from allmydata.immutable.downloader.cache import SegmentCache
 from allmydata.immutable.downloader.fetcher import SegmentFetcher
 from allmydata.codec import CRSDecoder
 from foolscap.eventual import eventually, fireEventually, flushEventualQueue
@@ -874,13 +875,95 @@ class DownloadTest(_Base, unittest.TestCase):
         d.addCallback(_got_ciphertext)
         return d
 
+    def _download_counting_active_segments(self, segment_window):
+        """
+        Upload a many-segment file, then download it while recording how many
+        segments the DownloadNode was fetching at once.
+        """
+        self.basedir = self.mktemp()
+        self.set_up_grid()
+        self.c0 = self.g.clients[0]
+        u = upload.Data(plaintext, None)
+        u.max_segment_size = 30 # 11 segments
+        d = self.c0.upload(u)
+        def _uploaded(ur):
+            n = self.c0.create_node_from_uri(ur.get_uri())
+            n._cnode._maybe_create_download_node()
+            dn = n._cnode._node
+            dn.segment_window = segment_window
+            self.active = []
+            start_new_segment = dn._start_new_segment
+            def _start_new_segment():
+                start_new_segment()
+                self.active.append(len(dn._active_segments))
+            dn._start_new_segment = _start_new_segment
+            return download_to_data(n)
+        d.addCallback(_uploaded)
+        def _downloaded(data):
+            self.assertEqual(data, plaintext)
+            return max(self.active)
+        d.addCallback(_downloaded)
+        return d
+
+    def test_readahead(self):
+        """
+        A sequential read keeps ``segment_window`` segments in flight once
+        the segment size is known.
+        """
+        d = self._download_counting_active_segments(4)
+        d.addCallback(self.assertEqual, 4)
+        return d
+
+    def test_readahead_disabled(self):
+        """
+        With a ``segment_window`` of 1, segments are fetched one at a time.
+        """
+        d = self._download_counting_active_segments(1)
+        d.addCallback(self.assertEqual, 1)
+        return d
+
+    def test_segment_cache(self):
+        """
+        With a segment cache, a new node for a recently downloaded file reads
+        it from the cache rather than from the storage servers.
+        """
+        self.basedir = self.mktemp()
+        self.set_up_grid()
+        self.c0 = self.g.clients[0]
+        cache = SegmentCache(10**6)
+        self.c0.nodemaker.segment_cache = cache
+
+        u = upload.Data(plaintext, None)
+        u.max_segment_size = 70 # 5 segs
+        d = self.c0.upload(u)
+        def _uploaded(ur):
+            self.cap = uri.from_string(ur.get_uri())
+            return download_to_data(self.c0.nodemaker._create_immutable(self.cap))
+        d.addCallback(_uploaded)
+        def _lose_shares(data):
+            self.assertEqual(data, plaintext)
+            si_dir = storage_index_to_dir(self.cap.get_storage_index())
+            for (i, ss, ssdir) in self.iterate_servers():
+                fileutil.rm_dir(os.path.join(ssdir, "shares", si_dir))
+            n = self.c0.nodemaker._create_immutable(self.cap)
+            return download_to_data(n, 100, 150)
+        d.addCallback(_lose_shares)
+        def _check(data):
+            self.assertEqual(data, plaintext[100:250])
+            stats = cache.get_stats()
+            self.assertEqual(stats["downloader.segment_cache.hits"], 3)
+            self.assertEqual(stats["downloader.segment_cache.misses"], 4)
+        d.addCallback(_check)
+        return d
+
 class BrokenDecoder(CRSDecoder):
     def decode(self, shares, shareids):
         d = CRSDecoder.decode(self, shares, shareids)
         def _decoded(buffers):
             def _corruptor(s, which):
                 return s[:which] + bchr(ord(s[which:which+1])^0x01) + s[which+1:]
-            buffers[0] = _corruptor(buffers[0], 0) # flip lsb of first byte
+            # primary blocks come back as views of the blocks we were given
+            buffers[0] = _corruptor(bytes(buffers[0]), 0) # flip lsb of first byte
             return buffers
         d.addCallback(_decoded)
         return d
@@ -12,6 +12,8 @@ from foolscap.api import fireEventually
 from allmydata import uri
 from allmydata.immutable import encode, upload, checker
 from allmydata.util import hashutil
+from allmydata.util.deferredutil import gatherResults
+from allmydata.util.cputhreadpool import disable_thread_pool_for_test
 from allmydata.util.assertutil import _assert
 from allmydata.util.consumer import download_to_data
 from allmydata.interfaces import IStorageBucketWriter, IStorageBucketReader
@@ -106,6 +108,10 @@ class FakeBucketReaderWriterProxy(object):
         d.addCallback(_try)
         return d
 
+    def get_blocks_data(self, first, count, blocksize, lastblocksize):
+        return gatherResults([self.get_block_data(blocknum, blocksize, None)
+                              for blocknum in range(first, first + count)])
+
     def get_plaintext_hashes(self):
         d = self._start()
         def _try(unused=None):
@@ -353,6 +359,152 @@ class Encode(unittest.TestCase):
         return self.do_encode(25, 101, 100, 5, 15, 8)
 
 
+class HeldBucketWriter(FakeBucketReaderWriterProxy):
+    """
+    A shareholder which doesn't acknowledge blocks until the test releases
+    them.
+    """
+    def __init__(self, held, peerid):
+        FakeBucketReaderWriterProxy.__init__(self, peerid=peerid)
+        self._held = held
+
+    def put_block(self, segmentnum, data):
+        assert segmentnum not in self.blocks
+        assert segmentnum == len(self.blocks), "blocks sent out of order"
+        self.blocks[segmentnum] = data
+        d = defer.Deferred()
+        self._held.append(d)
+        return d
+
+
+class Pipeline(unittest.TestCase):
+    """
+    The Encoder overlaps the encoding of later segments with the sending of
+    earlier ones, within the configured limits.
+    """
+    NUM_SEGMENTS = 10
+
+    def setUp(self):
+        # Encode synchronously, so the only thing between us and the next
+        # segment is the pipeline.
+        disable_thread_pool_for_test(self)
+
+    @defer.inlineCallbacks
+    def start_encoder(self, **kwargs):
+        # 3-of-10 with 30-byte segments: each segment encodes to ten 10-byte
+        # blocks.
+        e = encode.Encoder(**kwargs)
+        u = upload.Data(make_data(30 * self.NUM_SEGMENTS),
+                        convergence=b"some convergence string")
+        u.set_default_encoding_parameters({'max_segment_size': 30,
+                                           'k': 3, 'happy': 7, 'n': 10})
+        yield e.set_encrypted_uploadable(upload.EncryptAnUploadable(u))
+        self.assertEqual(e.get_param("num_segments"), self.NUM_SEGMENTS)
+        self.held = []
+        self.shareholders = {}
+        servermap = {}
+        for shnum in range(10):
+            peer = HeldBucketWriter(self.held, peerid="peer%d" % shnum)
+            self.shareholders[shnum] = peer
+            servermap[shnum] = {peer.get_peerid()}
+        e.set_shareholders(self.shareholders, servermap)
+        self.result = e.start()
+        defer.returnValue(e)
+
+    @defer.inlineCallbacks
+    def settle(self):
+        # Let fireEventually() and friends run until the encoder is blocked.
+        for i in range(50):
+            yield fireEventually()
+
+    def segments_sent(self, shnums=range(10)):
+        counts = set(len(self.shareholders[shnum].blocks) for shnum in shnums)
+        self.assertEqual(len(counts), 1)
+        return counts.pop()
+
+    def release_oldest_segment(self):
+        # each segment produced one put_block() per shareholder
+        for i in range(len(self.shareholders)):
+            self.held.pop(0).callback(None)
+
+    @defer.inlineCallbacks
+    def assert_window(self, window):
+        """
+        Acknowledge segments one at a time, checking that the encoder keeps
+        exactly ``window`` of them unacknowledged, and that the upload
+        completes.
+        """
+        yield self.settle()
+        for acked in range(self.NUM_SEGMENTS):
+            self.assertEqual(self.segments_sent(),
+                             min(acked + window, self.NUM_SEGMENTS))
+            self.assertNoResult(self.result)
+            self.release_oldest_segment()
+            yield self.settle()
+        self.assertEqual(self.held, [])
+        verifycap = yield self.result
+        self.assertEqual(verifycap.size, 30 * self.NUM_SEGMENTS)
+        for peer in self.shareholders.values():
+            self.assertTrue(peer.closed)
+
+    @defer.inlineCallbacks
+    def test_depth(self):
+        """
+        Up to ``pipeline_depth`` segments are sent before the first of them
+        has been acknowledged.
+        """
+        yield self.start_encoder(pipeline_depth=3)
+        yield self.assert_window(3)
+
+    @defer.inlineCallbacks
+    def test_depth_one(self):
+        """
+        With ``pipeline_depth=1`` each segment is acknowledged before the
+        next one is encoded.
+        """
+        yield self.start_encoder(pipeline_depth=1)
+        yield self.assert_window(1)
+
+    @defer.inlineCallbacks
+    def test_max_bytes(self):
+        """
+        ``pipeline_max_bytes`` limits the window even when
+        ``pipeline_depth`` would allow more segments.
+        """
+        yield self.start_encoder(pipeline_depth=8, pipeline_max_bytes=250)
+        yield self.assert_window(2)
+
+    @defer.inlineCallbacks
+    def test_max_bytes_too_small(self):
+        """
+        A segment larger than ``pipeline_max_bytes`` is still sent, one at a
+        time.
+        """
+        yield self.start_encoder(pipeline_depth=8, pipeline_max_bytes=1)
+        yield self.assert_window(1)
+
+    @defer.inlineCallbacks
+    def test_lost_peer_while_in_flight(self):
+        """
+        A shareholder failing a block while later segments are in flight is
+        removed, and the upload carries on with the others.
+        """
+        e = yield self.start_encoder(pipeline_depth=4)
+        yield self.settle()
+        self.assertEqual(self.segments_sent(), 4)
+        # fail shareholder 0's first block, acknowledge everything else
+        self.held.pop(0).errback(LostPeerError("I went away"))
+        for i in range(self.NUM_SEGMENTS):
+            while self.held:
+                self.held.pop(0).callback(None)
+            yield self.settle()
+        yield self.result
+        self.assertEqual(self.segments_sent(range(1, 10)), self.NUM_SEGMENTS)
+        # nothing more was sent to the lost shareholder
+        self.assertEqual(self.segments_sent([0]), 4)
+        self.assertEqual(e.get_shares_placed(), set(range(1, 10)))
+
+
 class Roundtrip(GridTestMixin, unittest.TestCase):
 
     # a series of 3*3 tests to check out edge conditions. One axis is how the
@@ -67,6 +67,42 @@ class Complete(SyncTestCase):
         self.failUnless("\n        8:" in d)
         self.failUnless("\n      4:" in d)
 
+class Compact(SyncTestCase):
+    """
+    CompactHashTree is the same as HashTree.
+    """
+
+    def test_same_as_hashtree(self):
+        # try out various sizes, since we pad to a power of two
+        for numleaves in list(range(0, 34)) + [63, 64, 65, 1000]:
+            leaf_hashes = [tagged_hash(b"tag", b"%d" % i)
+                           for i in range(numleaves)]
+            ht = hashtree.HashTree(leaf_hashes)
+            cht = hashtree.CompactHashTree(leaf_hashes)
+            self.assertEqual(len(cht), len(ht))
+            self.assertEqual(list(cht), list(ht))
+            self.assertEqual(cht.first_leaf_num, ht.first_leaf_num)
+            self.assertEqual(cht[-1], ht[-1])
+            self.assertEqual(cht[ht.first_leaf_num:], ht[ht.first_leaf_num:])
+            self.assertEqual(cht.dump(), ht.dump())
+            for leafnum in range(max(numleaves, 1)):
+                self.assertEqual(cht.get_leaf(leafnum), ht.get_leaf(leafnum))
+                for include_leaf in (False, True):
+                    self.assertEqual(
+                        cht.needed_hashes(leafnum, include_leaf),
+                        ht.needed_hashes(leafnum, include_leaf))
+
+    def test_out_of_range(self):
+        cht = hashtree.CompactHashTree([tagged_hash(b"tag", b"0")] * 5)
+        self.failUnlessRaises(IndexError, cht.__getitem__, 15)
+        self.failUnlessRaises(IndexError, cht.__getitem__, -16)
+        self.failUnlessRaises(IndexError, cht.get_leaf, 8)
+        self.failUnlessRaises(IndexError, cht.needed_hashes, 8)
+        self.failUnlessRaises(IndexError, cht.needed_hashes, -1)
+
+    def test_bad_leaf(self):
+        self.failUnlessRaises(ValueError, hashtree.CompactHashTree, [b"short"])
+
 class Incomplete(SyncTestCase):
 
     def test_create(self):
@@ -233,3 +269,46 @@ class Incomplete(SyncTestCase):
             iht.set_hashes(chain, leaves={4: tagged_hash(b"tag", b"4")})
         except hashtree.BadHashError as e:
             self.fail("bad hash: %s" % e)
+
+
+class Update(SyncTestCase):
+    def test_needed_for_update(self):
+        # a tree of 6 leaves is padded to 8, which are hashes 7..14
+        self.failUnlessEqual(hashtree.needed_for_update(6, [0]),
+                             set([8, 4, 2]))
+        self.failUnlessEqual(hashtree.needed_for_update(6, [0, 1]),
+                             set([4, 2]))
+        self.failUnlessEqual(hashtree.needed_for_update(6, [1, 2]),
+                             set([7, 10, 2]))
+        self.failUnlessEqual(hashtree.needed_for_update(6, range(8)), set())
+        self.failUnlessEqual(hashtree.needed_for_update(1, [0]), set())
+
+    def test_update_hashes(self):
+        # Changing some leaves and recomputing just the hashes above them
+        # gives the same tree as computing it from scratch.
+        for numleaves, changed in [(1, [0]), (6, [5]), (6, [2, 3, 5]),
+                                   (6, [5, 6, 7]), (9, [0, 8]), (8, [])]:
+            ht = make_tree(numleaves)
+            needed = hashtree.needed_for_update(numleaves, changed)
+            hashes = dict((i, ht[i]) for i in needed)
+            leaves = dict((leafnum, tagged_hash(b"new", b"%d" % leafnum))
+                          for leafnum in changed)
+            new_hashes = hashtree.update_hashes(numleaves, hashes, leaves)
+
+            expected_leaves = list(ht[ht.get_leaf_index(0):])
+            for leafnum, leafhash in leaves.items():
+                expected_leaves[leafnum] = leafhash
+            expected = hashtree.HashTree(expected_leaves)
+            updated = list(ht)
+            for i, h in new_hashes.items():
+                updated[i] = h
+            self.failUnlessEqual(updated, list(expected))
+            if changed:
+                self.assertIn(0, new_hashes)
+
+    def test_update_hashes_not_enough(self):
+        ht = make_tree(8)
+        hashes = {8: ht[8], 4: ht[4]}
+        self.failUnlessRaises(hashtree.NotEnoughHashesError,
+                              hashtree.update_hashes,
+                              8, hashes, {0: tagged_hash(b"new", b"0")})
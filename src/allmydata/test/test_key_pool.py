@@ -0,0 +1,147 @@
+"""
+Tests for ``allmydata.key_pool``.
+"""
+
+import os
+
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from allmydata import key_pool
+from allmydata.crypto import rsa
+from allmydata.key_pool import KeyPool, seal_private_keys, unseal_private_keys
+from allmydata.util.cputhreadpool import disable_thread_pool_for_test
+
+
+def _der(private_key):
+    return rsa.der_string_from_signing_key(private_key)
+
+
+class KeyPoolTests(unittest.SynchronousTestCase):
+    """
+    Tests for ``KeyPool``.
+    """
+
+    def setUp(self):
+        disable_thread_pool_for_test(self)
+        self.clock = Clock()
+        self.path = os.path.join(self.mktemp(), "key_pool")
+        os.makedirs(os.path.dirname(self.path))
+        self.secret = b"\x01" * 16
+
+    def make_pool(self, size=2, secret=None):
+        pool = KeyPool(size, self.path, secret or self.secret,
+                       idle_delay=5, clock=self.clock)
+        pool.startService()
+        self.addCleanup(lambda: pool.running and pool.stopService())
+        return pool
+
+    def generate(self, pool):
+        public, private = self.successResultOf(pool.generate())
+        self.assertEqual(rsa.der_string_from_verifying_key(public),
+                         rsa.der_string_from_verifying_key(private.public_key()))
+        return private
+
+    def test_refill_when_idle(self):
+        """
+        The pool is filled up once it has been idle for ``idle_delay``
+        seconds, and then not beyond its size.
+        """
+        pool = self.make_pool(size=2)
+        self.clock.advance(4)
+        self.assertEqual(len(pool), 0)
+        self.clock.advance(1)
+        self.assertEqual(len(pool), 2)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_generate(self):
+        """
+        Keypairs come from the pool while there are any, and are generated on
+        demand otherwise, and each is only handed out once.
+        """
+        pool = self.make_pool(size=2)
+        self.clock.advance(5)
+        keys = [_der(self.generate(pool)) for i in range(3)]
+        self.assertEqual(len(set(keys)), 3)
+        stats = pool.get_stats()
+        self.assertEqual(
+            (stats["key_pool.depth"], stats["key_pool.hits"],
+             stats["key_pool.misses"], stats["key_pool.miss_rate"]),
+            (0, 2, 1, 1 / 3),
+        )
+
+    def test_busy(self):
+        """
+        Refilling is put off while keypairs are being taken.
+        """
+        pool = self.make_pool(size=2)
+        self.clock.advance(4)
+        self.generate(pool)
+        self.clock.advance(4)
+        self.assertEqual(len(pool), 0)
+        self.clock.advance(1)
+        self.assertEqual(len(pool), 2)
+
+    def test_persisted(self):
+        """
+        The pool is kept across a restart, and the file it was kept in is
+        removed as soon as it is read.
+        """
+        pool = self.make_pool(size=2)
+        self.clock.advance(5)
+        kept = [_der(k) for k in pool._private_keys]
+        pool.stopService()
+        self.assertTrue(os.path.exists(self.path))
+
+        pool = self.make_pool(size=2)
+        self.assertFalse(os.path.exists(self.path))
+        self.assertEqual([_der(self.generate(pool)) for i in range(2)], kept)
+
+    def test_stopped_while_generating(self):
+        """
+        A keypair still being generated when the pool is stopped is kept with
+        the rest once it is done, and nothing more is generated.
+        """
+        generated = Deferred()
+        async def defer_to_thread(f, *args):
+            await generated
+            return f(*args)
+        self.patch(key_pool, "defer_to_thread", defer_to_thread)
+        pool = self.make_pool(size=2)
+        self.clock.advance(5)
+        stopped = pool.stopService()
+        self.assertNoResult(stopped)
+
+        generated.callback(None)
+        self.successResultOf(stopped)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        self.assertEqual(len(pool), 0)
+        with open(self.path, "rb") as f:
+            self.assertEqual(len(unseal_private_keys(self.secret, f.read())), 1)
+
+    def test_wrong_secret(self):
+        """
+        A kept pool which can't be authenticated is thrown away.
+        """
+        pool = self.make_pool(size=1)
+        self.clock.advance(5)
+        pool.stopService()
+
+        pool = self.make_pool(size=1, secret=b"\x02" * 16)
+        self.assertEqual(len(pool), 0)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_tampered(self):
+        """
+        ``unseal_private_keys`` rejects sealed keys which have been changed.
+        """
+        private, _ = rsa.create_signing_keypair(2048)
+        sealed = seal_private_keys(self.secret, [private])
+        self.assertEqual(
+            [_der(k) for k in unseal_private_keys(self.secret, sealed)],
+            [_der(private)],
+        )
+        tampered = sealed[:20] + bytes([sealed[20] ^ 1]) + sealed[21:]
+        with self.assertRaises(ValueError):
+            unseal_private_keys(self.secret, tampered)
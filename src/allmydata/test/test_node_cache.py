@@ -0,0 +1,183 @@
+"""
+Tests for ``allmydata.node_cache``.
+"""
+
+import gc
+
+from zope.interface import implementer
+from twisted.trial import unittest
+
+from allmydata import dirnode, uri
+from allmydata.interfaces import IDirectoryNode
+from allmydata.node_cache import NodeCache, NODE_OVERHEAD
+from allmydata.nodemaker import NodeMaker
+from allmydata.test.common import (
+    make_chk_file_uri,
+    make_mutable_file_cap,
+    make_mutable_file_uri,
+)
+
+
+class FakeFile(object):
+    pass
+
+
+@implementer(IDirectoryNode)
+class FakeDirectory(object):
+    def __init__(self, size=0):
+        self.size = size
+
+    def estimate_memory(self):
+        return self.size
+
+
+class NodeCacheTests(unittest.SynchronousTestCase):
+    """
+    Tests for ``NodeCache``.
+    """
+
+    def test_max_entries(self):
+        """
+        Once there are more than ``max_entries`` nodes, the least recently
+        used are forgotten.
+        """
+        cache = NodeCache(max_entries=2, max_bytes=10**9)
+        nodes = [FakeFile() for i in range(3)]
+        cache.add(b"0", nodes[0])
+        cache.add(b"1", nodes[1])
+        self.assertIs(cache.get(b"0"), nodes[0])
+        cache.add(b"2", nodes[2])
+        self.assertIs(cache.get(b"1"), None)
+        self.assertIs(cache.get(b"0"), nodes[0])
+        self.assertIs(cache.get(b"2"), nodes[2])
+        self.assertEqual(cache.get_stats()["nodemaker.node_cache.evictions"], 1)
+
+    def test_max_bytes(self):
+        """
+        Directories count as what they keep of their contents as well, which
+        is measured again whenever they are used, and nodes are forgotten to
+        keep the total under ``max_bytes``.
+        """
+        cache = NodeCache(max_entries=100, max_bytes=NODE_OVERHEAD * 4)
+        directory = FakeDirectory()
+        cache.add(b"d", directory)
+        for i in range(3):
+            cache.add(b"%d" % i, FakeFile())
+        self.assertEqual(len(cache), 4)
+        self.assertEqual(
+            cache.get_stats()["nodemaker.node_cache.bytes"], NODE_OVERHEAD * 4,
+        )
+
+        # Having read its contents, the directory is bigger.
+        directory.size = NODE_OVERHEAD
+        self.assertIs(cache.get(b"d"), directory)
+        self.assertEqual(len(cache), 3)
+        self.assertIs(cache.get(b"0"), None)
+        self.assertEqual(
+            cache.get_stats()["nodemaker.node_cache.bytes"], NODE_OVERHEAD * 4,
+        )
+
+        # Something bigger than the whole cache isn't kept at all.
+        directory.size = NODE_OVERHEAD * 4
+        cache.add(b"d", directory)
+        self.assertIs(cache.get(b"d"), None)
+        self.assertEqual(len(cache), 2)
+
+    def test_stats(self):
+        """
+        Hits and misses are reported, with the hit rate.
+        """
+        cache = NodeCache()
+        self.assertEqual(cache.get_stats()["nodemaker.node_cache.hit_rate"], 0.0)
+        cache.miss()
+        for i in range(3):
+            cache.hit()
+        stats = cache.get_stats()
+        self.assertEqual(
+            (stats["nodemaker.node_cache.hits"],
+             stats["nodemaker.node_cache.misses"],
+             stats["nodemaker.node_cache.hit_rate"]),
+            (3, 1, 0.75),
+        )
+
+
+class NodeMakerCacheTests(unittest.SynchronousTestCase):
+    """
+    Tests for ``NodeMaker`` with a ``NodeCache``.
+    """
+
+    def setUp(self):
+        self.cache = NodeCache(max_entries=10, max_bytes=10**9)
+        self.nodemaker = NodeMaker(None, None, None, None, None,
+                                   {"k": 3, "n": 10}, None, None,
+                                   node_cache=self.cache)
+
+    def assertKeptAlive(self, cap):
+        """
+        The node for ``cap`` is the same one, even once nothing else refers
+        to it.
+        """
+        node_id = id(self.nodemaker.create_from_cap(cap))
+        gc.collect()
+        self.assertEqual(id(self.nodemaker.create_from_cap(cap)), node_id)
+
+    def test_directory(self):
+        """
+        Directory nodes are kept after they are no longer used.
+        """
+        self.assertKeptAlive(uri.DirectoryURI(make_mutable_file_cap()).to_string())
+        stats = self.cache.get_stats()
+        self.assertEqual(
+            (stats["nodemaker.node_cache.hits"], stats["nodemaker.node_cache.misses"]),
+            (1, 1),
+        )
+
+    def test_listed_directory(self):
+        """
+        A directory counts as its unpacked children once it has listed them,
+        not only as its packed contents.
+        """
+        children = {
+            u"kid%d" % i: (self.nodemaker.create_from_cap(make_chk_file_uri(i + 1)),
+                           {"tahoe": {"linkcrtime": 1.5, "linkmotime": 2.5}})
+            for i in range(100)
+        }
+        packed = dirnode.pack_children(children, None, deep_immutable=True)
+        node = self.nodemaker.create_from_cap(
+            uri.LiteralDirectoryURI(uri.LiteralFileURI(packed)).to_string())
+
+        self.successResultOf(node.get(u"kid0"))
+        self.cache.add(b"d", node)
+        read = self.cache.get_stats()["nodemaker.node_cache.bytes"]
+        self.assertGreater(read, NODE_OVERHEAD + len(packed))
+
+        self.successResultOf(node.list())
+        self.cache.add(b"d", node)
+        listed = self.cache.get_stats()["nodemaker.node_cache.bytes"]
+        # the caps and metadata of every child are kept as well as their
+        # packed entries
+        self.assertGreater(listed, NODE_OVERHEAD + 2 * len(packed))
+
+    def test_immutable(self):
+        """
+        Immutable file nodes aren't kept, because they must not be reused
+        (ticket #1679).
+        """
+        self.nodemaker.create_from_cap(make_chk_file_uri(1000))
+        self.nodemaker.create_from_cap(uri.LiteralFileURI(b"data").to_string())
+        self.assertEqual(len(self.cache), 0)
+
+    def test_evicted_while_in_use(self):
+        """
+        A mutable node still in use after it is forgotten by the cache is
+        the one given out again, and is remembered again.
+        """
+        cap = uri.DirectoryURI(make_mutable_file_cap()).to_string()
+        node = self.nodemaker.create_from_cap(cap)
+        for i in range(10):
+            self.nodemaker.create_from_cap(make_mutable_file_uri())
+        self.assertEqual(len(self.cache), 10)
+        self.assertIs(self.nodemaker.create_from_cap(cap), node)
+        del node
+        gc.collect()
+        self.assertIsNot(self.cache.get(b"M" + cap), None)
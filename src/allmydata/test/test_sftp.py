@@ -21,7 +21,8 @@ except ImportError as e:
 else:
     conch_unavailable_reason = None  # type: ignore
 
-from allmydata.interfaces import IDirectoryNode, ExistingChildError, NoSuchChildError
+from allmydata.interfaces import IDirectoryNode, ExistingChildError, NoSuchChildError, \
+     SDMF_VERSION, MDMF_VERSION
 from allmydata.mutable.common import NotWriteableError
 
 from allmydata.util.consumer import download_to_data
@@ -561,6 +562,146 @@ class Handler(GridTestMixin, ShouldFailMixin, ReallyEqualMixin, unittest.TestCas
         d.addCallback(lambda ign: self.failUnlessEqual(self.handler._heisenfiles, {}))
         return d
 
+    def _record_fetches(self):
+        # Use small chunks, and record the (offset, size) of each chunk that
+        # a read-only handle fetches.
+        self.patch(sftpd, "CHUNK_SIZE", 100)
+        fetches = []
+        def _download_to_data(n, offset=0, size=None):
+            fetches.append((offset, size))
+            return download_to_data(n, offset, size)
+        self.patch(sftpd, "download_to_data", _download_to_data)
+        return fetches
+
+    def test_openFile_read_ranges(self):
+        fetches = self._record_fetches()
+        data = b"".join(b"%04d" % (i,) for i in range(1000))
+        d = self._set_up("openFile_read_ranges")
+        d.addCallback(lambda ign: self.root.add_file(u"large", upload.Data(data, None)))
+        d.addCallback(lambda ign: self.handler.openFile(b"large", sftp.FXF_READ, {}))
+        def _read(rf):
+            # opening the file doesn't fetch anything
+            self.failUnlessReallyEqual(fetches, [])
+
+            # reading the end of the file only fetches the last chunk
+            d2 = rf.readChunk(3996, 100)
+            d2.addCallback(lambda res: self.failUnlessReallyEqual(res, b"0999"))
+            d2.addCallback(lambda ign: self.failUnlessReallyEqual(fetches, [(3900, 100)]))
+
+            # a read spanning chunks fetches each of them
+            d2.addCallback(lambda ign: rf.readChunk(1096, 108))
+            d2.addCallback(lambda res: self.failUnlessReallyEqual(res, data[1096:1204]))
+            d2.addCallback(lambda ign: self.failUnlessReallyEqual(fetches[1:], [(1000, 100), (1100, 100), (1200, 100)]))
+
+            # reading cached chunks fetches nothing more
+            d2.addCallback(lambda ign: rf.readChunk(1150, 10))
+            d2.addCallback(lambda res: self.failUnlessReallyEqual(res, data[1150:1160]))
+            d2.addCallback(lambda ign: rf.readChunk(3990, 10))
+            d2.addCallback(lambda res: self.failUnlessReallyEqual(res, data[3990:4000]))
+            d2.addCallback(lambda ign: self.failUnlessReallyEqual(len(fetches), 4))
+
+            d2.addCallback(lambda ign: rf.close())
+            return d2
+        d.addCallback(_read)
+        return d
+
+    def test_openFile_read_ahead(self):
+        fetches = self._record_fetches()
+        data = b"".join(b"%04d" % (i,) for i in range(250))
+        d = self._set_up("openFile_read_ahead")
+        d.addCallback(lambda ign: self.root.add_file(u"large", upload.Data(data, None)))
+        d.addCallback(lambda ign: self.handler.openFile(b"large", sftp.FXF_READ, {}))
+        def _read(rf):
+            d2 = rf.readChunk(0, 50)
+            d2.addCallback(lambda res: self.failUnlessReallyEqual(res, data[:50]))
+            d2.addCallback(lambda ign: self.failUnlessReallyEqual(fetches, [(0, 100)]))
+
+            # a read that follows on from the previous one fetches ahead,
+            # up to the end of the file
+            d2.addCallback(lambda ign: rf.readChunk(50, 50))
+            d2.addCallback(lambda res: self.failUnlessReallyEqual(res, data[50:100]))
+            d2.addCallback(lambda ign: self.failUnlessReallyEqual(
+                fetches, [(0, 100)] + [(offset, 100) for offset in range(100, 500, 100)]))
+            d2.addCallback(lambda ign: rf.readChunk(100, 900))
+            d2.addCallback(lambda res: self.failUnlessReallyEqual(res, data[100:1000]))
+            d2.addCallback(lambda ign: self.failUnlessReallyEqual(len(fetches), 10))
+            d2.addCallback(lambda ign:
+                self.shouldFailWithSFTPError(sftp.FX_EOF, "readChunk starting at EOF",
+                                             rf.readChunk, 1000, 100))
+            d2.addCallback(lambda ign: self.failUnlessReallyEqual(len(fetches), 10))
+
+            # a read elsewhere in the file doesn't
+            d2.addCallback(lambda ign: rf.readChunk(10, 10))
+            d2.addCallback(lambda res: self.failUnlessReallyEqual(res, data[10:20]))
+            d2.addCallback(lambda ign: self.failUnlessReallyEqual(fetches[10:], [(0, 100)]))
+
+            d2.addCallback(lambda ign: rf.close())
+            return d2
+        d.addCallback(_read)
+        return d
+
+    def test_openFile_read_ahead_error(self):
+        fetches = self._record_fetches()
+        recorded = sftpd.download_to_data
+        reads = []
+        def _download_to_data(n, offset=0, size=None):
+            d = recorded(n, offset, size)
+            reads.append(d)
+            return d
+        self.patch(sftpd, "download_to_data", _download_to_data)
+        data = b"".join(b"%04d" % (i,) for i in range(250))
+        d = self._set_up("openFile_read_ahead_error")
+        d.addCallback(lambda ign: self.root.add_file(u"large", upload.Data(data, None)))
+        d.addCallback(lambda ign: self.handler.openFile(b"large", sftp.FXF_READ, {}))
+        def _read(rf):
+            d2 = rf.readChunk(0, 50)
+            # the read-ahead started by the next read fails, without an
+            # unhandled error
+            d2.addCallback(lambda ign: self.g.nuke_from_orbit())
+            d2.addCallback(lambda ign: rf.readChunk(50, 50))
+            d2.addCallback(lambda res: self.failUnlessReallyEqual(res, data[50:100]))
+            d2.addCallback(lambda ign: self.failUnlessReallyEqual(len(fetches), 5))
+            d2.addCallback(lambda ign: defer.DeferredList(reads[1:]))
+
+            # and the chunks are fetched again when they're read
+            d2.addCallback(lambda ign:
+                self.shouldFailWithSFTPError(sftp.FX_FAILURE, "read after failed read-ahead",
+                                             rf.readChunk, 100, 50))
+            d2.addCallback(lambda ign: self.failUnlessReallyEqual(fetches[5], (100, 100)))
+            d2.addCallback(lambda ign: rf.close())
+            return d2
+        d.addCallback(_read)
+        return d
+
+    def test_openFile_read_mutable(self):
+        fetches = self._record_fetches()
+        data = b"".join(b"%04d" % (i,) for i in range(250))
+        d = self._set_up("openFile_read_mutable")
+        def _read_all(version):
+            d2 = self.client.create_mutable_file(publish.MutableData(data), version=version)
+            d2.addCallback(lambda node: self.handler.openFile(b"uri/"+node.get_uri(), sftp.FXF_READ, {}))
+            def _opened(rf):
+                d3 = defer.succeed(None)
+                for offset in range(0, 1000, 50):
+                    d3.addCallback(lambda ign, offset=offset: rf.readChunk(offset, 50))
+                    d3.addCallback(lambda res, offset=offset:
+                                   self.failUnlessReallyEqual(res, data[offset:offset+50]))
+                d3.addCallback(lambda ign: rf.close())
+                return d3
+            d2.addCallback(_opened)
+            return d2
+
+        # An SDMF file is fetched whole, once, rather than a segment per chunk.
+        d.addCallback(lambda ign: _read_all(SDMF_VERSION))
+        d.addCallback(lambda ign: self.failUnlessReallyEqual(fetches, [(0, 1000)]))
+
+        # An MDMF file is fetched a chunk at a time, each chunk once.
+        d.addCallback(lambda ign: fetches.clear())
+        d.addCallback(lambda ign: _read_all(MDMF_VERSION))
+        d.addCallback(lambda ign: self.failUnlessReallyEqual(
+            fetches, [(offset, 100) for offset in range(0, 1000, 100)]))
+        return d
+
     def test_openFile_write(self):
         d = self._set_up("openFile_write")
         d.addCallback(lambda ign: self._set_up_tree())
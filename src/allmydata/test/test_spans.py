@@ -539,6 +539,22 @@ class StringSpans(unittest.TestCase):
         self.do_basic(DataSpans)
         self.do_scan(DataSpans)
 
+    def test_views(self):
+        ds = DataSpans()
+        ds.add(10, b"abcdefgh")
+        block = ds.pop(10, 3, view=True)
+        self.assertIsInstance(block, memoryview)
+        self.failUnlessEqual(block, b"abc")
+        # what's left over is still handed out as bytes, and can be merged
+        # with new data
+        self.failUnlessEqual(ds.get(13, 2), b"de")
+        self.assertIsInstance(ds.get(13, 2), bytes)
+        ds.add(18, b"ij")
+        ds.remove(15, 1)
+        ds.add(15, b"F")
+        self.failUnlessEqual(ds.get(13, 7), b"deFghij")
+        self.failUnlessEqual(ds.get(10, 1), None)
+
     def test_random(self):
         # attempt to increase coverage of corner cases by comparing behavior
         # of a simple-but-slow model implementation against the
@@ -17,29 +17,34 @@ import platform
 import stat
 import struct
 import shutil
+import threading
 from functools import partial
 from uuid import uuid4
 
 from testtools.matchers import (
+    AfterPreprocessing,
     Equals,
     NotEquals,
     Contains,
     HasLength,
+    Is,
     IsInstance,
 )
+from testtools.twistedsupport import succeeded, failed
 
 from twisted.trial import unittest
 
-from twisted.internet import defer
+from twisted.internet import defer, reactor
 from twisted.internet.task import Clock
 
 from hypothesis import given, strategies, example
 
 import itertools
 from allmydata import interfaces
-from allmydata.util import fileutil, hashutil, base32
+from allmydata.util import dbutil, fileutil, hashutil, base32
 from allmydata.storage.server import (
     StorageServer, DEFAULT_RENEWAL_TIME, FoolscapStorageServer,
+    MAX_CONCURRENT_LEASE_UPDATES,
 )
 from allmydata.storage.shares import get_share_file
 from allmydata.storage.mutable import MutableShareFile
@@ -57,6 +62,10 @@ from allmydata.storage.common import storage_index_to_dir, \
      UnknownMutableContainerVersionError, UnknownImmutableContainerVersionError, \
      si_b2a, si_a2b
 from allmydata.storage.lease import LeaseInfo
+from allmydata.storage.diskio import DiskIOExecutor, DiskQueueFull
+from allmydata.storage.readcache import ShareReadCache
+from allmydata.storage import shareindex
+from allmydata.storage.shareindex import IndexedShare, rebuild, verify
 from allmydata.immutable.layout import WriteBucketProxy, WriteBucketProxy_v2, \
      ReadBucketProxy, _WriteBuffer
 from allmydata.mutable.layout import MDMFSlotWriteProxy, MDMFSlotReadProxy, \
@@ -432,6 +441,12 @@ class RemoteBucket(object):
 
 
 class BucketProxy(AsyncTestCase):
+    def setUp(self):
+        super(BucketProxy, self).setUp()
+        # We stand in for the StorageServer, including its (synchronous)
+        # disk I/O executor:
+        self.disk_io = DiskIOExecutor(self.add_latency, Clock())
+
     def make_bucket(self, name, size):
         basedir = os.path.join("storage", "BucketProxy", name)
         incoming = os.path.join(basedir, "tmp", "bucket")
@@ -525,6 +540,11 @@ class BucketProxy(AsyncTestCase):
             d1.addCallback(lambda res: self.failUnlessEqual(res, b"c"*25))
             d1.addCallback(lambda res: rbp.get_block_data(3, 25, 20))
             d1.addCallback(lambda res: self.failUnlessEqual(res, b"d"*20))
+            d1.addCallback(lambda res: rbp.get_blocks_data(1, 3, 25, 20))
+            d1.addCallback(lambda res: self.failUnlessEqual(
+                res, [b"b"*25, b"c"*25, b"d"*20]))
+            d1.addCallback(lambda res: rbp.get_blocks_data(0, 1, 25, 25))
+            d1.addCallback(lambda res: self.failUnlessEqual(res, [b"a"*25]))
 
             d1.addCallback(lambda res: rbp.get_crypttext_hashes())
             d1.addCallback(lambda res:
@@ -702,6 +722,24 @@ class Server(AsyncTestCase):
         self.assertThat(ss.get_immutable_share_length(b"allocate", 22), Equals(75))
         self.assertThat(ss.get_buckets(b"allocate")[22].get_length(), Equals(75))
 
+    def test_immutable_readv(self):
+        """
+        ``BucketReader.readv_async()`` returns the data for each requested
+        range, truncating ranges which extend past the end of the share, and
+        the server advertises that it supports it.
+        """
+        ss = self.create("test_immutable_readv")
+        sv1 = ss.get_version()[b'http://allmydata.org/tahoe/protocols/storage/v1']
+        self.assertTrue(sv1.get(b'immutable-read-vectors'), sv1)
+        _, writers = self.allocate(ss, b"readv", [3], 26)
+        writers[3].write(0, b"abcdefghijklmnopqrstuvwxyz")
+        writers[3].close()
+        reader = ss.get_buckets(b"readv")[3]
+        self.assertThat(
+            reader.readv_async([(0, 3), (10, 2), (24, 10), (30, 5)]),
+            succeeded(Equals([b"abc", b"kl", b"yz", b""])),
+        )
+
     def test_allocate(self):
         ss = self.create("test_allocate")
 
@@ -3785,3 +3823,558 @@ class WriteBufferTests(SyncTestCase):
         result += flushed_data
 
         self.assertEqual(result, b"".join(small_writes))
+
+
+class DiskIOTests(AsyncTestCase):
+    """
+    Tests for ``DiskIOExecutor`` and the storage server APIs that dispatch to
+    it.
+    """
+
+    def setUp(self):
+        super(DiskIOTests, self).setUp()
+        self.sparent = LoggingServiceParent()
+        self.sparent.startService()
+        self.addCleanup(self.sparent.stopService)
+        self.recorded = []
+
+    def executor(self, threads, max_queue_depth=1000):
+        executor = DiskIOExecutor(
+            lambda category, value: self.recorded.append(category),
+            reactor,
+            threads=threads,
+            max_queue_depth=max_queue_depth,
+        )
+        executor.setServiceParent(self.sparent)
+        return executor
+
+    def test_synchronous(self):
+        """
+        With no threads, operations run immediately in the calling thread.
+        """
+        executor = self.executor(0)
+        d = executor.submit(threading.get_ident)
+        self.assertThat(d, succeeded(Equals(threading.get_ident())))
+        self.assertThat(
+            self.recorded,
+            Equals(["disk-io-queue-depth", "disk-io-wait", "disk-io-run"]),
+        )
+        self.assertThat(executor.queue_depth(), Equals(0))
+
+    @defer.inlineCallbacks
+    def test_threaded(self):
+        """
+        With threads, operations run outside the reactor thread and their
+        results are delivered back to it.
+        """
+        executor = self.executor(2)
+        ident = yield executor.submit(threading.get_ident)
+        self.assertThat(ident, NotEquals(threading.get_ident()))
+        self.assertThat(executor.queue_depth(), Equals(0))
+        with self.assertRaises(ZeroDivisionError):
+            yield executor.submit(lambda: 1 // 0)
+
+    @defer.inlineCallbacks
+    def test_queue_bound(self):
+        """
+        Once ``max_queue_depth`` operations are outstanding further
+        submissions fail with ``DiskQueueFull``.
+        """
+        executor = self.executor(1, max_queue_depth=2)
+        blocker = threading.Event()
+        first = executor.submit(blocker.wait)
+        second = executor.submit(lambda: None)
+        self.assertThat(executor.queue_depth(), Equals(2))
+        third = executor.submit(lambda: None)
+        self.assertThat(third, failed(AfterPreprocessing(
+            lambda f: f.type, Equals(DiskQueueFull))))
+        blocker.set()
+        yield first
+        yield second
+        self.assertThat(executor.queue_depth(), Equals(0))
+
+    @defer.inlineCallbacks
+    def test_key_serializes(self):
+        """
+        Operations with the same key don't overlap, even with several threads.
+        """
+        executor = self.executor(4)
+        running = []
+        overlaps = []
+
+        def op():
+            running.append(1)
+            if len(running) > 1:
+                overlaps.append(len(running))
+            time.sleep(0.01)
+            running.pop()
+
+        yield defer.gatherResults([
+            executor.submit(op, key=b"slot") for _ in range(5)
+        ])
+        self.assertThat(overlaps, Equals([]))
+
+    @defer.inlineCallbacks
+    def test_immutable_roundtrip(self):
+        """
+        An immutable share can be written, closed and read back through the
+        asynchronous ``BucketWriter`` and ``BucketReader`` APIs, with the
+        executor's statistics reported by the server.
+        """
+        ss = StorageServer(
+            os.path.join("storage", "DiskIOTests", "immutable"),
+            b"\x00" * 20,
+            disk_io_threads=2,
+        )
+        ss.setServiceParent(self.sparent)
+        _, writers = ss.allocate_buckets(
+            b"si1", b"r" * 32, b"c" * 32, {0}, 20,
+        )
+        bw = writers[0]
+        finished = yield bw.write_async(0, b"a" * 10)
+        self.assertThat(finished, Equals(False))
+        finished = yield bw.write_async(10, b"b" * 10)
+        self.assertThat(finished, Equals(True))
+        yield bw.close_async()
+
+        readers = yield ss.get_buckets_async(b"si1")
+        self.assertThat(set(readers), Equals({0}))
+        data = yield readers[0].read_async(5, 10)
+        self.assertThat(data, Equals(b"a" * 5 + b"b" * 5))
+
+        latencies = ss.get_latencies()
+        for category in ["disk-io-queue-depth", "disk-io-wait", "disk-io-run",
+                         "write", "close", "get", "read"]:
+            self.assertThat(latencies, Contains(category))
+        self.assertThat(
+            ss.get_stats()["storage_server.disk_io.queue_depth"], Equals(0),
+        )
+
+    @defer.inlineCallbacks
+    def test_mutable_roundtrip(self):
+        """
+        Mutable shares can be written and read through the asynchronous
+        ``StorageServer`` APIs.
+        """
+        ss = StorageServer(
+            os.path.join("storage", "DiskIOTests", "mutable"),
+            b"\x00" * 20,
+            disk_io_threads=2,
+        )
+        ss.setServiceParent(self.sparent)
+        secrets = (b"w" * 32, b"r" * 32, b"c" * 32)
+        result = yield ss.slot_testv_and_readv_and_writev_async(
+            b"si1", secrets, {0: ([], [(0, b"hello")], None)}, [],
+        )
+        self.assertThat(result, Equals((True, {})))
+        # A bad write enabler is still rejected, with logging done safely:
+        with self.assertRaises(BadWriteEnablerError):
+            yield ss.slot_testv_and_readv_and_writev_async(
+                b"si1", (b"x" * 32,) + secrets[1:], {0: ([], [], None)}, [],
+            )
+        datavs = yield ss.slot_readv_async(b"si1", [0], [(1, 3)])
+        self.assertThat(datavs, Equals({0: [b"ell"]}))
+
+    @defer.inlineCallbacks
+    def test_add_leases(self):
+        """
+        ``StorageServer.add_leases_async`` adds or renews leases on the shares
+        of many storage indexes, mutable and immutable, and says which of them
+        had any shares.
+        """
+        clock = Clock()
+        ss = StorageServer(
+            os.path.join("storage", "DiskIOTests", "add_leases"),
+            b"\x00" * 20,
+            disk_io_threads=2,
+            clock=clock,
+        )
+        ss.setServiceParent(self.sparent)
+        _, writers = ss.allocate_buckets(
+            b"immutable", b"r" * 32, b"c" * 32, {0, 1}, 10,
+        )
+        for bw in writers.values():
+            bw.write(0, b"a" * 10)
+            bw.close()
+        ss.slot_testv_and_readv_and_writev(
+            b"mutable", (b"w" * 32, b"r" * 32, b"c" * 32),
+            {0: ([], [(0, b"hello")], None)}, [],
+        )
+
+        clock.advance(100)
+        missing = [
+            (b"%016d" % i, b"r" * 32, b"c" * 32)
+            for i in range(MAX_CONCURRENT_LEASE_UPDATES)
+        ]
+        found = yield ss.add_leases_async(missing + [
+            (b"immutable", b"r" * 32, b"c" * 32),
+            (b"mutable", b"R" * 32, b"C" * 32),
+        ])
+        self.assertThat(
+            found, Equals([False] * MAX_CONCURRENT_LEASE_UPDATES + [True, True]),
+        )
+
+        [lease] = ss.get_leases(b"immutable")
+        self.assertThat(
+            lease.get_expiration_time(), Equals(100 + DEFAULT_RENEWAL_TIME),
+        )
+        self.assertThat(
+            [lease.get_expiration_time() for lease in ss.get_slot_leases(b"mutable")],
+            Equals([DEFAULT_RENEWAL_TIME, 100 + DEFAULT_RENEWAL_TIME]),
+        )
+
+    @defer.inlineCallbacks
+    def test_add_leases_error(self):
+        """
+        If the leases of one storage index can't be updated,
+        ``StorageServer.add_leases_async`` gives the exception as that index's
+        result and still updates the others.
+        """
+        clock = Clock()
+        ss = StorageServer(
+            os.path.join("storage", "DiskIOTests", "add_leases_error"),
+            b"\x00" * 20,
+            disk_io_threads=2,
+            clock=clock,
+        )
+        ss.setServiceParent(self.sparent)
+        for storage_index in [b"good", b"bad"]:
+            _, writers = ss.allocate_buckets(
+                storage_index, b"r" * 32, b"c" * 32, {0}, 10,
+            )
+            writers[0].write(0, b"a" * 10)
+            writers[0].close()
+        # Leave the header of the bad share incomplete:
+        fn = os.path.join(ss.sharedir, storage_index_to_dir(b"bad"), "0")
+        with open(fn, "rb+") as f:
+            f.truncate(8)
+
+        clock.advance(100)
+        found = yield ss.add_leases_async([
+            (b"bad", b"r" * 32, b"c" * 32),
+            (b"good", b"r" * 32, b"c" * 32),
+            (b"missing", b"r" * 32, b"c" * 32),
+        ])
+        self.assertThat(found[0], IsInstance(Exception))
+        self.assertThat(found[1:], Equals([True, False]))
+        [lease] = ss.get_leases(b"good")
+        self.assertThat(
+            lease.get_expiration_time(), Equals(100 + DEFAULT_RENEWAL_TIME),
+        )
+
+
+class ShareReadCacheTests(SyncTestCase):
+    """
+    Tests for ``ShareReadCache``.
+    """
+
+    def make_share(self, data, filename=None):
+        if filename is None:
+            filename = self.mktemp()
+        sf = ShareFile(filename, max_size=len(data), create=True)
+        sf.write_share_data(0, data)
+        sf.add_lease(LeaseInfo(
+            owner_num=0, renew_secret=b"r" * 32, cancel_secret=b"c" * 32,
+            expiration_time=1000, nodeid=b"\x00" * 20,
+        ))
+        return filename
+
+    def test_reads_match_share_file(self):
+        """
+        Reads through the cache return the same data as ``ShareFile``, and
+        repeating them is served from memory.
+        """
+        data = bytes(range(256)) * 40
+        filename = self.make_share(data)
+        cache = ShareReadCache(100000, block_size=1000)
+        cached = cache.open(filename)
+        sf = ShareFile(filename)
+        self.assertThat(cached.get_length(), Equals(len(data)))
+
+        reads = [(0, 10), (990, 20), (0, len(data)), (5000, 3000),
+                 (len(data) - 5, 100), (len(data), 10), (len(data) + 3, 1)]
+        for (offset, length) in reads:
+            self.assertThat(cached.read_share_data(offset, length),
+                            Equals(sf.read_share_data(offset, length)))
+        misses = cache.get_stats()["misses"]
+        for (offset, length) in reads:
+            self.assertThat(cached.read_share_data(offset, length),
+                            Equals(sf.read_share_data(offset, length)))
+        stats = cache.get_stats()
+        self.assertThat(stats["misses"], Equals(misses))
+        self.assertThat(stats["hits"], NotEquals(0))
+        self.assertThat(cache.open(filename), Is(cached))
+
+    def test_byte_budget(self):
+        """
+        The least recently used blocks are evicted to stay within the byte
+        budget.
+        """
+        filename = self.make_share(b"x" * 10000)
+        cache = ShareReadCache(2500, block_size=1000)
+        cached = cache.open(filename)
+        for offset in (2000, 3000, 4000, 2000):
+            cached.read_share_data(offset, 10)
+        self.assertThat(cache.get_stats(), Equals({
+            "hits": 0,
+            "misses": 4,
+            "evictions": 2,
+            "bytes": 2000,
+            "open_files": 1,
+        }))
+        cached.read_share_data(2000, 10)
+        self.assertThat(cache.get_stats()["hits"], Equals(1))
+
+    def test_replaced_share(self):
+        """
+        If a share file is replaced, the new one is read rather than cached
+        data from the old one.
+        """
+        filename = self.make_share(b"a" * 100)
+        cache = ShareReadCache(100000)
+        self.assertThat(cache.open(filename).read_share_data(0, 5),
+                        Equals(b"aaaaa"))
+        replacement = self.make_share(b"b" * 100)
+        os.rename(replacement, filename)
+        self.assertThat(cache.open(filename).read_share_data(0, 5),
+                        Equals(b"bbbbb"))
+
+    def test_recreated_share(self):
+        """
+        A share deleted and written again at the same path is read afresh,
+        even if the new file reuses the old one's inode.
+        """
+        filename = self.make_share(b"a" * 100)
+        other = self.make_share(b"o" * 100)
+        cache = ShareReadCache(100000, max_open_files=1)
+        self.assertThat(cache.open(filename).read_share_data(0, 5),
+                        Equals(b"aaaaa"))
+        # Once it's no longer open, the inode can be reused.
+        cache.open(other)
+        os.unlink(filename)
+        self.make_share(b"b" * 100, filename)
+        self.assertThat(cache.open(filename).read_share_data(0, 5),
+                        Equals(b"bbbbb"))
+
+    def test_evicted_file(self):
+        """
+        Evicting a share file closes its handle and drops its blocks, and
+        readers still holding it can go on reading it.
+        """
+        first = self.make_share(b"a" * 100)
+        second = self.make_share(b"b" * 100)
+        cache = ShareReadCache(100000, max_open_files=1)
+        cached = cache.open(first)
+        cached.read_share_data(0, 5)
+        self.assertThat(cache.get_stats()["bytes"], NotEquals(0))
+        cache.open(second)
+        self.assertThat(cached._file.closed, Equals(True))
+        self.assertThat(cache.get_stats()["bytes"], Equals(0))
+        self.assertThat(cached.read_share_data(0, 5), Equals(b"aaaaa"))
+        self.assertThat(cache.get_stats()["bytes"], Equals(0))
+
+    def test_server_stats(self):
+        """
+        A storage server configured with a read cache uses it for immutable
+        reads and reports its counters.
+        """
+        ss = StorageServer(self.mktemp(), b"\x00" * 20, read_cache_size=10**6)
+        _, writers = ss.allocate_buckets(
+            b"si1", b"r" * 32, b"c" * 32, {0}, 100,
+        )
+        writers[0].write(0, b"d" * 100)
+        writers[0].close()
+        for _ in range(2):
+            self.assertThat(ss.get_buckets(b"si1")[0].read(0, 100),
+                            Equals(b"d" * 100))
+        stats = ss.get_stats()
+        self.assertThat(stats["storage_server.read_cache.hits"], Equals(1))
+        self.assertThat(stats["storage_server.read_cache.misses"], Equals(1))
+
+
+class ShareIndexTests(SyncTestCase):
+    """
+    Tests for the storage server's optional share index.
+    """
+
+    def setUp(self):
+        super(ShareIndexTests, self).setUp()
+        self.sparent = LoggingServiceParent()
+        self.sparent.startService()
+        self.addCleanup(self.sparent.stopService)
+
+    def create(self, name):
+        ss = StorageServer(
+            os.path.join("storage", "ShareIndexTests", name), b"\x00" * 20,
+            share_index=True,
+        )
+        ss.setServiceParent(self.sparent)
+        return ss
+
+    def upload(self, ss, storage_index, shnum, data):
+        _, writers = ss.allocate_buckets(
+            storage_index, b"r" * 32, b"c" * 32, {shnum}, len(data),
+        )
+        writers[shnum].write(0, data)
+        writers[shnum].close()
+
+    def test_kept_up_to_date(self):
+        """
+        Creating, modifying and deleting shares updates the index.
+        """
+        ss = self.create("test_kept_up_to_date")
+        rebuild(ss.share_index, ss.sharedir)
+        self.assertTrue(ss.share_index.is_complete())
+
+        self.upload(ss, b"si1", 3, b"immutable data")
+        [share] = ss.share_index.get_shares(b"si1")
+        self.assertThat(share.shnum, Equals(3))
+        self.assertThat(share.sharetype, Equals("immutable"))
+        self.assertThat(share.length, Equals(14))
+        self.assertThat(share.lease_expiration, NotEquals(0))
+
+        secrets = (b"w" * 32, b"r" * 32, b"c" * 32)
+        ss.slot_testv_and_readv_and_writev(
+            b"si2", secrets, {0: ([], [(0, b"hello")], None),
+                              1: ([], [(0, b"world!")], None)}, [],
+        )
+        self.assertThat(
+            [(s.shnum, s.sharetype, s.length)
+             for s in ss.share_index.get_shares(b"si2")],
+            Equals([(0, "mutable", 5), (1, "mutable", 6)]),
+        )
+        self.assertThat(ss.get_stats()["storage_server.total_bucket_count"],
+                        Equals(2))
+
+        ss.slot_testv_and_readv_and_writev(
+            b"si2", secrets, {0: ([], [], 0)}, [],
+        )
+        self.assertThat(
+            [s.shnum for s in ss.share_index.get_shares(b"si2")], Equals([1]),
+        )
+        self.assertThat(verify(ss.share_index, ss.sharedir), Equals([]))
+
+    def test_lookups_use_index(self):
+        """
+        Once the index is complete, share lookups use it rather than the
+        share directories.
+        """
+        ss = self.create("test_lookups_use_index")
+        self.upload(ss, b"si1", 0, b"a" * 10)
+        # Not complete yet, so this share the index doesn't know about is
+        # found anyway:
+        ss.share_index.clear()
+        self.assertThat(set(ss.get_buckets(b"si1")), Equals({0}))
+
+        rebuild(ss.share_index, ss.sharedir)
+        ss.share_index.remove_share(b"si1", 0)
+        self.assertThat(ss.get_buckets(b"si1"), Equals({}))
+        self.assertThat(
+            verify(ss.share_index, ss.sharedir),
+            Equals(["{} sh0: missing from index".format(
+                str(si_b2a(b"si1"), "ascii"))]),
+        )
+
+        ss.share_index.add_share(b"si1", IndexedShare(0, "immutable", 10, 0))
+        self.assertThat(set(ss.get_buckets(b"si1")), Equals({0}))
+
+    def test_leases_recorded(self):
+        """
+        Adding and renewing leases updates the index's lease records, which
+        can be searched by expiration time.
+        """
+        ss = self.create("test_leases_recorded")
+        rebuild(ss.share_index, ss.sharedir)
+        self.upload(ss, b"si1", 0, b"a" * 10)
+        [first] = ss.share_index.get_leases(b"si1")[0]
+
+        ss.add_lease(b"si1", b"R" * 32, b"C" * 32)
+        ss.renew_lease(b"si1", b"r" * 32)
+        leases = ss.share_index.get_leases(b"si1")
+        self.assertThat(len(leases[0]), Equals(2))
+        self.assertThat(verify(ss.share_index, ss.sharedir), Equals([]))
+
+        prefix = str(si_b2a(b"si1"), "ascii")[:2]
+        self.assertThat(
+            ss.share_index.buckets_with_leases_expiring_by(prefix, first - 1),
+            Equals(set()),
+        )
+        self.assertThat(
+            ss.share_index.buckets_with_leases_expiring_by(prefix, max(leases[0])),
+            Equals({str(si_b2a(b"si1"), "ascii")}),
+        )
+        self.assertThat(
+            ss.share_index.lease_age_histogram(first - 31*24*60*60),
+            Equals([(0, 24*60*60, 2)]),
+        )
+
+        ss.share_index.remove_share(b"si1", 0)
+        self.assertThat(ss.share_index.get_leases(b"si1"), Equals({}))
+
+    def test_upgrade_from_v1(self):
+        """
+        An index from before leases were recorded is upgraded, and has to be
+        rebuilt before it is used.
+        """
+        dbfile = self.mktemp()
+        (_, db) = dbutil.get_db(dbfile, create_version=(shareindex.SCHEMA_v1, 1))
+        db.execute("INSERT INTO state (name, value) VALUES ('complete', 1)")
+        db.commit()
+        db.close()
+
+        index = shareindex.ShareIndex(dbfile)
+        self.addCleanup(index.close)
+        self.assertFalse(index.is_complete())
+        self.assertThat(index.get_leases(b"si1"), Equals({}))
+
+    def test_lease_checker_uses_index(self):
+        """
+        With expiration enabled and a complete index, the lease checker only
+        examines buckets which the index says may have expired leases.
+        """
+        clock = Clock()
+        ss = StorageServer(
+            os.path.join("storage", "ShareIndexTests", "test_lease_checker_uses_index"),
+            b"\x00" * 20,
+            share_index=True,
+            expiration_enabled=True,
+            clock=clock,
+        )
+        ss.setServiceParent(self.sparent)
+        # Leased at the start of the epoch, so long expired:
+        self.upload(ss, b"si1", 0, b"a" * 10)
+        clock.advance(time.time())
+        self.upload(ss, b"si2", 0, b"b" * 10)
+        rebuild(ss.share_index, ss.sharedir)
+
+        lc = ss.lease_checker
+        lc.cpu_slice = 500
+        lc.start_current_prefix(time.time())
+
+        self.assertThat(ss.get_buckets(b"si1"), Equals({}))
+        self.assertThat(set(ss.get_buckets(b"si2")), Equals({0}))
+        recovered = lc.get_state()["history"]["0"]["space-recovered"]
+        self.assertThat(recovered["examined-buckets"], Equals(1))
+        self.assertThat(recovered["actual-buckets"], Equals(1))
+        self.assertThat(verify(ss.share_index, ss.sharedir), Equals([]))
+
+    def test_crawler_builds_index(self):
+        """
+        A full crawl of the share directories populates the index and marks
+        it complete.
+        """
+        ss = self.create("test_crawler_builds_index")
+        self.upload(ss, b"si1", 0, b"a" * 10)
+        self.upload(ss, b"si2", 4, b"b" * 20)
+        ss.share_index.clear()
+        # And a stale entry that should be dropped:
+        ss.share_index.add_share(b"si3", IndexedShare(1, "immutable", 5, 0))
+        self.assertFalse(ss.share_index.is_complete())
+
+        crawler = ss.share_index_crawler
+        crawler.cpu_slice = 500
+        crawler.start_current_prefix(time.time())
+
+        self.assertTrue(ss.share_index.is_complete())
+        self.assertThat(verify(ss.share_index, ss.sharedir), Equals([]))
+        self.assertThat(ss.share_index.bucket_count(), Equals(2))
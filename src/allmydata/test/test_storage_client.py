@@ -56,6 +56,7 @@ from twisted.python.filepath import (
     FilePath,
 )
 from twisted.internet.task import Clock
+from twisted.web import http
 
 from foolscap.api import (
     Tub,
@@ -96,8 +97,11 @@ from allmydata.storage_client import (
     _FoolscapStorage,
     _NullStorage,
     _pick_a_http_server,
+    _LeaseRenewals,
     ANONYMOUS_STORAGE_NURLS,
 )
+from ..storage.http_client import ClientException as HTTPClientException
+from ..storage.http_common import MAX_LEASES_PER_REQUEST
 from ..storage.server import (
     StorageServer,
 )
@@ -683,6 +687,46 @@ storage:
         self.assertTrue(new_service.running)
         self.assertIdentical(new_service.parent, broker)
 
+    def test_http_connections_per_server(self):
+        """
+        ``[client]storage.http_connections_per_server`` sets how many
+        connections to each HTTP storage server are kept open.
+        """
+        tub_maker = lambda _: new_tub()
+        config = config_from_string(
+            "/dev/null", "",
+            "[client]\nstorage.http_connections_per_server = 25\n",
+        )
+        broker = StorageFarmBroker(
+            True, tub_maker, config,
+            StorageClientConfig.from_node_config(config),
+        )
+        broker.startService()
+        self.addCleanup(broker.stopService)
+        ones = str(base32.b2a(b"1"), "utf-8")
+        broker._got_announcement(b"v0-1234-1", {
+            "service-name": "storage",
+            "anonymous-storage-FURL": f"pb://{ones}@nowhere/fake2",
+            "permutation-seed-base32": "bbbbbbbbbbbbbbbbbbbbbbbb",
+            ANONYMOUS_STORAGE_NURLS: {f"pb://{ones}@nowhere/fake2#v=1"},
+        })
+        server = broker.servers[b"v0-1234-1"]
+        self.assertIsInstance(server, HTTPNativeStorageServer)
+        self.assertEqual(
+            server._storage_client_factory._connections_per_server, 25,
+        )
+
+    def test_http_connections_per_server_invalid(self):
+        """
+        ``[client]storage.http_connections_per_server`` must be at least 1.
+        """
+        config = config_from_string(
+            "/dev/null", "",
+            "[client]\nstorage.http_connections_per_server = 0\n",
+        )
+        with self.assertRaises(ValueError):
+            StorageClientConfig.from_node_config(config)
+
 
     def test_static_permutation_seed_pubkey(self):
         broker = make_broker()
@@ -897,3 +941,140 @@ class PickHTTPServerTests(unittest.SynchronousTestCase):
         exc = self.failureResultOf(result).value
         self.assertIsInstance(exc, MultiFailure)
         self.assertEqual({f.value for f in exc.failures}, {exception2, exception1})
+
+
+class FakeLeaseClient(object):
+    """
+    The lease parts of ``StorageClientGeneral``, answering requests only when
+    the test says so.
+
+    :ivar requests: ``(kind, leases, Deferred)`` for each request made, where
+        ``kind`` is ``"bulk"`` or ``"single"``.
+    """
+    def __init__(self):
+        self.requests = []
+
+    def add_or_renew_leases(self, leases):
+        d = Deferred()
+        self.requests.append(("bulk", list(leases), d))
+        return d
+
+    def add_or_renew_lease(self, storage_index, renew_secret, cancel_secret):
+        d = Deferred()
+        self.requests.append(
+            ("single", [(storage_index, renew_secret, cancel_secret)], d)
+        )
+        return d
+
+
+class LeaseRenewalsTests(unittest.SynchronousTestCase):
+    """Tests for ``_LeaseRenewals``."""
+
+    def setUp(self):
+        self.client = FakeLeaseClient()
+        self.renewals = _LeaseRenewals(self.client)
+
+    def lease(self, i):
+        return (b"%016d" % i, b"r" * 32, b"c" * 32)
+
+    def test_coalesced_while_request_in_progress(self):
+        """
+        The first lease is sent straight away, and those asked for while it
+        is in progress are then sent together.
+        """
+        results = [self.renewals.add_lease(*self.lease(i)) for i in range(4)]
+        self.assertEqual(
+            [(kind, leases) for (kind, leases, _) in self.client.requests],
+            [("bulk", [self.lease(0)])],
+        )
+        self.assertNoResult(results[1])
+
+        self.client.requests[0][2].callback([True])
+        self.assertIsNone(self.successResultOf(results[0]))
+        self.assertEqual(
+            [(kind, leases) for (kind, leases, _) in self.client.requests[1:]],
+            [("bulk", [self.lease(1), self.lease(2), self.lease(3)])],
+        )
+
+        self.client.requests[1][2].callback([True, False, True])
+        for result in results[1:]:
+            self.assertIsNone(self.successResultOf(result))
+
+    def test_batch_size_limited(self):
+        """
+        No more than ``MAX_LEASES_PER_REQUEST`` leases are sent in one
+        request.
+        """
+        results = [
+            self.renewals.add_lease(*self.lease(i))
+            for i in range(MAX_LEASES_PER_REQUEST + 2)
+        ]
+        self.assertEqual(
+            [len(leases) for (_, leases, _) in self.client.requests],
+            [1, MAX_LEASES_PER_REQUEST],
+        )
+        for (_, leases, d) in self.client.requests[:]:
+            d.callback([True] * len(leases))
+        self.assertEqual(
+            [len(leases) for (_, leases, _) in self.client.requests],
+            [1, MAX_LEASES_PER_REQUEST, 1],
+        )
+        self.client.requests[2][2].callback([True])
+        for result in results:
+            self.assertIsNone(self.successResultOf(result))
+
+    def test_old_server(self):
+        """
+        If the server doesn't have the bulk lease API, each lease is sent
+        separately, from then on, and unknown storage indexes are ignored.
+        """
+        first = self.renewals.add_lease(*self.lease(0))
+        second = self.renewals.add_lease(*self.lease(1))
+        self.client.requests[0][2].errback(HTTPClientException(http.NOT_FOUND))
+        self.assertEqual(
+            [(kind, leases) for (kind, leases, _) in self.client.requests[1:]],
+            [("single", [self.lease(0)])],
+        )
+        self.client.requests[1][2].errback(HTTPClientException(http.NOT_FOUND))
+        self.assertIsNone(self.successResultOf(first))
+
+        self.assertEqual(
+            [(kind, leases) for (kind, leases, _) in self.client.requests[2:]],
+            [("single", [self.lease(1)])],
+        )
+        self.client.requests[2][2].callback(None)
+        self.assertIsNone(self.successResultOf(second))
+
+    def test_errors(self):
+        """
+        If a bulk request fails, every lease it was for fails.
+        """
+        results = [self.renewals.add_lease(*self.lease(i)) for i in range(3)]
+        self.client.requests[0][2].callback([True])
+        self.client.requests[1][2].errback(
+            HTTPClientException(http.INTERNAL_SERVER_ERROR)
+        )
+        for result in results[1:]:
+            self.assertEqual(
+                self.failureResultOf(result, HTTPClientException).value.code,
+                http.INTERNAL_SERVER_ERROR,
+            )
+        # Later leases are still sent:
+        later = self.renewals.add_lease(*self.lease(3))
+        self.client.requests[2][2].callback([True])
+        self.assertIsNone(self.successResultOf(later))
+
+    def test_item_error(self):
+        """
+        If the server reports an error for one lease of a bulk request, only
+        that lease fails.
+        """
+        results = [self.renewals.add_lease(*self.lease(i)) for i in range(4)]
+        self.client.requests[0][2].callback([True])
+        self.client.requests[1][2].callback([True, "IOError", False])
+        self.assertIsNone(self.successResultOf(results[1]))
+        exc = self.failureResultOf(results[2], HTTPClientException).value
+        self.assertEqual(
+            (exc.code, exc.message), (http.INTERNAL_SERVER_ERROR, "IOError"),
+        )
+        self.assertIsNone(self.successResultOf(results[3]))
@@ -34,7 +34,7 @@ from hyperlink import DecodedURL
 from collections_extended import RangeMap
 from twisted.internet.task import Clock, Cooperator
 from twisted.internet.interfaces import IReactorTime, IReactorFromThreads
-from twisted.internet.defer import CancelledError, Deferred, ensureDeferred
+from twisted.internet.defer import CancelledError, Deferred, ensureDeferred, fail
 from twisted.web import http
 from twisted.web.http_headers import Headers
 from werkzeug import routing
@@ -50,10 +50,12 @@ from ..storage.http_common import (
     get_content_type,
     CBOR_MIME_TYPE,
     response_is_not_html,
+    MAX_LEASES_PER_REQUEST,
 )
 from ..storage.common import si_b2a
 from ..storage.lease import LeaseInfo
 from ..storage.server import StorageServer
+from ..storage import http_server
 from ..storage.http_server import (
     HTTPServer,
     _extract_secrets,
@@ -66,6 +68,7 @@ from ..storage.http_server import (
     _SCHEMAS as SERVER_SCHEMAS,
     BaseApp,
 )
+from ..storage_client import _HTTPBucketReader
 from ..storage.http_client import (
     StorageClient,
     StorageClientFactory,
@@ -1321,6 +1324,31 @@ class ImmutableHTTPAPITests(SyncTestCase):
                 self.general_client.add_or_renew_lease(storage_index, secret, secret)
             )
 
+    def test_bulk_lease_limits(self):
+        """
+        Bulk lease requests must have between one and
+        ``MAX_LEASES_PER_REQUEST`` leases, with secrets of the right length,
+        or they get a HTTP 400.
+        """
+        secret = b"A" * 32
+        for leases in [
+            [],
+            [(urandom(16), secret, secret)] * (MAX_LEASES_PER_REQUEST + 1),
+            [(urandom(16), b"A" * 31, secret)],
+        ]:
+            with assert_fails_with_http_code(self, http.BAD_REQUEST):
+                self.http.result_of_with_flush(
+                    self.general_client.add_or_renew_leases(leases)
+                )
+        self.assertEqual(
+            self.http.result_of_with_flush(
+                self.general_client.add_or_renew_leases(
+                    [(urandom(16), secret, secret)] * MAX_LEASES_PER_REQUEST
+                )
+            ),
+            [False] * MAX_LEASES_PER_REQUEST,
+        )
+
 
 class MutableHTTPAPIsTests(SyncTestCase):
     """Tests for mutable APIs."""
@@ -1614,6 +1642,64 @@ class SharedImmutableMutableTestsMixin:
         self.assertEqual(lease1.get_expiration_time(), initial_expiration_time + 167)
         self.assertEqual(lease2.get_expiration_time(), initial_expiration_time + 177)
 
+    def test_bulk_lease_renew_and_add(self):
+        """
+        Leases on many storage indexes can be renewed or added with a single
+        request, which says which of the storage indexes had shares.
+        """
+        storage_index, _, lease_secret = self.upload(0)
+        storage_index2, _, lease_secret2 = self.upload(1)
+        [lease] = self.get_leases(storage_index)
+        initial_expiration_time = lease.get_expiration_time()
+
+        # Time passes:
+        self.http.clock.advance(167)
+
+        new_secret = urandom(32)
+        renewed = self.http.result_of_with_flush(
+            self.general_client.add_or_renew_leases([
+                (storage_index, lease_secret, lease_secret),
+                (urandom(16), new_secret, new_secret),
+                (storage_index2, new_secret, new_secret),
+            ])
+        )
+        self.assertEqual(renewed, [True, False, True])
+
+        [lease] = self.get_leases(storage_index)
+        self.assertEqual(lease.get_expiration_time(), initial_expiration_time + 167)
+        [lease1, lease2] = self.get_leases(storage_index2)
+        self.assertEqual(lease1.get_expiration_time(), initial_expiration_time)
+        self.assertEqual(lease2.get_expiration_time(), initial_expiration_time + 167)
+
+    def test_bulk_lease_error(self):
+        """
+        If the server fails to update the leases of one storage index in a
+        bulk request, the response says so for that storage index and the
+        others are still updated.
+        """
+        storage_index, _, lease_secret = self.upload(0)
+        storage_index2, _, lease_secret2 = self.upload(1)
+        [lease] = self.get_leases(storage_index2)
+        initial_expiration_time = lease.get_expiration_time()
+        self.http.clock.advance(167)
+
+        original = self.http.storage_server._add_or_renew_leases
+        def add_or_renew_leases(shares, lease_info):
+            if lease_info.renew_secret == lease_secret:
+                raise OSError("/secret/path")
+            return original(shares, lease_info)
+        self.http.storage_server._add_or_renew_leases = add_or_renew_leases
+
+        renewed = self.http.result_of_with_flush(
+            self.general_client.add_or_renew_leases([
+                (storage_index, lease_secret, lease_secret),
+                (storage_index2, lease_secret2, lease_secret2),
+            ])
+        )
+        self.assertEqual(renewed, ["OSError", True])
+        [lease] = self.get_leases(storage_index2)
+        self.assertEqual(lease.get_expiration_time(), initial_expiration_time + 167)
+
     def test_read_of_wrong_storage_index_fails(self):
         """
         Reading from unknown storage index results in 404.
@@ -1791,6 +1877,61 @@ class ImmutableSharedTests(SharedImmutableMutableTestsMixin, SyncTestCase):
         """
         return self._read_with_no_range_test(data_length)
 
+    def test_read_share_chunks(self):
+        """
+        Several ranges of a share can be read with a single request; ranges
+        past the end of the share are truncated and shares the server doesn't
+        have are omitted.
+        """
+        storage_index, data, _ = self.upload(1, 100)
+        result = self.http.result_of_with_flush(
+            self.client.read_share_chunks(
+                storage_index,
+                {1: [(0, 10), (50, 5), (95, 20), (200, 5)], 7: [(0, 10)]},
+            )
+        )
+        self.assertEqual(
+            result, {1: [data[0:10], data[50:55], data[95:100], b""]}
+        )
+
+    def test_read_share_chunks_too_large(self):
+        """
+        A batched read which would return more than
+        ``MAX_READ_SHARE_CHUNKS_SIZE`` bytes fails with 413.
+        """
+        self.patch(http_server, "MAX_READ_SHARE_CHUNKS_SIZE", 50)
+        storage_index, _, _ = self.upload(1, 100)
+        with self.assertRaises(ClientException) as e:
+            self.http.result_of_with_flush(
+                self.client.read_share_chunks(
+                    storage_index, {1: [(0, 30), (50, 30)]}
+                )
+            )
+        self.assertEqual(e.exception.code, http.REQUEST_ENTITY_TOO_LARGE)
+
+    def test_bucket_reader_readv(self):
+        """
+        ``_HTTPBucketReader.readv`` uses the batched read API, and falls back
+        to individual reads against a server that doesn't support it.
+        """
+        storage_index, data, _ = self.upload(1, 100)
+        reader = _HTTPBucketReader(self.client, storage_index, 1)
+        readv = [(0, 10), (90, 20)]
+        expected = [data[0:10], data[90:100]]
+        self.assertEqual(
+            self.http.result_of_with_flush(reader.readv(readv)), expected
+        )
+        self.assertTrue(reader._readv_supported)
+
+        def not_found(*args, **kwargs):
+            return fail(ClientException(http.NOT_FOUND))
+
+        self.patch(StorageClientImmutables, "read_share_chunks", not_found)
+        self.assertEqual(
+            self.http.result_of_with_flush(reader.readv(readv)), expected
+        )
+        self.assertFalse(reader._readv_supported)
+
 
 class MutableSharedTests(SharedImmutableMutableTestsMixin, SyncTestCase):
     """Shared tests, running on mutables."""
@@ -29,6 +29,7 @@ from .certs import (
     cert_to_file,
 )
 from ..storage.http_common import get_spki, get_spki_hash
+from ..storage import http_client
 from ..storage.http_client import _StorageClientHTTPSPolicy
 from ..storage.http_server import _TLSEndpointWrapper
 from ..util.deferredutil import async_to_deferred
@@ -130,19 +131,21 @@ class PinningHTTPSValidation(AsyncTestCase):
             if result is not None:
                 await result
 
-    def request(self, url: str, expected_certificate: x509.Certificate):
+    def request(self, url: str, expected_certificate: x509.Certificate, policy=None):
         """
         Send a HTTPS request to the given URL, ensuring that the given
         certificate is the one used via SPKI-hash-based pinning comparison.
         """
+        if policy is None:
+            policy = _StorageClientHTTPSPolicy(
+                expected_spki_hash=get_spki_hash(expected_certificate)
+            )
         # No persistent connections, so we don't have dirty reactor at the end
         # of the test.
         treq_client = HTTPClient(
             Agent(
                 reactor,
-                _StorageClientHTTPSPolicy(
-                    expected_spki_hash=get_spki_hash(expected_certificate)
-                ),
+                policy,
                 pool=HTTPConnectionPool(reactor, persistent=False),
             )
         )
@@ -217,6 +220,59 @@ class PinningHTTPSValidation(AsyncTestCase):
             response = await self.request(url, certificate)
             self.assertEqual(await response.content(), b"YOYODYNE")
 
+    @async_to_deferred
+    async def test_session_resumed(self):
+        """
+        Later connections made with the same policy resume the TLS session
+        set up by the first, so the server's certificate is only validated
+        once.
+        """
+        validations = []
+
+        def counting_get_spki_hash(certificate):
+            validations.append(certificate)
+            return get_spki_hash(certificate)
+
+        self.patch(http_client, "get_spki_hash", counting_get_spki_hash)
+        private_key = generate_private_key()
+        certificate = generate_certificate(private_key)
+        policy = _StorageClientHTTPSPolicy(
+            expected_spki_hash=get_spki_hash(certificate)
+        )
+        async with self.listen(
+            private_key_to_file(FilePath(self.mktemp()), private_key),
+            cert_to_file(FilePath(self.mktemp()), certificate),
+        ) as url:
+            response = await self.request(url, certificate, policy)
+            self.assertEqual(await response.content(), b"YOYODYNE")
+            self.assertNotEqual(validations, [])
+            del validations[:]
+
+            response = await self.request(url, certificate, policy)
+            self.assertEqual(await response.content(), b"YOYODYNE")
+            self.assertEqual(validations, [])
+
+    @async_to_deferred
+    async def test_session_not_shared(self):
+        """
+        A TLS session set up for one pinned certificate is never used by a
+        policy for a different one.
+        """
+        private_key = generate_private_key()
+        certificate = generate_certificate(private_key)
+        policy = _StorageClientHTTPSPolicy(
+            expected_spki_hash=get_spki_hash(certificate)
+        )
+        other_certificate = generate_certificate(generate_private_key())
+        async with self.listen(
+            private_key_to_file(FilePath(self.mktemp()), private_key),
+            cert_to_file(FilePath(self.mktemp()), certificate),
+        ) as url:
+            response = await self.request(url, certificate, policy)
+            self.assertEqual(await response.content(), b"YOYODYNE")
+            with self.assertRaises(ResponseNeverReceived):
+                await self.request(url, other_certificate)
+
     # A potential attack to test is a private key that doesn't match the
     # certificate... but OpenSSL (quite rightly) won't let you listen with that
     # so I don't know how to test that! See
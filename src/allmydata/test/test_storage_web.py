@@ -23,6 +23,7 @@ from allmydata.util import fileutil, hashutil, base32, pollmixin
 from allmydata.storage.common import storage_index_to_dir, \
      UnknownMutableContainerVersionError, UnknownImmutableContainerVersionError
 from allmydata.storage.server import StorageServer
+from allmydata.storage.shareindex import rebuild
 from allmydata.storage.crawler import (
     BucketCountingCrawler,
     _LeaseStateSerializer,
@@ -1566,6 +1567,34 @@ class WebStatus(unittest.TestCase, pollmixin.PollMixin):
         d.addCallback(_check_json)
         return d
 
+    def test_status_lease_ages(self):
+        """
+        With a complete share index, the status page shows lease ages without
+        waiting for the lease checker.
+        """
+        basedir = "storage/WebStatus/status_lease_ages"
+        fileutil.make_dirs(basedir)
+        ss = StorageServer(basedir, b"\x00" * 20, share_index=True)
+        ss.setServiceParent(self.s)
+        _, writers = ss.allocate_buckets(
+            b"si1", b"r" * 32, b"c" * 32, {0}, 10,
+        )
+        writers[0].write(0, b"a" * 10)
+        writers[0].close()
+        rebuild(ss.share_index, ss.sharedir)
+        w = StorageStatus(ss, "nickname")
+        d = renderDeferred(w)
+        def _check_html(html):
+            s = remove_tags(html)
+            self.failUnlessIn(b"Lease ages (from the share index):", s)
+            self.failUnlessIn(b"0-1 days old: 1 leases", s)
+        d.addCallback(_check_html)
+        d.addCallback(lambda ign: renderJSON(w))
+        def _check_json(raw):
+            data = json.loads(raw)
+            self.failUnlessEqual(data["lease-age-histogram"], [[0, 86400, 1]])
+        d.addCallback(_check_json)
+        return d
 
     def test_status_no_disk_stats(self):
         def call_get_disk_stats(whichdir, reserved_space=0):
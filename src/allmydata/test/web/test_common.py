@@ -43,6 +43,8 @@ from twisted.web.resource import (
 )
 
 from ...web.common import (
+    StreamingRequestBody,
+    WebError,
     render_exception,
 )
 
@@ -257,3 +259,103 @@ class RenderExceptionTests(SyncTestCase):
         # garbage collected and then let the generic trial logic for failing
         # tests with logged errors kick in.
         gc.collect()
+
+
+class StreamingRequestBodyTests(SyncTestCase):
+    """
+    Tests for ``StreamingRequestBody``.
+    """
+    def setUp(self):
+        super(StreamingRequestBodyTests, self).setUp()
+        self.flow = []
+        self.body = StreamingRequestBody(
+            12,
+            lambda: self.flow.append("pause"),
+            lambda: self.flow.append("resume"),
+            max_buffered=4,
+        )
+
+    def test_read_waits_for_data(self):
+        """
+        A read fires once enough of the body has arrived, with exactly the
+        bytes asked for.
+        """
+        d = self.body.read(5)
+        self.body.write(b"abc")
+        self.assertThat(d, has_no_result())
+        self.body.write(b"defg")
+        self.assertThat(
+            d.addCallback(b"".join), succeeded(Equals(b"abcde")),
+        )
+        self.assertThat(
+            self.body.read(2).addCallback(b"".join), succeeded(Equals(b"fg")),
+        )
+
+    def test_short_read_at_end(self):
+        """
+        Once the whole body has arrived, a read returns whatever is left.
+        """
+        self.body.write(b"abc")
+        d = self.body.read(5)
+        self.body.finish()
+        self.assertThat(d.addCallback(b"".join), succeeded(Equals(b"abc")))
+        self.assertThat(self.body.is_complete(), Equals(True))
+
+    def test_flow_control(self):
+        """
+        The connection is paused while too much unread data is buffered, and
+        resumed when it has been read.
+        """
+        self.body.write(b"abc")
+        self.assertThat(self.flow, Equals([]))
+        self.body.write(b"de")
+        self.assertThat(self.flow, Equals(["pause"]))
+        self.assertThat(
+            self.body.read(4).addCallback(b"".join), succeeded(Equals(b"abcd")),
+        )
+        self.assertThat(self.flow, Equals(["pause", "resume"]))
+
+    def test_large_read_is_not_paused(self):
+        """
+        A read of more than the buffer limit doesn't leave the connection
+        paused while it waits.
+        """
+        self.body.write(b"abcde")
+        self.assertThat(self.flow, Equals(["pause"]))
+        d = self.body.read(8)
+        self.assertThat(self.flow, Equals(["pause", "resume"]))
+        self.body.write(b"fgh")
+        self.assertThat(self.flow, Equals(["pause", "resume"]))
+        self.assertThat(d.addCallback(b"".join), succeeded(Equals(b"abcdefgh")))
+
+    def test_abort(self):
+        """
+        If the connection is lost, a pending read fails.
+        """
+        d = self.body.read(5)
+        self.body.abort(Failure(ConnectionDone()))
+        self.assertThat(
+            d,
+            failed(
+                AfterPreprocessing(
+                    lambda reason: reason.type,
+                    Equals(ConnectionDone),
+                ),
+            ),
+        )
+
+    def test_discard(self):
+        """
+        A discarded body throws away what arrives, and never stays paused.
+        """
+        self.body.write(b"abcde")
+        self.body.discard()
+        self.body.write(b"fghijkl")
+        self.assertThat(self.flow, Equals(["pause", "resume"]))
+
+    def test_not_a_file(self):
+        """
+        Code expecting a file gets a ``WebError``.
+        """
+        self.assertRaises(WebError, self.body.seek, 0)
+        self.assertRaises(WebError, self.body.read)
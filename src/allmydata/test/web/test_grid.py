@@ -9,6 +9,7 @@ from io import StringIO
 
 from bs4 import BeautifulSoup
 
+from twisted.internet import defer
 from twisted.web import resource
 from allmydata import uri, dirnode
 from allmydata.util import base32
@@ -22,6 +23,7 @@ from allmydata.immutable import upload
 from allmydata.mutable import publish
 
 from ...web.common import (
+    DEFAULT_STREAMING_BODY_BUFFER,
     render_exception,
 )
 from .. import common_util as testutil
@@ -72,6 +74,20 @@ class Grid(GridTestMixin, WebErrorMixin, ShouldFailMixin, testutil.ReallyEqualMi
         d.addCallback(str, "utf-8")
         return d
 
+    @defer.inlineCallbacks
+    def test_streaming_upload(self):
+        """
+        A PUT with stream=true of more data than the streaming body buffers is
+        uploaded and can be downloaded again.
+        """
+        self.basedir = "web/Grid/streaming_upload"
+        self.set_up_grid()
+        DATA = os.urandom(DEFAULT_STREAMING_BODY_BUFFER + 100000)
+        cap = yield self.PUT("uri?stream=true", data=DATA)
+        self.assertTrue(cap.startswith(b"URI:CHK:"), cap)
+        downloaded = yield self.GET("uri/" + str(cap, "ascii"))
+        self.assertEqual(downloaded, DATA)
+
     def test_filecheck(self):
         self.basedir = "web/Grid/filecheck"
         self.set_up_grid()
@@ -29,6 +29,7 @@ from allmydata.immutable.downloader.status import DownloadStatus
 from allmydata.dirnode import DirectoryNode
 from allmydata.nodemaker import NodeMaker
 from allmydata.web.common import MultiFormatResource
+from allmydata.web import filenode as web_filenode
 from allmydata.util import fileutil, base32, hashutil, jsonbytes as json
 from allmydata.util.consumer import download_to_data
 from allmydata.util.encodingutil import to_bytes
@@ -269,6 +270,8 @@ class FakeStorageServer(service.MultiService):
         self.lease_checker = FakeLeaseChecker()
     def get_stats(self):
         return {"storage_server.accepting_immutable_shares": False}
+    def get_lease_age_histogram(self):
+        return None
     def on_status_changed(self, cb):
         cb(self)
 
@@ -1409,6 +1412,156 @@ class Web(WebMixin, WebErrorMixin, testutil.StallMixin, testutil.ReallyEqualMixi
         d.addCallback(_got)
         return d
 
+    def _multipart_ranges(self, headers, body):
+        """
+        Parse a ``multipart/byteranges`` response into a list of
+        (content-range, data) pairs.
+        """
+        ctype = headers.getRawHeaders("content-type")[0]
+        prefix = "multipart/byteranges; boundary="
+        self.assertTrue(ctype.startswith(prefix), ctype)
+        boundary = ctype[len(prefix):].encode("ascii")
+        self.assertTrue(body.endswith(b"\r\n--%s--\r\n" % boundary), body)
+        parts = []
+        for part in body.split(b"\r\n--%s" % boundary)[1:-1]:
+            part_headers, data = part.split(b"\r\n\r\n", 1)
+            part_headers = part_headers.split(b"\r\n")[1:]
+            self.assertIn(b"Content-Type: text/plain", part_headers)
+            [content_range] = [h for h in part_headers if h.startswith(b"Content-Range: ")]
+            parts.append((content_range[len(b"Content-Range: "):], data))
+        return parts
+
+    @inlineCallbacks
+    def test_GET_FILEURL_multirange(self):
+        """
+        A request for several ranges gets a ``multipart/byteranges`` response
+        with each of them, in order.
+        """
+        headers = {"range": "bytes=12-14, 1-3,-2"}
+        length = len(self.BAR_CONTENTS)
+        res, status, headers = yield self.GET(
+            self.public_url + "/foo/bar.txt", headers=headers,
+            return_response=True)
+        self.assertEqual(int(status), 206)
+        self.assertFalse(headers.hasHeader("content-range"))
+        self.assertEqual(self._multipart_ranges(headers, res), [
+            (b"bytes 1-3/%d" % length, self.BAR_CONTENTS[1:4]),
+            (b"bytes 12-14/%d" % length, self.BAR_CONTENTS[12:15]),
+            (b"bytes %d-%d/%d" % (length - 2, length - 1, length), self.BAR_CONTENTS[-2:]),
+        ])
+
+    @inlineCallbacks
+    def test_GET_FILEURL_multirange_streamed(self):
+        """
+        Only ranges of up to ``RANGE_READ_AHEAD_SIZE`` bytes are read into
+        memory ahead of time; bigger ones are streamed.
+        """
+        self.patch(web_filenode, "RANGE_READ_AHEAD_SIZE", 3)
+        read_ahead = []
+        def _download_to_data(n, offset=0, size=None):
+            read_ahead.append((offset, size))
+            return download_to_data(n, offset, size)
+        self.patch(web_filenode, "download_to_data", _download_to_data)
+        headers = {"range": "bytes=0-2,5-14,16-18"}
+        length = len(self.BAR_CONTENTS)
+        res, status, headers = yield self.GET(
+            self.public_url + "/foo/bar.txt", headers=headers,
+            return_response=True)
+        self.assertEqual(int(status), 206)
+        self.assertEqual(self._multipart_ranges(headers, res), [
+            (b"bytes 0-2/%d" % length, self.BAR_CONTENTS[0:3]),
+            (b"bytes 5-14/%d" % length, self.BAR_CONTENTS[5:15]),
+            (b"bytes 16-18/%d" % length, self.BAR_CONTENTS[16:19]),
+        ])
+        self.assertEqual(read_ahead, [(0, 3), (16, 3)])
+
+    @inlineCallbacks
+    def test_HEAD_FILEURL_multirange(self):
+        """
+        HEAD with several ranges gets the headers, and length, of the
+        ``multipart/byteranges`` response GET would send.
+        """
+        url = self.public_url + "/foo/bar.txt"
+        headers = {"range": "bytes=1-3,12-14"}
+        body, _, _ = yield self.GET(url, headers=headers, return_response=True)
+        res, status, headers = yield self.HEAD(
+            url, headers=headers, return_response=True)
+        self.assertEqual((res, int(status)), ("", 206))
+        self.assertTrue(
+            headers.getRawHeaders("content-type")[0].startswith("multipart/byteranges; "))
+        # boundaries are random, but always the same length
+        self.assertEqual(int(headers.getRawHeaders("content-length")[0]), len(body))
+
+    @inlineCallbacks
+    def test_GET_FILEURL_multirange_coalesced(self):
+        """
+        Overlapping and adjacent ranges are merged, and if that leaves one
+        range it's sent on its own.
+        """
+        headers = {"range": "bytes=1-5,3-8,9-10,100-200"}
+        res, status, headers = yield self.GET(
+            self.public_url + "/foo/bar.txt", headers=headers,
+            return_response=True)
+        self.assertEqual(int(status), 206)
+        self.assertEqual(headers.getRawHeaders("content-range")[0],
+                         "bytes 1-10/%d" % len(self.BAR_CONTENTS))
+        self.assertEqual(res, self.BAR_CONTENTS[1:11])
+
+    @inlineCallbacks
+    def test_GET_FILEURL_if_range(self):
+        """
+        A range is only sent if ``If-Range`` names the current ETag; otherwise
+        the whole file is.
+        """
+        url = self.public_url + "/foo/bar.txt"
+        _, _, headers = yield self.GET(url, return_response=True)
+        etag = headers.getRawHeaders("etag")[0]
+        self.assertTrue(etag.startswith('"') and etag.endswith('"'), etag)
+
+        res, status, _ = yield self.GET(url, return_response=True, headers={
+            "range": "bytes=1-10", "if-range": etag})
+        self.assertEqual((int(status), res), (206, self.BAR_CONTENTS[1:11]))
+
+        for if_range in ['"something-else"', "W/" + etag,
+                         "Sat, 29 Oct 1994 19:43:31 GMT"]:
+            res, status, _ = yield self.GET(url, return_response=True, headers={
+                "range": "bytes=1-10", "if-range": if_range})
+            self.assertEqual((int(status), res), (200, self.BAR_CONTENTS))
+
+    @inlineCallbacks
+    def test_GET_FILEURL_if_none_match(self):
+        """
+        ``If-None-Match`` with any of a list of ETags, including weak ones,
+        gets a 304 for GET and HEAD.
+        """
+        url = self.public_url + "/foo/bar.txt"
+        _, _, headers = yield self.GET(url, return_response=True)
+        etag = headers.getRawHeaders("etag")[0]
+        for if_none_match in ['"other", ' + etag, "W/" + etag, "*"]:
+            for method in (self.GET, self.HEAD):
+                res, status, headers = yield method(url, return_response=True, headers={
+                    "if-none-match": if_none_match})
+                self.assertEqual((int(status), len(res)), (304, 0))
+                self.assertEqual(headers.getRawHeaders("etag"), [etag])
+        res, status, _ = yield self.GET(url, return_response=True, headers={
+            "if-none-match": '"other"'})
+        self.assertEqual((int(status), res), (200, self.BAR_CONTENTS))
+
+    @inlineCallbacks
+    def test_GET_LIT_etag(self):
+        """
+        LIT files get an ETag from their contents.
+        """
+        url = "/uri/" + urlquote("URI:LIT:%s" % base32.b2a(b"literal").decode("ascii"))
+        _, _, headers = yield self.GET(url, return_response=True)
+        etag = headers.getRawHeaders("etag")[0]
+        res, status, _ = yield self.GET(url, return_response=True, headers={
+            "if-none-match": etag})
+        self.assertEqual(int(status), 304)
+        other = "/uri/" + urlquote("URI:LIT:%s" % base32.b2a(b"other").decode("ascii"))
+        _, _, headers = yield self.GET(other, return_response=True)
+        self.assertNotEqual(headers.getRawHeaders("etag")[0], etag)
+
     def test_HEAD_FILEURL(self):
         d = self.HEAD(self.public_url + "/foo/bar.txt", return_response=True)
         def _got(res_and_status_and_headers):
@@ -1587,8 +1740,10 @@ class Web(WebMixin, WebErrorMixin, testutil.StallMixin, testutil.ReallyEqualMixi
                 # All deferred must succeed
                 self.failUnless(all([r[0] for r in results]))
                 # the etag for the t=json form should be just like the etag
-                # fo the default t='' form, but with a 'json' suffix
-                self.failUnlessEqual(results[0][1] + 'json', results[1][1])
+                # fo the default t='' form, but with a 'json' suffix (inside
+                # the quotes of a file's strong ETag)
+                self.failUnlessEqual(results[0][1].strip('"') + 'json',
+                                     results[1][1].strip('"'))
             d.addCallback(_check)
             return d
 
@@ -4589,6 +4744,45 @@ class Web(WebMixin, WebErrorMixin, testutil.StallMixin, testutil.ReallyEqualMixi
         d.addCallback(_check2)
         return d
 
+    def test_PUT_NEWFILE_URI_stream(self):
+        """
+        With stream=true the body of a PUT /uri is uploaded as it arrives,
+        with the same result.
+        """
+        file_contents = b"New file contents here\n" * 1000
+        d = self.PUT("/uri?stream=true", file_contents)
+        def _check(uri):
+            self.failUnlessReallyEqual(self.get_all_contents()[uri],
+                                       file_contents)
+            return self.GET("/uri/%s" % str(uri, "utf-8"))
+        d.addCallback(_check)
+        d.addCallback(self.failUnlessReallyEqual, file_contents)
+        return d
+
+    def test_PUT_NEWFILEURL_stream(self):
+        """
+        With stream=true a PUT of a new child of a directory uploads the body
+        as it arrives.
+        """
+        d = self.PUT(self.public_url + "/foo/new.txt?stream=true",
+                     self.NEWFILE_CONTENTS)
+        d.addCallback(self.failUnlessURIMatchesROChild, self._foo_node, u"new.txt")
+        d.addCallback(lambda res:
+                      self.failUnlessChildContentsAre(self._foo_node, u"new.txt",
+                                                      self.NEWFILE_CONTENTS))
+        return d
+
+    def test_PUT_NEWFILE_URI_mutable_stream(self):
+        """
+        Mutable uploads can't be streamed.
+        """
+        d = self.PUT("/uri?mutable=true&stream=true", b"contents")
+        d.addBoth(self.shouldFail, error.Error,
+                  "PUT_NEWFILE_URI_mutable_stream",
+                  "400 Bad Request",
+                  "stream=true is only supported for uploads of immutable files")
+        return d
+
     def test_PUT_NEWFILE_URI_only_PUT(self):
         d = self.PUT("/uri?t=bogus", b"")
         d.addBoth(self.shouldFail, error.Error,
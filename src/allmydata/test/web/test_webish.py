@@ -30,6 +30,12 @@ from testtools.matchers import (
 from twisted.python.filepath import (
     FilePath,
 )
+from twisted.internet.task import (
+    Clock,
+)
+from twisted.internet.testing import (
+    StringTransport,
+)
 from twisted.web.test.requesthelper import (
     DummyChannel,
 )
@@ -41,6 +47,11 @@ from ..common import (
     SyncTestCase,
 )
 
+from ...web.common import (
+    DEFAULT_STREAMING_BODY_BUFFER,
+    StreamingRequestBody,
+)
+from ... import webish
 from ...webish import (
     TahoeLAFSRequest,
     TahoeLAFSSite,
@@ -314,6 +325,74 @@ class TahoeLAFSSiteTests(SyncTestCase):
         """
         self._large_request_test(request_body_size)
 
+    def _connect(self):
+        """
+        Connect a ``TahoeLAFSSite`` serving nothing to a ``StringTransport``.
+
+        :return: The channel and the transport.
+        """
+        tempdir = FilePath(self.mktemp())
+        tempdir.makedirs()
+        site = TahoeLAFSSite(
+            anonymous_tempfile_factory(tempdir.path),
+            Resource(),
+            logPath=self.mktemp(),
+        )
+        site.startFactory()
+        self.addCleanup(site.stopFactory)
+        channel = site.buildProtocol(None)
+        transport = StringTransport()
+        channel.makeConnection(transport)
+        return channel, transport
+
+    def test_streaming_put(self):
+        """
+        A ``PUT`` with ``stream=true`` gets a ``StreamingRequestBody`` as soon
+        as its headers arrive.  While too much of the body is unread the
+        transport is paused, and it is resumed once the response is sent.
+        """
+        clock = Clock()
+        self.patch(webish, "reactor", clock)
+        channel, transport = self._connect()
+        length = DEFAULT_STREAMING_BODY_BUFFER * 2
+        channel.dataReceived(
+            b"PUT /uri?stream=true HTTP/1.1\r\n"
+            b"Content-Length: %d\r\n\r\n" % (length,)
+        )
+        [request] = channel.requests
+        self.assertThat(request.method, Equals(b"PUT"))
+        self.assertThat(request.uri, Equals(b"/uri?stream=true"))
+        self.assertThat(request.content, IsInstance(StreamingRequestBody))
+
+        channel.dataReceived(b"x" * (DEFAULT_STREAMING_BODY_BUFFER + 1))
+        self.assertThat(transport.producerState, Equals("paused"))
+
+        # The transport's send buffer filling up and draining again doesn't
+        # resume reading the body.
+        channel.pauseProducing()
+        channel.resumeProducing()
+        self.assertThat(transport.producerState, Equals("paused"))
+
+        # The resource has nothing there, so the response is sent before the
+        # rest of the body arrives.
+        clock.advance(0)
+        self.assertThat(transport.producerState, Equals("producing"))
+        channel.dataReceived(b"x" * (DEFAULT_STREAMING_BODY_BUFFER - 1))
+        self.assertThat(transport.value(), Contains(b" 404 "))
+        self.assertThat(transport.producerState, Equals("producing"))
+
+    def test_put_not_streamed(self):
+        """
+        A ``PUT`` without ``stream=true`` has its body collected as usual.
+        """
+        channel, transport = self._connect()
+        channel.dataReceived(
+            b"PUT /uri HTTP/1.1\r\n"
+            b"Content-Length: 10\r\n\r\n"
+        )
+        [request] = channel.requests
+        self.assertThat(request.content, IsInstance(BytesIO))
+
 
 def param(name, value):
     return u"; {}={}".format(name, value)
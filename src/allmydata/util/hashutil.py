@@ -31,7 +31,8 @@ class _SHA256d_Hasher(object):
         self._digest = None
 
     def update(self, data):
-        assert isinstance(data, bytes)  # no unicode
+        # no unicode, but views of received or decoded data are fine
+        assert isinstance(data, (bytes, bytearray, memoryview))
         self.h.update(data)
 
     def digest(self):
@@ -301,5 +302,12 @@ def backupdb_dirhash(contents):
     return tagged_hash(BACKUPDB_DIRHASH_TAG, contents)
 
 
+WEB_ETAG_TAG = b"allmydata_web_immutable_etag_v1"
+
+
+def web_etag_hash(cap):
+    return tagged_hash(WEB_ETAG_TAG, cap, 16)
+
+
 def permute_server_hash(peer_selection_index, server_permutation_seed):
     return hashlib.sha1(peer_selection_index + server_permutation_seed).digest()
@@ -231,7 +231,10 @@ class DataSpans(object):
     """
 
     def __init__(self, other=None):
-        self.spans = [] # (start, data) tuples, non-overlapping, merged
+        # (start, data) tuples, non-overlapping, merged. The data may be a
+        # memoryview of a larger buffer, so that removing part of a span
+        # doesn't copy the rest of it.
+        self.spans = []
         if other:
             for (start, data) in other.get_chunks():
                 self.add(start, data)
@@ -272,8 +275,9 @@ class DataSpans(object):
                 print("ASSERTION FAILED", self.spans)
                 raise AssertionError
 
-    def get(self, start, length):
-        # returns a string of LENGTH, or None
+    def get(self, start, length, view=False):
+        # returns a string of LENGTH, or None. With view=True, returns a
+        # memoryview of the data we hold instead of a copy.
         #print("get", start, length, self.spans)
         end = start+length
         for (s_start,s_data) in self.spans:
@@ -288,7 +292,9 @@ class DataSpans(object):
                     #print(" None, span falls short")
                     return None # span falls short
                 #print(" some", s_data[offset:offset+length])
-                return s_data[offset:offset+length]
+                if view:
+                    return memoryview(s_data)[offset:offset+length]
+                return bytes(s_data[offset:offset+length])
             if s_start >= end:
                 # we've gone too far: no further spans will overlap
                 #print(" None, gone too far")
@@ -350,14 +356,16 @@ class DataSpans(object):
                         continue
                     # case B: modify the prefix, retain the suffix
                     #print(" modify prefix")
-                    self.spans[i] = (s_start, data + s_data[len(data):])
+                    self.spans[i] = (s_start,
+                                     b"".join((data, s_data[len(data):])))
                     break
                 if start > s_start and end < s_end:
                     # case E: modify the middle
                     #print(" modify middle")
                     prefix_len = start - s_start # we retain this much
                     suffix_len = s_end - end # and retain this much
-                    newdata = s_data[:prefix_len] + data + s_data[-suffix_len:]
+                    newdata = b"".join((s_data[:prefix_len], data,
+                                        s_data[-suffix_len:]))
                     self.spans[i] = (s_start, newdata)
                     break
                 # case D: retain the prefix, modify the suffix
@@ -366,7 +374,8 @@ class DataSpans(object):
                 suffix_len = s_len - prefix_len # we replace this much
                 #print("  ", s_data, prefix_len, suffix_len, s_len, data)
                 self.spans[i] = (s_start,
-                                 s_data[:prefix_len] + data[:suffix_len])
+                                 b"".join((s_data[:prefix_len],
+                                           data[:suffix_len])))
                 i += 1
                 start += suffix_len
                 data = data[suffix_len:]
@@ -383,7 +392,8 @@ class DataSpans(object):
         for (s_start,s_data) in self.spans:
             if newspans and adjacent(newspans[-1][0], len(newspans[-1][1]),
                                      s_start, len(s_data)):
-                newspans[-1] = (newspans[-1][0], newspans[-1][1] + s_data)
+                newspans[-1] = (newspans[-1][0],
+                                b"".join((newspans[-1][1], s_data)))
             else:
                 newspans.append( (s_start, s_data) )
         self.spans = newspans
@@ -415,28 +425,28 @@ class DataSpans(object):
             if o_start == s_start:
                 # remove a prefix, leaving the suffix from o_end to s_end
                 prefix_len = o_end - o_start
-                self.spans[i] = (o_end, s_data[prefix_len:])
+                self.spans[i] = (o_end, memoryview(s_data)[prefix_len:])
                 i += 1
                 continue
             elif o_end == s_end:
                 # remove a suffix, leaving the prefix from s_start to o_start
                 prefix_len = o_start - s_start
-                self.spans[i] = (s_start, s_data[:prefix_len])
+                self.spans[i] = (s_start, memoryview(s_data)[:prefix_len])
                 i += 1
                 continue
             # remove the middle, creating a new segment
             # left is s_start:o_start, right is o_end:s_end
             left_len = o_start - s_start
-            left = s_data[:left_len]
+            left = memoryview(s_data)[:left_len]
             right_len = s_end - o_end
-            right = s_data[-right_len:]
+            right = memoryview(s_data)[-right_len:]
             self.spans[i] = (s_start, left)
             self.spans.insert(i+1, (o_end, right))
             break
         #print(" done", self.spans)
 
-    def pop(self, start, length):
-        data = self.get(start, length)
+    def pop(self, start, length, view=False):
+        data = self.get(start, length, view)
         if data:
             self.remove(start, length)
         return data
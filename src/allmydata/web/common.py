@@ -11,7 +11,8 @@ else:
     from importlib_resources import files as resource_files, as_file
 from contextlib import ExitStack
 import weakref
-from typing import Optional, Union, TypeVar, overload
+from collections import deque
+from typing import Callable, Optional, Union, TypeVar, overload
 from typing_extensions import Literal
 
 import time
@@ -60,13 +61,14 @@ from twisted.python.failure import (
 )
 from twisted.internet.defer import (
     CancelledError,
+    Deferred,
     maybeDeferred,
 )
 from twisted.web.resource import (
     IResource,
 )
 
-from allmydata.dirnode import ONLY_FILES, _OnlyFiles
+from allmydata.dirnode import ONLY_FILES, _OnlyFiles, DirectoryChangedError
 from allmydata import blacklist
 from allmydata.interfaces import (
     EmptyPathnameComponentError,
@@ -82,6 +84,7 @@ from allmydata.interfaces import (
     SDMF_VERSION,
 )
 from allmydata.mutable.common import UnrecoverableFileError
+from allmydata.immutable.upload import FileHandle, StreamingFileHandle
 from allmydata.util.time_format import (
     format_delta,
     format_time,
@@ -323,6 +326,9 @@ def humanize_exception(exc):
     if isinstance(exc, ExistingChildError):
         return ("There was already a child by that name, and you asked me "
                 "to not replace it.", http.CONFLICT)
+    if isinstance(exc, DirectoryChangedError):
+        return ("The directory changed while it was being sharded, so it was "
+                "left as it was. Try again.", http.CONFLICT)
     if isinstance(exc, NoSuchChildError):
         quoted_name = quote_output_u(exc.args[0], quotemarks=False)
         return ("No such child: %s" % quoted_name, http.NOT_FOUND)
@@ -877,3 +883,162 @@ def add_static_children(root: IResource):
             str(temporary_file_manager.enter_context(as_file(child)))
         ))
     weakref.finalize(root, temporary_file_manager.close)
+
+
+# How much of a streamed request body to hold in memory, waiting to be
+# uploaded, before we stop reading from the connection.
+DEFAULT_STREAMING_BODY_BUFFER = 4 * 1024 * 1024
+
+
+class StreamingRequestBody(object):
+    """
+    The body of a request, handed to its resource while it is still arriving
+    instead of being collected in a temporary file first.
+
+    ``TahoeLAFSRequest`` writes the body to me as it is received and tells
+    me when all of it has been; the resource reads it with ``read()``.  If
+    more than ``max_buffered`` bytes arrive before they're read, I pause the
+    connection until they are.
+
+    Only resources which know about me can use me: the synchronous
+    file-like methods other resources use on ``request.content`` raise
+    ``WebError``.
+
+    :ivar length: The length of the whole body.
+    """
+
+    def __init__(self, length: int, pause: Callable[[], None],
+                 resume: Callable[[], None],
+                 max_buffered: int = DEFAULT_STREAMING_BODY_BUFFER):
+        self.length = length
+        self._pause = pause
+        self._resume = resume
+        self._max_buffered = max_buffered
+        self._buffer: deque[bytes] = deque()
+        self._buffered = 0
+        self._paused = False
+        self._complete = False
+        self._discarding = False
+        self._failure: Optional[Failure] = None
+        self._pending_read: Optional[tuple[int, Deferred]] = None
+
+    def is_complete(self) -> bool:
+        """
+        :return: Whether the whole body has been received.
+        """
+        return self._complete
+
+    def write(self, data: bytes) -> None:
+        """
+        Receive some more of the body.
+        """
+        if self._discarding or self._failure is not None:
+            return
+        self._buffer.append(data)
+        self._buffered += len(data)
+        self._deliver()
+        if (self._pending_read is None
+                and self._buffered > self._max_buffered
+                and not self._paused):
+            self._paused = True
+            self._pause()
+
+    def finish(self) -> None:
+        """
+        The whole body has been received.
+        """
+        self._complete = True
+        self._deliver()
+
+    def abort(self, reason: Failure) -> None:
+        """
+        The connection was lost before the whole body was received.
+        """
+        self._failure = reason
+        self._buffer.clear()
+        self._buffered = 0
+        self._deliver()
+
+    def discard(self) -> None:
+        """
+        Nothing is going to read the rest of the body (the response was sent
+        early, probably to report an error), so throw it away as it arrives.
+        """
+        self._discarding = True
+        self._buffer.clear()
+        self._buffered = 0
+        self._unpause()
+
+    def read(self, length: Optional[int] = None) -> Deferred[list[bytes]]:
+        """
+        Read the next ``length`` bytes of the body.
+
+        :return: A Deferred that fires with a list of strings, as for
+            ``IUploadable.read``, once that much has arrived or the body is
+            complete.
+        """
+        if length is None:
+            # someone expecting a file
+            self._not_a_file()
+        assert self._pending_read is None, "only one read at a time"
+        d: Deferred[list[bytes]] = Deferred()
+        self._pending_read = (length, d)
+        self._deliver()
+        return d
+
+    def close(self) -> None:
+        """
+        The request is finished with; nothing more will be read.
+        """
+        self._buffer.clear()
+        self._buffered = 0
+
+    def _deliver(self) -> None:
+        if self._pending_read is None:
+            return
+        (length, d) = self._pending_read
+        if self._failure is not None:
+            self._pending_read = None
+            d.errback(self._failure)
+            return
+        if self._buffered < length and not self._complete:
+            # wait for more, and make sure it can arrive
+            self._unpause()
+            return
+        self._pending_read = None
+        chunks = []
+        wanted = length
+        while wanted and self._buffer:
+            chunk = self._buffer.popleft()
+            if len(chunk) > wanted:
+                self._buffer.appendleft(chunk[wanted:])
+                chunk = chunk[:wanted]
+            chunks.append(chunk)
+            wanted -= len(chunk)
+        self._buffered -= length - wanted
+        if self._buffered <= self._max_buffered:
+            self._unpause()
+        d.callback(chunks)
+
+    def _unpause(self) -> None:
+        if self._paused:
+            self._paused = False
+            self._resume()
+
+    def _not_a_file(self, *args, **kwargs):
+        raise WebError("stream=true is only supported for uploads of "
+                       "immutable files")
+
+    seek = tell = _not_a_file
+
+
+def get_immutable_uploadable(req: IRequest, convergence: Optional[bytes]):
+    """
+    Get an ``IUploadable`` for the body of a request which uploads an
+    immutable file: a streaming one if ``TahoeLAFSSite`` arranged for the
+    body to be streamed, otherwise one that reads the temporary file it was
+    stored in.
+    """
+    if isinstance(req.content, StreamingRequestBody):
+        return StreamingFileHandle(req.content, req.content.length)
+    return FileHandle(req.content, convergence)
@@ -311,6 +311,8 @@ class DirectoryNodeHandler(ReplaceMeMixin, Resource, object):
             d = self._POST_stream_manifest(req)
         elif t == "set_children" or t == "set-children":
             d = self._POST_set_children(req)
+        elif t == "shard":
+            d = self._POST_shard(req)
         else:
             raise WebError("POST to a directory with bad t=%s" % t)
 
@@ -646,6 +648,19 @@ class DirectoryNodeHandler(ReplaceMeMixin, Resource, object):
         # TODO: results
         return d
 
+    def _POST_shard(self, req):
+        shards = get_arg(req, "shards")
+        if shards is not None:
+            try:
+                shards = int(shards)
+            except ValueError:
+                shards = 0
+            if shards < 1:
+                raise WebError("shards= must be a positive integer")
+        d = self.node.shard(shards)
+        d.addCallback(lambda shards: "%d" % (shards,))
+        return d
+
 def abbreviated_dirnode(dirnode):
     u = from_string_dirnode(dirnode.get_uri())
     return u.abbrev_si()
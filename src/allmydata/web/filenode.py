@@ -3,6 +3,8 @@ Ported to Python 3.
 """
 from __future__ import annotations
 
+import os
+
 from twisted.web import http, static
 from twisted.internet import defer
 from twisted.web.resource import (
@@ -15,7 +17,9 @@ from allmydata.monitor import Monitor
 from allmydata.immutable.upload import FileHandle
 from allmydata.mutable.publish import MutableFileHandle
 from allmydata.mutable.common import MODE_READ
-from allmydata.util import log, base32
+from allmydata.util import log, base32, hashutil
+from allmydata.util.consumer import download_to_data
+from allmydata.util.deferredutil import async_to_deferred
 from allmydata.util.encodingutil import quote_output
 from allmydata.blacklist import (
     FileProhibited,
@@ -29,6 +33,7 @@ from allmydata.web.common import (
     get_arg,
     get_filenode_metadata,
     get_format,
+    get_immutable_uploadable,
     get_mutable_type,
     parse_offset_arg,
     parse_replace_arg,
@@ -63,7 +68,7 @@ class ReplaceMeMixin(object):
             d.addCallback(_uploaded)
         else:
             assert file_format == "CHK"
-            uploadable = FileHandle(req.content, convergence=client.convergence)
+            uploadable = get_immutable_uploadable(req, client.convergence)
             d = self.parentnode.add_file(self.name, uploadable,
                                          overwrite=replace)
         def _done(filenode):
@@ -189,11 +194,12 @@ class FileNodeHandler(Resource, ReplaceMeMixin, object):
 
         # t=info contains variable ophandles, so is not allowed an ETag.
         FIXED_OUTPUT_TYPES = ["", "json", "uri", "readonly-uri"]
+        etag = None
         if not self.node.is_mutable() and t in FIXED_OUTPUT_TYPES:
+            etag = _immutable_etag(self.node, t)
             # if the client already has the ETag then we can
             # short-circuit the whole process.
-            si = self.node.get_storage_index()
-            if si and req.setETag(b'%s-%s' % (base32.b2a(si), t.encode("ascii") or b"")):
+            if _not_modified(req, etag):
                 return b""
 
         if not t:
@@ -211,7 +217,7 @@ class FileNodeHandler(Resource, ReplaceMeMixin, object):
             # with itself, and echo back the same bytes that we were given.
             filename = get_arg(req, "filename", self.name) or "unknown"
             d = self.node.get_best_readable_version()
-            d.addCallback(lambda dn: FileDownloader(dn, filename))
+            d.addCallback(lambda dn: FileDownloader(dn, filename, etag))
             return d
         if t == "json":
             # We do this to make sure that fields like size and
@@ -246,9 +252,14 @@ class FileNodeHandler(Resource, ReplaceMeMixin, object):
         t = get_arg(req, b"t", b"").strip()
         if t:
             raise WebError("HEAD file: bad t=%s" % t)
+        etag = None
+        if not self.node.is_mutable():
+            etag = _immutable_etag(self.node, "")
+            if _not_modified(req, etag):
+                return b""
         filename = get_arg(req, b"filename", self.name) or "unknown"
         d = self.node.get_best_readable_version()
-        d.addCallback(lambda dn: FileDownloader(dn, filename))
+        d.addCallback(lambda dn: FileDownloader(dn, filename, etag))
         return d
 
     @render_exception
@@ -373,11 +384,76 @@ class FileNodeHandler(Resource, ReplaceMeMixin, object):
         return d
 
 
+def _immutable_etag(filenode, t):
+    """
+    Return a strong ETag for the ``t`` form of an immutable file.
+
+    CHK files are identified by their verify cap, which (unlike the storage
+    index alone) commits to their contents, and LIT files by their contents.
+    Neither can change, so a client's copy can be revalidated without
+    touching the grid.
+    """
+    verifycap = filenode.get_verify_cap()
+    if verifycap is not None:
+        cap = verifycap.to_string()
+    else:
+        cap = filenode.get_uri()
+    return b'"%s-%s"' % (base32.b2a(hashutil.web_etag_hash(cap)), t.encode("ascii"))
+
+
+def _etag_listed(header, etag, weak):
+    """
+    Is ``etag`` one of the entity tags in an ``If-None-Match`` or
+    ``If-Range`` header?  Weak tags only match if ``weak`` is true, as for
+    the weak comparison which ``If-None-Match`` uses.
+    """
+    if header is None:
+        return False
+    for tag in header.split(b","):
+        tag = tag.strip()
+        if weak and tag == b"*":
+            return True
+        if tag.startswith(b"W/"):
+            if not weak:
+                continue
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def _not_modified(req, etag):
+    """
+    Set the ETag of the response, and if the client says it already has that
+    version, make the response a 304.
+
+    :return: ``True`` if the response is a 304 and there's nothing more to
+        send.
+    """
+    req.setHeader("etag", etag)
+    if _etag_listed(req.getHeader(b"if-none-match"), etag, weak=True):
+        req.setResponseCode(http.NOT_MODIFIED)
+        return True
+    return False
+
+
+# The most ranges a multipart/byteranges response is made of (after
+# coalescing); requests for more get the whole file.
+MAX_RANGES = 100
+
+# Ranges of up to RANGE_READ_AHEAD_SIZE bytes are read from the grid into
+# memory, RANGE_READS_AHEAD at once, ahead of being written. Bigger ones are
+# streamed to the client when their turn comes.
+RANGE_READS_AHEAD = 4
+RANGE_READ_AHEAD_SIZE = 128 * 1024
+
+
 class FileDownloader(Resource, object):
-    def __init__(self, filenode, filename):
+    def __init__(self, filenode, filename, etag=None):
         super(FileDownloader, self).__init__()
         self.filenode = filenode
         self.filename = filename
+        self.etag = etag
 
     def parse_range_header(self, range_header):
         # Parse a byte ranges according to RFC 2616 "14.35.1 Byte
@@ -427,6 +503,26 @@ class FileDownloader(Resource, object):
         except ValueError:
             return None
 
+    def satisfiable_ranges(self, ranges):
+        """
+        Clip the ranges from ``parse_range_header`` to the file, leaving out
+        any which start beyond its end, and merge any which overlap or touch.
+
+        :return: A sorted list of disjoint (first,last) inclusive ranges.
+        """
+        filesize = self.filenode.get_size()
+        merged = []
+        for (first, last) in sorted(ranges):
+            if first >= filesize:
+                continue
+            first = max(0, first)
+            last = min(filesize-1, last)
+            if merged and first <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+            else:
+                merged.append((first, last))
+        return merged
+
     @render_exception
     def render(self, req):
         gte = static.getTypeAndEncoding
@@ -452,25 +548,32 @@ class FileDownloader(Resource, object):
         contentsize = filesize
         req.setHeader("accept-ranges", "bytes")
 
-        # TODO: for mutable files, use the roothash. For LIT, hash the data.
-        # or maybe just use the URI for CHK and LIT.
         rangeheader = req.getHeader('range')
+        if rangeheader and req.getHeader(b"if-range") is not None:
+            # Only send part of the file if the client's copy of the rest is
+            # still current. We don't send Last-Modified, so the client can
+            # only tell us which version it has with an ETag.
+            if self.etag is None or not _etag_listed(
+                    req.getHeader(b"if-range"), self.etag, weak=False):
+                rangeheader = None
         if rangeheader:
             ranges = self.parse_range_header(rangeheader)
 
             # ranges = None means the header didn't parse, so ignore
-            # the header as if it didn't exist.  If is more than one
-            # range, then just return the first for now, until we can
-            # generate multipart/byteranges.
+            # the header as if it didn't exist.
             if ranges is not None:
-                first, last = ranges[0]
+                ranges = self.satisfiable_ranges(ranges)
 
-                if first >= filesize:
+                if not ranges:
                     raise WebError('First beyond end of file',
                                    http.REQUESTED_RANGE_NOT_SATISFIABLE)
+                elif len(ranges) > MAX_RANGES:
+                    # too many to be worth it, so send the whole file
+                    pass
+                elif len(ranges) > 1:
+                    return self.render_ranges(req, ctype, ranges)
                 else:
-                    first = max(0, first)
-                    last = min(filesize-1, last)
+                    first, last = ranges[0]
 
                     req.setResponseCode(http.PARTIAL_CONTENT)
                     req.setHeader('content-range',"bytes %s-%s/%s" %
@@ -484,33 +587,97 @@ class FileDownloader(Resource, object):
             return b""
 
         d = self.filenode.read(req, first, size)
-
-        def _error(f):
-            if f.check(defer.CancelledError):
-                # The HTTP connection was lost and we no longer have anywhere
-                # to send our result.  Let this pass through.
-                return f
-            if req.startedWriting:
-                # The content-type is already set, and the response code has
-                # already been sent, so we can't provide a clean error
-                # indication. We can emit text (which a browser might
-                # interpret as something else), and if we sent a Size header,
-                # they might notice that we've truncated the data. Keep the
-                # error message small to improve the chances of having our
-                # error response be shorter than the intended results.
-                #
-                # We don't have a lot of options, unfortunately.
-                return b"problem during download\n"
-            else:
-                # We haven't written anything yet, so we can provide a
-                # sensible error message.
-                return f
         d.addCallbacks(
             lambda ignored: None,
-            _error,
+            self._download_failed,
+            errbackArgs=(req,),
         )
         return d
 
+    def render_ranges(self, req, ctype, ranges):
+        """
+        Respond with a ``multipart/byteranges`` body made of each of the
+        given ranges of the file.
+        """
+        filesize = self.filenode.get_size()
+        boundary = base32.b2a(os.urandom(10))
+        parts = []
+        for (first, last) in ranges:
+            header = (
+                b"\r\n--%s\r\n"
+                b"Content-Type: %s\r\n"
+                b"Content-Range: bytes %d-%d/%d\r\n"
+                b"\r\n" % (boundary, ctype.encode("ascii"), first, last, filesize)
+            )
+            parts.append((header, first, last - first + 1))
+        trailer = b"\r\n--%s--\r\n" % (boundary,)
+
+        req.setResponseCode(http.PARTIAL_CONTENT)
+        req.setHeader("content-type",
+                      b"multipart/byteranges; boundary=%s" % (boundary,))
+        # that only applies to the parts
+        req.responseHeaders.removeHeader("content-encoding")
+        req.setHeader("content-length", b"%d" % (
+            sum(len(header) + size for (header, _, size) in parts)
+            + len(trailer)
+        ))
+        if req.method == b"HEAD":
+            return b""
+
+        d = self._write_ranges(req, parts, trailer)
+        d.addErrback(self._download_failed, req)
+        return d
+
+    @async_to_deferred
+    async def _write_ranges(self, req, parts, trailer):
+        # Read the small ranges among the next RANGE_READS_AHEAD ahead of
+        # time, so that writing out a run of them doesn't wait for the grid
+        # once per range. Only small ranges are held in memory like this;
+        # big ones go straight from the file to the request.
+        reads = {}
+        def read(i):
+            if i < len(parts):
+                (_, offset, size) = parts[i]
+                if size <= RANGE_READ_AHEAD_SIZE:
+                    reads[i] = download_to_data(self.filenode, offset, size)
+        for i in range(RANGE_READS_AHEAD):
+            read(i)
+        try:
+            for i, (header, offset, size) in enumerate(parts):
+                d = reads.pop(i, None)
+                read(i + RANGE_READS_AHEAD)
+                req.write(header)
+                if d is None:
+                    await self.filenode.read(req, offset, size)
+                else:
+                    req.write(await d)
+        finally:
+            for d in reads.values():
+                d.addErrback(lambda f: None)
+                d.cancel()
+        req.write(trailer)
+
+    def _download_failed(self, f, req):
+        if f.check(defer.CancelledError):
+            # The HTTP connection was lost and we no longer have anywhere
+            # to send our result.  Let this pass through.
+            return f
+        if req.startedWriting:
+            # The content-type is already set, and the response code has
+            # already been sent, so we can't provide a clean error
+            # indication. We can emit text (which a browser might
+            # interpret as something else), and if we sent a Size header,
+            # they might notice that we've truncated the data. Keep the
+            # error message small to improve the chances of having our
+            # error response be shorter than the intended results.
+            #
+            # We don't have a lot of options, unfortunately.
+            return b"problem during download\n"
+        else:
+            # We haven't written anything yet, so we can provide a
+            # sensible error message.
+            return f
+
 
 def _file_json_metadata(req, filenode, edge_metadata):
     rw_uri = filenode.get_write_uri()
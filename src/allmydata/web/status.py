@@ -1617,6 +1617,16 @@ class StatisticsElement(Element):
         return tag("%s files / %s bytes (%s)" %
                    (files, bytes_uploaded, abbreviate_size(bytes_uploaded)))
 
+    @renderer
+    def segment_cache(self, req, tag):
+        stats = self._stats["stats"]
+        if "downloader.segment_cache.hits" not in stats:
+            return tag("disabled")
+        return tag("%s hits / %s misses, %s cached" %
+                   (stats["downloader.segment_cache.hits"],
+                    stats["downloader.segment_cache.misses"],
+                    abbreviate_size(stats["downloader.segment_cache.bytes"])))
+
     @renderer
     def publishes(self, req, tag):
         files = self._stats["counters"].get("mutable.files_published", 0)
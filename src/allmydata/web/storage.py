@@ -190,6 +190,18 @@ class StorageStatusElement(Element):
                 " ".join(sorted(lc.sharetypes_to_expire)), ".")
         return tag
 
+    @renderer
+    def lease_age_histogram(self, req, tag):
+        histogram = self._storage.get_lease_age_histogram()
+        if histogram is None:
+            return ""
+        day = 24*60*60
+        p = T.ul()
+        for (min_age, max_age, count) in histogram:
+            p(T.li("%d-%d days old: %d leases"
+                   % (min_age // day, max_age // day, count)))
+        return tag("Lease ages (from the share index):", p)
+
     @renderer
     def lease_current_cycle_progress(self, req, tag):
         lc = self._storage.lease_checker
@@ -320,5 +332,6 @@ class StorageStatus(MultiFormatResource):
              "bucket-counter": self._storage.bucket_counter.get_state(),
              "lease-checker": self._storage.lease_checker.get_state(),
              "lease-checker-progress": self._storage.lease_checker.get_progress(),
+             "lease-age-histogram": self._storage.get_lease_age_histogram(),
              }
         return json.dumps(d, indent=1) + "\n"
@@ -20,6 +20,7 @@ from allmydata.mutable.publish import MutableFileHandle
 from allmydata.web.common import (
     get_keypair,
     get_arg,
+    get_immutable_uploadable,
     boolean_of_arg,
     convert_children_json,
     WebError,
@@ -32,7 +33,7 @@ from allmydata.web import status
 
 def PUTUnlinkedCHK(req, client):
     # "PUT /uri", to create an unlinked file.
-    uploadable = FileHandle(req.content, client.convergence)
+    uploadable = get_immutable_uploadable(req, client.convergence)
     d = client.upload(uploadable)
     d.addCallback(lambda results: results.get_uri())
     # that fires with the URI of the new file
@@ -18,13 +18,14 @@ from io import (
 from twisted.application import service, strports, internet
 from twisted.web import static
 from twisted.web.http import (
+    HTTPChannel,
     parse_qs,
 )
 from twisted.web.server import (
     Request,
     Site,
 )
-from twisted.internet import defer
+from twisted.internet import defer, reactor
 from twisted.internet.address import (
     IPv4Address,
     IPv6Address,
@@ -32,6 +33,7 @@ from twisted.internet.address import (
 from allmydata.util import log, fileutil
 
 from allmydata.web import introweb, root
+from allmydata.web.common import StreamingRequestBody
 from allmydata.web.operations import OphandleTable
 
 from .web.storage_plugins import (
@@ -83,6 +85,67 @@ class TahoeLAFSRequest(Request, object):
     """
     fields = None
 
+    # Set if the request body was a StreamingRequestBody and the response
+    # was finished before all of the body arrived.
+    _finish_when_received = False
+
+    def gotLength(self, length):
+        """
+        Called by channel when the request headers have been received.
+
+        Override the base implementation so that a ``PUT`` with
+        ``stream=true`` and a known length is processed straight away, with
+        its body streamed to the resource through a ``StreamingRequestBody``
+        instead of being collected in a temporary file first.
+        """
+        if (self.method != b"PUT" or length is None
+                or not _wants_streaming(self.uri)):
+            Request.gotLength(self, length)
+            return
+        self.content = StreamingRequestBody(
+            length, self.channel.pauseReading, self.channel.resumeReading,
+        )
+        # Let the channel answer any "Expect: 100-continue" first.
+        reactor.callLater(0, self._process_streaming)
+
+    def requestLineReceived(self, command, path, version):
+        """
+        Called by ``TahoeLAFSHTTPChannel`` when the request line has been
+        received, so ``gotLength`` can see the method and URI: the base
+        implementation doesn't get them until the whole body has arrived.
+        """
+        self._parse_request(command, path, version)
+
+    def _is_streaming(self):
+        return isinstance(self.content, StreamingRequestBody)
+
+    def _process_streaming(self):
+        if self._disconnected:
+            return
+        self._tahoeLAFSSecurityPolicy()
+        self.processing_started_timestamp = time.time()
+        self.process()
+
+    def finish(self):
+        """
+        Finish the response, unless the body of a streamed request is still
+        arriving: in that case throw the rest of it away and finish once it
+        has.
+        """
+        if self._is_streaming():
+            # Nothing is going to read the rest, and if the channel was
+            # paused it mustn't stay that way.
+            self.content.discard()
+            if not self.content.is_complete():
+                self._finish_when_received = True
+                return
+        return Request.finish(self)
+
+    def connectionLost(self, reason):
+        if self._is_streaming():
+            self.content.abort(reason)
+        Request.connectionLost(self, reason)
+
     def requestReceived(self, command, path, version):
         """
         Called by channel when all data has been received.
@@ -91,19 +154,14 @@ class TahoeLAFSRequest(Request, object):
         and to provide less memory-intensive multipart/form-post handling for
         large file uploads.
         """
+        if self._is_streaming():
+            # we're already processing it
+            self.content.finish()
+            if self._finish_when_received:
+                Request.finish(self)
+            return
         self.content.seek(0)
-        self.args = {}
-        self.stack = []
-
-        self.method, self.uri = command, path
-        self.clientproto = version
-        x = self.uri.split(b'?', 1)
-
-        if len(x) == 1:
-            self.path = self.uri
-        else:
-            self.path, argstring = x
-            self.args = parse_qs(argstring, 1)
+        self._parse_request(command, path, version)
 
         content_type = (self.requestHeaders.getRawHeaders("content-type") or [""])[0]
         if self.method == b'POST' and content_type.split(";")[0] in ("multipart/form-data", "application/x-www-form-urlencoded"):
@@ -132,6 +190,20 @@ class TahoeLAFSRequest(Request, object):
         self.processing_started_timestamp = time.time()
         self.process()
 
+    def _parse_request(self, command, path, version):
+        self.args = {}
+        self.stack = []
+
+        self.method, self.uri = command, path
+        self.clientproto = version
+        x = self.uri.split(b'?', 1)
+
+        if len(x) == 1:
+            self.path = self.uri
+        else:
+            self.path, argstring = x
+            self.args = parse_qs(argstring, 1)
+
     def _tahoeLAFSSecurityPolicy(self):
         """
         Set response properties related to Tahoe-LAFS-imposed security policy.
@@ -145,6 +217,18 @@ class TahoeLAFSRequest(Request, object):
         self.setHeader("Referrer-Policy", "no-referrer")
 
 
+def _wants_streaming(path):
+    """
+    :return: Whether the query arguments of a request path ask for the
+        request body to be streamed.
+    """
+    x = path.split(b"?", 1)
+    if len(x) == 1:
+        return False
+    stream = parse_qs(x[1], 1).get(b"stream", [b""])[-1]
+    return stream.lower() in (b"true", b"t", b"1", b"on")
+
+
 def _get_client_ip(request):
     try:
         get = request.getClientAddress
@@ -229,6 +313,48 @@ def anonymous_tempfile_factory(tempdir: bytes) -> Callable[[], IO[bytes]]:
     return lambda: tempfile.TemporaryFile(dir=tempdir)
 
 
+class TahoeLAFSHTTPChannel(HTTPChannel):
+    """
+    An ``HTTPChannel`` which tells its ``TahoeLAFSRequest`` about the request
+    line as soon as it arrives, and which can stop reading while a streamed
+    request body isn't being read as fast as it arrives.
+    """
+    _reading_paused = False
+
+    def pauseReading(self):
+        """
+        Stop reading from the transport until ``resumeReading`` is called.
+
+        This is separate from ``pauseProducing``, which the transport calls
+        when its send buffer is full.
+        """
+        self._reading_paused = True
+        self.transport.pauseProducing()
+
+    def resumeReading(self):
+        """
+        Undo ``pauseReading``.
+        """
+        self._reading_paused = False
+        self.transport.resumeProducing()
+
+    def resumeProducing(self):
+        HTTPChannel.resumeProducing(self)
+        if self._reading_paused:
+            # The send buffer has drained, but the request body still isn't
+            # being read.
+            self.transport.pauseProducing()
+
+    def lineReceived(self, line):
+        requests = len(self.requests)
+        HTTPChannel.lineReceived(self, line)
+        if len(self.requests) > requests:
+            # That was the request line of a new request.
+            parts = line.split()
+            if len(parts) == 3:
+                self.requests[-1].requestLineReceived(*parts)
+
+
 class TahoeLAFSSite(Site, object):
     """
     The HTTP protocol factory used by Tahoe-LAFS.
@@ -240,8 +366,12 @@ class TahoeLAFSSite(Site, object):
 
     * A log formatter that writes some access logs but omits capability
       strings to help keep them secret.
+
+    * Streaming of ``PUT`` request bodies when asked for with
+      ``stream=true``.
     """
     requestFactory = TahoeLAFSRequest
+    protocol = TahoeLAFSHTTPChannel
 
     def __init__(self, make_tempfile: Callable[[], IO[bytes]], *args, **kwargs):
         Site.__init__(self, *args, logFormatter=_logFormatter, **kwargs)